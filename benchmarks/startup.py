@@ -0,0 +1,63 @@
+# benchmarks/startup.py
+# Холодный старт консольного запуска против GUI:
+#   python benchmarks/startup.py [--runs 5]
+# Для каждого варианта — лучшее время из N запусков и пиковая память процесса.
+# GUI запускается как main.py --startup-timing: окно закрывается сразу после
+# первой отрисовки; --report печатает отчёт одного такого запуска (шаги и
+# импорт каждого модуля).
+# RSS берётся из os.wait4, поэтому скрипт работает только на Unix.
+# Без дисплея GUI запускается с QT_QPA_PLATFORM=offscreen.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'cli': [sys.executable, '-m', 'bitrix_exchange', '--help'],
+    'gui': [sys.executable, 'main.py', '--startup-timing'],
+}
+
+
+def measure(cmd, runs, env):
+    best_time, best_rss = None, None
+    for _ in range(runs):
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+        if status != 0:
+            raise SystemExit(f"❌ {' '.join(cmd[:3])} завершился с ошибкой")
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+        # ru_maxrss: Linux — килобайты, macOS — байты
+        rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+        best_rss = rss if best_rss is None else min(best_rss, rss)
+    return best_time, best_rss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Холодный старт CLI и GUI")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--report', action='store_true', help="отчёт --startup-timing одного запуска GUI")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if not env.get('DISPLAY') and sys.platform.startswith('linux'):
+        env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    if args.report:
+        subprocess.run(CASES['gui'], cwd=ROOT, env=env, check=True)
+        print()
+
+    print(f"{'режим':<6} {'время, с':>9} {'RSS, МБ':>8}")
+    for name, cmd in CASES.items():
+        t, rss = measure(cmd, args.runs, env)
+        print(f"{name:<6} {t:>9.3f} {rss / 1024:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
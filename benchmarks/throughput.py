@@ -0,0 +1,101 @@
+# benchmarks/throughput.py
+# Сквозной замер обмена против локального MockBitrix:
+#   python benchmarks/throughput.py [--sizes 1,8,32] [--limits 0,1048576,262144]
+#                                   [--latency 0] [--bandwidth 0] [--error-rate 0] [--json out.json]
+# Для каждой пары (размер файла, file_limit) — скорость загрузки в МБ/с,
+# число запросов за обмен, число опросов import и полное время. Файлы —
+# синтетический XML заданного размера во временной папке. Запускается
+# движок без GUI, паузы между опросами import — как в обычной работе.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener  # noqa: E402
+from bitrix_exchange.mock_server import MockBitrix  # noqa: E402
+
+MB = 1024 * 1024
+OFFER = '<Предложение><Ид>{:08d}</Ид><Наименование>Товар {:08d}</Наименование><Цена>100.00</Цена></Предложение>\n'
+
+
+class _PhaseClock(ExchangeListener):
+    # время начала каждого шага протокола
+    def __init__(self):
+        self.started = {}
+
+    def phase(self, name):
+        self.started[name] = time.perf_counter()
+
+
+def make_xml(path, size):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<КоммерческаяИнформация><ПакетПредложений><Предложения>\n')
+        written, i = 0, 0
+        while written < size:
+            line = OFFER.format(i, i)
+            f.write(line)
+            written += len(line.encode('utf-8'))
+            i += 1
+        f.write('</Предложения></ПакетПредложений></КоммерческаяИнформация>\n')
+
+
+def run_case(path, limit, args):
+    mock = MockBitrix(file_limit=limit, latency=args.latency, bandwidth=args.bandwidth * MB,
+                      error_rate=args.error_rate, import_steps=args.import_steps, seed=1)
+    with mock:
+        clock = _PhaseClock()
+        engine = ExchangeEngine(mock.url, 'admin', 'x', 'catalog', path, listener=clock)
+        started = time.perf_counter()
+        ok = engine.run()
+        wall = time.perf_counter() - started
+    size = os.path.getsize(path)
+    upload = clock.started.get('import', started + wall) - clock.started.get('file', started)
+    return {
+        'size_mb': round(size / MB, 2), 'file_limit': limit, 'ok': ok,
+        'upload_mb_s': round(size / MB / upload, 2) if upload > 0 else None,
+        'requests': mock.stats.total_requests, 'chunks': mock.stats.chunks,
+        'import_polls': mock.stats.requests.get('import', 0), 'errors': mock.stats.errors,
+        'wall_s': round(wall, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозной замер обмена против локального MockBitrix")
+    parser.add_argument('--sizes', default='1,8,32', help="размеры файлов, МБ, через запятую")
+    parser.add_argument('--limits', default='0,1048576,262144', help="file_limit, байт, через запятую (0 — без чанков)")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка каждого ответа сервера, секунд")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="скорость приёма сервера, МБ/с (0 — без ограничения)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля чанков с ответом 503")
+    parser.add_argument('--import-steps', type=int, default=3, help="ответов progress на XML")
+    parser.add_argument('--json', metavar='FILE', help="сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    sizes = [float(s) for s in args.sizes.split(',')]
+    limits = [int(s) for s in args.limits.split(',')]
+    results = []
+    print(f"{'size MB':>8} {'file_limit':>10} {'MB/s':>8} {'requests':>8} {'chunks':>6} "
+          f"{'polls':>5} {'errors':>6} {'wall s':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, 'import.xml')
+            make_xml(path, int(size * MB))
+            for limit in limits:
+                r = run_case(path, limit, args)
+                results.append(r)
+                print(f"{r['size_mb']:>8} {limit:>10} {r['upload_mb_s'] or 0:>8} {r['requests']:>8} "
+                      f"{r['chunks']:>6} {r['import_polls']:>5} {r['errors']:>6} {r['wall_s']:>7}"
+                      + ("" if r['ok'] else "  FAILED"), flush=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,15 @@
+# bitrix_exchange — Qt-независимое ядро обмена с 1С-Битрикс.
+# Консольный запуск: python -m bitrix_exchange --help
+#
+# Движок (а с ним requests) загружается при первом обращении к этим именам:
+# лёгкие модули пакета (preview, polling, paths) GUI импортирует при запуске,
+# не платя за сетевой стек.
+
+__all__ = ['ExchangeEngine', 'ExchangeListener', 'ExchangeError']
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import engine
+        return getattr(engine, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,422 @@
+# bitrix_exchange/cli.py
+# Консольный запуск обмена без PyQt5 (cron, CI):
+#   python -m bitrix_exchange standard --url ... --login ... --filename import.xml
+#   python -m bitrix_exchange standard --url ... --login ... --type sale --filename orders.xml
+#   python -m bitrix_exchange upload --url ... --login ... --file export.zip
+#   python -m bitrix_exchange fanout --targets sites.json --file export.zip
+#   python -m bitrix_exchange watch --targets sites.json --folder /mnt/1c-export
+#   python -m bitrix_exchange history --url site.ru
+# Пароль можно передать через переменную окружения BITRIX_PASSWORD.
+
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+from .connection import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, ConnectionManager
+from .engine import ExchangeEngine, ExchangeListener
+from .fanout import DEFAULT_CONCURRENCY, FanOut, load_targets, summary
+from .history import (DEFAULT_SLOWDOWN, FLAG_NAMES, HistoryError, RunHistory, format_time,
+                      sparkline)
+from .jobs import DEFAULT_PER_HOST, DEFAULT_SETTLE, DONE, FAILED, FolderWatcher, JobQueue, JobScheduler
+from .log_writer import DEFAULT_BACKUPS, FORMATS, LogListener, LogWriter
+from .metrics import format_summary, write_json, write_prometheus
+from .polling import DEFAULT_MAX_INTERVAL, DEFAULT_MIN_INTERVAL
+from .preview import DEFAULT_PREVIEW_CHARS, DEFAULT_SPILL_BYTES, ResponseStore
+from .profiling import Profiler
+from .zipstream import DEFAULT_LEVEL
+
+
+class ConsoleListener(ExchangeListener):
+    # при fanout сайты пишут из разных потоков — вывод под общей блокировкой
+    _lock = threading.Lock()
+
+    def __init__(self, quiet=False, prefix=''):
+        self.quiet = quiet
+        self.prefix = prefix
+
+    def message(self, msg):
+        if self.quiet:
+            return
+        if self.prefix:
+            msg = f"[{self.prefix}] {msg}"
+        with self._lock:
+            print(f"{datetime.now():%H:%M:%S} {msg}", flush=True)
+
+
+def _listener(args, log_writer, site=None):
+    console = ConsoleListener(quiet=args.quiet, prefix=site or '')
+    return LogListener(log_writer, console, site=site) if log_writer else console
+
+
+def _add_site(p):
+    p.add_argument('--url', required=True, help="адрес скрипта обмена, например https://site.ru/bitrix/admin/1c_exchange.php")
+    p.add_argument('--login', required=True)
+    p.add_argument('--password', default=os.environ.get('BITRIX_PASSWORD'),
+                   help="пароль (по умолчанию — из BITRIX_PASSWORD)")
+
+
+def _add_common(p):
+    p.add_argument('--type', dest='exchange_type', default='catalog', help="тип обмена (catalog, sale)")
+    p.add_argument('--log', metavar='FILE', help="дописывать лог в файл")
+    p.add_argument('--log-format', choices=FORMATS, default='text',
+                   help="text — как в консоли, jsonl — по объекту на строку (ts, phase, method, url, status, elapsed)")
+    p.add_argument('--log-max-size', type=float, default=0, metavar='MB',
+                   help="ротация лога при превышении размера (0 — не ротировать)")
+    p.add_argument('--log-rotate', type=float, default=0, metavar='HOURS',
+                   help="ротация лога раз в столько часов (0 — не ротировать)")
+    p.add_argument('--log-backups', type=int, default=DEFAULT_BACKUPS, metavar='N',
+                   help=f"сколько старых файлов лога хранить (по умолчанию {DEFAULT_BACKUPS})")
+    p.add_argument('-q', '--quiet', action='store_true', help="не печатать лог в консоль")
+    p.add_argument('--stats', action='store_true',
+                   help="в конце вывести время по шагам обмена, время работы и пиковую память")
+    p.add_argument('--metrics-json', metavar='FILE', help="сохранить замеры обмена в JSON")
+    p.add_argument('--metrics-prom', metavar='FILE',
+                   help="сохранить замеры в формате Prometheus (textfile для node_exporter)")
+    p.add_argument('--profile', nargs='?', const='', metavar='DIR',
+                   help="снимать стеки потоков во время обмена: свёрнутые стеки и сводка горячих точек "
+                        "в DIR (по умолчанию ~/.bitrix_exchange/profiles)")
+    p.add_argument('--connect-timeout', type=float, default=DEFAULT_CONNECT_TIMEOUT, metavar='SEC',
+                   help=f"таймаут соединения с сайтом (по умолчанию {DEFAULT_CONNECT_TIMEOUT:g})")
+    p.add_argument('--read-timeout', type=float, default=DEFAULT_READ_TIMEOUT, metavar='SEC',
+                   help=f"таймаут ответа сервера (по умолчанию {DEFAULT_READ_TIMEOUT:g})")
+    p.add_argument('--request-retries', type=int, default=3, metavar='N',
+                   help="повторов checkauth, init и опросов import при обрыве, таймауте, 429/5xx (по умолчанию 3)")
+    p.add_argument('--response-preview', type=int, default=DEFAULT_PREVIEW_CHARS, metavar='CHARS',
+                   help=f"сколько символов ответа сервера писать в лог (по умолчанию {DEFAULT_PREVIEW_CHARS})")
+    p.add_argument('--response-spill', type=float, default=DEFAULT_SPILL_BYTES / 1024 / 1024, metavar='MB',
+                   help="длинный ответ целиком, до стольких МБ, сохранять во временный файл (0 — не сохранять)")
+    p.add_argument('--no-history', dest='history', action='store_false',
+                   help="не записывать обмен в историю (~/.bitrix_exchange/history.sqlite)")
+    p.add_argument('--slowdown', type=float, default=DEFAULT_SLOWDOWN, metavar='X',
+                   help=f"помечать обмен, который медленнее обычного для сайта в X раз (по умолчанию {DEFAULT_SLOWDOWN:g})")
+    p.add_argument('--poll-min', type=float, default=DEFAULT_MIN_INTERVAL, metavar='SEC',
+                   help=f"минимальная пауза между опросами import (по умолчанию {DEFAULT_MIN_INTERVAL})")
+    p.add_argument('--poll-max', type=float, default=DEFAULT_MAX_INTERVAL, metavar='SEC',
+                   help=f"максимальная пауза между опросами import (по умолчанию {DEFAULT_MAX_INTERVAL})")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m bitrix_exchange',
+                                     description="Обмен с 1С-Битрикс без GUI.")
+    sub = parser.add_subparsers(dest='command', metavar='command')
+    sub.required = True
+
+    p1 = sub.add_parser('standard', help="стандартный обмен: импорт файла, уже лежащего на сервере; "
+                                         "с --type sale — выгрузка заказов с сайта")
+    _add_site(p1)
+    _add_common(p1)
+    p1.add_argument('--filename', required=True,
+                    help="имя файла на сервере; для sale — куда сохранить XML заказов")
+
+    p2 = sub.add_parser('upload', help="загрузка XML/ZIP на сервер и импорт")
+    _add_site(p2)
+    _add_common(p2)
+    _add_upload(p2)
+
+    p3 = sub.add_parser('fanout', help="загрузка одного пакета на несколько сайтов параллельно")
+    p3.add_argument('--targets', required=True, metavar='JSON',
+                    help='список сайтов: [{"url": ..., "login": ..., "password" или "password_env": ...}]')
+    p3.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                    help=f"сколько сайтов обрабатывать одновременно (по умолчанию {DEFAULT_CONCURRENCY})")
+    _add_common(p3)
+    _add_upload(p3)
+
+    p4 = sub.add_parser('watch', help="очередь обменов: новые XML/ZIP из папки — на сайты из списка")
+    p4.add_argument('--targets', required=True, metavar='JSON', help="список сайтов, как у fanout")
+    p4.add_argument('--folder', required=True, help="папка, куда 1С кладёт выгрузки")
+    p4.add_argument('--settle', type=float, default=DEFAULT_SETTLE, metavar='SEC',
+                    help=f"файл готов, если не менялся столько секунд (по умолчанию {DEFAULT_SETTLE:g})")
+    p4.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                    help=f"сколько обменов одновременно (по умолчанию {DEFAULT_CONCURRENCY})")
+    p4.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                    help=f"сколько обменов одновременно с одним сайтом (по умолчанию {DEFAULT_PER_HOST})")
+    p4.add_argument('--queue', metavar='FILE', help="файл очереди (по умолчанию ~/.bitrix_exchange/queue/jobs.json)")
+    p4.add_argument('--once', action='store_true',
+                    help="взять готовые файлы, выполнить очередь и выйти (для cron)")
+    _add_common(p4)
+    _add_upload(p4, with_file=False)
+
+    p5 = sub.add_parser('history', help="история обменов: скорость загрузки и импорта по сайтам, медленные обмены")
+    p5.add_argument('--url', help="только этот сайт (адрес скрипта обмена или домен)")
+    p5.add_argument('--type', dest='exchange_type', help="только этот тип обмена")
+    p5.add_argument('--limit', type=int, default=20, help="сколько последних обменов показать (по умолчанию 20)")
+    p5.add_argument('--slow', action='store_true', help="только обмены, помеченные как медленные")
+    return parser
+
+
+def _add_upload(p, with_file=True):
+    if with_file:
+        p.add_argument('--file', required=True,
+                       help="локальный XML или ZIP (с --zip — также папка с XML и картинками)")
+    p.add_argument('--zip', action='store_true', help="сжимать XML/папку в ZIP на лету во время отправки")
+    p.add_argument('--zip-level', type=int, default=DEFAULT_LEVEL, choices=range(0, 10), metavar='0-9',
+                   help=f"уровень сжатия (по умолчанию {DEFAULT_LEVEL})")
+    p.add_argument('--resume', action='store_true',
+                   help="вести журнал чанков и продолжить прерванную загрузку с последнего подтверждённого")
+    p.add_argument('--retries', type=int, default=3, help="повторов чанка при временных ошибках (по умолчанию 3)")
+    p.add_argument('--delta', action='store_true',
+                   help="отправить только товары и предложения, изменившиеся с прошлой успешной выгрузки на сайт")
+    p.add_argument('--skip-unchanged', action='store_true',
+                   help="не отправлять файлы пакета (картинки, XML), которые сайт уже принял; без изменений — не отправлять ничего")
+    p.add_argument('--split-size', type=float, default=0, metavar='MB',
+                   help="резать XML больше стольких МБ на части import_00001.xml, … и импортировать по очереди (0 — не резать)")
+    p.add_argument('--no-preflight', dest='preflight', action='store_false',
+                   help="не разбирать XML перед отправкой (по умолчанию битый пакет не отправляется)")
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS отдаёт байты, Linux — килобайты
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def _run_fanout(args, targets, fp, log_writer, options):
+    # Ctrl+C в главном потоке останавливает все сайты через interrupted
+    stop = threading.Event()
+    fan = FanOut(targets, args.exchange_type, fp, concurrency=args.concurrency,
+                 listener_factory=lambda i, t: _listener(args, log_writer, urlparse(t.url).netloc or t.url),
+                 interrupted=stop.is_set, **options)
+    box = {}
+    runner = threading.Thread(target=lambda: box.update(results=fan.run()), name='fanout-main')
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+        runner.join()
+        raise
+    results = box.get('results', [])
+    report = summary(results)
+    print(report)
+    if log_writer:
+        log_writer.write(report)
+    # сайты, до которых не дошло (битый пакет), замеров не имеют
+    return bool(results) and all(r.ok for r in results), [r.metrics.snapshot() for r in results if r.metrics]
+
+
+def _run_watch(args, targets, log_writer, options, upload):
+    # задания — в файле очереди; незавершённые с прошлого запуска выполняются первыми
+    queue = JobQueue(args.queue)
+    watcher = FolderWatcher(args.folder, args.settle)
+    announce = _listener(args, log_writer)
+    if queue.load_error:
+        announce.message(f"⚠️ {queue.load_error}")
+    # пароли в файле очереди не хранятся — задания прошлого запуска получают их из targets
+    for t in targets:
+        if t.password:
+            queue.set_password(t.url, t.login, t.password)
+    for url, login in queue.waiting_for_password():
+        announce.message(f"⚠️ Задания для {login} @ {url} ждут пароля: сайта нет в --targets")
+
+    def enqueue(path, stamp):
+        for t in targets:
+            job = queue.add(path, t.url, t.login, t.password, args.exchange_type, upload, stamp, t.password_env)
+            announce.message(f"📥 В очередь: #{job.id} {os.path.basename(path)} → {job.host}")
+
+    stop = threading.Event()
+    # соединения и sessid сайтов живут, пока работает очередь
+    connections = ConnectionManager()
+    scheduler = JobScheduler(
+        queue, args.concurrency, args.per_host,
+        listener_factory=lambda job: _listener(args, log_writer, f"#{job.id} {os.path.basename(job.file)} → {job.host}"),
+        interrupted=stop.is_set, connections=connections, **options)
+    if args.once:
+        # два взгляда на папку через settle: дописанные файлы — в очередь
+        watcher.poll()
+        time.sleep(args.settle)
+        for path, stamp in watcher.poll():
+            if not queue.known(path, stamp):
+                enqueue(path, stamp)
+        watcher = None
+    before = {job.id for job in queue.snapshot() if job.status in (DONE, FAILED)}
+    runner = threading.Thread(target=lambda: scheduler.run(watcher, enqueue, until_idle=args.once),
+                              name='watch-main')
+    runner.start()
+    try:
+        while runner.is_alive():
+            runner.join(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+        runner.join()
+        raise
+    finally:
+        connections.close()
+    jobs = [job for job in queue.snapshot() if job.id not in before and job.status in (DONE, FAILED)]
+    ok = sum(1 for job in jobs if job.status == DONE)
+    report = f"Итого: {ok} из {len(jobs)} заданий успешно" + ''.join(
+        f"\n❌ #{job.id} {job.file} → {job.url}: {job.message}" for job in jobs if job.status == FAILED)
+    print(report)
+    if log_writer:
+        log_writer.write(report)
+    return ok == len(jobs)
+
+
+def _report_metrics(args, snapshots, log_writer):
+    # snapshots — замеры одного обмена или список по сайтам
+    if args.stats:
+        for snap in (snapshots if isinstance(snapshots, list) else [snapshots]):
+            text = format_summary(snap)
+            if isinstance(snapshots, list):
+                text = f"[{urlparse(snap['url']).netloc or snap['url']}]\n{text}"
+            print(text, file=sys.stderr)
+            if log_writer:
+                log_writer.write(text)
+    for path, write in ((args.metrics_json, write_json), (args.metrics_prom, write_prometheus)):
+        if not path:
+            continue
+        try:
+            write(path, snapshots)
+        except OSError as e:
+            print(f"⚠️ Замеры не сохранены в {path}: {e}", file=sys.stderr)
+
+
+def _write_profile(profiler, log_writer):
+    profiler.stop()
+    try:
+        _, _, text = profiler.write()
+    except OSError as e:
+        print(f"⚠️ Профиль не сохранён: {e}", file=sys.stderr)
+        return
+    print(text, file=sys.stderr)
+    if log_writer:
+        log_writer.write(text)
+
+
+def _mb(value, digits=2):
+    return f"{value / 1024 / 1024:.{digits}f}" if value else "—"
+
+
+def _sec(value):
+    return f"{value:.1f}" if value is not None else "—"
+
+
+def _show_history(args):
+    try:
+        history = RunHistory()
+        trends = [t for t in history.trends() if (not args.url or args.url.rstrip('/') in (t.url, t.site))
+                  and (not args.exchange_type or t.exchange_type == args.exchange_type)]
+        runs = history.runs(args.url, args.exchange_type, args.limit, slow_only=args.slow)
+    except HistoryError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    if not trends:
+        print("История обменов пуста.")
+        return 0
+    print("Сайт, тип: обменов (ошибок) | загрузка МБ/с: обычно, последняя, ряд | импорт с: обычно, последний, ряд")
+    for t in trends:
+        print(f"{t.site} {t.exchange_type}: {t.total} ({t.failed}) | "
+              f"{_mb(t.median('throughput'))} {_mb(t.last('throughput'))} {sparkline(t.series('throughput'))} | "
+              f"{_sec(t.median('import_seconds'))} {_sec(t.last('import_seconds'))} "
+              f"{sparkline(t.series('import_seconds'))}"
+              + (f"  🐢 {', '.join(FLAG_NAMES[f] for f in t.last_flags)}" if t.last_flags else ""))
+    print()
+    for r in runs:
+        mark = ("🐢 " + ', '.join(FLAG_NAMES[f] for f in r.flag_list)) if r.flags else ""
+        result = "✅" if r.ok else ("❌ " + r.message.splitlines()[0] if r.message else "❌")
+        print(f"{format_time(r.started)} {r.site} {r.exchange_type}: {result}, {_sec(r.elapsed)} с, "
+              f"файл {_mb(r.file_size)} МБ, отправлено {_mb(r.bytes_sent)} МБ в {r.chunks} чанк., "
+              f"{_mb(r.throughput)} МБ/с, импорт {_sec(r.import_seconds)} с ({r.import_polls} опр.) {mark}".rstrip())
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'history':
+        return _show_history(args)
+    started = time.perf_counter()
+
+    targets = None
+    if args.command in ('fanout', 'watch'):
+        try:
+            targets = load_targets(args.targets)
+        except (OSError, ValueError) as e:
+            print(f"❌ Список сайтов не прочитан: {e}", file=sys.stderr)
+            return 2
+        if not targets:
+            print("❌ Список сайтов пуст", file=sys.stderr)
+            return 2
+    elif not args.password:
+        print("❌ Не задан пароль: --password или BITRIX_PASSWORD", file=sys.stderr)
+        return 2
+    if args.command == 'watch':
+        fp, send_file = None, True
+        if not os.path.isdir(args.folder):
+            print(f"❌ Папка не найдена: {args.folder}", file=sys.stderr)
+            return 2
+    elif args.command == 'standard':
+        fp, send_file = args.filename, False
+        # sale — заказы с сайта сохраняются в --filename
+        if args.exchange_type.lower() == 'sale' and not os.path.isdir(os.path.dirname(os.path.abspath(fp))):
+            print(f"❌ Папка не найдена: {os.path.dirname(fp)}", file=sys.stderr)
+            return 2
+    else:
+        fp, send_file = args.file, True
+        if not (os.path.isfile(fp) or (args.zip and os.path.isdir(fp))):
+            print(f"❌ Файл не найден: {fp}", file=sys.stderr)
+            return 2
+
+    log_writer = None
+    if args.log:
+        try:
+            log_writer = LogWriter(args.log, args.log_format,
+                                   max_bytes=int(args.log_max_size * 1024 * 1024),
+                                   rotate_interval=args.log_rotate * 3600,
+                                   backups=args.log_backups)
+        except OSError as e:
+            print(f"⚠️ Лог-файл недоступен: {e}", file=sys.stderr)
+
+    responses = ResponseStore(args.response_preview, int(args.response_spill * 1024 * 1024))
+    options = dict(poll_min=args.poll_min, poll_max=args.poll_max, connect_timeout=args.connect_timeout,
+                   read_timeout=args.read_timeout, request_retries=args.request_retries, responses=responses,
+                   history=RunHistory(slowdown=args.slowdown) if args.history else None)
+    # настройки пакета; у заданий очереди они сохраняются в каждом задании
+    upload = {}
+    if send_file:
+        upload = dict(resume=args.resume, chunk_retries=args.retries,
+                      compress=args.zip, compress_level=args.zip_level, preflight=args.preflight,
+                      delta=args.delta, split_size=int(args.split_size * 1024 * 1024),
+                      skip_unchanged=args.skip_unchanged)
+    profiler = Profiler(args.command, args.profile or None).start() if args.profile is not None else None
+    try:
+        if args.command == 'watch':
+            # у очереди свой итог, замеров отдельных обменов нет
+            ok = _run_watch(args, targets, log_writer, options, upload)
+            snapshots = []
+        elif targets is not None:
+            ok, snapshots = _run_fanout(args, targets, fp, log_writer, dict(options, **upload))
+        else:
+            engine = ExchangeEngine(args.url, args.login, args.password, args.exchange_type, fp,
+                                    send_file=send_file,
+                                    listener=_listener(args, log_writer),
+                                    **options, **upload)
+            ok = engine.run()
+            snapshots = engine.metrics.snapshot()
+        _report_metrics(args, snapshots, log_writer)
+    except KeyboardInterrupt:
+        print("🛑 Операция прервана пользователем.", file=sys.stderr)
+        return 130
+    finally:
+        if profiler:
+            # и после Ctrl+C: профиль зависшего обмена нужнее всего
+            _write_profile(profiler, log_writer)
+        if log_writer:
+            log_writer.close()
+        responses.cleanup()
+        if args.stats:
+            rss = _peak_rss_kb()
+            print(f"⏱ {time.perf_counter() - started:.2f} с"
+                  + (f", пиковая память {rss / 1024:.1f} МБ" if rss else ""), file=sys.stderr)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
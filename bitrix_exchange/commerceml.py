@@ -0,0 +1,143 @@
+# bitrix_exchange/commerceml.py
+# Предпроверка пакета CommerceML до отправки на сайт.
+#
+# Каждый XML — одиночный файл, файлы папки для сжатия на лету или члены
+# ZIP (читаются прямо из архива через zipfile) — разбирается iterparse'ом
+# потоком: разобранный элемент сразу отцепляется от родителя, так что
+# в памяти только путь от корня до текущего тега. Проверяется, что XML
+# корректен, и считаются группы, товары, предложения, цены и документы.
+# Битый пакет падает за секунды на своей машине, а не через полчаса
+# mode=import на сервере. Счётчики идут в ожидаемые итоги импорта
+# (ExchangeEngine.expected_totals) — для процента, если сервер шлёт
+# только "обработано N".
+
+import os
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+ROOT_TAG = 'КоммерческаяИнформация'
+# тег -> (родитель, счётчик): Цена внутри ТипЦены/Товара не считается
+COUNTED = {
+    'Группа': ('Группы', 'groups'),
+    'Товар': ('Товары', 'products'),
+    'Предложение': ('Предложения', 'offers'),
+    'Цена': ('Цены', 'prices'),
+    'Документ': (ROOT_TAG, 'documents'),
+}
+CHECK_EVERY = 10000  # как часто (в элементах) проверять кнопку Stop
+
+
+class PreflightError(Exception):
+    pass
+
+
+class XmlStats:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size      # байт XML (для члена ZIP — без сжатия)
+        self.root = None
+        self.elements = 0
+        self.groups = 0
+        self.products = 0
+        self.offers = 0
+        self.prices = 0
+        self.documents = 0
+        self.elapsed = 0.0
+
+    @property
+    def expected_total(self):
+        # сколько элементов импортирует Битрикс из этого файла
+        return self.products or self.offers or self.documents or self.groups or None
+
+    def describe(self):
+        counts = [f"{label}: {value}" for label, value in (
+            ("групп", self.groups), ("товаров", self.products), ("предложений", self.offers),
+            ("цен", self.prices), ("документов", self.documents)) if value]
+        return (f"{self.name}: " + (", ".join(counts) or "данных для импорта нет")
+                + f" ({self.size / 1024 / 1024:.1f} МБ, разбор {self.elapsed:.1f} с)")
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def analyze_xml(f, name, size=0, check=None):
+    # f — бинарный поток; check() вызывается каждые CHECK_EVERY элементов
+    # (может бросить исключение, чтобы прервать разбор)
+    stats = XmlStats(name, size)
+    started = time.monotonic()
+    stack = []
+    try:
+        for event, elem in ET.iterparse(f, events=('start', 'end')):
+            if event == 'start':
+                if stats.root is None:
+                    stats.root = _local(elem.tag)
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = _local(elem.tag)
+            counted = COUNTED.get(tag)
+            if counted and stack and _local(stack[-1].tag) == counted[0]:
+                setattr(stats, counted[1], getattr(stats, counted[1]) + 1)
+            stats.elements += 1
+            if check and stats.elements % CHECK_EVERY == 0:
+                check()
+            # отцепляем разобранное — память не растёт с размером файла
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+    except ET.ParseError as e:
+        # текст expat уже с позицией: "mismatched tag: line 12, column 4"
+        raise PreflightError(f"{name}: XML повреждён — {e}")
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def _files(path, compress):
+    # [(имя на сервере, путь)] для XML вне архива
+    if compress or os.path.isdir(path):
+        from .zipstream import collect_entries
+        return [(arc, full) for arc, full in collect_entries(path) if arc.lower().endswith('.xml')]
+    return [(os.path.basename(path), path)]
+
+
+def analyze_package(path, compress=False, check=None):
+    # список XmlStats по всем XML пакета в том виде, в каком их увидит сервер;
+    # PreflightError — на первом битом файле
+    if not (compress or os.path.isdir(path)) and path.lower().endswith('.zip'):
+        results = []
+        name = os.path.basename(path)
+        try:
+            with zipfile.ZipFile(path) as z:
+                for info in z.infolist():
+                    if info.filename.lower().endswith('.xml'):
+                        name = info.filename
+                        with z.open(info) as f:
+                            results.append(analyze_xml(f, name, info.file_size, check))
+        except zipfile.BadZipFile as e:
+            # CRC члена ZIP проверяется при чтении, поэтому ошибка может прийти посреди разбора
+            raise PreflightError(f"{name}: архив повреждён — {e}")
+        return results
+    results = []
+    for name, full in _files(path, compress):
+        with open(full, 'rb') as f:
+            results.append(analyze_xml(f, name, os.path.getsize(full), check))
+    return results
+
+
+def report(stats):
+    # строки для лога обмена
+    if not stats:
+        return ["⚠️ В пакете нет XML — импортировать будет нечего"]
+    lines = []
+    for st in stats:
+        lines.append("🔎 " + st.describe())
+        if st.root != ROOT_TAG:
+            lines.append(f"⚠️ {st.name}: корневой элемент <{st.root}>, а не <{ROOT_TAG}>")
+    return lines
+
+
+def expected_totals(stats):
+    # имя XML -> сколько элементов ждать в ответах import
+    return {st.name: st.expected_total for st in stats if st.expected_total}
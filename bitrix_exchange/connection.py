@@ -0,0 +1,100 @@
+# bitrix_exchange/connection.py
+# Соединения с сайтами, которые живут дольше одного обмена.
+#
+# ConnectionManager держит по одной requests.Session на скрипт обмена и
+# логин: keep-alive соединения из её пула (и TLS-сессия) переиспользуются
+# следующим обменом с тем же сайтом, а вместе с cookie PHPSESSID остаётся
+# и sessid последнего checkauth. Пока он моложе sessid_ttl, движок
+# пропускает checkauth; если сервер его уже не принимает, авторизуется заново.
+# Соединение, простоявшее дольше idle_timeout, закрывается перед выдачей:
+# сервер к этому времени всё равно его оборвал. Занятое соединение (тот же
+# сайт в двух обменах сразу) второй раз не выдаётся — второй обмен получает
+# отдельную сессию, которая закрывается после него.
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 300.0    # шаг import на сервере бывает долгим
+DEFAULT_IDLE_TIMEOUT = 60.0
+# PHP по умолчанию хранит сессию 24 минуты (session.gc_maxlifetime)
+DEFAULT_SESSID_TTL = 15 * 60
+POOL_SIZE = 4
+
+
+class Connection:
+    def __init__(self, key, session, pooled=True):
+        self.key = key
+        self.session = session
+        self.pooled = pooled
+        self.busy = False
+        self.last_used = 0.0
+        self.sessid = None
+        self.sessid_at = 0.0
+
+
+class ConnectionManager:
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, sessid_ttl=DEFAULT_SESSID_TTL,
+                 pool_size=POOL_SIZE, clock=time.monotonic):
+        self.idle_timeout = idle_timeout
+        self.sessid_ttl = sessid_ttl
+        self.pool_size = pool_size
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._connections = {}  # (url, логин) -> Connection
+
+    def _session(self, login, password):
+        session = requests.Session()
+        session.auth = (login, password)
+        # повторы делает движок, с паузами и записью в лог; urllib3 не повторяет сам
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def acquire(self, url, login, password):
+        key = (url.rstrip('/'), login)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn and conn.busy:
+                return Connection(key, self._session(login, password), pooled=False)
+            if conn and conn.session.auth != (login, password):
+                # пароль сменили — старые cookie и sessid не годятся
+                conn.session.close()
+                conn = None
+            if conn is None:
+                conn = self._connections[key] = Connection(key, self._session(login, password))
+            elif self.clock() - conn.last_used > self.idle_timeout:
+                # закрываем только сокеты, cookie остаются
+                conn.session.close()
+            conn.busy = True
+            return conn
+
+    def release(self, conn):
+        with self._lock:
+            conn.busy = False
+            conn.last_used = self.clock()
+            if not conn.pooled:
+                conn.session.close()
+
+    def sessid(self, conn):
+        # sessid прошлого checkauth, если он ещё может действовать
+        if conn.sessid and self.clock() - conn.sessid_at < self.sessid_ttl:
+            return conn.sessid
+        return None
+
+    def remember(self, conn, sessid):
+        conn.sessid = sessid
+        conn.sessid_at = self.clock()
+
+    def forget(self, conn):
+        conn.sessid = None
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.session.close()
+            self._connections.clear()
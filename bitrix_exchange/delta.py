@@ -0,0 +1,395 @@
+# bitrix_exchange/delta.py
+# Пакет только с изменениями относительно прошлой успешной выгрузки.
+#
+# DeltaIndex хранит для каждого сайта (URL + тип обмена) и каждого XML
+# пакета 64-битный хэш каждого Товара и Предложения по его Ид: gzip в
+# data_dir('delta'), строка "тег<TAB>Ид<TAB>хэш". make_delta прогоняет XML
+# через expat потоком и пишет копию исходных байт, в которой из списков Товары
+# и Предложения остались только новые и изменённые элементы, а в конец
+# списка добавлены заглушки удалённых (<Товар Статус="Удален"><Ид>…</Ид></Товар>).
+# У Каталог и ПакетПредложений выставлено СодержитТолькоИзменения="true",
+# всё вне списков (классификатор, типы цен, склады) копируется как есть.
+#
+# Если индекса для XML ещё нет, файл уходит целиком, как обычно, и только
+# индексируется. Новый индекс записывается после успешного обмена
+# (DeltaPackage.commit), поэтому неудачный запуск сравнится со старым снова.
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.parsers import expat
+
+from .paths import data_dir
+from .zipstream import collect_entries, extract_member
+
+# тег элемента -> тег списка, в котором он лежит
+ITEMS = {'Товар': 'Товары', 'Предложение': 'Предложения'}
+PARTIAL_TAGS = ('Каталог', 'ПакетПредложений')
+PARTIAL_ATTR = 'СодержитТолькоИзменения'
+# меняется в каждой выгрузке и не означает изменений
+VOLATILE_ATTRS = ('ДатаФормирования', PARTIAL_ATTR)
+SKELETON = '#'  # ключ хэша всего, что вне списков товаров и предложений
+READ_BLOCK = 1024 * 1024
+_START_TAG = re.compile(rb'<[^\s/>]+(?:\s+[^\s=]+\s*=\s*(?:"[^"]*"|\'[^\']*\'))*\s*/?>')
+_BETWEEN_TAGS = re.compile(rb'>\s+<')
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _attr(value):
+    return (value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;')
+            .replace('\n', '&#10;').replace('\r', '&#13;').replace('\t', '&#9;'))
+
+
+class XmlDelta:
+    def __init__(self, name):
+        self.name = name
+        self.full = False       # индекса не было — файл уходит целиком
+        self.total = 0          # Товаров и Предложений в новой выгрузке
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        self.skeleton_changed = False
+        self.size_in = 0
+        self.size_out = 0
+
+    @property
+    def unchanged(self):
+        return self.total - self.added - self.changed
+
+    @property
+    def has_changes(self):
+        return self.full or self.added or self.changed or self.removed or self.skeleton_changed
+
+    def describe(self):
+        if self.full:
+            return f"{self.name}: индекса ещё нет, отправляется целиком ({self.total} элементов)"
+        text = (f"{self.name}: новых {self.added}, изменённых {self.changed}, удалённых {self.removed}, "
+                f"без изменений {self.unchanged}")
+        if self.skeleton_changed:
+            text += ", изменён классификатор"
+        return text + f" — {self.size_out / 1024 / 1024:.2f} из {self.size_in / 1024 / 1024:.2f} МБ"
+
+
+class DeltaIndex:
+    def __init__(self, url, exchange_type, directory=None):
+        key = hashlib.sha1(f"{url}|{exchange_type}".encode('utf-8')).hexdigest()[:16]
+        self.directory = directory or data_dir('delta', key)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, hashlib.sha1(name.encode('utf-8')).hexdigest()[:16] + '.idx.gz')
+
+    def load(self, name):
+        # {(тег, Ид) | SKELETON: хэш} или None, если XML ещё не выгружался
+        try:
+            f = gzip.open(self._path(name), 'rt', encoding='utf-8', newline='\n')
+        except OSError:
+            return None
+        index = {}
+        try:
+            with f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 3:
+                        index[parts[0], parts[1]] = parts[2]
+                    elif len(parts) == 2 and parts[0] == SKELETON:
+                        index[SKELETON] = parts[1]
+        except (OSError, EOFError):
+            return None  # недописанный индекс — как будто его нет
+        return index
+
+    def save(self, name, index):
+        path = self._path(name)
+        tmp = path + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8', newline='\n', compresslevel=6) as f:
+            for key, value in index.items():
+                if key == SKELETON:
+                    f.write(f"{SKELETON}\t{value}\n")
+                else:
+                    f.write(f"{key[0]}\t{key[1]}\t{value}\n")
+        os.replace(tmp, path)
+
+
+class _DeltaWriter:
+    # Обработчики expat. Вход не пересобирается из событий: в out уходят
+    # исходные байты диапазонами, а неизменившиеся элементы просто
+    # пропускаются — кодировка, отступы и сущности остаются как были.
+    # В buf лежит вход с позиции copied: не больше одного элемента и блока.
+    def __init__(self, parser, out, old, stats):
+        self.parser = parser
+        self.out = out
+        self.old = old or {}
+        self.full = old is None
+        self.stats = stats
+        self.index = {}
+        self.encoding = 'utf-8'
+        self.buf = bytearray()
+        self.base = 0           # смещение buf[0] во входе
+        self.copied = 0         # вход до этого смещения уже записан или выброшен
+        self.stack = []         # [(тег, смещение начала, пустой ли <x/>)]
+        self.skeleton = hashlib.blake2b(digest_size=8)
+        self.skeleton_text = []
+        self.item_depth = 0     # глубина текущего Товара/Предложения, 0 — вне элемента
+        self.item_id = None
+        self.id_text = []
+        self.seen = set()
+        parser.XmlDeclHandler = self.declaration
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.skeleton_text.append
+
+    def feed(self, block):
+        self.buf += block
+        self.parser.Parse(block, not block)
+        if not block:
+            self._copy_to(self.base + len(self.buf))
+        elif not (self.item_depth or self.stack and self.stack[-1][0] in ITEMS.values()):
+            # вне списка всё до последнего "<" уже разобрано и переписываться
+            # не будет: недочитанный тег начинается с него (в атрибутах "<" нет)
+            cut = self.buf.rfind(b'<')
+            self._copy_to(self.base + (cut if cut >= 0 else len(self.buf)))
+        drop = self.copied - self.base
+        if drop > 0:
+            del self.buf[:drop]
+            self.base = self.copied
+
+    def _emit(self, data):
+        self.out.write(data)
+        self.stats.size_out += len(data)
+
+    def _copy_to(self, pos):
+        if pos > self.copied:
+            self._emit(self.buf[self.copied - self.base:pos - self.base])
+            self.copied = pos
+
+    def _encode(self, text):
+        return text.encode(self.encoding, 'xmlcharrefreplace')
+
+    def _skeleton_flush(self):
+        if self.skeleton_text:
+            self.skeleton.update(''.join(self.skeleton_text).strip().encode('utf-8'))
+            self.skeleton_text.clear()
+
+    def declaration(self, version, encoding, standalone):
+        self.encoding = encoding or 'utf-8'
+
+    def start(self, tag, attrs):
+        pos = self.parser.CurrentByteIndex
+        parent = self.stack[-1][0] if self.stack else None
+        if self.item_depth:
+            self.stack.append((tag, pos, False))
+            if tag == 'Ид' and len(self.stack) == self.item_depth + 1:
+                self.id_text = []
+                self.parser.CharacterDataHandler = self.id_text.append
+            return
+        # открывающий тег целиком в buf: expat сообщает о нём, только дочитав ">"
+        m = _START_TAG.match(self.buf, pos - self.base)
+        self.stack.append((tag, pos, m.group().endswith(b'/>')))
+        if parent is not None and ITEMS.get(tag) == parent:
+            self._skeleton_flush()
+            # отступ перед элементом уйдёт вместе с ним, у пропущенного — тоже пропадёт
+            if self.buf[self.copied - self.base:pos - self.base].strip():
+                self._copy_to(pos)
+            self.item_depth = len(self.stack)
+            self.item_id = None
+            self.parser.CharacterDataHandler = None
+            return
+        # attrs — плоский список [имя, значение, …] (ordered_attributes)
+        self._skeleton_flush()
+        pairs = list(zip(attrs[::2], attrs[1::2]))
+        self.skeleton.update(tag.encode('utf-8'))
+        for k, v in pairs:
+            if k not in VOLATILE_ATTRS:
+                self.skeleton.update(f" {k}={v}".encode('utf-8'))
+        if tag in PARTIAL_TAGS and not self.full:
+            # открывающий тег переписываем с СодержитТолькоИзменения="true"
+            self._copy_to(pos)
+            pairs = [(k, v) for k, v in pairs if k != PARTIAL_ATTR] + [(PARTIAL_ATTR, 'true')]
+            closing = '/>' if m.group().endswith(b'/>') else '>'
+            self._emit(self._encode(f"<{tag}" + ''.join(f' {k}="{_attr(v)}"' for k, v in pairs) + closing))
+            self.copied = self.base + m.end()
+
+    def end(self, tag):
+        pos = self.parser.CurrentByteIndex
+        _, start, empty = self.stack.pop()
+        depth = len(self.stack) + 1
+        if self.item_depth:
+            if depth == self.item_depth + 1 and tag == 'Ид':
+                self.item_id = ''.join(self.id_text).strip()
+                self.parser.CharacterDataHandler = None
+            elif depth == self.item_depth:
+                self._end_item(tag, start, self._end_pos(empty, pos))
+            return
+        self._skeleton_flush()
+        if tag in ITEMS.values() and not self.full:
+            if not empty:
+                # заглушки удалённых — перед закрывающим тегом списка
+                self._copy_to(pos)
+                self._write_removed(tag)
+            else:
+                self._fill_empty_list(tag, start)
+        self.skeleton.update(f"/{tag}".encode('utf-8'))
+
+    def _end_pos(self, empty, pos):
+        # конец элемента во входе: у <x/> expat сообщает конец уже за "/>",
+        # у <x>…</x> — на начале "</x>"
+        if empty:
+            return pos
+        return self.buf.index(b'>', pos - self.base) + self.base + 1
+
+    def _end_item(self, tag, start, end):
+        self.item_depth = 0
+        self.parser.CharacterDataHandler = self.skeleton_text.append
+        raw = bytes(self.buf[start - self.base:end - self.base])
+        self.stats.total += 1
+        include = True
+        if self.item_id is None:
+            # без Ид сравнивать не с чем — отправляем всегда
+            self.stats.added += 1
+        else:
+            key = (tag, self.item_id)
+            # отступы между тегами на содержимое не влияют
+            digest = hashlib.blake2b(_BETWEEN_TAGS.sub(b'><', raw), digest_size=8).hexdigest()
+            self.index[key] = digest
+            self.seen.add(key)
+            before = self.old.get(key)
+            if self.full:
+                pass
+            elif before is None:
+                self.stats.added += 1
+            elif before != digest:
+                self.stats.changed += 1
+            else:
+                include = False
+        if include:
+            self._copy_to(end)
+        self.copied = end
+
+    def _write_removed(self, list_tag):
+        for stub in self._removed(list_tag):
+            self._emit(stub)
+
+    def _removed(self, list_tag):
+        stubs = []
+        for item_tag, parent in ITEMS.items():
+            if parent != list_tag:
+                continue
+            for key in self.old:
+                if key != SKELETON and key[0] == item_tag and key not in self.seen:
+                    self.stats.removed += 1
+                    stubs.append(self._encode(
+                        f'<{item_tag} Статус="Удален"><Ид>{_escape(key[1])}</Ид></{item_tag}>'))
+                    self.seen.add(key)
+        return stubs
+
+    def _fill_empty_list(self, tag, start):
+        # <Товары/> — из выгрузки убрали все элементы: список раскрывается,
+        # внутрь — заглушки удалённых, как перед </Товары>
+        stubs = self._removed(tag)
+        if not stubs:
+            return
+        m = _START_TAG.match(self.buf, start - self.base)
+        self._copy_to(start)
+        self._emit(m.group()[:-2].rstrip() + b'>')
+        for stub in stubs:
+            self._emit(stub)
+        self._emit(self._encode(f"</{tag}>"))
+        self.copied = self.base + m.end()
+
+    def finish(self):
+        self._skeleton_flush()
+        self.index[SKELETON] = self.skeleton.hexdigest()
+        if not self.full:
+            self.stats.skeleton_changed = self.old.get(SKELETON) != self.index[SKELETON]
+
+
+def make_delta(src, dst, name, old, check=None):
+    # src — бинарный поток XML, dst — куда писать пакет изменений;
+    # old — прежний индекс этого XML или None. Возвращает (XmlDelta, новый индекс)
+    stats = XmlDelta(name)
+    stats.full = old is None
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    writer = _DeltaWriter(parser, dst, old, stats)
+    while True:
+        block = src.read(READ_BLOCK)
+        if check:
+            check()
+        stats.size_in += len(block)
+        writer.feed(block)
+        if not block:
+            break
+    writer.finish()
+    return stats, writer.index
+
+
+class DeltaPackage:
+    # что отправлять вместо исходного пакета: entries — [(имя в архиве, путь)]
+    def __init__(self, index, workdir):
+        self.index = index
+        self.workdir = workdir
+        self.entries = []
+        self.stats = []
+        self.single = False     # один XML без архива — отправлять как есть
+        self._pending = {}      # имя XML -> новый индекс
+
+    @property
+    def has_changes(self):
+        return any(st.has_changes for st in self.stats)
+
+    def commit(self):
+        # после успешного обмена: теперь сравниваем с этой выгрузкой
+        for name, new in self._pending.items():
+            self.index.save(name, new)
+        self._pending = {}
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def build_delta(path, compress, index, check=None, entries=None):
+    # XML, ZIP или папка (при compress), либо готовые entries (только изменённые
+    # файлы, manifest.py) -> DeltaPackage во временном каталоге
+    package = DeltaPackage(index, tempfile.mkdtemp(prefix='bitrix-delta-'))
+    try:
+        if entries is None and not (compress or os.path.isdir(path)) and path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as z:
+                for info in z.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.filename.lower().endswith('.xml'):
+                        with z.open(info) as src:
+                            _add_xml(package, info.filename, src, check)
+                    else:
+                        # картинки и прочее — как есть, извлекаем рядом
+                        target = extract_member(z, info, os.path.join(package.workdir, 'files'))
+                        package.entries.append((info.filename, target))
+        else:
+            package.single = entries is None and not (compress or os.path.isdir(path))
+            for arcname, full in (entries if entries is not None else collect_entries(path)):
+                if arcname.lower().endswith('.xml'):
+                    with open(full, 'rb') as src:
+                        _add_xml(package, arcname, src, check)
+                else:
+                    package.entries.append((arcname, full))
+    except BaseException:
+        package.cleanup()
+        raise
+    return package
+
+
+def _add_xml(package, name, src, check):
+    target = os.path.join(package.workdir, 'xml', *name.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as dst:
+        stats, new = make_delta(src, dst, name, package.index.load(name), check)
+    package.stats.append(stats)
+    package._pending[name] = new
+    package.entries.append((name, target))
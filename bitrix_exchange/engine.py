@@ -0,0 +1,739 @@
+# bitrix_exchange/engine.py
+# Протокол обмена 1С-Битрикс без зависимости от Qt: checkauth → init → file → import.
+# О ходе обмена движок сообщает через слушателя (ExchangeListener), поэтому
+# его можно запускать и из GUI-потока (ExchangeWorker), и из консоли (cli.py).
+
+import itertools
+import os
+import re
+import tempfile
+import time
+import zipfile
+from xml.parsers import expat
+
+from .commerceml import PreflightError, analyze_package, expected_totals, report
+from .connection import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, ConnectionManager
+from .delta import DeltaIndex, build_delta
+from .history import HistoryError, describe_flags
+from .manifest import ContentManifest, build_manifest, hash_package
+from .journal import UploadJournal
+from .metrics import RunMetrics
+from .orders import READ_BLOCK as ORDERS_BLOCK, OrdersError, save_orders
+from .polling import (DEFAULT_MAX_INTERVAL, DEFAULT_MIN_INTERVAL, ImportProgress, PollScheduler,
+                      format_eta, parse_progress)
+from .preview import ResponseStore, excerpt
+from .retry import TRANSIENT_ERRORS, TRANSIENT_STATUS, Backoff
+from .split import split_package
+from .stream import BLOCK_SIZE, BlockReader, ChunkBody
+from .zipstream import DEFAULT_LEVEL, ZipStream, archive_name, collect_entries
+
+
+class ExchangeListener:
+    # Базовый слушатель событий обмена: все методы — заглушки,
+    # наследник переопределяет только то, что ему нужно.
+
+    def message(self, msg: str):
+        pass
+
+    def progress_range(self, lo: int, hi: int):
+        pass
+
+    def progress_percent(self, value: int):
+        pass
+
+    def finished(self, ok: bool):
+        pass
+
+    def phase(self, name: str):
+        # начался шаг протокола: checkauth, init, file, import
+        pass
+
+    def http(self, method: str, url: str, status: int, elapsed: float):
+        # завершён HTTP-запрос к скрипту обмена (для структурированного лога)
+        pass
+
+
+class ExchangeError(Exception):
+    # Ошибка протокола: текст уже готов для вывода в лог
+    pass
+
+
+class ExchangeInterrupted(Exception):
+    pass
+
+
+class UploadSource:
+    # что уходит в mode=file: имя на сервере, длина, как открыть байты с начала,
+    # какие XML потом импортировать и отпечаток для журнала докачки.
+    # total=None — длина заранее неизвестна (ZIP на лету), source_size — сколько
+    # байт исходных файлов в него уйдёт
+    def __init__(self, name, total, open_raw, xmls, fingerprint=None, source_size=None):
+        self.name = name
+        self.total = total
+        self.open_raw = open_raw
+        self.xmls = xmls
+        self.fingerprint = fingerprint
+        self.source_size = source_size
+
+
+class ExchangeEngine:
+    def __init__(self, url, login, password, exchange_type, file_path=None, send_file=True,
+                 listener=None, interrupted=None, resume=False, journal=None, chunk_retries=3,
+                 compress=False, compress_level=DEFAULT_LEVEL,
+                 poll_min=DEFAULT_MIN_INTERVAL, poll_max=DEFAULT_MAX_INTERVAL, preflight=False,
+                 delta=False, delta_index=None, split_size=0, skip_unchanged=False, manifest=None,
+                 connections=None, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 request_retries=3, responses=None, history=None):
+        self.url = url.rstrip('/')
+        self.login = login
+        self.password = password
+        self.exchange_type = exchange_type
+        self.file_path = file_path
+        self.send_file = send_file
+        self.exchange_version = '3.1'
+        self.listener = listener or ExchangeListener()
+        # interrupted — callable без аргументов, True если пора остановиться
+        self._interrupted = interrupted or (lambda: False)
+        # resume — вести журнал чанков и продолжать прерванную загрузку
+        self.resume = resume
+        self.journal = journal or (UploadJournal() if resume else None)
+        self.chunk_retries = chunk_retries
+        # compress — упаковать XML или папку в ZIP на лету во время отправки
+        self.compress = compress
+        self.compress_level = compress_level
+        # preflight — разобрать XML пакета до отправки: битый файл не уйдёт на сервер
+        self.preflight = preflight
+        # delta — отправить только изменения с прошлой успешной выгрузки на этот сайт
+        self.delta = delta
+        self.delta_index = delta_index
+        self._delta = None
+        # skip_unchanged — не отправлять файлы, которые этот сайт уже принял (manifest.py);
+        # package_hashes — готовые хэши пакета (fanout считает их один раз на все сайты)
+        self.skip_unchanged = skip_unchanged
+        self.manifest = manifest
+        self.package_hashes = None
+        self._hashes = None     # хэши пакета этого запуска — для истории
+        self._uploaded = None   # длина пакета, который получил сервер, — для истории
+        self._manifest = None
+        # split_size — резать XML больше стольких байт на части для импорта по очереди (0 — не резать)
+        self.split_size = split_size
+        self._split = None
+        self._resume_raw = None     # источник, сверенный с журналом докачки и стоящий на её смещении
+        # границы паузы между опросами mode=import, секунды
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        # ожидаемое число элементов по имени XML — для процента, если сервер шлёт только счётчик
+        self.expected_totals = {}
+        # замеры последнего запуска: шаги, чанки, опросы import (см. metrics.py)
+        self.metrics = RunMetrics(self.url, exchange_type)
+        # connections — общий ConnectionManager: сессия, keep-alive и sessid переживают
+        # обмен; без него у каждого запуска своя сессия
+        self.connections = connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # повторов checkauth, init и опросов import при временных ошибках
+        self.request_retries = request_retries
+        # responses — ResponseStore: в лог идёт начало ответа, весь ответ — во временный файл
+        self.responses = responses or ResponseStore()
+        # history — RunHistory: каждый запуск пишется в историю, заметно медленный помечается
+        self.history = history
+        self.history_run = None
+        # стандартный обмен sale — выгрузка заказов с сайта в file_path (orders.py)
+        self.orders_stats = None
+        self._conn = None
+        self._reused_sessid = False
+        self.session = None
+        self.sessid = None
+
+    # --- служебное ---
+
+    def _emit(self, msg: str):
+        self.listener.message(msg)
+
+    def _emit_response(self, text: str):
+        self._emit("📥 Ответ сервера:\n" + self.responses.preview(text.strip()))
+
+    def _check_interrupted(self):
+        if self._interrupted():
+            raise ExchangeInterrupted()
+
+    def _sleep(self, seconds):
+        # пауза, которую можно прервать кнопкой Stop
+        steps = max(1, int(seconds / 0.1))
+        for _ in range(steps):
+            self._check_interrupted()
+            time.sleep(seconds / steps)
+
+    def _phase(self, name):
+        self.metrics.begin(name)
+        self.listener.phase(name)
+
+    def _request(self, method, params, **kwargs):
+        body = kwargs.get('data')
+        sent = len(body) if body is not None else 0
+        kwargs.setdefault('timeout', (self.connect_timeout, self.read_timeout))
+        started = time.monotonic()
+        try:
+            r = self.session.request(method, self.url, params=params, **kwargs)
+        except OSError:
+            # запрос без ответа тоже попадает в замеры — как ошибка
+            self.metrics.request(params.get('mode'), method, None, time.monotonic() - started,
+                                 sent, params.get('filename'))
+            raise
+        elapsed = time.monotonic() - started
+        self.metrics.request(params.get('mode'), method, r.status_code, elapsed, sent, params.get('filename'))
+        self.listener.http(method, r.url, r.status_code, elapsed)
+        return r
+
+    def _get(self, mode, **extra):
+        # GET шага, который можно повторить: при обрыве, таймауте, 429/5xx — пауза
+        # и повтор; когда попытки кончились, последний ответ разбирает вызывающий
+        backoff = Backoff(retries=self.request_retries)
+        while True:
+            try:
+                r = self._request('GET', self._params(mode, **extra))
+            except TRANSIENT_ERRORS as e:
+                reason, error = str(e), e
+            else:
+                if r.status_code not in TRANSIENT_STATUS:
+                    return r
+                reason, error = f"код {r.status_code}", None
+            delay = backoff.next_delay()
+            if delay is None:
+                if error:
+                    raise error
+                return r
+            self._emit(f"⚠️ {mode}: {reason}, повтор через {delay:.1f} с")
+            self._sleep(delay)
+
+    def _params(self, mode, **extra):
+        params = {'type': self.exchange_type, 'mode': mode}
+        if self.sessid:
+            params['sessid'] = self.sessid
+            params['version'] = self.exchange_version
+        params.update(extra)
+        return params
+
+    @property
+    def downloads_orders(self):
+        return not self.send_file and self.exchange_type.lower() == 'sale'
+
+    # --- запуск ---
+
+    def run(self) -> bool:
+        # sessid прошлого запуска не должен попасть в новый checkauth
+        self.sessid = None
+        manager = self.connections or ConnectionManager()
+        self._conn = manager.acquire(self.url, self.login, self.password)
+        self.session = self._conn.session
+        self.metrics = RunMetrics(self.url, self.exchange_type)
+        self.metrics.start()
+        success = False
+        error = ''
+        interrupted = False
+        entry = None
+        self.history_run = None
+        self._hashes = self.package_hashes
+        self._uploaded = None
+        try:
+            if self.send_file and self.skip_unchanged:
+                self._manifest = self._build_manifest()
+                if not self._manifest.has_changes:
+                    self._emit("✅ Пакет не изменился с прошлой успешной выгрузки на этот сайт — отправлять нечего.")
+                    success = True
+                    return success
+            if self.send_file and self.preflight:
+                self._preflight()
+            if self.send_file and self.delta:
+                self._delta = self._build_delta()
+                if not self._delta.has_changes:
+                    self._emit("✅ С прошлой выгрузки ничего не изменилось — отправлять нечего.")
+                    success = True
+                    return success
+            if self.send_file and self.split_size:
+                self._split = self._split_xml()
+            source = self._prepare_source() if self.send_file else None
+            start = 0
+            if self.send_file:
+                if self.journal:
+                    entry = self.journal.entry(self.url, self.file_path, source.fingerprint)
+                start = self._resume_point(entry, source)
+            # Stop во время подготовки пакета: к сайту ещё не обращались
+            self._check_interrupted()
+            # старый sessid проверяет init; без init (докачка, стандартный обмен) — только checkauth
+            self._authorize(reuse=self.send_file and not start)
+
+            if self.downloads_orders:
+                self._download_orders()
+                self._emit("✅ Обмен успешно завершен.")
+                success = True
+                return success
+
+            # 2–3. для стандартного обмена (send_file=False) пропускаем init и file
+            if not self.send_file:
+                self._emit("📤 Шаги 2 и 3: пропуск init и file для стандартного обмена")
+                xmls = [os.path.basename(self.file_path) if self.file_path else '']
+            else:
+                if start:
+                    # init на сервере очищает каталог обмена — при докачке его пропускаем
+                    limit = entry.file_limit
+                    self._emit(f"📤 Шаг 2: пропуск init, докачка с {start} байт (file_limit={limit})")
+                else:
+                    # init очищает каталог обмена на сайте — после Stop его не шлём
+                    self._check_interrupted()
+                    limit = self._init()
+                    if entry:
+                        entry.start(limit)
+                self._upload(source, limit, start, entry)
+                xmls = source.xmls
+
+            self._import(order_xmls(xmls))
+
+            self._emit("✅ Обмен успешно завершен.")
+            success = True
+            if entry:
+                entry.discard()
+            if self._delta:
+                # следующая выгрузка сравнивается с этой
+                self._delta.commit()
+            if self._manifest:
+                self._manifest.commit()
+        except ExchangeInterrupted:
+            error = "🛑 Операция прервана пользователем."
+            interrupted = True
+            self._emit(error)
+        except ExchangeError as e:
+            error = str(e)
+            self._emit(error)
+        except Exception as e:
+            error = f"❌ Неожиданная ошибка: {e}"
+            self._emit(error)
+        finally:
+            manager.release(self._conn)
+            if manager is not self.connections:
+                manager.close()
+            self._conn = None
+            if self._delta:
+                self._delta.cleanup()
+                self._delta = None
+            if self._split:
+                self._split.cleanup()
+                self._split = None
+            if self._manifest:
+                self._manifest.cleanup()
+                self._manifest = None
+            if self._resume_raw:
+                self._resume_raw.close()
+                self._resume_raw = None
+            self.metrics.finish(success)
+            self._record_history(error, interrupted)
+            self.listener.finished(success)
+        return success
+
+    def _record_history(self, error, interrupted=False):
+        if not self.history:
+            return
+        # локальный пакет: отправленный файл или сохранённые заказы sale
+        local = self.file_path if self.send_file or self.downloads_orders else None
+        try:
+            self.history_run = self.history.record(self.metrics.snapshot(), local, self._hashes, error,
+                                                   package_bytes=self._uploaded, digest=not interrupted)
+        except (HistoryError, OSError) as e:
+            self._emit(f"⚠️ Обмен не записан в историю: {e}")
+            return
+        if self.history_run.flags:
+            self._emit(f"🐢 Обмен медленнее обычного для этого сайта: {describe_flags(self.history_run)}")
+
+    # --- шаги протокола ---
+
+    def _preflight(self):
+        # 0. предпроверка на своей машине, до первого запроса к сайту
+        self._phase('preflight')
+        self._emit("🔎 Предпроверка XML перед отправкой.")
+        try:
+            stats = analyze_package(self.file_path, self.compress, check=self._check_interrupted)
+        except PreflightError as e:
+            raise ExchangeError(f"❌ Предпроверка: {e}")
+        for line in report(stats):
+            self._emit(line)
+        for name, total in expected_totals(stats).items():
+            self.expected_totals.setdefault(name, total)
+
+    def _authorize(self, reuse):
+        sessid = self.connections.sessid(self._conn) if reuse and self.connections else None
+        if sessid:
+            self.sessid = sessid
+            self._reused_sessid = True
+            self._emit("📤 Шаг 1: sessid прошлого обмена с сайтом ещё действует, checkauth пропущен.")
+            return
+        self._reused_sessid = False
+        self._checkauth()
+
+    def _checkauth(self):
+        # 1. checkauth
+        self._phase('checkauth')
+        self._emit("📤 Шаг 1: Авторизация.")
+        self.sessid = None
+        resp = self._get('checkauth')
+        self._emit(f"📤 Запрос: GET {resp.url}")
+        self._emit_response(resp.text)
+        if resp.status_code != 200:
+            raise ExchangeError(f"❌ Ошибка: код {resp.status_code} при авторизации")
+        lines = resp.text.strip().splitlines()
+        if not lines or not lines[0].lower().startswith("success"):
+            raise ExchangeError(f"❌ Авторизация не удалась: {excerpt(resp.text) or '<empty>'}")
+        for ln in lines:
+            if ln.startswith("sessid="):
+                self.sessid = ln.split("=", 1)[1]
+                break
+        if not self.sessid:
+            raise ExchangeError("❌ Ошибка: sessid не найден")
+        if self.connections:
+            self.connections.remember(self._conn, self.sessid)
+
+    def _init(self) -> int:
+        # 2. init — возвращает file_limit (0, если сервер его не прислал)
+        self._phase('init')
+        self._emit("📤 Шаг 2: Инициализация.")
+        resp = self._get('init')
+        self._emit(f"📤 Запрос: GET {resp.url}")
+        self._emit_response(resp.text)
+        if self._reused_sessid and (resp.status_code in (401, 403) or
+                                    resp.text.strip().lower().startswith("failure")):
+            # сессия на сервере истекла — один раз авторизуемся заново
+            self._emit("⚠️ Сервер не принял sessid прошлого обмена, авторизуемся заново.")
+            self.connections.forget(self._conn)
+            self._reused_sessid = False
+            self._checkauth()
+            return self._init()
+        if resp.status_code != 200:
+            raise ExchangeError(f"❌ Ошибка init: код {resp.status_code}")
+        init_txt = resp.text.strip().lower()
+        if init_txt.startswith("failure"):
+            raise ExchangeError(f"❌ Init failed: {init_txt}")
+        m = re.search(r'file_limit=(\d+)', init_txt)
+        return int(m.group(1)) if m else 0
+
+    def _download_orders(self):
+        # 2–4. sale: init, заказы mode=query прямо в файл, подтверждение mode=success
+        self._init()
+        self._phase('query')
+        self._emit(f"📥 Шаг 3: Выгрузка заказов в {self.file_path}.")
+        resp = self._request('GET', self._params('query'), stream=True)
+        try:
+            self._emit(f"📤 Запрос: GET {resp.url}")
+            if resp.status_code != 200:
+                raise ExchangeError(f"❌ Ошибка query: код {resp.status_code}")
+            blocks = resp.iter_content(ORDERS_BLOCK)
+            first = next(blocks, b'')
+            if first.lstrip()[:7].lower() == b'failure':
+                raise ExchangeError("❌ Выгрузка заказов не удалась: " + excerpt(first.decode('utf-8', 'replace')))
+            total = int(resp.headers.get('Content-Length') or 0)
+            # без Content-Length (chunked) процент неизвестен — бегущая полоса
+            self.listener.progress_range(0, 100 if total else 0)
+
+            def progress(stats):
+                self._emit(f"📥 Получено {stats.bytes / 1024 / 1024:.1f} МБ, документов {stats.documents}")
+                if total:
+                    self.listener.progress_percent(min(100, stats.bytes * 100 // total))
+
+            try:
+                stats = save_orders(itertools.chain([first], blocks), self.file_path,
+                                    check=self._check_interrupted, progress=progress)
+            except OrdersError as e:
+                raise ExchangeError(f"❌ {e}")
+        finally:
+            resp.close()
+        self.orders_stats = stats
+        self.listener.progress_range(0, 100)
+        self.listener.progress_percent(100)
+        self._emit("📥 Заказы: " + stats.describe() + (" (ZIP)" if stats.zipped else ""))
+
+        # 4. success — сайт отмечает заказы выгруженными
+        self._phase('success')
+        self._emit("📤 Шаг 4: Подтверждение получения заказов.")
+        resp = self._get('success')
+        self._emit_response(resp.text)
+        if resp.status_code != 200 or not resp.text.strip().lower().startswith("success"):
+            raise ExchangeError(f"❌ Сайт не принял подтверждение: {excerpt(resp.text) or resp.status_code}. "
+                                f"Заказы сохранены в {self.file_path}, при следующей выгрузке придут снова.")
+
+    def _build_manifest(self):
+        # 0. хэши файлов пакета против того, что сайт уже принял
+        self._phase('manifest')
+        self._emit("🧮 Сравнение файлов пакета с уже принятыми сайтом.")
+        hashes = self._hashes = self.package_hashes or hash_package(self.file_path, self.compress,
+                                                                    check=self._check_interrupted)
+        package = build_manifest(hashes, self.manifest or ContentManifest(self.url, self.exchange_type))
+        self._emit("🧮 " + package.describe())
+        return package
+
+    def _changed_entries(self):
+        # файлы, которые остались отправить после манифеста, или None — весь пакет
+        m = self._manifest
+        return m.entries if m and m.entries else None
+
+    def _build_delta(self):
+        # 0. пакет изменений: только новые, изменённые и удалённые товары и предложения
+        self._phase('delta')
+        self._emit("🧮 Сравнение с прошлой выгрузкой на этот сайт.")
+        index = self.delta_index or DeltaIndex(self.url, self.exchange_type)
+        try:
+            package = build_delta(self.file_path, self.compress, index, check=self._check_interrupted,
+                                  entries=self._changed_entries())
+        except expat.ExpatError as e:
+            raise ExchangeError(f"❌ XML повреждён: {e}")
+        for st in package.stats:
+            self._emit("🧮 " + st.describe())
+            if not st.full:
+                # импортироваться будут только изменения
+                self.expected_totals[st.name] = st.added + st.changed + st.removed
+        return package
+
+    def _split_xml(self):
+        # 0. большие XML -> части не больше split_size, каждая импортируется отдельно
+        self._phase('split')
+        self._emit(f"✂️ Разрезание XML больше {self.split_size / 1024 / 1024:.0f} МБ на части.")
+        entries = self._delta.entries if self._delta else self._changed_entries()
+        try:
+            package = split_package(self.file_path, self.compress, self.split_size,
+                                    check=self._check_interrupted, entries=entries)
+        except expat.ExpatError as e:
+            raise ExchangeError(f"❌ XML повреждён: {e}")
+        for reason in package.skipped:
+            self._emit(f"⚠️ Не разрезан: {reason}, отправляется целиком")
+        if not package.stats:
+            self._emit("✂️ Резать нечего: все XML меньше порога.")
+            package.cleanup()
+            return None
+        for st in package.stats:
+            self._emit("✂️ " + st.describe())
+            self.expected_totals.pop(st.name, None)
+            for name, _, count in st.parts:
+                self.expected_totals[name] = count
+        return package
+
+    def _prepare_source(self) -> UploadSource:
+        path = self.file_path
+        if self._split:
+            # части уходят одним ZIP, даже если на входе был одиночный XML
+            return self._zip_source(self._split.entries, archive_name(path))
+        if self._delta:
+            package = self._delta
+            if package.single:
+                name, xml = package.entries[0]
+                return UploadSource(name, os.path.getsize(xml), lambda: open(xml, 'rb', buffering=0), [name])
+            return self._zip_source(package.entries, archive_name(path))
+        if self._changed_entries():
+            return self._zip_source(self._manifest.entries, archive_name(path))
+        if not self.compress:
+            if os.path.isdir(path):
+                raise ExchangeError("❌ Папку можно отправить только со сжатием в ZIP")
+            fname = os.path.basename(path)
+            return UploadSource(fname, os.path.getsize(path),
+                                lambda: open(path, 'rb', buffering=0), self._list_xmls(fname))
+
+        # сжатие на лету: архив собирается прямо в цикле mode=file
+        return self._zip_source(collect_entries(path), archive_name(path))
+
+    def _zip_source(self, entries, name) -> UploadSource:
+        stream = ZipStream(entries, self.compress_level)
+        source_size = stream.source_size()
+        self._emit(f"📦 Сжатие в ZIP на лету: {len(entries)} файл(ов), {source_size} байт, "
+                   f"уровень {self.compress_level}")
+        # длина архива станет известна, только когда он весь сожмётся: чанки
+        # отправляются по мере сжатия, без отдельного прохода ради размера
+        return UploadSource(name, None,
+                            lambda: ZipStream(entries, self.compress_level),
+                            stream.xml_names(), stream.fingerprint(), source_size)
+
+    def _resume_point(self, entry, source):
+        # смещение, с которого можно продолжить загрузку, или 0
+        if not (self.resume and entry and entry.chunks):
+            return 0
+        raw = source.open_raw()
+        if not entry.verify(raw):
+            raw.close()
+            self._emit("⚠️ Журнал докачки не совпал с файлом, загружаем заново.")
+            return 0
+        # сверка дочитала источник до точки докачки — загрузка продолжится с него,
+        # архив не пересжимается второй раз
+        self._resume_raw = raw
+        return entry.acked_bytes
+
+    def _upload(self, source, limit, start=0, entry=None):
+        # 3. file — разбиваем на чанки и отсылаем, сообщаем процент
+        # чанки уходят потоком из BlockReader, в память попадает только его пул буферов
+        self._phase('file')
+        fname, total = source.name, source.total
+        raw, self._resume_raw = self._resume_raw or source.open_raw(), None
+        with raw as f:
+            if f.tell() != start:
+                f.seek(start)
+            with BlockReader(f) as reader:
+                if total is None:
+                    self._uploaded = self._upload_spooled(reader, f, source, limit, start, entry)
+                    return
+                chunk = limit or total
+                bytes_sent = start
+                while bytes_sent < total:
+                    self._check_interrupted()
+
+                    size = min(chunk, total - bytes_sent)
+                    percent = int((bytes_sent + size) / total * 100)
+                    self.listener.progress_percent(percent)
+                    self._emit(f"📤 Отправлено {bytes_sent + size}/{total} байт ({percent}%)")
+                    crc = self._post_chunk(reader, fname, bytes_sent, size)
+                    if entry:
+                        entry.ack(bytes_sent, size, crc)
+                    bytes_sent += size
+        self._uploaded = bytes_sent
+        # доводим до 100%
+        self.listener.progress_percent(100)
+
+    def _upload_spooled(self, reader, stream, source, limit, start, entry):
+        # ZIP на лету: очередной чанк копится во временном файле, его длина — Content-Length,
+        # повтор чанка читает этот файл, а не пересжимает архив. Короткий чанк — последний
+        fname, bytes_sent = source.name, start
+        with tempfile.TemporaryFile() as spool:
+            while True:
+                self._check_interrupted()
+                size = _spool(reader, spool, limit)
+                if not size:
+                    break
+                # процент — по сжатым исходным байтам: длины архива ещё нет
+                percent = min(99, stream.consumed * 100 // source.source_size) if source.source_size else 0
+                self.listener.progress_percent(percent)
+                self._emit(f"📤 Отправлено {bytes_sent + size} байт архива ({percent}%)")
+                with BlockReader(spool) as chunk_reader:
+                    crc = self._post_chunk(chunk_reader, fname, bytes_sent, size, at=0)
+                if entry:
+                    entry.ack(bytes_sent, size, crc)
+                bytes_sent += size
+                if limit and size < limit:
+                    break
+        self.listener.progress_percent(100)
+        ratio = source.source_size / bytes_sent if bytes_sent else 0
+        self._emit(f"📦 Размер архива: {bytes_sent} байт (сжатие {ratio:.1f}×)")
+        return bytes_sent
+
+    def _post_chunk(self, reader, fname, offset, size, at=None):
+        # один чанк с повторами при временных ошибках; возвращает CRC32 чанка.
+        # at — где чанк лежит в reader, если не на offset (временный файл чанка)
+        at = offset if at is None else at
+        backoff = Backoff(retries=self.chunk_retries)
+        while True:
+            if reader.tell() != at:
+                reader.seek(at)
+            body = ChunkBody(reader, size)
+            try:
+                r = self._request('POST', self._params('file', filename=fname), data=body)
+            except OSError as e:  # в т.ч. requests.RequestException
+                if body.error:
+                    raise ExchangeError(f"❌ Ошибка чтения {fname} во время отправки: {body.error}")
+                if not isinstance(e, TRANSIENT_ERRORS):
+                    raise
+                reason = str(e)
+            else:
+                self._emit_response(r.text)
+                if r.status_code == 200 and r.text.lower().startswith("success"):
+                    return body.crc
+                if r.status_code not in TRANSIENT_STATUS:
+                    raise ExchangeError(f"❌ Ошибка file: {excerpt(r.text)}")
+                reason = f"код {r.status_code}"
+            delay = backoff.next_delay()
+            if delay is None:
+                raise ExchangeError(f"❌ Ошибка file: {reason}, попытки исчерпаны")
+            self._emit(f"⚠️ Чанк {offset}+{size} не принят ({reason}), повтор через {delay:.1f} с")
+            self._sleep(delay)
+
+    def _list_xmls(self, fname):
+        # собираем список XML внутри ZIP или одиночного файла
+        if fname.lower().endswith('.zip'):
+            with zipfile.ZipFile(self.file_path, 'r') as z:
+                return [info.filename for info in z.infolist()
+                        if info.filename.lower().endswith('.xml')]
+        return [fname]
+
+    def _import(self, xmls):
+        # 4. import — переключаем прогресс в неопределённый режим
+        self._phase('import')
+        self._emit("📤 Шаг 4: Импорт данных.")
+        self.listener.progress_range(0, 0)
+        self._import_determinate = False
+        for xf in xmls:
+            self._emit(
+                f"📤 Запрос: GET {self.url}"
+                f"?type={self.exchange_type}&mode=import&filename={xf}&sessid={self.sessid}&version={self.exchange_version}"
+            )
+            scheduler = PollScheduler(self.poll_min, self.poll_max)
+            tracker = ImportProgress(self.expected_totals.get(xf))
+            while True:
+                self._check_interrupted()
+
+                started = time.monotonic()
+                r = self._get('import', filename=xf)
+                step_time = time.monotonic() - started
+                self._emit_response(r.text)
+                if r.status_code != 200:
+                    raise ExchangeError(f"❌ Ошибка import: код {r.status_code}")
+                txt = r.text.strip().lower()
+                if txt.startswith('progress'):
+                    info = parse_progress(r.text)
+                    self._report_import(xmls, xf, tracker, info)
+                    self._sleep(scheduler.next_delay(step_time, info))
+                    continue
+                if txt.startswith('success'):
+                    self.metrics.xml_done(xf, tracker.elapsed)
+                    self._emit(f"✅ {xf}: импорт за {format_eta(tracker.elapsed)}")
+                    break
+                raise ExchangeError("❌ Ошибка import, прерываем.")
+
+        # после импорта возвращаем нормальный диапазон и ставим 100%
+        self.listener.progress_range(0, 100)
+        self.listener.progress_percent(100)
+
+    def _report_import(self, xmls, xf, tracker, info):
+        # реальный процент вместо лоадера, как только сервер прислал счётчики
+        fraction = tracker.update(info)
+        if fraction is None:
+            return
+        index = xmls.index(xf)
+        percent = int((index + fraction) / len(xmls) * 100)
+        if not self._import_determinate:
+            self.listener.progress_range(0, 100)
+            self._import_determinate = True
+        self.listener.progress_percent(percent)
+        eta = tracker.eta()
+        self._emit(f"⏳ {xf}: {info.step or 'импорт'} — {fraction * 100:.0f}%"
+                   + (f", осталось ~{format_eta(eta)}" if eta is not None else ""))
+
+
+def order_xmls(xmls):
+    # упорядочиваем xml: import, catalog, goods…
+    xmls = sorted(xmls, key=str.lower)
+    ordered = []
+    for k in ('import', 'catalog', 'goods'):
+        for x in xmls:
+            if x.lower().startswith(k) and x not in ordered:
+                ordered.append(x)
+    for x in xmls:
+        if x not in ordered:
+            ordered.append(x)
+    return ordered
+
+
+def _spool(reader, spool, limit):
+    # следующие limit байт ридера (0 — все до конца) во временный файл; -> сколько записано
+    spool.seek(0)
+    spool.truncate()
+    size = 0
+    while not limit or size < limit:
+        data = reader.read(min(BLOCK_SIZE, limit - size) if limit else BLOCK_SIZE)
+        if not data:
+            break
+        spool.write(data)
+        size += len(data)
+    spool.flush()
+    spool.seek(0)
+    return size
@@ -0,0 +1,182 @@
+# bitrix_exchange/fanout.py
+# Один пакет обмена — на несколько сайтов одновременно.
+#
+# На каждый сайт свой ExchangeEngine: отдельная requests.Session, свой
+# checkauth и sessid. Параллельно работают не больше `concurrency` сайтов.
+# Слушателя для каждого сайта создаёт listener_factory(index, target),
+# итог — список SiteResult в порядке целей и сводка summary().
+# Предпроверка XML (preflight) делается один раз на весь пакет: если он
+# битый, ни один сайт не получает запросов. Хэши файлов пакета для
+# skip_unchanged тоже считаются один раз, сравнивает их каждый сайт со своим
+# манифестом.
+
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .commerceml import PreflightError, analyze_package, expected_totals, report
+from .engine import ExchangeEngine, ExchangeListener
+from .manifest import hash_package
+
+DEFAULT_CONCURRENCY = 4
+
+
+class SiteTarget:
+    def __init__(self, url, login, password, password_env=None):
+        self.url = url
+        self.login = login
+        self.password = password
+        self.password_env = password_env  # откуда взят пароль, если не из файла
+
+    def __repr__(self):
+        return f"SiteTarget({self.url!r}, {self.login!r})"
+
+
+class SiteResult:
+    def __init__(self, target, ok, elapsed, last_message='', metrics=None):
+        self.target = target
+        self.ok = ok
+        self.elapsed = elapsed
+        self.last_message = last_message
+        self.metrics = metrics  # RunMetrics обмена с этим сайтом
+
+
+class _LastMessage(ExchangeListener):
+    # запоминает последнее сообщение сайта для сводки и передаёт события дальше
+    def __init__(self, inner):
+        self.inner = inner
+        self.last = ''
+
+    def message(self, msg):
+        self.last = msg
+        self.inner.message(msg)
+
+    def progress_range(self, lo, hi):
+        self.inner.progress_range(lo, hi)
+
+    def progress_percent(self, value):
+        self.inner.progress_percent(value)
+
+    def finished(self, ok):
+        self.inner.finished(ok)
+
+    def phase(self, name):
+        self.inner.phase(name)
+
+    def http(self, method, url, status, elapsed):
+        self.inner.http(method, url, status, elapsed)
+
+
+def load_targets(path):
+    # JSON: [{"url": ..., "login": ..., "password": ...}]; вместо password
+    # можно указать "password_env" — имя переменной окружения с паролем
+    with open(path, encoding='utf-8') as f:
+        items = json.load(f)
+    targets = []
+    for item in items:
+        password, env = item.get('password'), None
+        if password is None and item.get('password_env'):
+            env = item['password_env']
+            password = os.environ.get(env)
+        if not (item.get('url') and item.get('login') and password):
+            raise ValueError(f"неполная запись сайта: {item.get('url') or item}")
+        targets.append(SiteTarget(item['url'], item['login'], password, env))
+    return targets
+
+
+class FanOut:
+    def __init__(self, targets, exchange_type, file_path, send_file=True, concurrency=DEFAULT_CONCURRENCY,
+                 listener_factory=None, interrupted=None, preflight=False, **engine_options):
+        self.targets = list(targets)
+        self.exchange_type = exchange_type
+        self.file_path = file_path
+        self.send_file = send_file
+        self.concurrency = max(1, concurrency)
+        self.listener_factory = listener_factory or (lambda index, target: ExchangeListener())
+        self.interrupted = interrupted
+        self.preflight = preflight
+        self.engine_options = engine_options
+        self.expected_totals = {}
+        self.package_hashes = None
+        self._report = []  # строки предпроверки — в лог каждого сайта
+
+    def _run_one(self, index, target):
+        listener = _LastMessage(self.listener_factory(index, target))
+        engine = ExchangeEngine(target.url, target.login, target.password, self.exchange_type,
+                                self.file_path, send_file=self.send_file, listener=listener,
+                                interrupted=self.interrupted, **self.engine_options)
+        engine.expected_totals.update(self.expected_totals)
+        engine.package_hashes = self.package_hashes
+        for msg in self._report:
+            listener.message(msg)
+        started = time.monotonic()
+        ok = engine.run()
+        return SiteResult(target, ok, time.monotonic() - started, listener.last, engine.metrics)
+
+    def _preflight(self):
+        # None, если пакет в порядке, иначе текст ошибки
+        self._report = ["🔎 Предпроверка XML перед отправкой."]
+        try:
+            stats = analyze_package(self.file_path, self.engine_options.get('compress', False),
+                                    check=self._check_interrupted)
+        except PreflightError as e:
+            return f"❌ Предпроверка: {e}"
+        except InterruptedError:
+            return "🛑 Операция прервана пользователем."
+        except OSError as e:
+            return f"❌ Предпроверка: {e}"
+        self._report += report(stats)
+        self.expected_totals = expected_totals(stats)
+        return None
+
+    def _hash(self):
+        # None, если хэши посчитаны, иначе текст ошибки
+        try:
+            self.package_hashes = hash_package(self.file_path, self.engine_options.get('compress', False),
+                                               check=self._check_interrupted)
+        except InterruptedError:
+            return "🛑 Операция прервана пользователем."
+        except (OSError, zipfile.BadZipFile) as e:
+            return f"❌ Пакет не прочитан: {e}"
+        return None
+
+    def _check_interrupted(self):
+        if self.interrupted and self.interrupted():
+            raise InterruptedError()
+
+    def _fail_all(self, error):
+        results = []
+        for index, target in enumerate(self.targets):
+            listener = self.listener_factory(index, target)
+            for msg in self._report + [error]:
+                listener.message(msg)
+            listener.finished(False)
+            results.append(SiteResult(target, False, 0.0, error))
+        return results
+
+    def run(self):
+        if self.preflight and self.send_file:
+            error = self._preflight()
+            if error:
+                return self._fail_all(error)
+        if self.engine_options.get('skip_unchanged') and self.send_file:
+            error = self._hash()
+            if error:
+                return self._fail_all(error)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fanout') as pool:
+            futures = [pool.submit(self._run_one, i, t) for i, t in enumerate(self.targets)]
+            return [f.result() for f in futures]
+
+
+def summary(results):
+    ok = sum(1 for r in results if r.ok)
+    lines = [f"Итого: {ok} из {len(results)} сайтов успешно"]
+    for r in results:
+        mark = "✅" if r.ok else "❌"
+        line = f"{mark} {r.target.url} — {r.elapsed:.1f} с"
+        if not r.ok and r.last_message:
+            line += f": {r.last_message.splitlines()[0]}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,377 @@
+# bitrix_exchange/history.py
+# История обменов в SQLite и поиск замедлений.
+#
+# Движок, которому передан RunHistory, после каждого запуска пишет строку в
+# ~/.bitrix_exchange/history.sqlite: сайт, тип обмена, размер и хэш пакета,
+# сколько байт ушло и сколькими чанками, время каждого шага, число опросов
+# import, итог и текст ошибки. Успешный обмен сравнивается с базой — медианами
+# последних BASELINE_RUNS успешных обменов с тем же сайтом и типом:
+#   upload  — скорость загрузки упала больше чем в slowdown раз;
+#   import  — Битрикс импортирует байт пакета в секунду больше чем в slowdown
+#             раз медленнее (так сравниваются пакеты разного размера);
+#   connect — checkauth и init дольше базы больше чем в slowdown раз.
+# Короткие шаги (меньше MIN_FLAG_SECONDS) и загрузки меньше MIN_UPLOAD_BYTES
+# не помечаются: там замер — в основном шум. Пометки (flags) видны в логе
+# обмена, на вкладке «История» и в `python -m bitrix_exchange history`.
+#
+# Каждый вызов открывает своё соединение: fanout и очередь пишут из
+# нескольких потоков, SQLite в режиме WAL это выдерживает.
+#
+# Хэш пакета берётся из хэшей манифеста, если запуск их уже посчитал, а хэш
+# одиночного файла помнится в той же базе по (путь, размер, mtime_ns):
+# повторная выгрузка того же файла не читает его заново. Прерванный обмен
+# пакет не хэширует вовсе. Скорость импорта считается по байтам, которые
+# получил сервер, — у delta-выгрузки это пакет изменений, а не весь файл.
+
+import json
+import os
+import sqlite3
+import statistics
+import threading
+from datetime import datetime
+from urllib.parse import urlparse
+
+from .manifest import hash_stream
+from .paths import data_dir
+from .zipstream import collect_entries
+
+SCHEMA_VERSION = 2
+BASELINE_RUNS = 10      # сколько прошлых успешных обменов составляют базу
+MIN_BASELINE = 3        # меньше — сравнивать не с чем
+DEFAULT_SLOWDOWN = 2.0
+MIN_FLAG_SECONDS = 1.0
+MIN_UPLOAD_BYTES = 1024 * 1024
+SPARK = "▁▂▃▄▅▆▇█"
+FLAG_NAMES = {'upload': "загрузка", 'import': "импорт", 'connect': "авторизация и init"}
+
+_COLUMNS = ('started', 'url', 'site', 'exchange_type', 'file', 'file_size', 'file_hash', 'bytes_sent',
+            'chunks', 'retries', 'phases', 'connect_seconds', 'upload_seconds', 'import_seconds',
+            'import_polls', 'elapsed', 'throughput', 'import_speed', 'ok', 'message', 'flags')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    url TEXT NOT NULL,
+    site TEXT NOT NULL,
+    exchange_type TEXT NOT NULL,
+    file TEXT,
+    file_size INTEGER,
+    file_hash TEXT,
+    bytes_sent INTEGER NOT NULL DEFAULT 0,
+    chunks INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    phases TEXT NOT NULL DEFAULT '{}',
+    connect_seconds REAL,
+    upload_seconds REAL,
+    import_seconds REAL,
+    import_polls INTEGER NOT NULL DEFAULT 0,
+    elapsed REAL,
+    throughput REAL,
+    import_speed REAL,
+    ok INTEGER NOT NULL,
+    message TEXT NOT NULL DEFAULT '',
+    flags TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS runs_site ON runs (url, exchange_type, started);
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+"""
+
+
+class HistoryError(Exception):
+    pass
+
+
+class Run:
+    # строка истории; flags — через запятую: upload, import, connect;
+    # baseline — медианы, с которыми обмен сравнивался (только у только что записанного)
+    def __init__(self, row):
+        self.baseline = None
+        for key in row.keys():
+            setattr(self, key, row[key])
+        self.ok = bool(self.ok)
+        self.phases = json.loads(self.phases or '{}')
+
+    @property
+    def flag_list(self):
+        return [f for f in self.flags.split(',') if f]
+
+
+class RunHistory:
+    def __init__(self, path=None, baseline_runs=BASELINE_RUNS, slowdown=DEFAULT_SLOWDOWN):
+        self.path = path or os.path.join(data_dir(), 'history.sqlite')
+        self.baseline_runs = baseline_runs
+        self.slowdown = slowdown
+        self._ready = False
+        # сайты fanout заканчивают разом: один файл хэширует один поток
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        try:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.row_factory = sqlite3.Row
+            if not self._ready:
+                db.execute("PRAGMA journal_mode=WAL")
+                if db.execute("PRAGMA user_version").fetchone()[0] > SCHEMA_VERSION:
+                    db.close()
+                    raise HistoryError(f"история {self.path} записана более новой версией программы")
+                db.executescript(_SCHEMA)
+                db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+                self._ready = True
+        except sqlite3.Error as e:
+            raise HistoryError(f"история {self.path}: {e}")
+        return db
+
+    # --- запись ---
+
+    def record(self, snap, file_path=None, hashes=None, message='', package_bytes=None, digest=True):
+        # snap — RunMetrics.snapshot() законченного обмена -> Run с пометками;
+        # package_bytes — длина пакета, который получил сервер (с докачанной частью);
+        # digest=False — пакет не хэшировать (обмен прерван)
+        size, file_hash = self.package_digest(file_path, hashes) if digest else (_size(file_path), None)
+        up, imp, parts = snap['upload'], snap['import'], snap['breakdown']
+        ok = bool(snap['ok'])
+        import_seconds = imp['seconds'] if imp['polls'] else None
+        package = package_bytes or up['bytes']
+        row = {
+            'started': snap['started'] or datetime.now().isoformat(timespec='seconds'),
+            'url': snap['url'],
+            'site': urlparse(snap['url']).netloc or snap['url'],
+            'exchange_type': snap['type'],
+            'file': file_path,
+            'file_size': size,
+            'file_hash': file_hash,
+            'bytes_sent': up['bytes'],
+            'chunks': up['chunks'],
+            'retries': up['retries'],
+            'phases': json.dumps(snap['phases']),
+            'connect_seconds': parts['connect'] or None,
+            'upload_seconds': up['seconds'] or None,
+            'import_seconds': import_seconds,
+            'import_polls': imp['polls'],
+            'elapsed': snap['elapsed'],
+            'throughput': up['throughput'] if up['bytes'] >= MIN_UPLOAD_BYTES else None,
+            'import_speed': package / import_seconds if package and import_seconds else None,
+            'ok': int(ok),
+            'message': message or '',
+            'flags': '',
+        }
+        try:
+            db = self._connect()
+            try:
+                with db:
+                    base = self._baseline(db, row['url'], row['exchange_type'])
+                    if ok:
+                        row['flags'] = ','.join(self._flags(base, row))
+                    cursor = db.execute(f"INSERT INTO runs ({', '.join(_COLUMNS)}) VALUES "
+                                        f"({', '.join('?' * len(_COLUMNS))})", [row[c] for c in _COLUMNS])
+                    run = Run(db.execute("SELECT * FROM runs WHERE id = ?", (cursor.lastrowid,)).fetchone())
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            raise HistoryError(f"история {self.path}: {e}")
+        run.baseline = base
+        return run
+
+    def package_digest(self, path, hashes=None):
+        # (размер, хэш) пакета; хэш — blake2b файла или хэшей файлов пакета
+        if hashes is not None and hashes.members:
+            members = sorted(hashes.members, key=lambda m: m[0])
+            digest = hash_stream(_Lines(f"{name}\t{h}" for name, _, _, h in members))
+            return hashes.size, digest
+        if not path or not os.path.isfile(path):
+            return _size(path), None
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._cached_digest(key)
+            if digest is None:
+                with open(path, 'rb') as f:
+                    digest = hash_stream(f)
+                self._remember_digest(key, digest)
+        return st.st_size, digest
+
+    def _cached_digest(self, key):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT hash FROM digests WHERE path = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+        except sqlite3.Error as e:
+            raise HistoryError(f"история {self.path}: {e}")
+        finally:
+            db.close()
+        return row['hash'] if row else None
+
+    def _remember_digest(self, key, digest):
+        # одна строка на путь: хэш прежней версии файла больше не понадобится
+        db = self._connect()
+        try:
+            with db:
+                db.execute("INSERT OR REPLACE INTO digests (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                           key + (digest,))
+        except sqlite3.Error as e:
+            raise HistoryError(f"история {self.path}: {e}")
+        finally:
+            db.close()
+
+    def _flags(self, base, row):
+        flags = []
+        if row['throughput'] is not None and base['throughput']:
+            if row['throughput'] * self.slowdown < base['throughput']:
+                flags.append('upload')
+        if row['import_speed'] is not None and base['import_speed'] and row['import_seconds'] >= MIN_FLAG_SECONDS:
+            if row['import_speed'] * self.slowdown < base['import_speed']:
+                flags.append('import')
+        if row['connect_seconds'] is not None and base['connect_seconds'] and row['connect_seconds'] >= MIN_FLAG_SECONDS:
+            if row['connect_seconds'] > base['connect_seconds'] * self.slowdown:
+                flags.append('connect')
+        return flags
+
+    def _baseline(self, db, url, exchange_type):
+        rows = db.execute("SELECT throughput, import_speed, connect_seconds FROM runs "
+                          "WHERE url = ? AND exchange_type = ? AND ok = 1 ORDER BY id DESC LIMIT ?",
+                          (url, exchange_type, self.baseline_runs)).fetchall()
+        base = {}
+        for key in ('throughput', 'import_speed', 'connect_seconds'):
+            values = [r[key] for r in rows if r[key] is not None]
+            base[key] = statistics.median(values) if len(values) >= MIN_BASELINE else None
+        return base
+
+    # --- чтение ---
+
+    def baseline(self, url, exchange_type):
+        # медианы последних успешных обменов: throughput, import_speed, connect_seconds
+        db = self._connect()
+        try:
+            return self._baseline(db, url.rstrip('/'), exchange_type)
+        finally:
+            db.close()
+
+    def runs(self, url=None, exchange_type=None, limit=50, slow_only=False):
+        # последние обмены, новые первыми
+        where, params = [], []
+        if url:
+            where.append("(url = ? OR site = ?)")
+            params += [url.rstrip('/'), url]
+        if exchange_type:
+            where.append("exchange_type = ?")
+            params.append(exchange_type)
+        if slow_only:
+            where.append("flags != ''")
+        sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        db = self._connect()
+        try:
+            return [Run(r) for r in db.execute(sql, params)]
+        finally:
+            db.close()
+
+    def trends(self, points=20):
+        # по сайту и типу обмена: последние points успешных обменов, старые первыми
+        db = self._connect()
+        try:
+            keys = db.execute("SELECT url, site, exchange_type, COUNT(*) AS runs, SUM(ok = 0) AS failed, "
+                              "MAX(id) AS last FROM runs GROUP BY url, exchange_type ORDER BY last DESC").fetchall()
+            result = []
+            for key in keys:
+                rows = db.execute("SELECT * FROM runs WHERE url = ? AND exchange_type = ? AND ok = 1 "
+                                  "ORDER BY id DESC LIMIT ?", (key['url'], key['exchange_type'], points)).fetchall()
+                result.append(Trend(key, [Run(r) for r in reversed(rows)]))
+            return result
+        finally:
+            db.close()
+
+
+class Trend:
+    # ряд успешных обменов одного сайта и типа для графика
+    def __init__(self, key, runs):
+        self.url = key['url']
+        self.site = key['site']
+        self.exchange_type = key['exchange_type']
+        self.total = key['runs']
+        self.failed = key['failed'] or 0
+        self.runs = runs
+
+    def series(self, name):
+        return [getattr(r, name) for r in self.runs]
+
+    def median(self, name):
+        values = [v for v in self.series(name) if v is not None]
+        return statistics.median(values) if values else None
+
+    def last(self, name):
+        for value in reversed(self.series(name)):
+            if value is not None:
+                return value
+        return None
+
+    @property
+    def last_flags(self):
+        return self.runs[-1].flag_list if self.runs else []
+
+
+def _size(path):
+    # размер файла или всех файлов папки; None — пакета нет
+    if path and os.path.isdir(path):
+        return sum(os.path.getsize(p) for _, p in collect_entries(path))
+    if path and os.path.isfile(path):
+        return os.path.getsize(path)
+    return None
+
+
+class _Lines:
+    # итератор строк как файл для hash_stream
+    def __init__(self, lines):
+        self._data = "\n".join(lines).encode('utf-8')
+
+    def read(self, size=-1):
+        block, self._data = self._data[:size], self._data[size:]
+        return block
+
+
+def sparkline(values):
+    # ▁▃▇ по значениям ряда; пропуск — пробел
+    known = [v for v in values if v is not None]
+    if not known:
+        return ''
+    lo, hi = min(known), max(known)
+    span = hi - lo
+    return ''.join(' ' if v is None else SPARK[int((v - lo) / span * (len(SPARK) - 1)) if span else 3]
+                   for v in values)
+
+
+def describe_flags(run):
+    # «загрузка 0.4 МБ/с при обычных 2.1 МБ/с, …» для лога
+    baseline = run.baseline
+    parts = []
+    for flag in run.flag_list:
+        if flag == 'upload':
+            text = f"загрузка {_mbps(run.throughput)}"
+            if baseline and baseline.get('throughput'):
+                text += f" при обычных {_mbps(baseline['throughput'])}"
+        elif flag == 'import':
+            text = f"импорт {run.import_seconds:.1f} с ({_mbps(run.import_speed)})"
+            if baseline and baseline.get('import_speed'):
+                text += f" при обычных {_mbps(baseline['import_speed'])}"
+        else:
+            text = f"{FLAG_NAMES[flag]} {run.connect_seconds:.1f} с"
+            if baseline and baseline.get('connect_seconds'):
+                text += f" при обычных {baseline['connect_seconds']:.1f} с"
+        parts.append(text)
+    return ", ".join(parts)
+
+
+def _mbps(value):
+    return f"{value / 1024 / 1024:.2f} МБ/с" if value else "—"
+
+
+def format_time(iso):
+    try:
+        return datetime.fromisoformat(iso).strftime('%d.%m %H:%M')
+    except (TypeError, ValueError):
+        return iso or ''
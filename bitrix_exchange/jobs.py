@@ -0,0 +1,352 @@
+# bitrix_exchange/jobs.py
+# Очередь обменов, которая работает без оператора.
+#
+# JobQueue — список заданий «файл → сайт, тип обмена» в JSON
+# (data_dir('queue')/jobs.json), сохраняется после каждого изменения и
+# переживает перезапуск: прерванные на середине задания снова ждут очереди.
+# Там же помнятся размер и mtime уже поставленных в очередь файлов, так
+# что после перезапуска или очистки списка старая выгрузка не уйдёт снова.
+# JobScheduler раздаёт задания потокам: всего не больше concurrency, на
+# один сайт — не больше per_host (init на сервере очищает каталог обмена,
+# поэтому два обмена с одним сайтом сразу мешают друг другу). Пока сайт
+# занят, идут задания других сайтов — конвейер не простаивает.
+# FolderWatcher следит за папкой выгрузок 1С: XML или ZIP попадает в
+# очередь, когда его размер и время изменения не менялись settle секунд,
+# то есть 1С его дописала.
+#
+# Пароль в файл очереди не пишется: он живёт только в памяти процесса,
+# а "password_env" в задании — имя переменной окружения с паролем, которая
+# читается при загрузке. Ожидающие задания без пароля после перезапуска
+# получают статус NEEDS_PASSWORD и не раздаются, пока set_password() (или
+# новое задание на тот же сайт с тем же логином) не вернёт им пароль.
+
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .engine import ExchangeEngine, ExchangeListener
+from .fanout import DEFAULT_CONCURRENCY, _LastMessage
+from .paths import data_dir
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+NEEDS_PASSWORD = 'needs password'
+DEFAULT_PER_HOST = 1
+DEFAULT_SETTLE = 5.0
+WATCH_EXTENSIONS = ('.xml', '.zip')
+
+
+class Job:
+    def __init__(self, id, file, url, login, password, exchange_type='catalog', options=None,
+                 stamp=None, password_env=None):
+        self.id = id
+        self.file = file
+        self.url = url
+        self.login = login
+        self.password = password
+        self.password_env = password_env
+        self.exchange_type = exchange_type
+        self.options = options or {}    # настройки ExchangeEngine этого задания (compress, delta, …)
+        self.stamp = stamp              # (размер, mtime_ns) файла, которым задание создано
+        self.status = PENDING
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.message = ''
+
+    @property
+    def host(self):
+        return urlparse(self.url).netloc or self.url
+
+    def to_dict(self):
+        data = dict(self.__dict__)
+        data['password'] = None
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['id'], data['file'], data['url'], data['login'], data.get('password'),
+                  data.get('exchange_type', 'catalog'), data.get('options'),
+                  tuple(data['stamp']) if data.get('stamp') else None, data.get('password_env'))
+        if job.password is None and job.password_env:
+            job.password = os.environ.get(job.password_env)
+        for key in ('status', 'created', 'started', 'finished', 'message'):
+            if key in data:
+                setattr(job, key, data[key])
+        return job
+
+
+class JobQueue:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(data_dir('queue'), 'jobs.json')
+        self._lock = threading.Lock()
+        self.jobs = []
+        self.files = {}     # путь -> (размер, mtime_ns) последней версии, попавшей в очередь
+        self.version = 0    # растёт с каждым изменением — есть ли что перерисовать
+        self.load_error = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.jobs = [Job.from_dict(item) for item in data['jobs']]
+            self.files = {path: tuple(stamp) for path, stamp in data.get('files', {}).items()}
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # испорченный файл откладываем в сторону и начинаем с пустой очереди
+            self.load_error = f"очередь {self.path} не прочитана ({e}), сохранена как .broken"
+            self.jobs, self.files = [], {}
+            try:
+                os.replace(self.path, f"{self.path}.broken")
+            except OSError:
+                pass
+            return
+        for job in self.jobs:
+            if job.status == RUNNING:
+                # приложение закрыли посреди обмена — задание выполняется заново
+                job.status = PENDING
+                job.started = None
+            if job.status == PENDING and not job.password:
+                job.status = NEEDS_PASSWORD
+
+    def _save(self):
+        # под self._lock
+        self.version += 1
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump({'jobs': [job.to_dict() for job in self.jobs], 'files': self.files},
+                      f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+    def add(self, file, url, login, password, exchange_type='catalog', options=None,
+            stamp=None, password_env=None):
+        with self._lock:
+            job = Job(max((j.id for j in self.jobs), default=0) + 1, file, url, login, password,
+                      exchange_type, options, stamp, password_env)
+            self.jobs.append(job)
+            if stamp:
+                self.files[file] = stamp
+            if password:
+                self._unlock(url, login, password)
+            self._save()
+            return job
+
+    def set_password(self, url, login, password):
+        # пароль сайта для заданий, ждущих его после перезапуска; -> сколько их
+        with self._lock:
+            count = self._unlock(url, login, password)
+            if count:
+                self._save()
+            return count
+
+    def _unlock(self, url, login, password):
+        # под self._lock
+        count = 0
+        for job in self.jobs:
+            if job.url == url and job.login == login and not job.password:
+                job.password = password
+                if job.status == NEEDS_PASSWORD:
+                    job.status = PENDING
+                    count += 1
+        return count
+
+    def waiting_for_password(self):
+        # [(url, login)] сайтов, у заданий которых нет пароля
+        with self._lock:
+            return list(dict.fromkeys((job.url, job.login) for job in self.jobs if job.status == NEEDS_PASSWORD))
+
+    def take(self, per_host=DEFAULT_PER_HOST):
+        # первое ожидающее задание, чей сайт не занят; оно помечается running
+        with self._lock:
+            busy = {}
+            for job in self.jobs:
+                if job.status == RUNNING:
+                    busy[job.host] = busy.get(job.host, 0) + 1
+            for job in self.jobs:
+                if job.status == PENDING and busy.get(job.host, 0) < per_host:
+                    job.status = RUNNING
+                    job.started = time.time()
+                    job.finished = None
+                    job.message = ''
+                    self._save()
+                    return job
+            return None
+
+    def finish(self, job, ok, message=''):
+        with self._lock:
+            job.status = DONE if ok else FAILED
+            job.finished = time.time()
+            job.message = message
+            self._save()
+
+    def requeue(self, job):
+        # обмен прервали остановкой очереди — задание подождёт следующего запуска
+        with self._lock:
+            job.status = PENDING
+            job.started = None
+            job.message = ''
+            self._save()
+
+    def retry_failed(self):
+        with self._lock:
+            for job in self.jobs:
+                if job.status == FAILED:
+                    job.status = PENDING if job.password or job.password_env else NEEDS_PASSWORD
+            self._save()
+
+    def clear_finished(self):
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job.status not in (DONE, FAILED)]
+            # удалённые из папки файлы больше не нужно помнить
+            self.files = {path: stamp for path, stamp in self.files.items() if os.path.exists(path)}
+            self._save()
+
+    def remove(self, ids):
+        # выполняющееся задание не удаляется — его сначала надо остановить
+        ids = set(ids)
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job.id not in ids or job.status == RUNNING]
+            self._save()
+
+    def known(self, file, stamp):
+        # этот файл в этом виде уже ставился в очередь
+        with self._lock:
+            return self.files.get(file) == tuple(stamp)
+
+    def counts(self):
+        with self._lock:
+            result = dict.fromkeys((PENDING, NEEDS_PASSWORD, RUNNING, DONE, FAILED), 0)
+            for job in self.jobs:
+                result[job.status] += 1
+            return result
+
+    def snapshot(self):
+        # копии заданий для показа в другом потоке
+        with self._lock:
+            return [Job.from_dict(job.to_dict()) for job in self.jobs]
+
+
+class FolderWatcher:
+    def __init__(self, folder, settle=DEFAULT_SETTLE, clock=time.monotonic):
+        self.folder = folder
+        self.settle = settle
+        self.clock = clock
+        self._seen = {}     # путь -> ((размер, mtime_ns), с какого момента не меняется)
+        self._reported = {}  # путь -> (размер, mtime_ns), уже отданный poll()
+
+    def poll(self):
+        # [(путь, (размер, mtime_ns))] файлов, которые дописаны и ещё не отдавались
+        now = self.clock()
+        ready = []
+        present = set()
+        try:
+            entries = list(os.scandir(self.folder))
+        except OSError:
+            return ready    # сетевая папка недоступна — попробуем в следующий раз
+        for entry in sorted(entries, key=lambda e: e.name):
+            if not entry.name.lower().endswith(WATCH_EXTENSIONS) or entry.name.startswith('.'):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if not entry.is_file():
+                continue
+            path = entry.path
+            present.add(path)
+            stamp = (st.st_size, st.st_mtime_ns)
+            seen = self._seen.get(path)
+            if seen is None or seen[0] != stamp:
+                self._seen[path] = (stamp, now)
+                continue
+            if now - seen[1] >= self.settle and self._reported.get(path) != stamp:
+                self._reported[path] = stamp
+                ready.append((path, stamp))
+        for path in set(self._seen) - present:
+            del self._seen[path]
+            self._reported.pop(path, None)
+        return ready
+
+
+class JobScheduler:
+    def __init__(self, queue, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST,
+                 listener_factory=None, on_finished=None, interrupted=None, **engine_options):
+        self.queue = queue
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        # listener_factory(job) -> ExchangeListener; on_finished(job, ok) — из потока задания
+        self.listener_factory = listener_factory or (lambda job: ExchangeListener())
+        self.on_finished = on_finished
+        self.interrupted = interrupted or (lambda: False)
+        # общие настройки движка (таймауты, connections, опрос import); задание их дополняет
+        self.engine_options = engine_options
+        self._wake = threading.Event()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _run_job(self, job):
+        listener = _LastMessage(self.listener_factory(job))
+        ok = False
+        try:
+            if not job.password:
+                listener.message(f"❌ Нет пароля для {job.url}" + (
+                    f": переменная {job.password_env} не задана" if job.password_env else ""))
+                listener.finished(False)
+            elif not os.path.exists(job.file):
+                listener.message(f"❌ Файл не найден: {job.file}")
+                listener.finished(False)
+            else:
+                options = dict(self.engine_options, **job.options)
+                engine = ExchangeEngine(job.url, job.login, job.password, job.exchange_type, job.file,
+                                        listener=listener, interrupted=self.interrupted, **options)
+                ok = engine.run()
+        except Exception as e:
+            # иначе пул проглотит исключение, а задание молча уйдёт в failed; стек — в раскрываемых строках
+            listener.message(f"❌ Неожиданная ошибка: {e}\n{traceback.format_exc().rstrip()}")
+            listener.finished(False)
+        finally:
+            if not ok and self.interrupted():
+                self.queue.requeue(job)
+            else:
+                self.queue.finish(job, ok, listener.last.splitlines()[0] if listener.last else '')
+            with self._lock:
+                self._running -= 1
+            self._wake.set()
+            if self.on_finished:
+                self.on_finished(job, ok)
+
+    def run(self, watcher=None, enqueue=None, until_idle=False, poll_interval=1.0):
+        # главный цикл: watcher.poll() -> enqueue(путь, stamp), свободные места -> задания.
+        # Выход по interrupted() или, при until_idle, когда ждать больше нечего
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self.interrupted():
+                if watcher:
+                    for path, stamp in watcher.poll():
+                        if not self.queue.known(path, stamp):
+                            enqueue(path, stamp)
+                while True:
+                    with self._lock:
+                        if self._running >= self.concurrency:
+                            break
+                        job = self.queue.take(self.per_host)
+                        if job is None:
+                            break
+                        self._running += 1
+                    pool.submit(self._run_job, job)
+                with self._lock:
+                    idle = self._running == 0
+                if until_idle and idle and not self.queue.counts()[PENDING]:
+                    break
+                self._wake.wait(poll_interval)
+                self._wake.clear()
+            # при остановке выполняющиеся задания видят interrupted() и завершаются сами
+
+    def wake(self):
+        # новое задание добавлено извне — раздать, не дожидаясь poll_interval
+        self._wake.set()
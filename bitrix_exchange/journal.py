@@ -0,0 +1,131 @@
+# bitrix_exchange/journal.py
+# Журнал загрузки для докачки mode=file.
+#
+# На каждый файл — отдельный append-only JSONL в data_dir('journal'):
+# первая строка — заголовок (сайт, путь, размер, mtime, file_limit),
+# дальше по строке на каждый чанк, который сервер подтвердил "success":
+# смещение, длина и CRC32. Ключ журнала — хэш от URL сайта, пути, размера
+# и mtime, поэтому изменённый файл журнал не унаследует. Для архива, который
+# собирается на лету, вместо размера и mtime используется отпечаток его
+# содержимого (ZipStream.fingerprint).
+
+import hashlib
+import json
+import os
+import zlib
+
+from .paths import data_dir
+
+VERIFY_BLOCK = 1024 * 1024
+
+
+class JournalEntry:
+    def __init__(self, path, url, file_path, fingerprint=None):
+        self.path = path
+        self.url = url
+        self.file_path = file_path
+        st = os.stat(file_path)
+        self.size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.fingerprint = fingerprint
+        self.file_limit = 0
+        self.chunks = []  # [(offset, length, crc)]
+        self._load()
+
+    def _header(self):
+        return {'url': self.url, 'path': os.path.abspath(self.file_path),
+                'size': self.size, 'mtime_ns': self.mtime_ns, 'fingerprint': self.fingerprint,
+                'file_limit': self.file_limit}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        self.file_limit = header.get('file_limit', 0)
+        for ln in lines[1:]:
+            try:
+                rec = json.loads(ln)
+                self.chunks.append((rec['offset'], rec['length'], rec['crc']))
+            except (ValueError, KeyError):
+                break  # недописанная строка после сбоя — дальше не доверяем
+
+    @property
+    def acked_bytes(self):
+        # длина непрерывного подтверждённого префикса файла
+        end = 0
+        for offset, length, _ in self.chunks:
+            if offset != end:
+                break
+            end += length
+        return end
+
+    def verify(self, source=None):
+        # сверяем CRC подтверждённых чанков с локальным файлом
+        # (или с другим источником тех же байт, например ZipStream). Переданный
+        # источник не закрывается: после сверки он стоит на acked_bytes, и
+        # загрузка продолжается с него без повторного чтения префикса
+        if source is None:
+            with open(self.file_path, 'rb') as f:
+                return self._verify(f)
+        return self._verify(source)
+
+    def _verify(self, f):
+        end = self.acked_bytes
+        for offset, length, crc in self.chunks:
+            if offset >= end:
+                break
+            f.seek(offset)
+            actual, left = 0, length
+            while left:
+                data = f.read(min(VERIFY_BLOCK, left))
+                if not data:
+                    return False
+                actual = zlib.crc32(data, actual)
+                left -= len(data)
+            if actual != crc:
+                return False
+        return True
+
+    def start(self, file_limit):
+        # новая загрузка с нуля: переписываем журнал
+        self.file_limit = file_limit
+        self.chunks = []
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self._header()) + "\n")
+
+    def ack(self, offset, length, crc):
+        self.chunks.append((offset, length, crc))
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'offset': offset, 'length': length, 'crc': crc}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def discard(self):
+        self.chunks = []
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class UploadJournal:
+    def __init__(self, directory=None):
+        self.directory = directory or data_dir('journal')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, url, file_path, fingerprint=None):
+        if fingerprint is None:
+            st = os.stat(file_path)
+            fingerprint = f"{st.st_size}|{st.st_mtime_ns}"
+        raw = f"{url}|{os.path.abspath(file_path)}|{fingerprint}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def entry(self, url, file_path, fingerprint=None) -> JournalEntry:
+        path = os.path.join(self.directory, self.key(url, file_path, fingerprint) + '.jsonl')
+        return JournalEntry(path, url, file_path, fingerprint)
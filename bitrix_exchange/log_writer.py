@@ -0,0 +1,192 @@
+# bitrix_exchange/log_writer.py
+# Запись лога обмена в файл из отдельного потока.
+#
+# write() только кладёт запись в ограниченную очередь и никогда не ждёт
+# диск: если очередь переполнена, запись отбрасывается, а число пропусков
+# попадает в лог следующей пачкой. Поток пишет пачками и сбрасывает буфер
+# на диск не чаще раза в flush_interval секунд. Ротация — по размеру
+# (max_bytes) и по времени (rotate_interval): текущий файл становится .1,
+# прежний .1 — .2 и так далее, хранится backups штук.
+#
+# Формат 'text' — строки как в консоли, 'jsonl' — объект на строку с
+# полями ts, phase, method, url, status, elapsed, site и message: по нему
+# удобно искать grep/jq. LogListener подключает запись к слушателю движка.
+
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from .engine import ExchangeListener
+
+FORMATS = ('text', 'jsonl')
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_BACKUPS = 5
+
+_STOP = object()
+
+
+class LogWriter:
+    def __init__(self, path, fmt='text', max_bytes=0, rotate_interval=0, backups=DEFAULT_BACKUPS,
+                 queue_size=DEFAULT_QUEUE_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL, batch=DEFAULT_BATCH):
+        if fmt not in FORMATS:
+            raise ValueError(f"неизвестный формат лога: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.max_bytes = max_bytes              # 0 — без ротации по размеру
+        self.rotate_interval = rotate_interval  # секунды, 0 — без ротации по времени
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self.dropped = 0
+        self.error = None  # последняя ошибка записи: лог не должен ронять обмен
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        # файл открываем сразу, чтобы недоступный путь был виден вызывающему
+        self._file = None
+        self._open()
+        if fmt == 'text':
+            self._file.write(f"\n=== {datetime.now():%Y-%m-%d %H:%M:%S} ===\n")
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    # --- вызывается из любого потока ---
+
+    def write(self, message=None, phase=None, method=None, url=None, status=None, elapsed=None, site=None):
+        # message=None — только HTTP-запрос; в текстовый формат такие не попадают
+        try:
+            self._queue.put_nowait((time.time(), message, phase, method, url, status, elapsed, site))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def close(self, timeout=None):
+        # дописывает очередь и закрывает файл; timeout=0 — не ждать потока.
+        # Маркер в очереди только будит поток: если очередь полна, поток
+        # и так занят и увидит флаг, когда её разберёт
+        self._closing.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    # --- поток записи ---
+
+    def _open(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._opened = time.monotonic()
+        self._size = self._file.seek(0, os.SEEK_END)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        stop = False
+        while not stop:
+            try:
+                records = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                records = []
+            while len(records) < self.batch:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [r for r in records if r is not _STOP]
+            stop = self._closing.is_set() and self._queue.empty()
+            data = self._format_batch(records)
+            try:
+                if data:
+                    size = len(data.encode('utf-8'))
+                    self._maybe_rotate(size)
+                    self._file.write(data)
+                    self._size += size
+                now = time.monotonic()
+                if stop or now - last_flush >= self.flush_interval:
+                    self._file.flush()
+                    last_flush = now
+            except OSError as e:
+                self.error = e
+        try:
+            self._file.close()
+        except OSError as e:
+            self.error = e
+
+    def _format_batch(self, records):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        lines = []
+        if dropped:
+            lines.append(self._format((time.time(), f"⚠️ Лог не успевал записываться: пропущено {dropped} записей",
+                                       None, None, None, None, None, None)))
+        for rec in records:
+            line = self._format(rec)
+            if line is not None:
+                lines.append(line)
+        return ''.join(lines)
+
+    def _format(self, rec):
+        ts, message, phase, method, url, status, elapsed, site = rec
+        if self.fmt == 'text':
+            if message is None:
+                return None
+            return (f"[{site}] {message}" if site else message) + "\n"
+        return json.dumps({
+            'ts': datetime.fromtimestamp(ts).isoformat(timespec='milliseconds'),
+            'phase': phase, 'method': method, 'url': url, 'status': status,
+            'elapsed': round(elapsed, 4) if elapsed is not None else None,
+            'site': site, 'message': message,
+        }, ensure_ascii=False) + "\n"
+
+    def _maybe_rotate(self, incoming):
+        by_size = self.max_bytes and self._size and self._size + incoming > self.max_bytes
+        by_time = self.rotate_interval and time.monotonic() - self._opened >= self.rotate_interval
+        if by_size or by_time:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        if self.backups:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+
+class LogListener(ExchangeListener):
+    # пишет события движка в LogWriter и передаёт их дальше слушателю inner
+    def __init__(self, writer, inner=None, site=None):
+        self.writer = writer
+        self.inner = inner or ExchangeListener()
+        self.site = site
+        self._phase = None
+
+    def message(self, msg):
+        self.writer.write(msg, phase=self._phase, site=self.site)
+        self.inner.message(msg)
+
+    def progress_range(self, lo, hi):
+        self.inner.progress_range(lo, hi)
+
+    def progress_percent(self, value):
+        self.inner.progress_percent(value)
+
+    def finished(self, ok):
+        self.inner.finished(ok)
+
+    def phase(self, name):
+        self._phase = name
+        self.inner.phase(name)
+
+    def http(self, method, url, status, elapsed):
+        self.writer.write(phase=self._phase, method=method, url=url, status=status,
+                          elapsed=elapsed, site=self.site)
+        self.inner.http(method, url, status, elapsed)
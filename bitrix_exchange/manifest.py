@@ -0,0 +1,196 @@
+# bitrix_exchange/manifest.py
+# Пропуск файлов, которые сайт уже получил.
+#
+# Полная выгрузка 1С приносит тысячи картинок товаров, которые от запуска к
+# запуску не меняются. ContentManifest хранит для каждого сайта (URL + тип
+# обмена) хэш содержимого каждого файла, принятого прошлыми успешными
+# обменами: члена ZIP, файла папки или самого XML. hash_package считает
+# blake2b всех файлов пакета потоком, блоками по READ_BLOCK, в нескольких
+# потоках сразу: hashlib и распаковка zlib отпускают GIL, так что хэширование
+# идёт на всех ядрах и обходится много дешевле загрузки, которую экономит.
+#
+# build_manifest сравнивает пакет с манифестом сайта. Не изменилось ничего —
+# отправлять нечего. Изменилась часть — уходит ZIP только с изменёнными XML
+# и новыми или изменёнными картинками; картинки, которые на сайте уже есть,
+# остаются от прошлых импортов. Если изменились только картинки, XML
+# отправляются все: без импорта Битрикс новые картинки не подхватит.
+# Манифест обновляется после успешного обмена (ManifestPackage.commit).
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .paths import data_dir
+from .zipstream import READ_BLOCK, collect_entries, extract_member
+
+DIGEST_SIZE = 16
+
+
+def hash_stream(src, check=None):
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    while True:
+        block = src.read(READ_BLOCK)
+        if not block:
+            return h.hexdigest()
+        if check:
+            check()
+        h.update(block)
+
+
+class PackageHashes:
+    # хэши файлов пакета; считаются один раз и годятся для любого сайта
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind        # 'zip' — члены архива, 'files' — файлы папки, 'single' — один файл как есть
+        self.members = []       # [(имя в архиве, путь; у члена ZIP — None, размер, хэш)]
+        self.elapsed = 0.0
+
+    @property
+    def size(self):
+        return sum(size for _, _, size, _ in self.members)
+
+
+def hash_package(path, compress, check=None, workers=None):
+    # XML, ZIP или папка (при compress) -> PackageHashes
+    started = time.monotonic()
+    zips, lock, local = [], threading.Lock(), threading.local()
+
+    def zip_member(info):
+        # у каждого потока свой ZipFile: чтение через один объект шло бы по очереди
+        z = getattr(local, 'zip', None)
+        if z is None:
+            z = local.zip = zipfile.ZipFile(path)
+            with lock:
+                zips.append(z)
+        with z.open(info) as src:
+            return info.filename, None, info.file_size, hash_stream(src, check)
+
+    def file_member(entry):
+        arcname, full = entry
+        with open(full, 'rb') as src:
+            return arcname, full, os.fstat(src.fileno()).st_size, hash_stream(src, check)
+
+    if not (compress or os.path.isdir(path)) and path.lower().endswith('.zip'):
+        hashes = PackageHashes(path, 'zip')
+        with zipfile.ZipFile(path) as z:
+            items = [info for info in z.infolist() if not info.is_dir()]
+        member = zip_member
+    else:
+        hashes = PackageHashes(path, 'files' if compress or os.path.isdir(path) else 'single')
+        items = collect_entries(path)
+        member = file_member
+    try:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1, thread_name_prefix='hash') as pool:
+            hashes.members = list(pool.map(member, items))
+    finally:
+        for z in zips:
+            z.close()
+    hashes.elapsed = time.monotonic() - started
+    return hashes
+
+
+class ContentManifest:
+    def __init__(self, url, exchange_type, directory=None):
+        key = hashlib.sha1(f"{url}|{exchange_type}".encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory or data_dir('manifest'), key + '.tsv.gz')
+
+    def load(self):
+        # {имя в архиве: хэш} файлов, которые сайт уже принял
+        try:
+            f = gzip.open(self.path, 'rt', encoding='utf-8', newline='\n')
+        except OSError:
+            return {}
+        known = {}
+        try:
+            with f:
+                for line in f:
+                    digest, sep, name = line.rstrip('\n').partition('\t')
+                    if sep:
+                        known[name] = digest
+        except (OSError, EOFError):
+            return {}   # недописанный манифест — как будто его нет
+        return known
+
+    def save(self, known):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with gzip.open(tmp, 'wt', encoding='utf-8', newline='\n', compresslevel=6) as f:
+            for name, digest in known.items():
+                f.write(f"{digest}\t{name}\n")
+        os.replace(tmp, self.path)
+
+
+class ManifestPackage:
+    # entries — [(имя в архиве, путь)] того, что отправлять; whole — пакет уходит как есть
+    def __init__(self, manifest, hashes, workdir):
+        self.manifest = manifest
+        self.hashes = hashes
+        self.workdir = workdir
+        self.entries = []
+        self.whole = False
+        self.changed = []       # имена новых и изменённых файлов
+        self.total = len(hashes.members)
+        self.bytes_sent = 0
+        self._known = {}
+
+    @property
+    def has_changes(self):
+        return bool(self.changed)
+
+    @property
+    def single(self):
+        return self.hashes.kind == 'single'
+
+    def describe(self):
+        if not self.changed:
+            return f"все {self.total} файл(ов) уже на сайте"
+        size = self.hashes.size
+        return (f"изменено {len(self.changed)} из {self.total} файл(ов), отправляется "
+                f"{self.bytes_sent / 1024 / 1024:.2f} из {size / 1024 / 1024:.2f} МБ "
+                f"(хэширование {self.hashes.elapsed:.1f} с)")
+
+    def commit(self):
+        # после успешного обмена: эти файлы сайт принял
+        if self._known:
+            self.manifest.save(self._known)
+            self._known = {}
+
+    def cleanup(self):
+        if self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def build_manifest(hashes, manifest):
+    # PackageHashes + манифест сайта -> ManifestPackage; ZIP с частью файлов
+    # распаковывается во временный каталог
+    known = manifest.load()
+    package = ManifestPackage(manifest, hashes, None)
+    package.changed = [name for name, _, _, digest in hashes.members if known.get(name) != digest]
+    package._known = {**known, **{name: digest for name, _, _, digest in hashes.members}}
+    changed = set(package.changed)
+    xmls = [name for name, _, _, _ in hashes.members if name.lower().endswith('.xml')]
+    if changed and not changed.intersection(xmls):
+        changed.update(xmls)
+    selected = [m for m in hashes.members if m[0] in changed]
+    package.bytes_sent = sum(size for _, _, size, _ in selected)
+    if not changed or len(selected) == len(hashes.members):
+        package.whole = bool(changed)
+        return package
+    if hashes.kind == 'zip':
+        package.workdir = tempfile.mkdtemp(prefix='bitrix-manifest-')
+        try:
+            with zipfile.ZipFile(hashes.path) as z:
+                for name, _, _, _ in selected:
+                    package.entries.append((name, extract_member(z, z.getinfo(name), package.workdir)))
+        except BaseException:
+            package.cleanup()
+            raise
+    else:
+        package.entries = [(name, full) for name, full, _, _ in selected]
+    return package
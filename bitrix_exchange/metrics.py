@@ -0,0 +1,280 @@
+# bitrix_exchange/metrics.py
+# Замеры одного обмена по шагам протокола.
+#
+# Движок сам пишет в RunMetrics (engine.metrics): длительность каждого шага
+# (checkauth, init, file, import), каждый HTTP-запрос, каждую попытку чанка
+# mode=file (байты, время ответа, статус), каждый опрос mode=import и полное
+# время импорта каждого XML. snapshot() — словарь со сводкой, его можно
+# брать из другого потока, пока обмен идёт: так работает панель в GUI.
+#
+# Сводка делит время на части, чтобы было видно, откуда медленный обмен:
+# manifest — хэши файлов пакета, preflight, delta и split — разбор XML у себя,
+# connect — checkauth и init (сеть и авторизация), upload — отправка файла,
+# import — работа Битрикса, orders — выгрузка заказов sale (query и success);
+# у импорта отдельно время ответов сервера и наши паузы между опросами.
+# Экспорт — write_json и write_prometheus (textfile для node_exporter).
+
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+PHASES = ('manifest', 'preflight', 'delta', 'split', 'checkauth', 'init', 'file', 'import', 'query', 'success')
+
+
+def _percentile(values, q):
+    # ближайший ранг по отсортированному списку
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def _ok(status):
+    return status is not None and status < 400
+
+
+class RunMetrics:
+    def __init__(self, url='', exchange_type='', clock=time.monotonic):
+        self.url = url
+        self.exchange_type = exchange_type
+        self.clock = clock
+        self.version = 0        # растёт с каждой записью — есть ли что перерисовать
+        self._lock = threading.Lock()
+        self._started_at = None  # time.time() начала, для отчёта
+        self._t0 = None
+        self._elapsed = None
+        self.ok = None
+        self.phase = None
+        self._phase_started = None
+        self.phases = {}         # шаг -> секунды
+        self.requests = []       # (mode, method, status, elapsed); status None — нет ответа
+        self.chunks = []         # (bytes, elapsed, status) — каждая попытка POST mode=file
+        self.polls = {}          # XML -> [elapsed, …] опросов import
+        self.xml_times = {}      # XML -> секунды от первого опроса до success
+
+    # --- запись, из потока обмена ---
+
+    def start(self):
+        with self._lock:
+            self._started_at = time.time()
+            self._t0 = self.clock()
+            self.version += 1
+
+    def begin(self, phase):
+        with self._lock:
+            self._close_phase()
+            self.phase = phase
+            self._phase_started = self.clock()
+            self.version += 1
+
+    def request(self, mode, method, status, elapsed, sent=0, filename=None):
+        with self._lock:
+            self.requests.append((mode, method, status, elapsed))
+            if mode == 'file':
+                self.chunks.append((sent, elapsed, status))
+            elif mode == 'import':
+                self.polls.setdefault(filename or '', []).append(elapsed)
+            self.version += 1
+
+    def xml_done(self, name, seconds):
+        with self._lock:
+            self.xml_times[name] = seconds
+            self.version += 1
+
+    def finish(self, ok):
+        with self._lock:
+            self._close_phase()
+            self.phase = None
+            self.ok = ok
+            if self._t0 is not None:
+                self._elapsed = self.clock() - self._t0
+            self.version += 1
+
+    def _close_phase(self):
+        if self.phase is not None:
+            spent = self.clock() - self._phase_started
+            self.phases[self.phase] = self.phases.get(self.phase, 0.0) + spent
+
+    # --- чтение, из любого потока ---
+
+    def snapshot(self):
+        with self._lock:
+            now = self.clock()
+            phases = dict(self.phases)
+            if self.phase is not None:
+                phases[self.phase] = phases.get(self.phase, 0.0) + now - self._phase_started
+            elapsed = self._elapsed if self._elapsed is not None else (
+                now - self._t0 if self._t0 is not None else 0.0)
+            requests = list(self.requests)
+            chunks = list(self.chunks)
+            polls = {name: list(v) for name, v in self.polls.items()}
+            xml_times = dict(self.xml_times)
+            phase, ok, started_at = self.phase, self.ok, self._started_at
+
+        accepted = [(size, t) for size, t, status in chunks if _ok(status)]
+        sent = sum(size for size, _ in accepted)
+        upload_time = phases.get('file', 0.0)
+        latencies = [t for _, t in accepted]
+        all_polls = [t for v in polls.values() for t in v]
+        import_time = phases.get('import', 0.0)
+        import_server = sum(all_polls)
+        return {
+            'url': self.url,
+            'type': self.exchange_type,
+            'started': datetime.fromtimestamp(started_at).isoformat(timespec='seconds') if started_at else None,
+            'elapsed': elapsed,
+            'ok': ok,
+            'phase': phase,
+            'phases': phases,
+            'requests': len(requests),
+            'errors': sum(1 for _, _, status, _ in requests if not _ok(status)),
+            'upload': {
+                'bytes': sent,
+                'seconds': upload_time,
+                'throughput': sent / upload_time if upload_time > 0 else None,
+                'chunks': len(accepted),
+                'retries': len(chunks) - len(accepted),
+                'latency': {
+                    'avg': sum(latencies) / len(latencies) if latencies else None,
+                    'p50': _percentile(latencies, 0.5),
+                    'p95': _percentile(latencies, 0.95),
+                    'max': max(latencies) if latencies else None,
+                },
+            },
+            'import': {
+                'seconds': import_time,
+                'server': import_server,
+                'wait': max(0.0, import_time - import_server),
+                'polls': len(all_polls),
+                'files': {
+                    name: {'seconds': xml_times.get(name), 'polls': len(v),
+                           'poll_avg': sum(v) / len(v) if v else None}
+                    for name, v in polls.items()
+                },
+            },
+            'breakdown': {
+                'manifest': phases.get('manifest', 0.0),
+                'preflight': phases.get('preflight', 0.0),
+                'delta': phases.get('delta', 0.0),
+                'split': phases.get('split', 0.0),
+                'connect': phases.get('checkauth', 0.0) + phases.get('init', 0.0),
+                'upload': upload_time,
+                'import': import_time,
+                'orders': phases.get('query', 0.0) + phases.get('success', 0.0),
+            },
+        }
+
+
+def bottleneck(snap):
+    # (часть, доля) — куда ушло больше всего времени, или None, если ещё никуда
+    parts = snap['breakdown']
+    total = sum(parts.values())
+    if not total:
+        return None
+    name = max(parts, key=parts.get)
+    return name, parts[name] / total
+
+
+_PART_NAMES = {'manifest': "хэширование пакета", 'preflight': "предпроверка XML", 'delta': "сборка пакета изменений", 'split': "разрезание XML",
+               'connect': "авторизация и init", 'upload': "загрузка файла", 'import': "импорт на сервере",
+               'orders': "выгрузка заказов"}
+
+
+def _seconds(value):
+    return f"{value:.2f} с" if value is not None else "—"
+
+
+def format_summary(snap):
+    # несколько строк для консоли и лога
+    phases = snap['phases']
+    lines = [f"⏱ Обмен {_seconds(snap['elapsed'])}: checkauth {_seconds(phases.get('checkauth'))}, "
+             f"init {_seconds(phases.get('init'))}, запросов {snap['requests']}, ошибок {snap['errors']}"]
+    up = snap['upload']
+    if up['chunks'] or up['retries']:
+        speed = f"{up['throughput'] / 1024 / 1024:.2f} МБ/с" if up['throughput'] else "—"
+        lines.append(f"📤 Загрузка: {up['bytes'] / 1024 / 1024:.2f} МБ за {_seconds(up['seconds'])} ({speed}), "
+                     f"чанков {up['chunks']}, повторов {up['retries']}, "
+                     f"ответ p50 {_seconds(up['latency']['p50'])}, p95 {_seconds(up['latency']['p95'])}")
+    imp = snap['import']
+    if imp['polls']:
+        lines.append(f"📥 Импорт: {_seconds(imp['seconds'])} (ответы сервера {_seconds(imp['server'])}, "
+                     f"паузы {_seconds(imp['wait'])}), опросов {imp['polls']}")
+        for name, f in imp['files'].items():
+            lines.append(f"   {name}: {_seconds(f['seconds'])}, опросов {f['polls']}, "
+                         f"в среднем {_seconds(f['poll_avg'])} на опрос")
+    top = bottleneck(snap)
+    if top:
+        lines.append(f"📊 Больше всего времени: {_PART_NAMES[top[0]]} ({top[1] * 100:.0f}%)")
+    return "\n".join(lines)
+
+
+def write_json(path, snapshots):
+    # snapshots — словарь одного обмена или список (несколько сайтов)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshots, f, ensure_ascii=False, indent=2)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshots):
+    if isinstance(snapshots, dict):
+        snapshots = [snapshots]
+    metrics = {}  # имя -> (help, type, [(labels, value)])
+
+    def add(name, help_, value, type_='gauge', **labels):
+        if value is None:
+            return
+        metrics.setdefault(name, (help_, type_, []))[2].append((labels, value))
+
+    for snap in snapshots:
+        site = urlparse(snap['url']).netloc or snap['url']
+        add('bitrix_exchange_success', "1, если последний обмен завершился успешно",
+            int(bool(snap['ok'])), site=site, type=snap['type'])
+        if snap['started']:
+            add('bitrix_exchange_last_run_timestamp_seconds', "время начала последнего обмена",
+                datetime.fromisoformat(snap['started']).timestamp(), site=site)
+        add('bitrix_exchange_duration_seconds', "длительность обмена", snap['elapsed'], site=site)
+        for phase in PHASES:
+            add('bitrix_exchange_phase_seconds', "длительность шага протокола",
+                snap['phases'].get(phase), site=site, phase=phase)
+        add('bitrix_exchange_requests', "HTTP-запросов за обмен", snap['requests'], site=site)
+        add('bitrix_exchange_request_errors', "запросов без ответа или с кодом >= 400", snap['errors'], site=site)
+        up = snap['upload']
+        add('bitrix_exchange_upload_bytes', "принятых сервером байт mode=file", up['bytes'], site=site)
+        add('bitrix_exchange_upload_throughput_bytes_per_second', "скорость загрузки файла",
+            up['throughput'], site=site)
+        add('bitrix_exchange_upload_chunks', "принятых чанков", up['chunks'], site=site)
+        add('bitrix_exchange_upload_retries', "повторно отправленных чанков", up['retries'], site=site)
+        for q in ('p50', 'p95', 'max'):
+            add('bitrix_exchange_chunk_latency_seconds', "время ответа на чанк",
+                up['latency'][q], site=site, quantile={'p50': '0.5', 'p95': '0.95', 'max': '1'}[q])
+        imp = snap['import']
+        add('bitrix_exchange_import_server_seconds', "сумма времени ответов на опросы import",
+            imp['server'], site=site)
+        add('bitrix_exchange_import_wait_seconds', "паузы между опросами import", imp['wait'], site=site)
+        for name, f in imp['files'].items():
+            add('bitrix_exchange_import_file_seconds', "время импорта XML", f['seconds'], site=site, xml=name)
+            add('bitrix_exchange_import_polls', "опросов import на XML", f['polls'], site=site, xml=name)
+
+    out = []
+    for name, (help_, type_, samples) in metrics.items():
+        out.append(f"# HELP {name} {help_}")
+        out.append(f"# TYPE {name} {type_}")
+        for labels, value in samples:
+            text = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            out.append(f"{name}{{{text}}} {value!r}")
+    return "\n".join(out) + "\n"
+
+
+def write_prometheus(path, snapshots):
+    # node_exporter читает каталог textfile в любой момент — пишем во временный файл и подменяем
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text(snapshots))
+    os.replace(tmp, path)
@@ -0,0 +1,236 @@
+# bitrix_exchange/mock_server.py
+# Локальная замена скрипта обмена Битрикса для замеров и отладки без сайта:
+#   python -m bitrix_exchange.mock_server --port 8765 --file-limit 1048576 --latency 0.05
+#
+# Отвечает на checkauth, init (с file_limit), принимает чанки mode=file и
+# отдаёт mode=import в несколько шагов "progress" со счётчиками, потом
+# "success". Можно добавить задержку на каждый запрос, ограничить скорость
+# приёма тела и отвечать 503 на заданную долю чанков. Принятые байты не
+# сохраняются — считается только их число. На mode=query (обмен sale)
+# отдаёт orders сгенерированных заказов по частям (chunked), не собирая
+# ответ в памяти; mode=success — "success". Счётчики — в MockBitrix.stats.
+
+import argparse
+import random
+import socket
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+READ_BLOCK = 64 * 1024
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}      # mode -> число запросов
+        self.bytes_received = 0
+        self.chunks = 0         # принятые чанки mode=file
+        self.errors = 0         # ответы 503 по error_rate
+        self.connections = 0    # принятых TCP-соединений (keep-alive их экономит)
+
+    def count(self, mode):
+        with self.lock:
+            self.requests[mode] = self.requests.get(mode, 0) + 1
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def as_dict(self):
+        return {'requests': dict(self.requests), 'total_requests': self.total_requests,
+                'bytes_received': self.bytes_received, 'chunks': self.chunks, 'errors': self.errors,
+                'connections': self.connections}
+
+
+class MockBitrix:
+    def __init__(self, host='127.0.0.1', port=0, file_limit=0, latency=0.0, bandwidth=0.0,
+                 error_rate=0.0, import_steps=3, import_total=10000, seed=None, orders=0):
+        self.file_limit = file_limit      # байт на чанк в ответе init, 0 — без ограничения
+        self.latency = latency            # секунд на каждый ответ
+        self.bandwidth = bandwidth        # байт/с на приём тела mode=file, 0 — без ограничения
+        self.error_rate = error_rate      # доля чанков, на которые отвечаем 503
+        self.import_steps = import_steps  # сколько ответов "progress" до "success" на каждый XML
+        self.import_total = import_total  # "из N" в ответах progress
+        self.orders = orders              # заказов в ответе mode=query
+        self.stats = MockStats()
+        self._random = random.Random(seed)
+        self._polls = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bitrix/admin/1c_exchange.php"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,),
+                                        name='mock-bitrix', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # --- ответы ---
+
+    def _fail_now(self):
+        with self._lock:
+            return self.error_rate and self._random.random() < self.error_rate
+
+    def answer_import(self, filename):
+        with self._lock:
+            step = self._polls.get(filename, 0) + 1
+            self._polls[filename] = step
+        if step > self.import_steps:
+            self._polls.pop(filename, None)
+            return "success\nИмпорт завершен"
+        done = self.import_total * step // (self.import_steps + 1)
+        return f"progress\nИмпорт элементов\nОбработано {done} из {self.import_total}"
+
+    def order_blocks(self):
+        # XML заказов кусками, как их отдаёт PHP при буферизации вывода
+        yield ('<?xml version="1.0" encoding="windows-1251"?>\n'
+               '<КоммерческаяИнформация ВерсияСхемы="2.08">').encode('cp1251')
+        batch = []
+        for n in range(1, self.orders + 1):
+            batch.append(f'<Документ><Ид>{n}</Ид><Номер>{n}</Номер><ХозОперация>Заказ товара</ХозОперация>'
+                         f'<Валюта>руб</Валюта><Сумма>{n % 1000}.50</Сумма><Товары><Товар><Ид>p{n % 97}</Ид>'
+                         f'<Наименование>Товар {n % 97}</Наименование><Количество>1</Количество>'
+                         f'<Сумма>{n % 1000}.50</Сумма></Товар></Товары></Документ>')
+            if len(batch) == 100:
+                yield ''.join(batch).encode('cp1251')
+                batch = []
+        yield (''.join(batch) + '</КоммерческаяИнформация>').encode('cp1251')
+
+
+def _handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # заголовки и тело ответа уходят двумя записями; без TCP_NODELAY вторая
+            # ждёт отложенного ACK клиента (~40 мс на запрос), как не ждёт nginx
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with mock.stats.lock:
+                mock.stats.connections += 1
+
+        def _send(self, status, text):
+            if mock.latency:
+                time.sleep(mock.latency)
+            body = text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunked(self, blocks):
+            if mock.latency:
+                time.sleep(mock.latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/xml; charset=windows-1251')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for block in blocks:
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(block), block))
+            self.wfile.write(b'0\r\n\r\n')
+
+        def _params(self):
+            return dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+
+        def do_GET(self):
+            params = self._params()
+            mode = params.get('mode')
+            mock.stats.count(mode)
+            if mode == 'checkauth':
+                self._send(200, "success\nPHPSESSID\nmock\nsessid=mock-sessid\n")
+            elif mode == 'init':
+                self._send(200, f"zip=yes\nfile_limit={mock.file_limit}\n")
+            elif mode == 'import':
+                self._send(200, mock.answer_import(params.get('filename', '')))
+            elif mode == 'query':
+                self._send_chunked(mock.order_blocks())
+            elif mode == 'success':
+                self._send(200, "success\n")
+            else:
+                self._send(400, "failure\nunknown mode")
+
+        def do_POST(self):
+            params = self._params()
+            mode = params.get('mode')
+            mock.stats.count(mode)
+            received = self._read_body(int(self.headers.get('Content-Length') or 0))
+            if mode != 'file':
+                self._send(400, "failure\nunknown mode")
+            elif mock._fail_now():
+                with mock.stats.lock:
+                    mock.stats.errors += 1
+                self._send(503, "Service Unavailable")
+            else:
+                with mock.stats.lock:
+                    mock.stats.bytes_received += received
+                    mock.stats.chunks += 1
+                self._send(200, "success\n")
+
+        def _read_body(self, length):
+            # читаем блоками, при bandwidth — не быстрее заданной скорости
+            started = time.monotonic()
+            left = length
+            while left:
+                block = self.rfile.read(min(READ_BLOCK, left))
+                if not block:
+                    break
+                left -= len(block)
+                if mock.bandwidth:
+                    ahead = (length - left) / mock.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            return length - left
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bitrix_exchange.mock_server',
+                                     description="Локальный скрипт обмена для замеров без сайта Битрикс")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--file-limit', type=int, default=0, help="file_limit в ответе init, байт")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка каждого ответа, секунд")
+    parser.add_argument('--bandwidth', type=float, default=0.0, help="скорость приёма чанков, МБ/с (0 — без ограничения)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля чанков с ответом 503")
+    parser.add_argument('--import-steps', type=int, default=3, help="ответов progress на каждый XML")
+    parser.add_argument('--orders', type=int, default=0, help="заказов в ответе mode=query (обмен sale)")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+    mock = MockBitrix(args.host, args.port, args.file_limit, args.latency, args.bandwidth * 1024 * 1024,
+                      args.error_rate, args.import_steps, seed=args.seed, orders=args.orders)
+    print(f"Mock Bitrix: {mock.url}", flush=True)
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
+        print(mock.stats.as_dict())
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+# bitrix_exchange/orders.py
+# Выгрузка заказов с сайта: обмен sale в обратную сторону.
+#
+# На mode=query Битрикс отдаёт XML со всеми новыми заказами — на больших
+# магазинах это сотни мегабайт. Ответ не собирается в resp.text: он пишется
+# на диск блоками iter_content и тут же скармливается expat'у, который
+# считает документы и суммы по валютам, пока ответ ещё идёт. Дерево не
+# строится, так что память не растёт с числом заказов. Если сайт отдал ZIP
+# (zip=yes в init), архив сначала дописывается на диск, а считаются уже его
+# XML, так же потоком.
+
+import os
+import time
+import zipfile
+from decimal import Decimal, InvalidOperation
+from xml.parsers import expat
+
+DOCUMENT_TAG = 'Документ'
+READ_BLOCK = 256 * 1024
+REPORT_EVERY = 0.5  # секунд между сообщениями о ходе выгрузки
+
+
+class OrdersStats:
+    def __init__(self, path):
+        self.path = path
+        self.documents = 0
+        self.orders = 0         # документы с ХозОперация "Заказ товара"
+        self.totals = {}        # валюта -> Decimal, сумма документов
+        self.bytes = 0
+        self.zipped = False
+        self.elapsed = 0.0
+
+    def describe(self):
+        totals = ", ".join(f"{amount:.2f} {currency}".rstrip() for currency, amount in sorted(self.totals.items()))
+        text = f"документов {self.documents}, заказов {self.orders}"
+        if totals:
+            text += f", на сумму {totals}"
+        return text + f" ({self.bytes / 1024 / 1024:.2f} МБ за {self.elapsed:.1f} с)"
+
+
+class OrderCounter:
+    # feed() — очередной кусок XML; итоги копятся в stats. Обработчики expat
+    # только считают глубину и запоминают текст нужных полей документа:
+    # дерево не строится, на сотнях тысяч заказов это в разы быстрее
+    FIELDS = ('ХозОперация', 'Валюта', 'Сумма')
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start
+        self.parser.EndElementHandler = self.end
+        self.depth = 0
+        self.doc = None     # поля текущего Документ
+        self.text = None
+
+    def feed(self, data, final=False):
+        try:
+            self.parser.Parse(data, final)
+        except expat.ExpatError as e:
+            raise OrdersError(f"XML заказов повреждён — {e}")
+
+    def close(self):
+        self.feed(b'', True)
+
+    def start(self, tag, attrs):
+        self.depth += 1
+        if self.depth == 2 and tag == DOCUMENT_TAG:
+            self.doc = {}
+        elif self.depth == 3 and self.doc is not None and tag in self.FIELDS:
+            self.text = []
+            self.parser.CharacterDataHandler = self.text.append
+
+    def end(self, tag):
+        if self.text is not None:
+            self.doc[tag] = ''.join(self.text).strip()
+            self.text = None
+            self.parser.CharacterDataHandler = None
+        elif self.depth == 2 and self.doc is not None:
+            self._document(self.doc)
+            self.doc = None
+        self.depth -= 1
+
+    def _document(self, fields):
+        self.stats.documents += 1
+        if fields.get('ХозОперация', 'Заказ товара') == 'Заказ товара':
+            self.stats.orders += 1
+        try:
+            amount = Decimal(fields.get('Сумма', '').replace(',', '.').replace(' ', ''))
+        except InvalidOperation:
+            return
+        currency = fields.get('Валюта', '')
+        self.stats.totals[currency] = self.stats.totals.get(currency, Decimal(0)) + amount
+
+
+class OrdersError(Exception):
+    pass
+
+
+def save_orders(blocks, path, check=None, progress=None):
+    # blocks — итератор байтов ответа mode=query. Пишет их в path (через
+    # path.part, чтобы недокачанный файл не выдал себя за готовый) и
+    # возвращает OrdersStats. progress(stats) зовётся не чаще REPORT_EVERY
+    stats = OrdersStats(path)
+    started = time.monotonic()
+    counter = None
+    reported = started
+    tmp = path + '.part'
+    try:
+        with open(tmp, 'wb') as out:
+            for block in blocks:
+                if check:
+                    check()
+                if not block:
+                    continue
+                if not stats.bytes:
+                    stats.zipped = block[:2] == b'PK'
+                    if not stats.zipped:
+                        counter = OrderCounter(stats)
+                out.write(block)
+                stats.bytes += len(block)
+                if counter:
+                    counter.feed(block)
+                now = time.monotonic()
+                if progress and now - reported >= REPORT_EVERY:
+                    reported = now
+                    stats.elapsed = now - started
+                    progress(stats)
+        if counter:
+            counter.close()
+        elif stats.zipped:
+            _count_zip(tmp, stats, check)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def _count_zip(path, stats, check):
+    try:
+        with zipfile.ZipFile(path) as z:
+            for info in z.infolist():
+                if not info.filename.lower().endswith('.xml'):
+                    continue
+                counter = OrderCounter(stats)
+                with z.open(info) as src:
+                    while True:
+                        block = src.read(READ_BLOCK)
+                        if not block:
+                            break
+                        if check:
+                            check()
+                        counter.feed(block)
+                counter.close()
+    except zipfile.BadZipFile as e:
+        raise OrdersError(f"архив заказов повреждён — {e}")
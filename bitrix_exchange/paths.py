@@ -0,0 +1,12 @@
+# bitrix_exchange/paths.py
+# Каталог локальных данных приложения (журналы, индексы, история).
+# По умолчанию ~/.bitrix_exchange, переопределяется BITRIX_EXCHANGE_HOME.
+
+import os
+
+
+def data_dir(*parts):
+    base = os.environ.get('BITRIX_EXCHANGE_HOME') or os.path.join(os.path.expanduser('~'), '.bitrix_exchange')
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
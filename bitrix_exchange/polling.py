@@ -0,0 +1,126 @@
+# bitrix_exchange/polling.py
+# Опрос mode=import: адаптивный интервал и разбор ответа "progress".
+#
+# Каждый запрос import — это шаг работы на сервере. PollScheduler держит
+# сглаженную длительность шага и ждёт между запросами её долю в пределах
+# [min_interval, max_interval]. Если счётчики в ответе не двигаются, пауза
+# удваивается; как только прогресс пошёл — возвращается к расчётной.
+#
+# parse_progress вытаскивает из текста ответа текущий шаг и счётчики
+# ("Обработано 1500 из 20000", "45%", "Импортировано элементов: 300"),
+# ImportProgress превращает их в процент и оценку оставшегося времени.
+
+import re
+import time
+
+DEFAULT_MIN_INTERVAL = 0.05
+DEFAULT_MAX_INTERVAL = 10.0
+
+_OF_RE = re.compile(r'(\d[\d\s ]*?)\s*(?:из|/|of)\s*(\d[\d\s ]*)', re.IGNORECASE)
+_PERCENT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%')
+_COUNT_RE = re.compile(r'(\d[\d\s ]*)')
+
+
+def _int(text):
+    return int(re.sub(r'\D', '', text))
+
+
+class ProgressInfo:
+    def __init__(self, step='', done=None, total=None, percent=None):
+        self.step = step        # текст текущего шага, как его прислал сервер
+        self.done = done        # обработано элементов
+        self.total = total      # всего элементов (если сервер сообщил)
+        self.percent = percent  # процент (если сервер сообщил)
+
+    def key(self):
+        # по изменению ключа понимаем, что импорт продвинулся
+        return self.step, self.done, self.total, self.percent
+
+
+def parse_progress(text) -> ProgressInfo:
+    lines = [ln.strip() for ln in text.strip().splitlines()]
+    if lines and lines[0].lower().startswith('progress'):
+        lines = lines[1:]
+    body = [ln for ln in lines if ln]
+    info = ProgressInfo(step=body[0] if body else '')
+    joined = ' '.join(body)
+    m = _OF_RE.search(joined)
+    if m:
+        info.done, info.total = _int(m.group(1)), _int(m.group(2))
+        return info
+    m = _PERCENT_RE.search(joined)
+    if m:
+        info.percent = float(m.group(1).replace(',', '.'))
+        return info
+    m = _COUNT_RE.search(joined)
+    if m:
+        info.done = _int(m.group(1))
+    return info
+
+
+class ImportProgress:
+    # процент и ETA импорта одного XML
+    def __init__(self, expected_total=None, clock=time.monotonic):
+        # expected_total — сколько элементов ожидаем (например, из предпроверки файла)
+        self.expected_total = expected_total
+        self.clock = clock
+        self.started = clock()
+        self.fraction = None
+
+    def update(self, info: ProgressInfo):
+        if info.total:
+            fraction = info.done / info.total
+        elif info.percent is not None:
+            fraction = info.percent / 100
+        elif info.done is not None and self.expected_total:
+            fraction = info.done / self.expected_total
+        else:
+            fraction = None
+        if fraction is not None:
+            self.fraction = max(0.0, min(fraction, 1.0))
+        return self.fraction
+
+    @property
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def eta(self):
+        # секунд до конца по средней скорости с начала импорта файла
+        if not self.fraction:
+            return None
+        return self.elapsed * (1 - self.fraction) / self.fraction
+
+
+class PollScheduler:
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL,
+                 ratio=0.5, smoothing=0.3):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.ratio = ratio          # доля длительности шага, которую ждём
+        self.smoothing = smoothing  # вес нового шага в сглаженной длительности
+        self.step_time = None
+        self._stalled = 0
+        self._last_key = None
+
+    def next_delay(self, step_duration, info=None):
+        if self.step_time is None:
+            self.step_time = step_duration
+        else:
+            self.step_time += self.smoothing * (step_duration - self.step_time)
+        if info is not None:
+            key = info.key()
+            self._stalled = self._stalled + 1 if key == self._last_key else 0
+            self._last_key = key
+        delay = self.step_time * self.ratio * (2 ** min(self._stalled, 10))
+        return max(self.min_interval, min(delay, self.max_interval))
+
+
+def format_eta(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes} мин {seconds:02d} с"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes:02d} мин"
@@ -0,0 +1,119 @@
+# bitrix_exchange/preview.py
+# Ответы сервера в логе — в коротком виде.
+#
+# На ошибке nginx или PHP сайт отвечает HTML-страницей в мегабайты, и раньше
+# она целиком уходила в лог и в консоль GUI. ResponseStore оставляет в
+# сообщении только начало ответа (preview_chars символов), а весь ответ, до
+# spill_bytes байт, один раз пишет во временный файл; путь к нему — последняя
+# строка сообщения (SPILL_MARK). Консоль GUI читает файл, только когда
+# запись раскрывают. Короткие ответы (success, progress, file_limit)
+# остаются в сообщении целиком.
+#
+# Файлы лежат в своём каталоге процесса (mkdtemp), хранится не больше
+# keep_files файлов и keep_bytes байт — старые удаляются первыми, так что
+# watch и долгая очередь не копят ответы без конца. cleanup() удаляет всё:
+# CLI — при выходе, GUI — при закрытии окна.
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+DEFAULT_PREVIEW_CHARS = 2000
+DEFAULT_SPILL_BYTES = 16 * 1024 * 1024
+DEFAULT_KEEP_FILES = 50
+DEFAULT_KEEP_BYTES = 256 * 1024 * 1024
+EXCERPT_CHARS = 300     # ответ внутри сообщения об ошибке
+SPILL_MARK = "📄 Полный ответ: "
+SPILL_RE = re.compile(r'^' + re.escape(SPILL_MARK) + r'(.+)$', re.MULTILINE)
+
+
+def excerpt(text, limit=EXCERPT_CHARS):
+    # начало ответа для сообщения об ошибке; весь ответ уже в логе выше
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + " …"
+
+
+def spilled_path(text):
+    # путь к полному ответу из сообщения или None
+    m = SPILL_RE.search(text)
+    return m.group(1) if m else None
+
+
+class ResponseStore:
+    def __init__(self, preview_chars=DEFAULT_PREVIEW_CHARS, spill_bytes=DEFAULT_SPILL_BYTES, directory=None,
+                 keep_files=DEFAULT_KEEP_FILES, keep_bytes=DEFAULT_KEEP_BYTES):
+        self.preview_chars = preview_chars
+        self.spill_bytes = spill_bytes      # 0 — полный ответ не сохранять
+        self.directory = directory          # None — свой временный каталог процесса
+        self.keep_files = keep_files
+        self.keep_bytes = keep_bytes
+        self.files = []                     # старые первыми
+        self._sizes = {}
+        self._own = None
+        self._lock = threading.Lock()
+
+    def preview(self, text):
+        # текст для лога: сам ответ или его начало и ссылка на файл
+        if len(text) <= self.preview_chars:
+            return text
+        head = text[:self.preview_chars].rstrip()
+        note = f"… показано {self.preview_chars} из {len(text)} символов"
+        path = self._spill(text) if self.spill_bytes else None
+        if path:
+            return f"{head}\n{note}\n{SPILL_MARK}{path}"
+        return f"{head}\n{note}"
+
+    def _spill(self, text):
+        data = text.encode('utf-8')[:self.spill_bytes]
+        try:
+            fd, path = tempfile.mkstemp(prefix=time.strftime('response-%Y%m%d-%H%M%S-'), suffix='.txt',
+                                        dir=self._directory())
+            with open(fd, 'wb') as f:
+                f.write(data)
+        except OSError:
+            return None     # без файла — только начало ответа
+        with self._lock:
+            self.files.append(path)
+            self._sizes[path] = len(data)
+            stale = self._evict()
+        self._remove(stale)
+        return path
+
+    def _directory(self):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            return self.directory
+        with self._lock:
+            if self._own is None:
+                self._own = tempfile.mkdtemp(prefix='bitrix_exchange_responses-')
+            return self._own
+
+    def _evict(self):
+        # под замком: самые старые файлы сверх лимитов; последний остаётся всегда
+        stale = []
+        total = sum(self._sizes.values())
+        while len(self.files) > 1 and (len(self.files) > self.keep_files or total > self.keep_bytes):
+            path = self.files.pop(0)
+            total -= self._sizes.pop(path)
+            stale.append(path)
+        return stale
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        # удалить сохранённые ответы (CLI — при выходе, GUI — при закрытии окна)
+        with self._lock:
+            files, self.files, self._sizes = self.files, [], {}
+            own, self._own = self._own, None
+        self._remove(files)
+        if own:
+            shutil.rmtree(own, ignore_errors=True)
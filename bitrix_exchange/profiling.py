@@ -0,0 +1,220 @@
+# bitrix_exchange/profiling.py
+# Профиль обмена: куда уходит время — в движок, в сеть или в GUI.
+#
+# Profiler раз в interval секунд снимает стеки всех потоков процесса
+# (sys._current_frames) — выборочный профиль без трассировки каждого вызова,
+# так что обмен под ним идёт почти с обычной скоростью, а видно и поток
+# обмена, и потоки fanout, и GUI. Ожидание в сокете попадает в выборки как
+# ssl.py:read / socket.py:readinto, то есть сеть отделяется от работы Python.
+# Выборки простоя (поток ждёт замка или очереди, цикл событий Qt ждёт
+# событий) в сводку не идут.
+#
+# GUI дополнительно вызывает beat() по таймеру в своём потоке: если таймер
+# не успевает дольше stall_threshold, цикл событий завис — записываются
+# длительность и стек GUI-потока в этот момент. timed() оборачивает
+# обработчик сигнала и считает его вызовы и время.
+#
+# write() кладёт в data_dir('profiles') два файла с общим именем: .folded —
+# свёрнутые стеки «поток;функция;…;функция число» для flamegraph.pl или
+# speedscope, и .txt — короткую сводку горячих точек, обработчиков и зависаний.
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from .paths import data_dir
+
+DEFAULT_INTERVAL = 0.005
+DEFAULT_STALL = 0.1
+BEAT_INTERVAL = 0.02    # период таймера GUI, который вызывает beat()
+TOP = 8                 # горячих точек на поток в сводке
+STALL_FRAMES = 4        # сколько внутренних кадров стека показывать у зависания
+# выборки, где поток только ждёт, — не работа
+IDLE = frozenset(('threading.py:wait', 'threading.py:_wait_for_tstate_lock', 'threading.py:join',
+                  'queue.py:get', 'selectors.py:select', 'socketserver.py:serve_forever',
+                  'thread.py:_worker'))
+_labels = {}    # объект кода -> «файл.py:функция»
+
+
+def _label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    return label
+
+
+def _stack(frame):
+    # (корень, …, лист) — функции стека
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+def _where(frame):
+    # «console_widget.py:123 log_many ← main.py:88 _start» — где стоит GUI-поток
+    parts = []
+    while frame is not None and len(parts) < STALL_FRAMES:
+        parts.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}")
+        frame = frame.f_back
+    return " ← ".join(parts)
+
+
+def is_idle(stack):
+    # стек из одного кадра — поток в C без Python-кода (цикл событий Qt, app.exec_())
+    return len(stack) <= 1 or stack[-1] in IDLE
+
+
+class Profiler:
+    def __init__(self, name='exchange', directory=None, interval=DEFAULT_INTERVAL, stall_threshold=DEFAULT_STALL,
+                 gui=False):
+        # gui — главный поток крутит цикл событий Qt и вызывает beat()
+        self.name = name
+        self.gui = gui
+        self.directory = directory
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stacks = Counter()     # (поток, функция, …) -> выборок
+        self.ticks = 0
+        self.handlers = {}          # имя обработчика -> [вызовов, секунд, максимум]
+        self.stalls = []            # (секунда от начала, длительность, где стоял GUI-поток)
+        self.started = None
+        self.elapsed = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._main = threading.main_thread().ident
+        self._beat = None           # время последнего beat(), None — GUI не следим
+        self._stall_where = None
+
+    # --- запуск ---
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time.monotonic() - self.started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            with self._lock:
+                self.ticks += 1
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    if ident == self._main and self.gui:
+                        thread = "GUI"
+                    else:
+                        thread = names.get(ident, f"thread-{ident}")
+                    self.stacks[(thread,) + _stack(frame)] += 1
+                if (self._beat is not None and self._stall_where is None
+                        and time.monotonic() - self._beat > BEAT_INTERVAL + self.stall_threshold):
+                    self._stall_where = _where(frames.get(self._main))
+
+    # --- GUI ---
+
+    def beat(self):
+        # из таймера GUI-потока каждые BEAT_INTERVAL секунд
+        now = time.monotonic()
+        with self._lock:
+            if self._beat is not None:
+                late = now - self._beat - BEAT_INTERVAL
+                if late >= self.stall_threshold:
+                    self.stalls.append((self._beat - self.started, late, self._stall_where or "—"))
+            self._beat = now
+            self._stall_where = None
+
+    def timed(self, name, slot):
+        # обработчик сигнала со счётчиком вызовов и времени
+        def wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return slot(*args)
+            finally:
+                self.handler(name, time.perf_counter() - started)
+        return wrapper
+
+    def handler(self, name, seconds):
+        with self._lock:
+            calls = self.handlers.setdefault(name, [0, 0.0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+            calls[2] = max(calls[2], seconds)
+
+    # --- отчёт ---
+
+    def summary(self, folded_path=None):
+        with self._lock:
+            stacks = Counter(self.stacks)
+            ticks = self.ticks
+            handlers = {name: list(v) for name, v in self.handlers.items()}
+            stalls = list(self.stalls)
+        elapsed = self.elapsed if self.elapsed is not None else time.monotonic() - self.started
+        # реальный шаг выборки: сон потока дольше interval, если процесс занят
+        step = elapsed / ticks if ticks else self.interval
+        lines = [f"🔬 Профиль «{self.name}»: {elapsed:.2f} с, {ticks} выборок, шаг {step * 1000:.1f} мс"]
+        busy, hot = Counter(), {}
+        for stack, count in stacks.items():
+            if is_idle(stack[1:]):
+                continue
+            busy[stack[0]] += count
+            hot.setdefault(stack[0], Counter())[stack[-1]] += count
+        if not busy:
+            lines.append("Все потоки простаивали.")
+        for thread, count in busy.most_common():
+            lines.append(f"Поток {thread}: занят {count * step:.2f} с ({count / ticks * 100:.0f}% времени), "
+                         f"больше всего в:")
+            for label, n in hot[thread].most_common(TOP):
+                lines.append(f"  {n * step:7.2f} с  {n / count * 100:3.0f}%  {label}")
+        if handlers:
+            lines.append("Обработчики сигналов в GUI (вызовов, всего, максимум):")
+            for name, (calls, total, worst) in sorted(handlers.items(), key=lambda kv: -kv[1][1]):
+                lines.append(f"  {calls:6d}  {total:7.3f} с  {worst * 1000:7.1f} мс  {name}")
+        if self.gui:
+            if stalls:
+                lengths = [seconds for _, seconds, _ in stalls]
+                lines.append(f"Зависания GUI дольше {self.stall_threshold * 1000:.0f} мс: {len(stalls)}, "
+                             f"всего {sum(lengths):.2f} с, худшее {max(lengths):.2f} с")
+                for at, seconds, where in sorted(stalls, key=lambda s: -s[1])[:TOP]:
+                    lines.append(f"  +{at:.2f} с  {seconds:.2f} с  {where}")
+            else:
+                lines.append(f"Зависаний GUI дольше {self.stall_threshold * 1000:.0f} мс нет")
+        if folded_path:
+            lines.append(f"Стеки: {folded_path} (flamegraph.pl, speedscope)")
+        return "\n".join(lines)
+
+    def write(self):
+        # (путь .folded, путь .txt, сводка); профилировщик уже остановлен
+        directory = self.directory or data_dir('profiles')
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, f"{self.name}-{datetime.now():%Y%m%d-%H%M%S}")
+        base, n = stem, 1
+        while os.path.exists(base + '.txt'):
+            n += 1
+            base = f"{stem}-{n}"
+        folded = base + '.folded'
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        with open(folded, 'w', encoding='utf-8') as f:
+            for stack, count in stacks:
+                f.write(f"{';'.join(stack)} {count}\n")
+        text = self.summary(folded)
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        return folded, base + '.txt', text
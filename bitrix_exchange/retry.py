@@ -0,0 +1,28 @@
+# bitrix_exchange/retry.py
+# Повторы с экспоненциальной задержкой для временных сетевых ошибок.
+
+import random
+
+import requests
+
+# коды ответа, после которых имеет смысл повторить запрос
+TRANSIENT_STATUS = frozenset((429, 500, 502, 503, 504))
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class Backoff:
+    # delays: 1, 2, 4, … с, не больше max_delay, ±25% случайного разброса
+    def __init__(self, retries=3, base=1.0, max_delay=30.0, jitter=0.25):
+        self.retries = retries
+        self.base = base
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next_delay(self):
+        # задержка перед следующей попыткой или None, если попытки кончились
+        if self.attempt >= self.retries:
+            return None
+        delay = min(self.base * (2 ** self.attempt), self.max_delay)
+        self.attempt += 1
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
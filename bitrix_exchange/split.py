@@ -0,0 +1,320 @@
+# bitrix_exchange/split.py
+# Разрезание большого XML CommerceML на несколько документов поменьше.
+#
+# Чанки mode=file делят только передачу: импортирует Битрикс всё равно
+# один файл, и многогигабайтный offers.xml упирается в max_execution_time
+# и memory_limit PHP на mode=import. split_xml проходит XML expat'ом потоком
+# и раскладывает Товары или Предложения по частям не больше max_bytes:
+# offers.xml -> offers_00001.xml, offers_00002.xml, … Каждая часть — целый
+# документ: всё, что вокруг списка (классификатор, типы цен, склады),
+# повторяется в каждой, а у Каталог/ПакетПредложений выставлено
+# СодержитТолькоИзменения="true" — иначе Битрикс после каждой части
+# деактивировал бы товары остальных. Если исходный файл — полная выгрузка
+# (флаг false или его нет), последняя часть уходит с исходным флагом: все
+# части импортируются в одной сессии обмена, и после последней Битрикс, как
+# и для целого файла, деактивирует товары, которых не было ни в одной части.
+# Элементы копируются исходными байтами, кодировка файла сохраняется.
+# Части сортируются там же, где исходный файл, так что порядок
+# import → offers из order_xmls не меняется; они уходят одним ZIP и
+# импортируются по очереди.
+
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from xml.parsers import expat
+
+from .delta import ITEMS, PARTIAL_ATTR, PARTIAL_TAGS, READ_BLOCK, _START_TAG, _attr
+from .zipstream import collect_entries, extract_member
+
+
+class SplitError(Exception):
+    # XML нельзя разрезать — отправляется целиком
+    pass
+
+
+def part_name(name, n):
+    # dir/offers.xml, 1 -> dir/offers_00001.xml
+    stem, ext = os.path.splitext(name)
+    return f"{stem}_{n:05d}{ext}"
+
+
+class XmlSplit:
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.parts = []         # [(имя части, путь, элементов)]
+        self.items = 0
+        self.size_in = 0
+        self.elapsed = 0.0
+        self.full_export = False    # источник — полная выгрузка, последняя часть с исходным флагом
+
+    def describe(self):
+        text = (f"{self.name}: {self.items} элементов → {len(self.parts)} част(ей) до "
+                f"{self.max_bytes / 1024 / 1024:.0f} МБ ({self.size_in / 1024 / 1024:.1f} МБ, "
+                f"{self.elapsed:.1f} с)")
+        if self.full_export:
+            text += ("; полная выгрузка: части, кроме последней, помечены как изменения, "
+                     "отсутствующие товары Битрикс деактивирует после последней")
+        return text
+
+
+class _Splitter:
+    # Обработчики expat. До первого элемента списка вход копируется в head,
+    # после закрывающего тега списка — в tail; элементы — в текущую часть.
+    # Части дописываются хвостом в finish(), когда он уже известен.
+    def __init__(self, parser, stats, workdir):
+        self.parser = parser
+        self.stats = stats
+        self.workdir = workdir
+        self.encoding = 'utf-8'
+        self.buf = bytearray()
+        self.base = 0
+        self.copied = 0
+        self.stack = []         # теги от корня до текущего
+        self.list_depth = 0     # глубина списка Товары/Предложения, 0 — ещё не встретился
+        self.item_depth = 0
+        self.item_start = 0
+        self.item_empty = False
+        self.done = False       # список закрыт, дальше хвост
+        self.head = open(os.path.join(workdir, 'head'), 'w+b')
+        self.tail = open(os.path.join(workdir, 'tail'), 'w+b')
+        self.sink = self.head
+        self.part = None
+        self.part_size = 0
+        # [(смещение в head, тег с "true", исходный тег)] — для последней части полной выгрузки
+        self.flags = []
+        parser.XmlDeclHandler = self.declaration
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+
+    def feed(self, block):
+        self.buf += block
+        self.parser.Parse(block, not block)
+        if not block:
+            self._copy_to(self.base + len(self.buf))
+        elif self.sink is not None:
+            # до последнего "<" всё разобрано: недочитанный тег начинается с него
+            cut = self.buf.rfind(b'<')
+            self._copy_to(self.base + (cut if cut >= 0 else len(self.buf)))
+        drop = self.copied - self.base
+        if drop > 0:
+            del self.buf[:drop]
+            self.base = self.copied
+
+    def _copy_to(self, pos):
+        # в head или tail; внутри списка (sink None) байты между элементами — отступы
+        if pos > self.copied and self.sink is not None:
+            self.sink.write(self.buf[self.copied - self.base:pos - self.base])
+        self.copied = max(self.copied, pos)
+
+    def declaration(self, version, encoding, standalone):
+        self.encoding = encoding or 'utf-8'
+
+    def start(self, tag, attrs):
+        pos = self.parser.CurrentByteIndex
+        if self.item_depth:
+            self.stack.append(tag)
+            return
+        parent = self.stack[-1] if self.stack else None
+        self.stack.append(tag)
+        depth = len(self.stack)
+        m = _START_TAG.match(self.buf, pos - self.base)
+        empty = m.group().endswith(b'/>')
+        if self.list_depth and depth == self.list_depth + 1 and ITEMS.get(tag) == parent:
+            self.item_depth = depth
+            self.item_empty = empty
+            # комментарий перед элементом уходит вместе с ним, отступ — нет
+            gap = self.buf[self.copied - self.base:pos - self.base]
+            self.item_start = self.copied if gap.strip() else pos
+            return
+        if tag in ITEMS.values() and not empty:
+            if self.list_depth or self.done:
+                raise SplitError(f"в {self.stats.name} больше одного списка {tag}")
+            self._copy_to(self.base + m.end())
+            self.list_depth = depth
+            self.sink = None
+        elif tag in PARTIAL_TAGS and not self.done:
+            # в каждой части только часть товаров — это выгрузка изменений
+            self._copy_to(pos)
+            source = list(zip(attrs[::2], attrs[1::2]))
+            pairs = [(k, v) for k, v in source if k != PARTIAL_ATTR] + [(PARTIAL_ATTR, 'true')]
+            text = self._tag(tag, pairs, empty)
+            if self.sink is self.head and dict(source).get(PARTIAL_ATTR, 'false').strip().lower() != 'true':
+                self.flags.append((self.head.tell(), text, self._tag(tag, source, empty)))
+                self.stats.full_export = True
+            self.sink.write(text)
+            self.copied = self.base + m.end()
+
+    def _tag(self, tag, pairs, empty):
+        text = f"<{tag}" + ''.join(f' {k}="{_attr(v)}"' for k, v in pairs) + ('/>' if empty else '>')
+        return text.encode(self.encoding, 'xmlcharrefreplace')
+
+    def end(self, tag):
+        pos = self.parser.CurrentByteIndex
+        depth = len(self.stack)
+        self.stack.pop()
+        if self.item_depth:
+            if depth == self.item_depth:
+                self.item_depth = 0
+                # у <x/> expat сообщает конец за "/>", у <x>…</x> — на начале "</x>"
+                end = pos if self.item_empty else self.buf.index(b'>', pos - self.base) + self.base + 1
+                self._add_item(self.buf[self.item_start - self.base:end - self.base])
+                self.copied = end
+            return
+        if depth == self.list_depth:
+            gap = self.buf[self.copied - self.base:pos - self.base]
+            if not gap.strip():
+                self.copied = pos
+            self.list_depth = 0
+            self.done = True
+            self.sink = self.tail
+
+    def _add_item(self, raw):
+        if self.part is None or (self.stats.parts[-1][2] and self.part_size + len(raw) > self.stats.max_bytes):
+            self._new_part()
+        self.part.write(raw)
+        self.part_size += len(raw)
+        name, path, count = self.stats.parts[-1]
+        self.stats.parts[-1] = (name, path, count + 1)
+        self.stats.items += 1
+
+    def _new_part(self):
+        if self.part:
+            self.part.close()
+        name = part_name(self.stats.name, len(self.stats.parts) + 1)
+        path = os.path.join(self.workdir, *name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.part = open(path, 'wb')
+        self.head.seek(0)
+        shutil.copyfileobj(self.head, self.part, READ_BLOCK)
+        self.part_size = self.head.tell()
+        self.stats.parts.append((name, path, 0))
+
+    def finish(self):
+        if self.part:
+            self.part.close()
+        self.tail.flush()
+        for _, path, _ in self.stats.parts:
+            with open(path, 'ab') as f:
+                self.tail.seek(0)
+                shutil.copyfileobj(self.tail, f, READ_BLOCK)
+        if self.flags and self.stats.parts:
+            self._restore_flags(self.stats.parts[-1][1])
+
+    def _restore_flags(self, path):
+        # часть начинается с копии head: теги с флагом стоят на тех же смещениях
+        with open(path, 'rb') as src, open(path + '.tmp', 'wb') as dst:
+            pos = 0
+            for offset, partial, original in self.flags:
+                dst.write(src.read(offset - pos))
+                src.read(len(partial))
+                dst.write(original)
+                pos = offset + len(partial)
+            shutil.copyfileobj(src, dst, READ_BLOCK)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        if self.part:
+            self.part.close()
+        for f in (self.head, self.tail):
+            f.close()
+            os.remove(f.name)
+
+
+def split_xml(src, name, workdir, max_bytes, check=None):
+    # src — бинарный поток XML; части пишутся в workdir. Возвращает XmlSplit;
+    # если элементов не набралось больше чем на одну часть, parts пуст
+    stats = XmlSplit(name, max_bytes)
+    started = time.monotonic()
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    splitter = _Splitter(parser, stats, workdir)
+    try:
+        while True:
+            block = src.read(READ_BLOCK)
+            if check:
+                check()
+            stats.size_in += len(block)
+            splitter.feed(block)
+            if not block:
+                break
+        splitter.finish()
+    except BaseException:
+        splitter.close()
+        _remove(stats.parts)
+        raise
+    splitter.close()
+    if len(stats.parts) < 2:
+        _remove(stats.parts)
+        stats.parts = []
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def _remove(parts):
+    for _, path, _ in parts:
+        os.remove(path)
+
+
+class SplitPackage:
+    # entries — [(имя в архиве, путь)]: большие XML заменены частями
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.entries = []
+        self.stats = []         # XmlSplit по разрезанным XML
+        self.skipped = []       # почему большой XML остался целым
+
+    def cleanup(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def split_package(path, compress, max_bytes, check=None, entries=None):
+    # XML, ZIP или папка (при compress), либо готовые entries (пакет изменений)
+    # -> SplitPackage во временном каталоге; stats пуст, если резать нечего
+    package = SplitPackage(tempfile.mkdtemp(prefix='bitrix-split-'))
+    try:
+        if entries is None and not (compress or os.path.isdir(path)) and path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as z:
+                infos = [info for info in z.infolist() if not info.is_dir()]
+                if not any(_too_big(info.filename, info.file_size, max_bytes) for info in infos):
+                    return package
+                for info in infos:
+                    if _too_big(info.filename, info.file_size, max_bytes):
+                        with z.open(info) as src:
+                            if _add(package, info.filename, src, max_bytes, check):
+                                continue
+                    package.entries.append(
+                        (info.filename, extract_member(z, info, os.path.join(package.workdir, 'files'))))
+        else:
+            for arcname, full in (entries if entries is not None else collect_entries(path)):
+                if _too_big(arcname, os.path.getsize(full), max_bytes):
+                    with open(full, 'rb') as src:
+                        if _add(package, arcname, src, max_bytes, check):
+                            continue
+                package.entries.append((arcname, full))
+    except BaseException:
+        package.cleanup()
+        raise
+    return package
+
+
+def _too_big(name, size, max_bytes):
+    return name.lower().endswith('.xml') and size > max_bytes
+
+
+def _add(package, name, src, max_bytes, check):
+    # True, если XML разрезан и его части добавлены вместо него
+    workdir = os.path.join(package.workdir, 'parts')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        stats = split_xml(src, name, workdir, max_bytes, check)
+    except SplitError as e:
+        package.skipped.append(str(e))
+        return False
+    if not stats.parts:
+        return False
+    package.stats.append(stats)
+    package.entries.extend((part, path) for part, path, _ in stats.parts)
+    return True
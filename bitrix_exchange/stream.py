@@ -0,0 +1,173 @@
+# bitrix_exchange/stream.py
+# Потоковая отправка чанков mode=file с ограниченной памятью.
+#
+# BlockReader в фоновом потоке читает источник блоками фиксированного размера
+# в пул переиспользуемых буферов — пока текущий POST в полёте, следующие блоки
+# уже прочитаны с диска. ChunkBody отдаёт requests ровно `length` байт из
+# ридера срезами memoryview, без копирования. Пиковая память —
+# (READ_AHEAD + 1) * BLOCK_SIZE независимо от размера файла и file_limit.
+# Для повторной отправки (редирект 307/308) ChunkBody умеет seek(): ридер
+# перематывает файл и заново запускает упреждающее чтение.
+
+import queue
+import threading
+import zlib
+
+BLOCK_SIZE = 256 * 1024
+READ_AHEAD = 4
+
+
+class BlockReader:
+    def __init__(self, raw, block_size=BLOCK_SIZE, depth=READ_AHEAD):
+        # raw — бинарный объект с readinto() (файл или поток)
+        self._raw = raw
+        self._free = queue.Queue()
+        for _ in range(depth + 1):
+            self._free.put(bytearray(block_size))
+        self._ready = queue.Queue()
+        self._buf = None
+        self._view = None
+        self._offset = raw.tell() if raw.seekable() else 0
+        self._start()
+
+    def _start(self):
+        self._closed = threading.Event()
+        self._error = None
+        self._eof = False
+        self._pos = self._len = 0
+        self._thread = threading.Thread(target=self._fill, args=(self._closed,),
+                                        name='chunk-read-ahead', daemon=True)
+        self._thread.start()
+
+    def _fill(self, closed):
+        try:
+            while True:
+                buf = self._take_free(closed)
+                if buf is None:
+                    return
+                n = self._raw.readinto(buf)
+                if not n:
+                    self._free.put(buf)
+                    break
+                self._ready.put((buf, n))
+        except Exception as e:
+            self._error = e
+        self._ready.put(None)
+
+    def _take_free(self, closed):
+        while not closed.is_set():
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _stop(self):
+        # останавливаем упреждающее чтение и возвращаем все буферы в пул
+        self._closed.set()
+        self._thread.join()
+        if self._buf is not None:
+            self._free.put(self._buf)
+            self._buf = self._view = None
+        while True:
+            try:
+                item = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._free.put(item[0])
+
+    def tell(self):
+        # смещение следующего байта, который получит читатель
+        return self._offset
+
+    def seek(self, offset):
+        self._stop()
+        self._raw.seek(offset)
+        self._offset = offset
+        self._start()
+
+    def read(self, n):
+        # возвращает до n байт (memoryview) или b'' в конце источника
+        while self._pos >= self._len:
+            if self._buf is not None:
+                # предыдущий блок уже отправлен — буфер снова свободен
+                self._free.put(self._buf)
+                self._buf = self._view = None
+            if self._eof:
+                return b''
+            item = self._ready.get()
+            if item is None:
+                self._eof = True
+                if self._error:
+                    raise self._error
+                return b''
+            self._buf, self._len = item
+            self._view = memoryview(self._buf)
+            self._pos = 0
+        end = min(self._pos + n, self._len)
+        data = self._view[self._pos:end]
+        self._offset += end - self._pos
+        self._pos = end
+        return data
+
+    def close(self):
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChunkBody:
+    # Тело одного POST: файлоподобный объект известной длины, чтобы requests
+    # выставил Content-Length и читал его блоками, не собирая в bytes.
+    def __init__(self, reader, length):
+        self._reader = reader
+        self._start = reader.tell()
+        self._length = length
+        self._left = length
+        # CRC32 отданных байт — для журнала докачки
+        self.crc = 0
+        # ошибка чтения источника; requests заворачивает её в ConnectionError,
+        # поэтому движок смотрит сюда, чтобы показать настоящую причину
+        self.error = None
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._length - self._left
+
+    def seek(self, pos):
+        # requests перематывает тело перед повторной отправкой на редиректе
+        self._reader.seek(self._start + pos)
+        self._left = self._length - pos
+        # requests перематывает только в начало; с середины CRC не восстановить
+        self.crc = 0 if pos == 0 else None
+
+    def read(self, n=-1):
+        if self._left <= 0:
+            return b''
+        if n is None or n < 0:
+            n = self._left
+        try:
+            data = self._reader.read(min(n, self._left))
+            if not data:
+                raise OSError(f"источник закончился раньше времени: не хватает {self._left} байт")
+        except Exception as e:
+            self.error = e
+            raise
+        self._left -= len(data)
+        if self.crc is not None:
+            self.crc = zlib.crc32(data, self.crc)
+        return data
+
+    def __iter__(self):
+        while True:
+            data = self.read(BLOCK_SIZE)
+            if not data:
+                return
+            yield data
@@ -0,0 +1,167 @@
+# bitrix_exchange/zipstream.py
+# Сжатие XML (или папки с XML и картинками) в ZIP на лету, прямо в цикл mode=file.
+#
+# ZipStream — файлоподобный источник для BlockReader: zipfile пишет архив
+# в маленький буфер-приёмник, а readinto() отдаёт готовые байты. Архив
+# не пишется на диск и целиком в памяти не лежит. Сжатие детерминировано
+# (те же файлы, mtime и уровень — те же байты), поэтому seek() реализован
+# пересжатием с начала и пропуском: им пользуется докачка.
+# Размер архива заранее неизвестен: движок копит каждый чанк во временном
+# файле и берёт Content-Length из его длины, а о ходе загрузки судит по
+# consumed — сколько байт исходных файлов уже сжато. size() — отдельный
+# проход сжатия, движку он не нужен.
+
+import hashlib
+import io
+import os
+import shutil
+import zipfile
+
+READ_BLOCK = 256 * 1024
+DEFAULT_LEVEL = 6
+
+
+def collect_entries(path):
+    # [(имя в архиве, путь)] для файла или для всех файлов папки
+    if os.path.isfile(path):
+        return [(os.path.basename(path), path)]
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            entries.append((os.path.relpath(full, path).replace(os.sep, '/'), full))
+    return entries
+
+
+def extract_member(z, info, directory):
+    # член ZIP -> файл в directory с тем же относительным путём
+    target = os.path.join(directory, *info.filename.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with z.open(info) as src, open(target, 'wb') as dst:
+        shutil.copyfileobj(src, dst, READ_BLOCK)
+    return target
+
+
+def archive_name(path):
+    # import.xml → import.zip, папка export → export.zip
+    base = os.path.basename(os.path.normpath(path))
+    if os.path.isfile(path):
+        base = os.path.splitext(base)[0]
+    return base + '.zip'
+
+
+class _Sink(io.RawIOBase):
+    # приёмник для zipfile: копит записанное до следующего readinto()
+    def __init__(self):
+        self.parts = []
+        self.written = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.written += len(data)
+        return len(data)
+
+    def tell(self):
+        # без seek() zipfile пишет в потоковом режиме (data descriptor)
+        return self.written
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+class ZipStream(io.RawIOBase):
+    def __init__(self, entries, level=DEFAULT_LEVEL):
+        self.entries = entries
+        self.level = level
+        self._gen = None
+        self._pending = memoryview(b'')
+        self._pos = 0
+        self.consumed = 0
+        self._restart()
+
+    def _generate(self):
+        sink = _Sink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=self.level) as zf:
+            for arcname, path in self.entries:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, zf.open(info, 'w') as dst:
+                    while True:
+                        block = src.read(READ_BLOCK)
+                        if not block:
+                            break
+                        dst.write(block)
+                        self.consumed += len(block)
+                        if sink.parts:
+                            yield sink.drain()
+                yield sink.drain()
+        yield sink.drain()  # центральный каталог
+
+    def _restart(self):
+        if self._gen is not None:
+            self._gen.close()
+        self._gen = self._generate()
+        self._pending = memoryview(b'')
+        self._pos = 0
+        self.consumed = 0
+
+    # --- интерфейс файла ---
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def readinto(self, buf):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._gen))
+            except StopIteration:
+                return 0
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("ZipStream поддерживает только SEEK_SET")
+        if offset < self._pos:
+            self._restart()
+        scratch = bytearray(READ_BLOCK)
+        while self._pos < offset:
+            n = self.readinto(memoryview(scratch)[:min(READ_BLOCK, offset - self._pos)])
+            if not n:
+                break
+        return self._pos
+
+    # --- сведения об архиве ---
+
+    def size(self):
+        # длина архива: отдельный проход сжатия без сохранения данных
+        return sum(len(part) for part in ZipStream(self.entries, self.level)._generate())
+
+    def source_size(self):
+        return sum(os.path.getsize(path) for _, path in self.entries)
+
+    def fingerprint(self):
+        # отпечаток содержимого для журнала докачки
+        h = hashlib.sha1(str(self.level).encode())
+        for arcname, path in self.entries:
+            st = os.stat(path)
+            h.update(f"{arcname}|{st.st_size}|{st.st_mtime_ns}\n".encode('utf-8'))
+        return h.hexdigest()
+
+    def xml_names(self):
+        return [arcname for arcname, _ in self.entries if arcname.lower().endswith('.xml')]
@@ -0,0 +1,542 @@
+# console_widget.py
+# Консоль лога: таблица над моделью с кольцевым буфером записей.
+#
+# Запись хранит только время и исходный текст сообщения. В таблице у записи
+# одна строка — первая строка сообщения; остальные строки, нарезанные по
+# WRAP_WIDTH, вставляются под ней только когда запись раскрывают (двойной
+# щелчок, "Expand All"), и перенос кешируется в записи. Модель плоская:
+# QTreeView при каждой вставке пересчитывает раскладку всех строк и
+# спрашивает у модели каждую, а QTableView с фиксированной высотой строк
+# обращается к модели только за видимыми. Буфер ограничен max_entries,
+# старые записи вытесняются пачкой — добавление сообщения стоит O(1).
+#
+# Фильтр: у каждой записи при добавлении считаются текст в нижнем регистре
+# и маска фасетов (❌ ошибки, 📤 запросы, 📥 ответы по первой строке), так
+# что смена фильтра — один проход по готовому индексу без повторных lower().
+# Если новый текст лишь уточняет прежний, проверяются только видимые записи.
+# Ввод в поле фильтра применяется с задержкой FILTER_DEBOUNCE_MS.
+#
+# Перенос не делается в GUI-потоке: воркер присылает сообщения как LogText
+# (prewrap), уже с нарезанными строками. Длинный ответ сервера приходит
+# коротким — начало и путь к файлу с полным ответом (bitrix_exchange/preview.py);
+# файл читается и переносится в фоновом потоке, только когда такую запись
+# раскрывают вручную, а при сворачивании полный текст снова забывается.
+
+import re
+import textwrap
+import threading
+from bisect import bisect_left
+from datetime import datetime
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import (
+    QAbstractItemView, QAction, QApplication, QCheckBox, QHBoxLayout, QHeaderView, QLineEdit, QMenu,
+    QPushButton, QTableView, QWidget
+)
+
+from bitrix_exchange.preview import SPILL_MARK, spilled_path
+
+DEFAULT_MAX_ENTRIES = 50000
+WRAP_WIDTH = 120
+FILTER_DEBOUNCE_MS = 200
+
+FACET_ERROR = 1
+FACET_REQUEST = 2
+FACET_RESPONSE = 4
+FACETS = ((FACET_ERROR, "❌", "Errors"), (FACET_REQUEST, "📤", "Requests"), (FACET_RESPONSE, "📥", "Responses"))
+
+# строка таблицы — (serial записи, номер строки переноса); TOP — сама запись
+TOP = -1
+
+
+def wrap_lines(text):
+    # строки под первой, нарезанные по WRAP_WIDTH
+    parts = []
+    for ln in text.splitlines()[1:]:
+        parts.extend(textwrap.wrap(ln, width=WRAP_WIDTH) or [""])
+    return parts
+
+
+class LogText(str):
+    # сообщение с готовым переносом; children — строки под первой
+    def prefixed(self, prefix):
+        return LogText.with_children(prefix + self, self.children)
+
+    @staticmethod
+    def with_children(text, children):
+        text = LogText(text)
+        text.children = children
+        return text
+
+
+def prewrap(text):
+    # вызывается в потоке обмена, чтобы GUI не занимался переносом
+    return LogText.with_children(text, wrap_lines(text))
+
+
+def prefixed(prefix, msg):
+    # префикс сайта или задания в первой строке; готовый перенос не теряется
+    if isinstance(msg, LogText):
+        return msg.prefixed(prefix)
+    return prefix + msg
+
+
+def facets_of(text):
+    first = text.partition("\n")[0]
+    mask = 0
+    for bit, mark, _ in FACETS:
+        if mark in first:
+            mask |= bit
+    return mask
+
+
+class LogEntry:
+    __slots__ = ('serial', 'time', 'text', 'lower', 'facets', 'spill', 'full', '_children')
+
+    def __init__(self, serial, time, text):
+        self.serial = serial
+        self.time = time
+        self.text = text
+        # индекс для фильтра — считается один раз при добавлении
+        self.lower = text.lower()
+        self.facets = facets_of(text)
+        # путь к полному ответу сервера; full — строки полного ответа уже загружены
+        self.spill = spilled_path(text) if SPILL_MARK in text else None
+        self.full = False
+        self._children = getattr(text, 'children', None)
+
+    @property
+    def first(self):
+        return self.text.partition("\n")[0]
+
+    @property
+    def has_children(self):
+        return "\n" in self.text
+
+    def children(self):
+        # перенос строк считаем только при первом раскрытии
+        if self._children is None:
+            self._children = wrap_lines(self.text)
+        return self._children
+
+    def forget_full(self):
+        # свернули — полный ответ больше не держим в памяти
+        if self.full:
+            self.full = False
+            self._children = None
+
+
+class LogFilter:
+    def __init__(self, text="", regex=False, facets=0):
+        # facets — маска FACET_*: запись проходит, если есть хотя бы один
+        # из выбранных фасетов; 0 — фасеты не ограничивают
+        self.text = text
+        self.regex = regex
+        self.facets = facets
+        self._pattern = re.compile(text, re.IGNORECASE) if regex and text else None
+        self._needle = text.lower()
+
+    def __bool__(self):
+        return bool(self.text or self.facets)
+
+    def matches(self, entry):
+        if self.facets and not entry.facets & self.facets:
+            return False
+        if self._pattern is not None:
+            return self._pattern.search(entry.text) is not None
+        return self._needle in entry.lower
+
+    def narrows(self, old):
+        # всё, что пройдёт новый фильтр, проходило и старый
+        if self.regex or old.regex or self.facets != old.facets:
+            return False
+        return old._needle in self._needle
+
+
+def load_full(entry):
+    # полный ответ из файла, перенесённый; вызывается в фоновом потоке
+    try:
+        with open(entry.spill, 'rb') as f:
+            body = f.read().decode('utf-8', errors='replace')
+    except OSError as e:
+        return entry.children() + [f"⚠️ Полный ответ недоступен: {e}"]
+    return wrap_lines(entry.first + "\n" + body) + [f"{SPILL_MARK}{entry.spill}"]
+
+
+class LogModel(QAbstractTableModel):
+    HEADERS = ("Time", "Message")
+    # (serial, строки полного ответа) из фонового потока
+    fullLoaded = pyqtSignal(int, object)
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, parent=None):
+        super().__init__(parent)
+        self._max_entries = max(1, max_entries)
+        self._ring = [None] * self._max_entries
+        self._next_serial = 0
+        self._count = 0
+        self._rows = []         # [(serial, TOP | номер строки переноса)] по возрастанию
+        self._expanded = set()  # serial раскрытых записей
+        self.expand_new = False
+        self.filter = LogFilter()
+        self.fullLoaded.connect(self._set_full)
+
+    # --- буфер ---
+
+    def entry(self, serial) -> LogEntry:
+        return self._ring[serial % len(self._ring)]
+
+    def entry_at(self, row) -> LogEntry:
+        return self.entry(self._rows[row][0])
+
+    def is_child_row(self, row):
+        return self._rows[row][1] != TOP
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def filter_text(self):
+        return self.filter.text
+
+    def _matches(self, entry):
+        return not self.filter or self.filter.matches(entry)
+
+    def _lines(self, entry):
+        rows = [(entry.serial, TOP)]
+        if entry.serial in self._expanded:
+            rows.extend((entry.serial, i) for i in range(len(entry.children())))
+        return rows
+
+    def append(self, text, time=None):
+        # строка новой записи или -1, если её скрыл фильтр
+        return self.extend([text], time)
+
+    def extend(self, texts, time=None):
+        # пачка записей — одно уведомление вида; возвращает первую новую строку или -1
+        texts = texts[-self._max_entries:]
+        overflow = self._count + len(texts) - self._max_entries
+        if overflow > 0:
+            # вытесняем не меньше десятой части разом: одно уведомление на пачку
+            self._evict(min(self._count, max(overflow, self._max_entries // 10)))
+        time = time or datetime.now().strftime("%H:%M:%S")
+        lines = []
+        for text in texts:
+            serial = self._next_serial
+            entry = LogEntry(serial, time, text)
+            self._ring[serial % len(self._ring)] = entry
+            self._next_serial += 1
+            self._count += 1
+            if self.expand_new and entry.has_children:
+                self._expanded.add(serial)
+            if self._matches(entry):
+                lines.extend(self._lines(entry))
+        if not lines:
+            return -1
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row + len(lines) - 1)
+        self._rows.extend(lines)
+        self.endInsertRows()
+        return row
+
+    def _evict(self, n):
+        first = self._next_serial - self._count
+        oldest_kept = first + n
+        k = bisect_left(self._rows, (oldest_kept, TOP))
+        if k:
+            self.beginRemoveRows(QModelIndex(), 0, k - 1)
+            del self._rows[:k]
+            self.endRemoveRows()
+        for serial in range(first, oldest_kept):
+            self._ring[serial % len(self._ring)] = None
+            self._expanded.discard(serial)
+        self._count -= n
+
+    def _rebuild(self, serials=None):
+        if serials is None:
+            serials = range(self._next_serial - self._count, self._next_serial)
+        entry, lines = self.entry, self._lines
+        rows = []
+        if not self.filter:
+            for s in serials:
+                rows.extend(lines(entry(s)))
+        else:
+            matches = self.filter.matches
+            for s in serials:
+                e = entry(s)
+                if matches(e):
+                    rows.extend(lines(e))
+        self._rows = rows
+
+    def set_max_entries(self, n):
+        n = max(1, n)
+        if n == self._max_entries:
+            return
+        kept = [self.entry(s) for s in range(self._next_serial - min(self._count, n), self._next_serial)]
+        self.beginResetModel()
+        self._max_entries = n
+        self._ring = [None] * n
+        for e in kept:
+            self._ring[e.serial % len(self._ring)] = e
+        self._count = len(kept)
+        self._expanded = {e.serial for e in kept if e.serial in self._expanded}
+        self._rebuild()
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self._ring = [None] * len(self._ring)
+        self._count = 0
+        self._rows = []
+        self._expanded = set()
+        self.endResetModel()
+
+    def set_filter(self, text="", regex=False, facets=0):
+        # re.error из неверного выражения уходит вызывающему, фильтр не меняется
+        new = LogFilter(text, regex, facets)
+        visible = None
+        if new.narrows(self.filter):
+            visible = [s for s, line in self._rows if line == TOP]
+        self.beginResetModel()
+        self.filter = new
+        self._rebuild(visible)
+        self.endResetModel()
+
+    # --- раскрытие ---
+
+    def top_row(self, row):
+        # строка самой записи для строки переноса
+        serial = self._rows[row][0]
+        return bisect_left(self._rows, (serial, TOP))
+
+    def is_expanded(self, row):
+        return self._rows[row][0] in self._expanded
+
+    def toggle(self, row):
+        row = self.top_row(row)
+        entry = self.entry_at(row)
+        if not entry.has_children:
+            return
+        if entry.serial in self._expanded:
+            self._remove_children(row, entry)
+            self._expanded.discard(entry.serial)
+            entry.forget_full()
+        else:
+            self._expanded.add(entry.serial)
+            self._insert_children(row, entry)
+            if entry.spill and not entry.full:
+                # пока файл читается, видно начало ответа
+                threading.Thread(target=lambda: self.fullLoaded.emit(entry.serial, load_full(entry)),
+                                 name='console-full', daemon=True).start()
+
+    def _remove_children(self, row, entry):
+        n = len(entry.children())
+        if n:
+            self.beginRemoveRows(QModelIndex(), row + 1, row + n)
+            del self._rows[row + 1:row + 1 + n]
+            self.endRemoveRows()
+
+    def _insert_children(self, row, entry):
+        children = [(entry.serial, i) for i in range(len(entry.children()))]
+        if children:
+            self.beginInsertRows(QModelIndex(), row + 1, row + len(children))
+            self._rows[row + 1:row + 1] = children
+            self.endInsertRows()
+
+    def _set_full(self, serial, lines):
+        # GUI-поток: полный ответ готов; запись могли уже свернуть или вытеснить
+        entry = self.entry(serial)
+        if entry is None or entry.serial != serial or serial not in self._expanded or entry.full:
+            return
+        row = bisect_left(self._rows, (serial, TOP))
+        shown = row < len(self._rows) and self._rows[row] == (serial, TOP)
+        if shown:
+            self._remove_children(row, entry)
+        entry._children = lines
+        entry.full = True
+        if shown:
+            self._insert_children(row, entry)
+
+    def set_all_expanded(self, expanded):
+        first = self._next_serial - self._count
+        self.beginResetModel()
+        if expanded:
+            self._expanded = {s for s in range(first, self._next_serial) if self.entry(s).has_children}
+        else:
+            for s in self._expanded:
+                self.entry(s).forget_full()
+            self._expanded = set()
+        self._rebuild()
+        self.endResetModel()
+
+    # --- QAbstractTableModel ---
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        serial, line = self._rows[index.row()]
+        entry = self.entry(serial)
+        if line != TOP:
+            return "" if index.column() == 0 else entry.children()[line]
+        return entry.time if index.column() == 0 else entry.first
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+
+class ConsoleWidget(QTableView):
+    def __init__(self, parent=None, max_entries=DEFAULT_MAX_ENTRIES):
+        super().__init__(parent)
+        self.log_model = LogModel(max_entries, self)
+        self.setModel(self.log_model)
+        self.setShowGrid(False)
+        self.setWordWrap(False)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.verticalHeader().hide()
+        # все строки однострочные: высоту не нужно мерить для каждой
+        self.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 4)
+        # ширина колонки времени постоянна — не меряем содержимое строк
+        self.horizontalHeader().setSectionResizeMode(0, QHeaderView.Fixed)
+        self.setColumnWidth(0, self.fontMetrics().horizontalAdvance("00:00:00") + 16)
+        self.horizontalHeader().setStretchLastSection(True)
+        self.horizontalHeader().setHighlightSections(False)
+        self.doubleClicked.connect(lambda index: self.log_model.toggle(index.row()))
+        self.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.customContextMenuRequested.connect(self._show_context_menu)
+        # режим автoраскрытия/сворачивания новых сообщений: 'expand' | 'collapse' | None
+        self._expand_mode = None
+
+        # ввод в фильтр применяем, когда пользователь перестал печатать
+        self._filter_timer = QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(FILTER_DEBOUNCE_MS)
+        self._filter_timer.timeout.connect(self.apply_filter)
+        self._pending_filter = ("", False, 0)  # (текст, regex, фасеты)
+
+    @property
+    def filter_text(self):
+        return self.log_model.filter_text
+
+    def log(self, msg: str):
+        return self.log_many([msg])
+
+    def log_many(self, msgs):
+        # пачка сообщений от воркера: одна вставка и одна прокрутка
+        # проверяем: если сейчас скролл внизу — будем "прилипать"
+        sb = self.verticalScrollBar()
+        at_bottom = (sb.value() == sb.maximum())
+
+        # sticky-режим касается только новых записей
+        self.log_model.expand_new = self._expand_mode == 'expand'
+        row = self.log_model.extend(msgs)
+
+        # если были внизу — скроллим вниз
+        if at_bottom:
+            self.scrollToBottom()
+
+        return row
+
+    def clear(self):
+        self.log_model.clear()
+
+    def set_filter(self, text: str, regex=None, facets=None):
+        # отложенно: повторные вызовы до истечения задержки перезапускают таймер
+        _, old_regex, old_facets = self._pending_filter
+        self._pending_filter = (text, old_regex if regex is None else regex,
+                                old_facets if facets is None else facets)
+        self._filter_timer.start()
+
+    def apply_filter(self):
+        self._filter_timer.stop()
+        try:
+            self.log_model.set_filter(*self._pending_filter)
+        except re.error:
+            return False
+        return True
+
+    def set_max_entries(self, n: int):
+        self.log_model.set_max_entries(n)
+
+    def expandAll(self):
+        self.log_model.set_all_expanded(True)
+
+    def collapseAll(self):
+        self.log_model.set_all_expanded(False)
+
+    def _show_context_menu(self, pos):
+        index = self.indexAt(pos)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        copy = QAction("Copy Message", self)
+        expand = QAction("Expand All", self)
+        collapse = QAction("Collapse All", self)
+        menu.addAction(copy)
+        menu.addSeparator()
+        menu.addAction(expand)
+        menu.addAction(collapse)
+        act = menu.exec_(self.viewport().mapToGlobal(pos))
+        if act == copy:
+            QApplication.clipboard().setText(self.log_model.entry_at(index.row()).text)
+        elif act == expand:
+            self.expandAll()
+            self._expand_mode = 'expand'
+        elif act == collapse:
+            self.collapseAll()
+            self._expand_mode = 'collapse'
+
+
+class FilterBar(QWidget):
+    # поле фильтра консоли: текст или регулярное выражение и быстрые фасеты
+    def __init__(self, console, parent=None):
+        super().__init__(parent)
+        self.console = console
+        lay = QHBoxLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        self.text = QLineEdit()
+        self.text.setClearButtonEnabled(True)
+        lay.addWidget(self.text, 1)
+        self.regex = QCheckBox("Regex")
+        lay.addWidget(self.regex)
+        self.facet_buttons = {}
+        for bit, mark, title in FACETS:
+            b = QPushButton(f"{mark} {title}")
+            b.setCheckable(True)
+            b.toggled.connect(self._apply_now)
+            lay.addWidget(b)
+            self.facet_buttons[bit] = b
+        self.text.textChanged.connect(self._changed)
+        self.regex.toggled.connect(self._apply_now)
+        console._filter_timer.timeout.connect(self._show_validity)
+
+    def facets(self):
+        return sum(bit for bit, b in self.facet_buttons.items() if b.isChecked())
+
+    def _changed(self):
+        self.console.set_filter(self.text.text(), self.regex.isChecked(), self.facets())
+
+    def _apply_now(self):
+        self._changed()
+        self.console.apply_filter()
+        self._show_validity()
+
+    def _show_validity(self):
+        bad = False
+        if self.regex.isChecked() and self.text.text():
+            try:
+                re.compile(self.text.text())
+            except re.error as e:
+                bad = True
+                self.text.setToolTip(f"Regex: {e}")
+        self.text.setStyleSheet("QLineEdit { color: #c00; }" if bad else "")
+        if not bad:
+            self.text.setToolTip("")
@@ -1,183 +1,243 @@
 # exchange_worker.py
+#
+# События движка приходят в потоке обмена и не отправляются в GUI по одному:
+# слушатель складывает их в _Pending под замком, а таймер в GUI-потоке
+# UI_RATE_HZ раз в секунду забирает накопленное. Сообщения уходят пачкой,
+# из процентов и диапазонов прогресса доставляется только последнее значение.
+# Поток обмена не ждёт ни очереди событий Qt, ни перерисовки окна.
+# Снимок замеров движка (metrics.py) уходит тем же таймером, но реже —
+# METRICS_RATE_HZ раз в секунду и только если что-то изменилось.
+# Перенос строк сообщения для консоли (console_widget.prewrap) тоже делается
+# здесь, в потоке обмена, — GUI получает готовые строки.
+# Потоки воркеров названы (exchange, fanout-main, queue-main): под этими
+# именами они видны в профиле (bitrix_exchange/profiling.py).
 
-from PyQt5 import QtCore
-import requests
-import zipfile
-import os
+import threading
 import time
-import re
 
-class ExchangeWorker(QtCore.QThread):
-    progress = QtCore.pyqtSignal(str)
+from PyQt5 import QtCore
+
+from console_widget import prewrap
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener
+from bitrix_exchange.fanout import FanOut, summary
+from bitrix_exchange.jobs import JobScheduler
+from bitrix_exchange.log_writer import LogListener
+
+UI_RATE_HZ = 20
+METRICS_RATE_HZ = 4
+
+
+class _Pending:
+    # накопленные события по ключу (номер сайта; у одиночного обмена — 0)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.messages = []   # [(key, msg)] в порядке поступления
+        self.ranges = {}     # key -> (lo, hi), последний
+        self.percents = {}   # key -> value, последний после смены диапазона
+        self.finished = {}   # key -> ok
+        self.done = None     # итог всего воркера, если он уже известен
+
+    def take(self):
+        with self.lock:
+            batch = (self.messages, self.ranges, self.percents, self.finished, self.done)
+            self._reset()
+        return batch
+
+
+class _BufferedListener(ExchangeListener):
+    # вызывается в потоке обмена: только дописывает в _Pending
+    def __init__(self, pending, key=0):
+        self.pending = pending
+        self.key = key
+
+    def message(self, msg):
+        msg = prewrap(msg)
+        with self.pending.lock:
+            self.pending.messages.append((self.key, msg))
+
+    def progress_range(self, lo, hi):
+        with self.pending.lock:
+            self.pending.ranges[self.key] = (lo, hi)
+            # процент, присланный до смены диапазона, уже неактуален
+            self.pending.percents.pop(self.key, None)
+
+    def progress_percent(self, value):
+        with self.pending.lock:
+            self.pending.percents[self.key] = value
+
+    def finished(self, ok):
+        with self.pending.lock:
+            self.pending.finished[self.key] = ok
+
+
+class _CoalescingThread(QtCore.QThread):
+    # общий таймер доставки; наследник раскладывает пачку по своим сигналам
+    def __init__(self):
+        super().__init__()
+        self._pending = _Pending()
+        # объект потока живёт в GUI-потоке, значит и таймер тикает там
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(1000 // UI_RATE_HZ)
+        self._timer.timeout.connect(self._deliver)
+
+    def start(self, *args):
+        self._timer.start()
+        super().start(*args)
+
+    def flush(self):
+        # доставить накопленное немедленно (тесты, закрытие окна)
+        self._deliver()
+
+    def _deliver(self):
+        messages, ranges, percents, finished, done = self._pending.take()
+        self._emit_batch(messages, ranges, percents, finished)
+        if done is not None:
+            self._timer.stop()
+            self._emit_done(*done)
+
+    # хуки-заглушки, как у ExchangeListener: наследник переопределяет нужные
+
+    def _emit_batch(self, messages, ranges, percents, finished):
+        # пачка за тик таймера: сообщения, диапазоны и проценты прогресса, завершённые задачи
+        pass
+
+    def _emit_done(self, *done):
+        # поток закончил работу; done — то, что run() положил в _pending.done
+        pass
+
+
+class ExchangeWorker(_CoalescingThread):
+    progressBatch = QtCore.pyqtSignal(list)
     progressRange = QtCore.pyqtSignal(int, int)
     progressPercent = QtCore.pyqtSignal(int)
+    metrics = QtCore.pyqtSignal(dict)  # RunMetrics.snapshot()
+    finished = QtCore.pyqtSignal(bool)
+
+    def __init__(self, url, login, password, exchange_type, file_path=None, send_file=True,
+                 log_writer=None, **options):
+        # options — дополнительные настройки ExchangeEngine (resume, compress, …)
+        # log_writer — LogWriter: лог в файл пишется из потока воркера, не из GUI
+        super().__init__()
+        listener = _BufferedListener(self._pending)
+        if log_writer:
+            listener = LogListener(log_writer, listener)
+        self.engine = ExchangeEngine(
+            url, login, password, exchange_type, file_path, send_file=send_file,
+            listener=listener,
+            interrupted=self.isInterruptionRequested,
+            **options
+        )
+        self._metrics_version = None
+        self._metrics_sent = 0.0
+
+    def run(self):
+        threading.current_thread().name = 'exchange'
+        ok = self.engine.run()
+        with self._pending.lock:
+            self._pending.done = (ok,)
+
+    def _emit_batch(self, messages, ranges, percents, finished):
+        if 0 in ranges:
+            self.progressRange.emit(*ranges[0])
+        if 0 in percents:
+            self.progressPercent.emit(percents[0])
+        if messages:
+            self.progressBatch.emit([msg for _, msg in messages])
+        now = time.monotonic()
+        if now - self._metrics_sent >= 1 / METRICS_RATE_HZ:
+            self._emit_metrics()
+            self._metrics_sent = now
+
+    def _emit_metrics(self):
+        # run() заводит новый RunMetrics — атрибут движка читаем каждый раз
+        metrics = self.engine.metrics
+        key = (id(metrics), metrics.version)
+        if key != self._metrics_version:
+            self._metrics_version = key
+            self.metrics.emit(metrics.snapshot())
+
+    def _emit_done(self, ok):
+        self._emit_metrics()
+        self.finished.emit(ok)
+
+
+class FanOutWorker(_CoalescingThread):
+    siteMessages = QtCore.pyqtSignal(list)  # [(номер сайта, сообщение)]
+    siteRange = QtCore.pyqtSignal(int, int, int)
+    sitePercent = QtCore.pyqtSignal(int, int)
+    siteFinished = QtCore.pyqtSignal(int, bool)
+    summary = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal(bool)
 
-    def __init__(self, url, login, password, exchange_type, file_path=None, send_file=True):
+    def __init__(self, targets, exchange_type, file_path, concurrency, **options):
         super().__init__()
-        self.url = url.rstrip('/')
-        self.login = login
-        self.password = password
-        self.exchange_type = exchange_type
-        self.file_path = file_path
-        self.send_file = send_file
-        self.exchange_version = '3.1'
+        self.fanout = FanOut(
+            targets, exchange_type, file_path, concurrency=concurrency,
+            listener_factory=lambda index, target: _BufferedListener(self._pending, index),
+            interrupted=self.isInterruptionRequested,
+            **options
+        )
 
     def run(self):
-        session = requests.Session()
-        session.auth = (self.login, self.password)
-        success = False
-        try:
-            # 1. checkauth
-            self.progress.emit("📤 Шаг 1: Авторизация.")
-            params = {'type': self.exchange_type, 'mode': 'checkauth'}
-            resp = session.get(self.url, params=params)
-            self.progress.emit(f"📤 Запрос: GET {resp.url}")
-            self.progress.emit("📥 Ответ сервера:\n" + resp.text.strip())
-            if resp.status_code != 200:
-                self.progress.emit(f"❌ Ошибка: код {resp.status_code} при авторизации")
-                return
-            lines = resp.text.strip().splitlines()
-            if not lines or not lines[0].lower().startswith("success"):
-                self.progress.emit(f"❌ Авторизация не удалась: {resp.text.strip() or '<empty>'}")
-                return
-            sessid = None
-            for ln in lines:
-                if ln.startswith("sessid="):
-                    sessid = ln.split("=", 1)[1]
-                    break
-            if not sessid:
-                self.progress.emit("❌ Ошибка: sessid не найден")
-                return
-
-            # 2–3. для стандартного обмена (send_file=False) пропускаем init и file
-            fname = os.path.basename(self.file_path) if self.file_path else ''
-            if not self.send_file:
-                self.progress.emit("📤 Шаги 2 и 3: пропуск init и file для стандартного обмена")
-                xmls = [fname]
-            else:
-                # 2. init
-                self.progress.emit("📤 Шаг 2: Инициализация.")
-                params = {
-                    'type': self.exchange_type,
-                    'mode': 'init',
-                    'sessid': sessid,
-                    'version': self.exchange_version
-                }
-                resp = session.get(self.url, params=params)
-                self.progress.emit(f"📤 Запрос: GET {resp.url}")
-                self.progress.emit("📥 Ответ сервера:\n" + resp.text.strip())
-                if resp.status_code != 200:
-                    self.progress.emit(f"❌ Ошибка init: код {resp.status_code}")
-                    return
-                init_txt = resp.text.strip().lower()
-                if init_txt.startswith("failure"):
-                    self.progress.emit(f"❌ Init failed: {init_txt}")
-                    return
-                m = re.search(r'file_limit=(\d+)', init_txt)
-                limit = int(m.group(1)) if m else 0
-
-                # 3. file — разбиваем на чанки и отсылаем, эмитим процент
-                total = os.path.getsize(self.file_path)
-                chunk = limit or total
-                bytes_sent = 0
-                with open(self.file_path, 'rb') as f:
-                    while True:
-                        if self.isInterruptionRequested():
-                            self.progress.emit("🛑 Операция прервана пользователем.")
-                            return
-
-                        data = f.read(chunk)
-                        if not data:
-                            break
-                        bytes_sent += len(data)
-                        percent = int(bytes_sent / total * 100)
-                        # обновляем прогресс-бар
-                        self.progressPercent.emit(percent)
-                        self.progress.emit(f"📤 Отправлено {bytes_sent}/{total} байт ({percent}%)")
-                        r = session.post(
-                            self.url,
-                            params={
-                                'type': self.exchange_type,
-                                'mode': 'file',
-                                'filename': fname,
-                                'sessid': sessid,
-                                'version': self.exchange_version
-                            },
-                            data=data
-                        )
-                        self.progress.emit("📥 Ответ сервера:\n" + r.text.strip())
-                        if r.status_code != 200 or not r.text.lower().startswith("success"):
-                            self.progress.emit(f"❌ Ошибка file: {r.text.strip()}")
-                            return
-                # доводим до 100%
-                self.progressPercent.emit(100)
-
-                # собираем список XML внутри ZIP или одиночного файла
-                if fname.lower().endswith('.zip'):
-                    with zipfile.ZipFile(self.file_path, 'r') as z:
-                        xmls = [info.filename for info in z.infolist()
-                                if info.filename.lower().endswith('.xml')]
-                else:
-                    xmls = [fname]
-
-            # упорядочиваем xml: import, catalog, goods…
-            xmls.sort(key=str.lower)
-            ordered = []
-            for k in ('import', 'catalog', 'goods'):
-                for x in xmls:
-                    if x.lower().startswith(k) and x not in ordered:
-                        ordered.append(x)
-            for x in xmls:
-                if x not in ordered:
-                    ordered.append(x)
-            xmls = ordered
-
-            # 4. import — переключаем progressBar в лоадер
-            self.progress.emit("📤 Шаг 4: Импорт данных.")
-            self.progressRange.emit(0, 0)  # лоадер (неопределённый)
-            for xf in xmls:
-                self.progress.emit(
-                    f"📤 Запрос: GET {self.url}"
-                    f"?type={self.exchange_type}&mode=import&filename={xf}&sessid={sessid}&version={self.exchange_version}"
-                )
-                while True:
-                    if self.isInterruptionRequested():
-                        self.progress.emit("🛑 Операция прервана пользователем.")
-                        return
-
-                    r = session.get(
-                        self.url,
-                        params={
-                            'type': self.exchange_type,
-                            'mode': 'import',
-                            'filename': xf,
-                            'sessid': sessid,
-                            'version': self.exchange_version
-                        }
-                    )
-                    self.progress.emit("📥 Ответ сервера:\n" + r.text.strip())
-                    if r.status_code != 200:
-                        self.progress.emit(f"❌ Ошибка import: код {r.status_code}")
-                        return
-                    txt = r.text.strip().lower()
-                    if txt.startswith('progress'):
-                        time.sleep(0.5)
-                        continue
-                    if txt.startswith('success'):
-                        break
-                    self.progress.emit("❌ Ошибка import, прерываем.")
-                    return
-
-            # после импорта возвращаем нормальный диапазон и ставим 100%
-            self.progressRange.emit(0, 100)
-            self.progressPercent.emit(100)
-
-            self.progress.emit("✅ Обмен успешно завершен.")
-            success = True
-
-        except Exception as e:
-            self.progress.emit(f"❌ Неожиданная ошибка: {e}")
-        finally:
-            session.close()
-            self.finished.emit(success)
+        threading.current_thread().name = 'fanout-main'
+        results = self.fanout.run()
+        ok = bool(results) and all(r.ok for r in results)
+        with self._pending.lock:
+            self._pending.done = (ok, summary(results))
+
+    def _emit_batch(self, messages, ranges, percents, finished):
+        for row, (lo, hi) in ranges.items():
+            self.siteRange.emit(row, lo, hi)
+        for row, value in percents.items():
+            self.sitePercent.emit(row, value)
+        if messages:
+            self.siteMessages.emit(messages)
+        for row, ok in finished.items():
+            self.siteFinished.emit(row, ok)
+
+    def _emit_done(self, ok, report):
+        self.summary.emit(report)
+        self.finished.emit(ok)
+
+
+class QueueWorker(_CoalescingThread):
+    # очередь заданий (jobs.py): работает, пока её не остановят
+    jobMessages = QtCore.pyqtSignal(list)   # [(номер задания, сообщение)]
+    jobsChanged = QtCore.pyqtSignal(list)   # JobQueue.snapshot()
+    finished = QtCore.pyqtSignal(bool)
+
+    def __init__(self, queue, concurrency, per_host, watcher=None, enqueue=None, **options):
+        # enqueue(путь, stamp) вызывается из потока очереди для дописанных в папку файлов
+        super().__init__()
+        self.queue = queue
+        self.watcher = watcher
+        self.enqueue = enqueue
+        self.scheduler = JobScheduler(
+            queue, concurrency, per_host,
+            listener_factory=lambda job: _BufferedListener(self._pending, job.id),
+            interrupted=self.isInterruptionRequested,
+            **options
+        )
+        self._version = None
+
+    def run(self):
+        threading.current_thread().name = 'queue-main'
+        self.scheduler.run(self.watcher, self.enqueue)
+        with self._pending.lock:
+            self._pending.done = (True,)
+
+    def wake(self):
+        self.scheduler.wake()
+
+    def _emit_batch(self, messages, ranges, percents, finished):
+        if messages:
+            self.jobMessages.emit(messages)
+        if self.queue.version != self._version:
+            self._version = self.queue.version
+            self.jobsChanged.emit(self.queue.snapshot())
+
+    def _emit_done(self, ok):
+        self.finished.emit(ok)
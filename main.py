@@ -1,114 +1,70 @@
 # main.py
 import sys
 import os
-import textwrap
-from datetime import datetime
+
+# первым: с --startup-timing перехват импортов ставится до всех остальных
+from startup import lazy_import, timing
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLabel, QLineEdit, QPushButton,
     QProgressBar, QFileDialog, QMessageBox, QTabWidget, QVBoxLayout,
-    QGridLayout, QHBoxLayout, QComboBox, QCheckBox, QTreeWidget,
-    QTreeWidgetItem, QAction, QMenu
+    QGridLayout, QHBoxLayout, QComboBox, QCheckBox, QSpinBox, QDoubleSpinBox, QGroupBox,
+    QFormLayout, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QInputDialog
 )
 from PyQt5.QtCore import Qt
-from exchange_worker import ExchangeWorker  # assumes it accepts send_file flag
-
-
-class ConsoleWidget(QTreeWidget):
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        self.setColumnCount(2)
-        self.setHeaderLabels(["Time", "Message"])
-        self.setRootIsDecorated(False)
-        self.setUniformRowHeights(False)
-        self.setAllColumnsShowFocus(True)
-        self.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.customContextMenuRequested.connect(self._show_context_menu)
-        self.filter_text = ""
-        # режим автoраскрытия/сворачивания новых сообщений: 'expand' | 'collapse' | None
-        self._expand_mode = None
-
-    def log(self, msg: str):
-        # проверяем: если сейчас скролл внизу — будем "прилипать"
-        sb = self.verticalScrollBar()
-        at_bottom = (sb.value() == sb.maximum())
-
-        now = datetime.now().strftime("%H:%M:%S")
-        lines = msg.splitlines()
-        first = lines[0] if lines else ""
-        item = QTreeWidgetItem([now, first])
-        # wrap and children
-        for ln in lines[1:]:
-            wrapped = textwrap.wrap(ln, width=120) or [""]
-            for part in wrapped:
-                child = QTreeWidgetItem(["", part])
-                item.addChild(child)
-        self.addTopLevelItem(item)
-        # filter
-        full = "\n".join([item.text(1)] + [item.child(i).text(1) for i in range(item.childCount())])
-        hide = bool(self.filter_text and self.filter_text.lower() not in full.lower())
-        item.setHidden(hide)
-        for i in range(item.childCount()):
-            item.child(i).setHidden(hide)
-
-        # применяем sticky-режим раскрутки
-        if self._expand_mode == 'expand':
-            self.expandAll()
-        elif self._expand_mode == 'collapse':
-            self.collapseAll()
-
-        # если были внизу — скроллим вниз
-        if at_bottom:
-            self.scrollToBottom()
-
-        return item
-
-    def set_filter(self, text: str):
-        self.filter_text = text
-        lower = text.lower()
-        for i in range(self.topLevelItemCount()):
-            it = self.topLevelItem(i)
-            full = "\n".join([it.text(1)] + [it.child(j).text(1) for j in range(it.childCount())])
-            hide = bool(lower and lower not in full.lower())
-            it.setHidden(hide)
-            for j in range(it.childCount()):
-                it.child(j).setHidden(hide)
-
-    def _show_context_menu(self, pos):
-        item = self.itemAt(pos)
-        if not item:
-            return
-        menu = QMenu(self)
-        copy = QAction("Copy Message", self)
-        expand = QAction("Expand All", self)
-        collapse = QAction("Collapse All", self)
-        menu.addAction(copy)
-        menu.addSeparator()
-        menu.addAction(expand)
-        menu.addAction(collapse)
-        act = menu.exec_(self.viewport().mapToGlobal(pos))
-        if act == copy:
-            root = item
-            while root.parent():
-                root = root.parent()
-            parts = [root.text(1)] + [root.child(i).text(1) for i in range(root.childCount())]
-            QApplication.clipboard().setText("\n".join(parts))
-        elif act == expand:
-            self.expandAll()
-            self._expand_mode = 'expand'
-        elif act == collapse:
-            self.collapseAll()
-            self._expand_mode = 'collapse'
+from console_widget import DEFAULT_MAX_ENTRIES, ConsoleWidget, FilterBar, prefixed
+from bitrix_exchange.polling import DEFAULT_MAX_INTERVAL, DEFAULT_MIN_INTERVAL
+from bitrix_exchange.preview import DEFAULT_PREVIEW_CHARS, DEFAULT_SPILL_BYTES, ResponseStore
+
+# сеть (requests), архивы и движок обмена до первого окна не нужны: модули
+# исполняются при первом обращении — по Start или при открытии вкладки
+exchange_worker = lazy_import('exchange_worker')
+connection = lazy_import('bitrix_exchange.connection')
+fanout = lazy_import('bitrix_exchange.fanout')
+history = lazy_import('bitrix_exchange.history')
+jobs = lazy_import('bitrix_exchange.jobs')
+log_writer = lazy_import('bitrix_exchange.log_writer')
+metrics = lazy_import('bitrix_exchange.metrics')
+profiling = lazy_import('bitrix_exchange.profiling')
 
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.worker = None
-        self.log_file = None
+        self.fan_worker = None
+        self.queue_worker = None
+        self._fanout_report = ""
+        # очередь заданий хранится между запусками приложения; читается при первом обращении
+        self._job_queue = None
+        self.log_writer = None
+        self.last_metrics = None
+        # сессии с сайтами живут, пока открыто окно: keep-alive и sessid между запусками
+        self.connections = None
+        # длинные ответы сервера — во временных файлах до закрытия окна
+        self.responses = ResponseStore()
+        # история обменов (SQLite) — открывается при первом запуске или на вкладке "История"
+        self._run_history = None
+        # профили идущих запусков: "exchange", "fanout", "queue" -> (Profiler, таймер beat)
+        self._profiles = {}
         self._init_ui()
         self.setWindowIcon(QtGui.QIcon("resources/c_icon.ico"))
 
+    @property
+    def job_queue(self):
+        # вкладка "Очередь" или "Add to queue" — до этого файл очереди не читается
+        if self._job_queue is None:
+            self._job_queue = jobs.JobQueue()
+            if self._job_queue.load_error:
+                QMessageBox.warning(self, "Очередь", self._job_queue.load_error)
+        return self._job_queue
+
+    @property
+    def run_history(self):
+        if self._run_history is None:
+            self._run_history = history.RunHistory()
+        return self._run_history
+
     def _init_ui(self):
         self.setWindowTitle("1С-Битрикс: Обмен с сайтом")
         self.resize(900, 700)
@@ -119,9 +75,41 @@ class MainWindow(QMainWindow):
 
         self.tabs = QTabWidget()
         main_l.addWidget(self.tabs)
+        # окно показывается с первой вкладкой; остальные строятся при первом открытии
+        # (_ensure_tab) — и когда их поля нужны другой вкладке
+        self._tab_names = []
+        self._tab_pages = {}
+        self._built_tabs = set()
+        for name, title, build in (("standard", "Стандартный обмен", self._build_standard_tab),
+                                   ("upload", "Загрузка файла", self._build_upload_tab),
+                                   ("sites", "Несколько сайтов", self._build_sites_tab),
+                                   ("queue", "Очередь", self._build_queue_tab),
+                                   ("history", "История", self._build_history_tab),
+                                   ("settings", "Дополнительно", self._build_settings_tab)):
+            page = QWidget()
+            self.tabs.addTab(page, title)
+            self._tab_names.append(name)
+            self._tab_pages[name] = (page, build)
+        self._ensure_tab("standard")
+        self.tabs.currentChanged.connect(lambda i: self._ensure_tab(self._tab_names[i]))
+
+    def _ensure_tab(self, name):
+        if name in self._built_tabs:
+            return
+        self._built_tabs.add(name)
+        page, build = self._tab_pages[name]
+        build(page)
+
+    def _console(self):
+        # новая консоль получает текущий предел записей с вкладки "Дополнительно"
+        limit = self.console_limit.value() if "settings" in self._built_tabs else DEFAULT_MAX_ENTRIES
+        return ConsoleWidget(max_entries=limit)
+
+    def _consoles(self):
+        return [c for c in (getattr(self, f"console{n}", None) for n in (1, 2, 4, 5)) if c]
 
-        # --- Tab 1: Стандартный обмен (имя файла только) ---
-        t1 = QWidget()
+    # Tab 1: Стандартный обмен (имя файла только)
+    def _build_standard_tab(self, t1):
         g1 = QGridLayout(t1)
         g1.addWidget(QLabel("URL:"), 0, 0)
         self.url1 = QLineEdit()
@@ -138,23 +126,28 @@ class MainWindow(QMainWindow):
 
         g1.addWidget(QLabel("Exchange Type:"), 3, 0)
         self.type1 = QComboBox()
-        self.type1.addItems(["catalog"]) # self.type1.addItems(["catalog", "sale"]) было, пока скрыл
+        self.type1.addItems(["catalog", "sale"])
         self.type1.setEditable(True)
         g1.addWidget(self.type1, 3, 1, 1, 3)
 
-        g1.addWidget(QLabel("Remote File Name:"), 4, 0)
+        # для sale — не имя на сервере, а куда сохранить заказы с сайта
+        self.filename_label1 = QLabel("Remote File Name:")
+        g1.addWidget(self.filename_label1, 4, 0)
         self.filename1 = QLineEdit()
-        g1.addWidget(self.filename1, 4, 1, 1, 3)
+        g1.addWidget(self.filename1, 4, 1, 1, 2)
+        self.save1 = QPushButton("Save as...")
+        self.save1.setVisible(False)
+        g1.addWidget(self.save1, 4, 3)
 
         g1.addWidget(QLabel("Progress:"), 5, 0)
         self.progress1 = QProgressBar()
         g1.addWidget(self.progress1, 5, 1, 1, 3)
 
+        self.console1 = self._console()
         g1.addWidget(QLabel("Filter:"), 6, 0)
-        self.filter1 = QLineEdit()
+        self.filter1 = FilterBar(self.console1)
         g1.addWidget(self.filter1, 6, 1, 1, 3)
 
-        self.console1 = ConsoleWidget()
         g1.addWidget(self.console1, 7, 0, 4, 4)
 
         btn1 = QHBoxLayout()
@@ -174,10 +167,15 @@ class MainWindow(QMainWindow):
         self.log_b1.setEnabled(False)
         g1.addWidget(self.log_b1, 12, 3)
 
-        self.tabs.addTab(t1, "Стандартный обмен")
+        self.type1.currentTextChanged.connect(self._type1_changed)
+        self.save1.clicked.connect(self._browse_save1)
+        self.start1.clicked.connect(lambda: self._start(tab=1))
+        self.stop1.clicked.connect(lambda: self._stop(tab=1))
+        self.log_b1.clicked.connect(self._browse_log1)
+        self.log_chk1.toggled.connect(lambda v: (self.log_path1.setEnabled(v), self.log_b1.setEnabled(v)))
 
-        # --- Tab 2: Загрузка файла ---
-        t2 = QWidget()
+    # Tab 2: Загрузка файла
+    def _build_upload_tab(self, t2):
         g2 = QGridLayout(t2)
         g2.addWidget(QLabel("URL:"), 0, 0)
         self.url2 = QLineEdit()
@@ -201,65 +199,851 @@ class MainWindow(QMainWindow):
         g2.addWidget(QLabel("File XML/ZIP:"), 4, 0)
         self.file2 = QLineEdit()
         g2.addWidget(self.file2, 4, 1, 1, 2)
+        browse2_l = QHBoxLayout()
         self.browse2 = QPushButton("Browse...")
-        g2.addWidget(self.browse2, 4, 3)
+        # папку (XML + картинки) можно отправить только со сжатием в ZIP
+        self.browse_dir2 = QPushButton("Folder...")
+        browse2_l.addWidget(self.browse2)
+        browse2_l.addWidget(self.browse_dir2)
+        g2.addLayout(browse2_l, 4, 3)
 
-        g2.addWidget(QLabel("Progress:"), 5, 0)
+        g2.addWidget(QLabel("Options:"), 5, 0)
+        opts2 = QHBoxLayout()
+        # докачка: журнал чанков, после сбоя продолжаем с последнего подтверждённого
+        self.resume2 = QCheckBox("Resume interrupted upload")
+        opts2.addWidget(self.resume2)
+        # сжатие в ZIP на лету: архив собирается прямо во время отправки
+        self.zip2 = QCheckBox("Compress to ZIP, level:")
+        opts2.addWidget(self.zip2)
+        self.zip_level2 = QSpinBox()
+        self.zip_level2.setRange(0, 9)
+        self.zip_level2.setValue(6)
+        self.zip_level2.setEnabled(False)
+        opts2.addWidget(self.zip_level2)
+        # предпроверка: XML разбирается у себя, битый пакет не уходит на сайт
+        self.preflight2 = QCheckBox("Check XML before upload")
+        self.preflight2.setChecked(True)
+        opts2.addWidget(self.preflight2)
+        # только изменения с прошлой успешной выгрузки на этот сайт
+        self.delta2 = QCheckBox("Only changes")
+        opts2.addWidget(self.delta2)
+        # файлы (картинки, XML), которые сайт уже принял, не отправляются снова
+        self.skip2 = QCheckBox("Skip unchanged files")
+        opts2.addWidget(self.skip2)
+        # большие XML режутся на части, Битрикс импортирует их по очереди
+        opts2.addWidget(QLabel("Split XML over:"))
+        self.split2 = self._split_spin()
+        opts2.addWidget(self.split2)
+        opts2.addStretch(1)
+        g2.addLayout(opts2, 5, 1, 1, 3)
+
+        g2.addWidget(QLabel("Progress:"), 6, 0)
         self.progress2 = QProgressBar()
-        g2.addWidget(self.progress2, 5, 1, 1, 3)
+        g2.addWidget(self.progress2, 6, 1, 1, 3)
 
-        g2.addWidget(QLabel("Filter:"), 6, 0)
-        self.filter2 = QLineEdit()
-        g2.addWidget(self.filter2, 6, 1, 1, 3)
+        self.console2 = self._console()
+        g2.addWidget(QLabel("Filter:"), 7, 0)
+        self.filter2 = FilterBar(self.console2)
+        g2.addWidget(self.filter2, 7, 1, 1, 3)
 
-        self.console2 = ConsoleWidget()
-        g2.addWidget(self.console2, 7, 0, 4, 4)
+        g2.addWidget(self.console2, 8, 0, 4, 4)
 
         btn2 = QHBoxLayout()
         self.start2 = QPushButton("Start")
         self.stop2 = QPushButton("Stop")
         self.stop2.setEnabled(False)
+        # то же задание — в очередь (вкладка "Очередь"), без ожидания
+        self.queue2 = QPushButton("Add to queue")
         btn2.addWidget(self.start2)
         btn2.addWidget(self.stop2)
-        g2.addLayout(btn2, 11, 0, 1, 4)
+        btn2.addWidget(self.queue2)
+        g2.addLayout(btn2, 12, 0, 1, 4)
 
         self.log_chk2 = QCheckBox("Log to file")
-        g2.addWidget(self.log_chk2, 12, 0)
+        g2.addWidget(self.log_chk2, 13, 0)
         self.log_path2 = QLineEdit()
         self.log_path2.setEnabled(False)
-        g2.addWidget(self.log_path2, 12, 1, 1, 2)
+        g2.addWidget(self.log_path2, 13, 1, 1, 2)
         self.log_b2 = QPushButton("Browse")
         self.log_b2.setEnabled(False)
-        g2.addWidget(self.log_b2, 12, 3)
-
-        self.tabs.addTab(t2, "Загрузка файла")
-
-        # --- Tab 3: Дополнительно ---
-        t3 = QWidget()
-        l3 = QVBoxLayout(t3)
-        l3.addWidget(QLabel("Дополнительный функционал здесь."))
-        self.tabs.addTab(t3, "Дополнительно")
+        g2.addWidget(self.log_b2, 13, 3)
 
-        # --- Connections Tab1 ---
-        self.start1.clicked.connect(lambda: self._start(tab=1))
-        self.stop1.clicked.connect(lambda: self._stop(tab=1))
-        self.log_b1.clicked.connect(self._browse_log1)
-        self.filter1.textChanged.connect(self.console1.set_filter)
-        self.log_chk1.toggled.connect(lambda v: (self.log_path1.setEnabled(v), self.log_b1.setEnabled(v)))
-
-        # --- Connections Tab2 ---
         self.start2.clicked.connect(lambda: self._start(tab=2))
         self.stop2.clicked.connect(lambda: self._stop(tab=2))
         self.browse2.clicked.connect(self._browse2)
+        self.browse_dir2.clicked.connect(self._browse_dir2)
+        self.zip2.toggled.connect(self.zip_level2.setEnabled)
         self.log_b2.clicked.connect(self._browse_log2)
-        self.filter2.textChanged.connect(self.console2.set_filter)
         self.log_chk2.toggled.connect(lambda v: (self.log_path2.setEnabled(v), self.log_b2.setEnabled(v)))
+        self.queue2.clicked.connect(self._queue_tab2)
+
+    # Tab 3: Несколько сайтов (один пакет — на все сайты параллельно)
+    def _build_sites_tab(self, t4):
+        g4 = QGridLayout(t4)
+        # колонки: URL, Login, Password, Progress, Status
+        self.sites4 = QTableWidget(0, 5)
+        self.sites4.setHorizontalHeaderLabels(["URL", "Login", "Password", "Progress", "Status"])
+        self.sites4.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.sites4.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.sites4.setSelectionBehavior(QAbstractItemView.SelectRows)
+        g4.addWidget(self.sites4, 0, 0, 3, 4)
+
+        sites_btn4 = QHBoxLayout()
+        self.add_site4 = QPushButton("Add site")
+        self.remove_site4 = QPushButton("Remove")
+        self.load_sites4 = QPushButton("Load JSON...")
+        sites_btn4.addWidget(self.add_site4)
+        sites_btn4.addWidget(self.remove_site4)
+        sites_btn4.addWidget(self.load_sites4)
+        sites_btn4.addStretch(1)
+        g4.addLayout(sites_btn4, 3, 0, 1, 4)
+
+        g4.addWidget(QLabel("Exchange Type:"), 4, 0)
+        self.type4 = QComboBox()
+        self.type4.addItems(["catalog", "sale"])
+        self.type4.setEditable(True)
+        g4.addWidget(self.type4, 4, 1, 1, 3)
+
+        g4.addWidget(QLabel("File XML/ZIP:"), 5, 0)
+        self.file4 = QLineEdit()
+        g4.addWidget(self.file4, 5, 1, 1, 2)
+        self.browse4 = QPushButton("Browse...")
+        g4.addWidget(self.browse4, 5, 3)
+
+        g4.addWidget(QLabel("Options:"), 6, 0)
+        opts4 = QHBoxLayout()
+        self.zip4 = QCheckBox("Compress to ZIP")
+        opts4.addWidget(self.zip4)
+        self.preflight4 = QCheckBox("Check XML before upload")
+        self.preflight4.setChecked(True)
+        opts4.addWidget(self.preflight4)
+        self.delta4 = QCheckBox("Only changes")
+        opts4.addWidget(self.delta4)
+        self.skip4 = QCheckBox("Skip unchanged files")
+        opts4.addWidget(self.skip4)
+        opts4.addWidget(QLabel("Split XML over:"))
+        self.split4 = self._split_spin()
+        opts4.addWidget(self.split4)
+        opts4.addWidget(QLabel("Sites at once:"))
+        self.concurrency4 = QSpinBox()
+        self.concurrency4.setRange(1, 32)
+        self.concurrency4.setValue(fanout.DEFAULT_CONCURRENCY)
+        opts4.addWidget(self.concurrency4)
+        opts4.addStretch(1)
+        g4.addLayout(opts4, 6, 1, 1, 3)
+
+        self.console4 = self._console()
+        g4.addWidget(QLabel("Filter:"), 7, 0)
+        self.filter4 = FilterBar(self.console4)
+        g4.addWidget(self.filter4, 7, 1, 1, 3)
+
+        g4.addWidget(self.console4, 8, 0, 4, 4)
+
+        btn4 = QHBoxLayout()
+        self.start4 = QPushButton("Start")
+        self.stop4 = QPushButton("Stop")
+        self.stop4.setEnabled(False)
+        btn4.addWidget(self.start4)
+        btn4.addWidget(self.stop4)
+        g4.addLayout(btn4, 12, 0, 1, 4)
+
+        self.add_site4.clicked.connect(lambda: self._add_site_row())
+        self.remove_site4.clicked.connect(self._remove_site_rows)
+        self.load_sites4.clicked.connect(self._load_sites)
+        self.browse4.clicked.connect(self._browse4)
+        self.start4.clicked.connect(self._start_fanout)
+        self.stop4.clicked.connect(self._stop_fanout)
+
+    # Tab 5: Очередь (задания выполняются без оператора, папка выгрузок 1С)
+    def _build_queue_tab(self, t5):
+        g5 = QGridLayout(t5)
+        # колонки: File, Site, Type, Status, Started, Duration, Message
+        self.jobs5 = QTableWidget(0, 7)
+        self.jobs5.setHorizontalHeaderLabels(["File", "Site", "Type", "Status", "Started", "Duration", "Message"])
+        self.jobs5.horizontalHeader().setSectionResizeMode(6, QHeaderView.Stretch)
+        self.jobs5.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.jobs5.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        g5.addWidget(self.jobs5, 0, 0, 4, 4)
+
+        jobs_btn5 = QHBoxLayout()
+        # задание на каждый сайт вкладки "Несколько сайтов" с её настройками
+        self.add_job5 = QPushButton("Add file...")
+        self.retry5 = QPushButton("Retry failed")
+        self.clear5 = QPushButton("Clear finished")
+        self.remove_job5 = QPushButton("Remove")
+        # пароли в файл очереди не пишутся — после перезапуска их вводят заново
+        self.password_job5 = QPushButton("Enter passwords...")
+        for b in (self.add_job5, self.retry5, self.clear5, self.remove_job5, self.password_job5):
+            jobs_btn5.addWidget(b)
+        jobs_btn5.addStretch(1)
+        g5.addLayout(jobs_btn5, 4, 0, 1, 4)
+
+        # дописанный 1С файл ставится в очередь на те же сайты
+        self.watch5 = QCheckBox("Watch folder:")
+        g5.addWidget(self.watch5, 5, 0)
+        self.folder5 = QLineEdit()
+        g5.addWidget(self.folder5, 5, 1, 1, 2)
+        self.browse5 = QPushButton("Browse...")
+        g5.addWidget(self.browse5, 5, 3)
+
+        g5.addWidget(QLabel("Options:"), 6, 0)
+        opts5 = QHBoxLayout()
+        opts5.addWidget(QLabel("File settled for:"))
+        self.settle5 = QDoubleSpinBox()
+        self.settle5.setRange(0.0, 3600.0)
+        self.settle5.setSuffix(" s")
+        self.settle5.setValue(jobs.DEFAULT_SETTLE)
+        opts5.addWidget(self.settle5)
+        opts5.addWidget(QLabel("Jobs at once:"))
+        self.concurrency5 = QSpinBox()
+        self.concurrency5.setRange(1, 32)
+        self.concurrency5.setValue(fanout.DEFAULT_CONCURRENCY)
+        opts5.addWidget(self.concurrency5)
+        opts5.addWidget(QLabel("Per site:"))
+        self.per_host5 = QSpinBox()
+        self.per_host5.setRange(1, 8)
+        self.per_host5.setValue(jobs.DEFAULT_PER_HOST)
+        opts5.addWidget(self.per_host5)
+        opts5.addStretch(1)
+        g5.addLayout(opts5, 6, 1, 1, 3)
+
+        self.console5 = self._console()
+        g5.addWidget(QLabel("Filter:"), 7, 0)
+        self.filter5 = FilterBar(self.console5)
+        g5.addWidget(self.filter5, 7, 1, 1, 3)
+
+        g5.addWidget(self.console5, 8, 0, 4, 4)
+
+        btn5 = QHBoxLayout()
+        self.start5 = QPushButton("Start queue")
+        self.stop5 = QPushButton("Stop queue")
+        self.stop5.setEnabled(False)
+        btn5.addWidget(self.start5)
+        btn5.addWidget(self.stop5)
+        g5.addLayout(btn5, 12, 0, 1, 4)
+
+        self.add_job5.clicked.connect(self._add_jobs)
+        self.retry5.clicked.connect(lambda: self._change_jobs(self.job_queue.retry_failed))
+        self.clear5.clicked.connect(lambda: self._change_jobs(self.job_queue.clear_finished))
+        self.remove_job5.clicked.connect(self._remove_jobs)
+        self.password_job5.clicked.connect(self._enter_job_passwords)
+        self.browse5.clicked.connect(self._browse5)
+        self.start5.clicked.connect(self._start_queue)
+        self.stop5.clicked.connect(self._stop_queue)
+        self._refresh_jobs(self.job_queue.snapshot())
+
+    # Tab 6: История (скорость загрузки и импорта по сайтам, медленные обмены)
+    def _build_history_tab(self, t6):
+        l6 = QVBoxLayout(t6)
+        # по сайту: обычная (медиана) и последняя скорость, ряд последних обменов
+        self.trends6 = QTableWidget(0, 10)
+        self.trends6.setHorizontalHeaderLabels(["Site", "Type", "Runs", "Failed", "Upload MB/s", "Last",
+                                                "Upload trend", "Import s", "Last", "Import trend"])
+        self.trends6.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.trends6.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.trends6.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.trends6.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        l6.addWidget(self.trends6, 1)
+
+        opts6 = QHBoxLayout()
+        self.slow6 = QCheckBox("Only slow runs")
+        opts6.addWidget(self.slow6)
+        opts6.addStretch(1)
+        self.refresh6 = QPushButton("Refresh")
+        opts6.addWidget(self.refresh6)
+        l6.addLayout(opts6)
+
+        # обмены выбранного сайта (или всех), новые сверху; медленные подсвечены
+        self.runs6 = QTableWidget(0, 11)
+        self.runs6.setHorizontalHeaderLabels(["Started", "Site", "Type", "Result", "Duration", "File MB",
+                                              "Sent MB", "Chunks", "Upload MB/s", "Import s", "Slow"])
+        self.runs6.horizontalHeader().setSectionResizeMode(10, QHeaderView.Stretch)
+        self.runs6.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.runs6.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        l6.addWidget(self.runs6, 2)
+
+        self.refresh6.clicked.connect(self._refresh_history)
+        self.slow6.toggled.connect(self._refresh_runs)
+        self.trends6.itemSelectionChanged.connect(self._refresh_runs)
+        self._refresh_history()
+
+    # Tab 4: Дополнительно
+    def _build_settings_tab(self, t3):
+        l3 = QVBoxLayout(t3)
+
+        # опрос mode=import: пауза подстраивается под длительность шага в этих границах
+        poll_box = QGroupBox("Import polling")
+        poll_f = QFormLayout(poll_box)
+        self.poll_min = QDoubleSpinBox()
+        self.poll_min.setRange(0.0, 60.0)
+        self.poll_min.setSingleStep(0.05)
+        self.poll_min.setSuffix(" s")
+        self.poll_min.setValue(DEFAULT_MIN_INTERVAL)
+        poll_f.addRow("Min interval:", self.poll_min)
+        self.poll_max = QDoubleSpinBox()
+        self.poll_max.setRange(0.1, 600.0)
+        self.poll_max.setSuffix(" s")
+        self.poll_max.setValue(DEFAULT_MAX_INTERVAL)
+        poll_f.addRow("Max interval:", self.poll_max)
+        l3.addWidget(poll_box)
+
+        # соединения с сайтами: таймауты, keep-alive между запусками, повторы GET
+        conn_box = QGroupBox("Connection")
+        conn_f = QFormLayout(conn_box)
+        self.connect_timeout = QDoubleSpinBox()
+        self.connect_timeout.setRange(1.0, 120.0)
+        self.connect_timeout.setSuffix(" s")
+        self.connect_timeout.setValue(connection.DEFAULT_CONNECT_TIMEOUT)
+        conn_f.addRow("Connect timeout:", self.connect_timeout)
+        self.read_timeout = QDoubleSpinBox()
+        self.read_timeout.setRange(1.0, 3600.0)
+        self.read_timeout.setSuffix(" s")
+        self.read_timeout.setValue(connection.DEFAULT_READ_TIMEOUT)
+        conn_f.addRow("Read timeout:", self.read_timeout)
+        self.keepalive = QSpinBox()
+        self.keepalive.setRange(0, 3600)
+        self.keepalive.setSuffix(" s")
+        self.keepalive.setValue(int(connection.DEFAULT_IDLE_TIMEOUT))
+        conn_f.addRow("Keep idle connections:", self.keepalive)
+        self.request_retries = QSpinBox()
+        self.request_retries.setRange(0, 20)
+        self.request_retries.setValue(3)
+        conn_f.addRow("Retries (checkauth, init, import):", self.request_retries)
+        self.reuse_sessid = QCheckBox("Reuse sessid between runs")
+        self.reuse_sessid.setChecked(True)
+        conn_f.addRow(self.reuse_sessid)
+        l3.addWidget(conn_box)
+
+        # консоль хранит не больше стольких сообщений, старые вытесняются
+        console_box = QGroupBox("Console")
+        console_f = QFormLayout(console_box)
+        self.console_limit = QSpinBox()
+        self.console_limit.setRange(1000, 1000000)
+        self.console_limit.setSingleStep(10000)
+        self.console_limit.setValue(DEFAULT_MAX_ENTRIES)
+        console_f.addRow("Max entries:", self.console_limit)
+        # ответ сервера в консоли — только начало; целиком — во временном файле,
+        # который читается при раскрытии записи
+        self.response_preview = QSpinBox()
+        self.response_preview.setRange(200, 1000000)
+        self.response_preview.setSingleStep(1000)
+        self.response_preview.setSuffix(" chars")
+        self.response_preview.setValue(DEFAULT_PREVIEW_CHARS)
+        console_f.addRow("Response preview:", self.response_preview)
+        self.response_spill = QSpinBox()
+        self.response_spill.setRange(0, 1024)
+        self.response_spill.setSuffix(" MB")
+        self.response_spill.setSpecialValueText("don't keep")
+        self.response_spill.setValue(DEFAULT_SPILL_BYTES // 1024 // 1024)
+        console_f.addRow("Keep full response up to:", self.response_spill)
+        l3.addWidget(console_box)
+
+        # лог в файл (галочка "Log to file" на вкладках): формат и ротация
+        log_box = QGroupBox("Log file")
+        log_f = QFormLayout(log_box)
+        self.log_format = QComboBox()
+        self.log_format.addItems(log_writer.FORMATS)
+        log_f.addRow("Format:", self.log_format)
+        self.log_max_size = QSpinBox()
+        self.log_max_size.setRange(0, 10000)
+        self.log_max_size.setSuffix(" MB")
+        self.log_max_size.setSpecialValueText("no size rotation")
+        log_f.addRow("Rotate at size:", self.log_max_size)
+        self.log_rotate = QSpinBox()
+        self.log_rotate.setRange(0, 24 * 30)
+        self.log_rotate.setSuffix(" h")
+        self.log_rotate.setSpecialValueText("no time rotation")
+        log_f.addRow("Rotate every:", self.log_rotate)
+        self.log_backups = QSpinBox()
+        self.log_backups.setRange(0, 100)
+        self.log_backups.setValue(log_writer.DEFAULT_BACKUPS)
+        log_f.addRow("Keep old files:", self.log_backups)
+        l3.addWidget(log_box)
+
+        # история обменов: каждый запуск в ~/.bitrix_exchange/history.sqlite,
+        # обмен медленнее обычного для сайта помечается
+        history_box = QGroupBox("Run history")
+        history_f = QFormLayout(history_box)
+        self.record_history = QCheckBox("Record every run")
+        self.record_history.setChecked(True)
+        history_f.addRow(self.record_history)
+        self.slowdown = QDoubleSpinBox()
+        self.slowdown.setRange(1.1, 100.0)
+        self.slowdown.setSingleStep(0.5)
+        self.slowdown.setPrefix("× ")
+        self.slowdown.setValue(2.0)
+        history_f.addRow("Flag runs slower than usual by:", self.slowdown)
+        l3.addWidget(history_box)
+
+        # профиль запуска: стеки всех потоков, зависания GUI, время обработчиков сигналов;
+        # файлы — в ~/.bitrix_exchange/profiles, сводка — в консоль вкладки
+        profile_box = QGroupBox("Profiling")
+        profile_f = QFormLayout(profile_box)
+        self.profile_runs = QCheckBox("Profile next runs")
+        profile_f.addRow(self.profile_runs)
+        self.stall_threshold = QSpinBox()
+        self.stall_threshold.setRange(20, 10000)
+        self.stall_threshold.setSingleStep(50)
+        self.stall_threshold.setSuffix(" ms")
+        self.stall_threshold.setValue(100)
+        profile_f.addRow("Report GUI stalls longer than:", self.stall_threshold)
+        l3.addWidget(profile_box)
+
+        # замеры текущего/последнего обмена на вкладках 1 и 2, обновляются на лету
+        metrics_box = QGroupBox("Exchange metrics")
+        metrics_f = QFormLayout(metrics_box)
+        self.metric_labels = {}
+        for key, title in (("status", "Status:"), ("total", "Total:"), ("connect", "checkauth / init:"),
+                           ("upload", "Upload:"), ("latency", "Chunk response:"),
+                           ("import", "Import:"), ("files", "Per XML:"), ("slowest", "Most time in:")):
+            label = QLabel("—")
+            label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+            self.metric_labels[key] = label
+            metrics_f.addRow(title, label)
+        export_row = QHBoxLayout()
+        self.metrics_json = QPushButton("Export JSON...")
+        self.metrics_prom = QPushButton("Export Prometheus...")
+        for b in (self.metrics_json, self.metrics_prom):
+            b.setEnabled(False)
+            export_row.addWidget(b)
+        export_row.addStretch(1)
+        metrics_f.addRow(export_row)
+        l3.addWidget(metrics_box)
+        l3.addStretch(1)
+
+        self.console_limit.valueChanged.connect(lambda n: [c.set_max_entries(n) for c in self._consoles()])
+        self.metrics_json.clicked.connect(lambda: self._export_metrics(
+            metrics.write_json, "Save metrics", "metrics.json", "JSON (*.json);;All Files (*)"))
+        self.metrics_prom.clicked.connect(lambda: self._export_metrics(
+            metrics.write_prometheus, "Save metrics", "bitrix_exchange.prom", "Prometheus textfile (*.prom);;All Files (*)"))
+
+    def _type1_changed(self, text: str):
+        sale = text.strip().lower() == "sale"
+        self.filename_label1.setText("Save Orders To:" if sale else "Remote File Name:")
+        self.save1.setVisible(sale)
+
+    def _browse_save1(self):
+        f, _ = QFileDialog.getSaveFileName(self, "Save orders", "orders.xml", "XML or ZIP (*.xml *.zip)")
+        if f:
+            self.filename1.setText(f)
+
+    def _split_spin(self):
+        # порог в МБ; 0 — не резать
+        spin = QSpinBox()
+        spin.setRange(0, 100000)
+        spin.setSingleStep(50)
+        spin.setSuffix(" MB")
+        spin.setSpecialValueText("off")
+        return spin
 
     def _browse2(self):
         f, _ = QFileDialog.getOpenFileName(self, "Select file", "", "XML or ZIP (*.xml *.zip)")
         if f:
             self.file2.setText(f)
 
+    def _browse_dir2(self):
+        d = QFileDialog.getExistingDirectory(self, "Select folder with XML and images")
+        if d:
+            self.file2.setText(d)
+            self.zip2.setChecked(True)
+
+    def _browse4(self):
+        f, _ = QFileDialog.getOpenFileName(self, "Select file", "", "XML or ZIP (*.xml *.zip)")
+        if f:
+            self.file4.setText(f)
+
+    def _add_site_row(self, url="", login="", password=""):
+        row = self.sites4.rowCount()
+        self.sites4.insertRow(row)
+        self.sites4.setItem(row, 0, QTableWidgetItem(url))
+        self.sites4.setItem(row, 1, QTableWidgetItem(login))
+        pwd = QLineEdit(password)
+        pwd.setEchoMode(QLineEdit.Password)
+        pwd.setFrame(False)
+        self.sites4.setCellWidget(row, 2, pwd)
+        bar = QProgressBar()
+        bar.setRange(0, 100)
+        bar.setValue(0)
+        self.sites4.setCellWidget(row, 3, bar)
+        status = QTableWidgetItem("")
+        status.setFlags(status.flags() & ~Qt.ItemIsEditable)
+        self.sites4.setItem(row, 4, status)
+
+    def _remove_site_rows(self):
+        for row in sorted({i.row() for i in self.sites4.selectedIndexes()}, reverse=True):
+            self.sites4.removeRow(row)
+
+    def _load_sites(self):
+        f, _ = QFileDialog.getOpenFileName(self, "Select sites list", "", "JSON (*.json)")
+        if not f:
+            return
+        try:
+            targets = fanout.load_targets(f)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Ошибка", f"Список сайтов не прочитан: {e}")
+            return
+        self.sites4.setRowCount(0)
+        for t in targets:
+            self._add_site_row(t.url, t.login, t.password)
+
+    def _site_targets(self):
+        targets = []
+        for row in range(self.sites4.rowCount()):
+            url = (self.sites4.item(row, 0).text() if self.sites4.item(row, 0) else "").strip()
+            login = (self.sites4.item(row, 1).text() if self.sites4.item(row, 1) else "").strip()
+            pwd = self.sites4.cellWidget(row, 2).text().strip()
+            if not all([url, login, pwd]):
+                return None
+            targets.append(fanout.SiteTarget(url, login, pwd))
+        return targets
+
+    def _set_fanout_enabled(self, enabled: bool):
+        for w in (self.sites4, self.add_site4, self.remove_site4, self.load_sites4,
+                  self.type4, self.file4, self.browse4, self.zip4, self.preflight4, self.delta4, self.skip4, self.split4,
+                  self.concurrency4,
+                  self.start4):
+            w.setEnabled(enabled)
+        self.stop4.setEnabled(not enabled)
+
+    def _start_fanout(self):
+        self._ensure_tab("settings")
+        targets = self._site_targets()
+        exch, fp = self.type4.currentText().strip(), self.file4.text().strip()
+        if not targets or not exch or not os.path.isfile(fp):
+            QMessageBox.warning(self, "Error", "Fill URL, login and password for every site and select existing file.")
+            return
+
+        for row in range(self.sites4.rowCount()):
+            bar = self.sites4.cellWidget(row, 3)
+            bar.setRange(0, 100)
+            bar.setValue(0)
+            self.sites4.item(row, 4).setText("⏳")
+        self.console4.clear()
+        self._fanout_report = ""
+        self._set_fanout_enabled(False)
+
+        options = dict(self._upload_options4(), poll_min=self.poll_min.value(), poll_max=self.poll_max.value(),
+                       **self._connection_options())
+        self.fan_worker = exchange_worker.FanOutWorker(targets, exch, fp, self.concurrency4.value(), **options)
+        profile = self._start_profile("fanout")
+        self._connect(profile, self.fan_worker.siteMessages, "siteMessages → _fanout_messages", self._fanout_messages)
+        self._connect(profile, self.fan_worker.siteRange, "siteRange → setRange",
+                      lambda row, lo, hi: self.sites4.cellWidget(row, 3).setRange(lo, hi))
+        self._connect(profile, self.fan_worker.sitePercent, "sitePercent → setValue",
+                      lambda row, v: self.sites4.cellWidget(row, 3).setValue(v))
+        self._connect(profile, self.fan_worker.siteFinished, "siteFinished → _fanout_site_finished",
+                      self._fanout_site_finished)
+        self.fan_worker.summary.connect(self._fanout_summary)
+        self.fan_worker.finished.connect(self._fanout_finish)
+        self.fan_worker.start()
+
+    def _stop_fanout(self):
+        if self.fan_worker:
+            self.fan_worker.requestInterruption()
+
+    def _fanout_messages(self, batch: list):
+        # в общую консоль — с адресом сайта, в таблицу — последняя строка сайта
+        self.console4.log_many([prefixed(f"[{self.sites4.item(row, 0).text()}] ", msg) for row, msg in batch])
+        last = dict(batch)
+        for row, msg in last.items():
+            self.sites4.item(row, 4).setText(msg.splitlines()[0] if msg else "")
+
+    def _fanout_site_finished(self, row: int, ok: bool):
+        bar = self.sites4.cellWidget(row, 3)
+        bar.setRange(0, 100)
+        bar.setValue(100 if ok else bar.value())
+
+    def _fanout_summary(self, text: str):
+        self._fanout_report = text
+        self.console4.log(text)
+
+    def _fanout_finish(self, ok: bool):
+        self._set_fanout_enabled(True)
+        self._finish_profile("fanout", self.console4)
+        self._refresh_history()
+        report = self._fanout_report
+        if ok:
+            QMessageBox.information(self, "Success", report)
+        else:
+            QMessageBox.critical(self, "Error", report or "Exchange finished с ошибками.")
+
+    def _upload_options2(self):
+        return dict(resume=self.resume2.isChecked(),
+                    compress=self.zip2.isChecked(),
+                    compress_level=self.zip_level2.value(),
+                    preflight=self.preflight2.isChecked(),
+                    delta=self.delta2.isChecked(),
+                    skip_unchanged=self.skip2.isChecked(),
+                    split_size=self.split2.value() * 1024 * 1024)
+
+    def _upload_options4(self):
+        return dict(compress=self.zip4.isChecked(), preflight=self.preflight4.isChecked(),
+                    delta=self.delta4.isChecked(), skip_unchanged=self.skip4.isChecked(),
+                    split_size=self.split4.value() * 1024 * 1024)
+
+    def _queue_tab2(self):
+        url, login, pwd = self.url2.text().strip(), self.login2.text().strip(), self.password2.text().strip()
+        exch, fp = self.type2.currentText().strip(), self.file2.text().strip()
+        options = self._upload_options2()
+        if not all([url, login, pwd, exch, fp]) or not (
+                os.path.isfile(fp) or (options['compress'] and os.path.isdir(fp))):
+            QMessageBox.warning(self, "Error", "Fill all fields and select existing file.")
+            return
+        self._change_jobs(lambda: self.job_queue.add(os.path.abspath(fp), url, login, pwd, exch, options))
+        self.console2.log(f"📥 В очередь: {fp} → {url}")
+
+    def _enqueue_for_sites(self, targets, exch, options):
+        # enqueue(путь, stamp) — вызывается и из потока очереди (папка выгрузок)
+        def enqueue(path, stamp=None):
+            for t in targets:
+                self.job_queue.add(path, t.url, t.login, t.password, exch, options, stamp, t.password_env)
+        return enqueue
+
+    def _queue_targets(self):
+        self._ensure_tab("sites")
+        targets = self._site_targets()
+        exch = self.type4.currentText().strip()
+        if not targets or not exch:
+            QMessageBox.warning(self, "Error", "Fill URL, login and password for every site on 'Несколько сайтов'.")
+            return None
+        return self._enqueue_for_sites(targets, exch, self._upload_options4())
+
+    def _add_jobs(self):
+        enqueue = self._queue_targets()
+        if not enqueue:
+            return
+        files, _ = QFileDialog.getOpenFileNames(self, "Select files", "", "XML or ZIP (*.xml *.zip)")
+        if files:
+            self._change_jobs(lambda: [enqueue(os.path.abspath(f)) for f in files])
+
+    def _remove_jobs(self):
+        rows = {i.row() for i in self.jobs5.selectedIndexes()}
+        ids = [self.jobs5.item(row, 0).data(Qt.UserRole) for row in rows]
+        self._change_jobs(lambda: self.job_queue.remove(ids))
+
+    def _enter_job_passwords(self):
+        for url, login in self.job_queue.waiting_for_password():
+            pwd, ok = QInputDialog.getText(self, "Queue", f"Password for {login} @ {url}:", QLineEdit.Password)
+            if not ok:
+                return
+            if pwd:
+                self._change_jobs(lambda: self.job_queue.set_password(url, login, pwd))
+
+    def _change_jobs(self, change):
+        change()
+        if self.queue_worker and self.queue_worker.isRunning():
+            # таблицу обновит воркер; новые задания раздаются сразу
+            self.queue_worker.wake()
+        else:
+            self._refresh_jobs(self.job_queue.snapshot())
+
+    def _browse5(self):
+        d = QFileDialog.getExistingDirectory(self, "Select 1C export folder")
+        if d:
+            self.folder5.setText(d)
+            self.watch5.setChecked(True)
+
+    def _refresh_jobs(self, queued: list):
+        if "queue" not in self._built_tabs:
+            return  # вкладка при постройке покажет очередь сама
+        self.jobs5.setRowCount(len(queued))
+        self.password_job5.setEnabled(any(job.status == jobs.NEEDS_PASSWORD for job in queued))
+        for row, job in enumerate(queued):
+            if job.started:
+                started = QtCore.QDateTime.fromSecsSinceEpoch(int(job.started)).toString("dd.MM HH:mm:ss")
+                duration = f"{(job.finished or QtCore.QDateTime.currentSecsSinceEpoch()) - job.started:.0f} s"
+            else:
+                started = duration = ""
+            cells = (os.path.basename(job.file), job.host, job.exchange_type, job.status, started, duration,
+                     job.message)
+            for col, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if col == 0:
+                    item.setData(Qt.UserRole, job.id)
+                    item.setToolTip(job.file)
+                self.jobs5.setItem(row, col, item)
+
+    def _set_queue_enabled(self, enabled: bool):
+        for w in (self.watch5, self.folder5, self.browse5, self.settle5, self.concurrency5, self.per_host5,
+                  self.start5):
+            w.setEnabled(enabled)
+        self.stop5.setEnabled(not enabled)
+
+    def _start_queue(self):
+        self._ensure_tab("settings")
+        watcher = enqueue = None
+        if self.watch5.isChecked():
+            folder = self.folder5.text().strip()
+            if not os.path.isdir(folder):
+                QMessageBox.warning(self, "Error", "Select existing folder to watch.")
+                return
+            enqueue = self._queue_targets()
+            if not enqueue:
+                return
+            watcher = jobs.FolderWatcher(folder, self.settle5.value())
+        self._set_queue_enabled(False)
+        self.console5.log("▶️ Очередь запущена" + (f", папка {watcher.folder}" if watcher else ""))
+        options = dict(poll_min=self.poll_min.value(), poll_max=self.poll_max.value(),
+                       **self._connection_options())
+        self.queue_worker = exchange_worker.QueueWorker(self.job_queue, self.concurrency5.value(), self.per_host5.value(),
+                                        watcher, enqueue, **options)
+        profile = self._start_profile("queue")
+        self._connect(profile, self.queue_worker.jobMessages, "jobMessages → _job_messages", self._job_messages)
+        self._connect(profile, self.queue_worker.jobsChanged, "jobsChanged → _refresh_jobs", self._refresh_jobs)
+        self.queue_worker.finished.connect(self._queue_finish)
+        self.queue_worker.start()
+
+    def _stop_queue(self):
+        if self.queue_worker:
+            self.queue_worker.requestInterruption()
+            self.queue_worker.wake()
+
+    def _job_messages(self, batch: list):
+        names = {job.id: (os.path.basename(job.file), job.host) for job in self.job_queue.snapshot()}
+        self.console5.log_many([prefixed(f"[#{jid} {' → '.join(names.get(jid, ('?', '?')))}] ", msg)
+                                for jid, msg in batch])
+
+    def _queue_finish(self, ok: bool):
+        self._set_queue_enabled(True)
+        self._refresh_jobs(self.job_queue.snapshot())
+        self._finish_profile("queue", self.console5)
+        self._refresh_history()
+        counts = self.job_queue.counts()
+        self.console5.log(f"⏹ Очередь остановлена: выполнено {counts['done']}, с ошибкой {counts['failed']}, "
+                          f"ждут {counts['pending']}"
+                          + (f", ждут пароля {counts[jobs.NEEDS_PASSWORD]}" if counts[jobs.NEEDS_PASSWORD] else ""))
+
+    def _start_profile(self, key):
+        # None, если на вкладке "Дополнительно" профилирование выключено
+        if not self.profile_runs.isChecked():
+            return None
+        profile = profiling.Profiler(key, stall_threshold=self.stall_threshold.value() / 1000, gui=True)
+        beat = QtCore.QTimer(self)
+        beat.setInterval(int(profiling.BEAT_INTERVAL * 1000))
+        beat.timeout.connect(profile.beat)
+        beat.start()
+        self._profiles[key] = (profile.start(), beat)
+        return profile
+
+    def _connect(self, profile, signal, name, slot):
+        # при профилировании обработчик считает свои вызовы и время
+        signal.connect(profile.timed(name, slot) if profile else slot)
+
+    def _finish_profile(self, key, console):
+        if key not in self._profiles:
+            return
+        profile, beat = self._profiles.pop(key)
+        beat.stop()
+        beat.deleteLater()
+        profile.stop()
+        try:
+            _, _, text = profile.write()
+        except OSError as e:
+            console.log(f"⚠️ Профиль не сохранён: {e}")
+            return
+        console.log(text)
+
+    def _refresh_history(self):
+        if "history" not in self._built_tabs:
+            return  # вкладка при постройке прочитает историю сама
+        try:
+            trends = self.run_history.trends()
+        except history.HistoryError as e:
+            self.trends6.setRowCount(0)
+            self.runs6.setRowCount(0)
+            QMessageBox.warning(self, "History", str(e))
+            return
+        selected = self._history_site()
+        self.trends6.blockSignals(True)
+        self.trends6.setRowCount(len(trends))
+        for row, t in enumerate(trends):
+            cells = (t.site, t.exchange_type, str(t.total), str(t.failed),
+                     _mb(t.median('throughput')), _mb(t.last('throughput')),
+                     history.sparkline(t.series('throughput')),
+                     _sec(t.median('import_seconds')), _sec(t.last('import_seconds')),
+                     history.sparkline(t.series('import_seconds')))
+            for col, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if col == 0:
+                    item.setData(Qt.UserRole, (t.url, t.exchange_type))
+                    item.setToolTip(t.url)
+                if t.last_flags and col in (5, 8):
+                    item.setBackground(QtGui.QColor(255, 220, 200))
+                    item.setToolTip("Последний обмен медленнее обычного: "
+                                    + ", ".join(history.FLAG_NAMES[f] for f in t.last_flags))
+                self.trends6.setItem(row, col, item)
+            if (t.url, t.exchange_type) == selected:
+                self.trends6.selectRow(row)
+        self.trends6.blockSignals(False)
+        self._refresh_runs()
+
+    def _history_site(self):
+        rows = {i.row() for i in self.trends6.selectedIndexes()}
+        return self.trends6.item(rows.pop(), 0).data(Qt.UserRole) if rows else None
+
+    def _refresh_runs(self):
+        url, exch = self._history_site() or (None, None)
+        try:
+            runs = self.run_history.runs(url, exch, limit=200, slow_only=self.slow6.isChecked())
+        except history.HistoryError as e:
+            QMessageBox.warning(self, "History", str(e))
+            return
+        self.runs6.setRowCount(len(runs))
+        for row, r in enumerate(runs):
+            slow = ", ".join(history.FLAG_NAMES[f] for f in r.flag_list)
+            cells = (history.format_time(r.started), r.site, r.exchange_type, "OK" if r.ok else "failed",
+                     _sec(r.elapsed), _mb(r.file_size), _mb(r.bytes_sent), str(r.chunks), _mb(r.throughput),
+                     _sec(r.import_seconds), slow)
+            for col, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                if col == 3 and r.message:
+                    item.setToolTip(r.message)
+                if col == 5 and r.file_hash:
+                    item.setToolTip(f"{r.file}\n{r.file_hash}")
+                if slow:
+                    item.setBackground(QtGui.QColor(255, 220, 200))
+                self.runs6.setItem(row, col, item)
+
+    def _show_metrics(self, snap: dict):
+        def sec(v):
+            return f"{v:.2f} s" if v is not None else "—"
+
+        self.last_metrics = snap
+        m = self.metric_labels
+        phases = snap['phases']
+        if snap['ok'] is None:
+            m['status'].setText(f"running: {snap['phase'] or 'start'}")
+        else:
+            m['status'].setText("OK" if snap['ok'] else "failed")
+        m['total'].setText(f"{sec(snap['elapsed'])}, {snap['requests']} requests, {snap['errors']} errors")
+        m['connect'].setText(f"{sec(phases.get('checkauth'))} / {sec(phases.get('init'))}")
+        up = snap['upload']
+        speed = f"{up['throughput'] / 1024 / 1024:.2f} MB/s" if up['throughput'] else "—"
+        m['upload'].setText(f"{up['bytes'] / 1024 / 1024:.2f} MB in {sec(up['seconds'])} ({speed}), "
+                            f"{up['chunks']} chunks, {up['retries']} retries")
+        lat = up['latency']
+        m['latency'].setText(f"p50 {sec(lat['p50'])}, p95 {sec(lat['p95'])}, max {sec(lat['max'])}")
+        imp = snap['import']
+        m['import'].setText(f"{sec(imp['seconds'])}: server {sec(imp['server'])}, "
+                            f"waiting {sec(imp['wait'])}, {imp['polls']} polls")
+        m['files'].setText("\n".join(f"{name}: {sec(f['seconds'])}, {f['polls']} polls"
+                                     for name, f in imp['files'].items()) or "—")
+        top = metrics.bottleneck(snap)
+        m['slowest'].setText(f"{top[0]} ({top[1] * 100:.0f}%)" if top else "—")
+        self.metrics_json.setEnabled(True)
+        self.metrics_prom.setEnabled(True)
+
+    def _export_metrics(self, write, caption, default, filters):
+        if not self.last_metrics:
+            return
+        f, _ = QFileDialog.getSaveFileName(self, caption, default, filters)
+        if not f:
+            return
+        try:
+            write(f, self.last_metrics)
+        except OSError as e:
+            QMessageBox.warning(self, "Metrics", f"Metrics were not saved: {e}")
+
     def _browse_log1(self):
         f, _ = QFileDialog.getSaveFileName(self, "Select log file", "", "TXT (*.txt);;All Files (*)")
         if f:
@@ -270,21 +1054,40 @@ class MainWindow(QMainWindow):
         if f:
             self.log_path2.setText(f)
 
+    def _connection_options(self):
+        # настройки с вкладки "Дополнительно" действуют со следующего запуска
+        self._ensure_tab("settings")
+        if self.connections is None:
+            self.connections = connection.ConnectionManager()
+        self.connections.idle_timeout = self.keepalive.value()
+        self.connections.sessid_ttl = connection.DEFAULT_SESSID_TTL if self.reuse_sessid.isChecked() else 0
+        self.responses.preview_chars = self.response_preview.value()
+        self.responses.spill_bytes = self.response_spill.value() * 1024 * 1024
+        run_history = None
+        if self.record_history.isChecked():
+            run_history = self.run_history
+            run_history.slowdown = self.slowdown.value()
+        return dict(connections=self.connections, connect_timeout=self.connect_timeout.value(),
+                    read_timeout=self.read_timeout.value(), request_retries=self.request_retries.value(),
+                    responses=self.responses, history=run_history)
+
     def _start(self, tab: int):
+        self._ensure_tab("settings")
         if tab == 1:
             url, login, pwd = self.url1.text().strip(), self.login1.text().strip(), self.password1.text().strip()
             exch, fp = self.type1.currentText().strip(), self.filename1.text().strip()
-            # запретим непредвиденный sale
-            if exch.lower() == "sale":
-                QMessageBox.warning(self, "Ошибка", "‘sale’ пока недоступен в Стандартном обмене")
+            # sale — заказы с сайта в локальный файл
+            if exch.lower() == "sale" and fp and not os.path.isdir(os.path.dirname(os.path.abspath(fp))):
+                QMessageBox.warning(self, "Ошибка", "Папка для файла заказов не найдена.")
                 return
 
             send_file = False
+            options = {}
             console, progress = self.console1, self.progress1
             log_chk, log_path, log_btn = self.log_chk1, self.log_path1, self.log_b1
             ui_disable = (
                 self.url1, self.login1, self.password1,
-                self.type1, self.filename1,
+                self.type1, self.filename1, self.save1,
                 self.start1, log_chk, log_path, log_btn
             )
             stop_btn = self.stop1
@@ -292,29 +1095,37 @@ class MainWindow(QMainWindow):
             url, login, pwd = self.url2.text().strip(), self.login2.text().strip(), self.password2.text().strip()
             exch, fp = self.type2.currentText().strip(), self.file2.text().strip()
             send_file = True
+            options = self._upload_options2()
             console, progress = self.console2, self.progress2
             log_chk, log_path, log_btn = self.log_chk2, self.log_path2, self.log_b2
             ui_disable = (
                 self.url2, self.login2, self.password2,
-                self.type2, self.file2, self.browse2,
+                self.type2, self.file2, self.browse2, self.browse_dir2,
+                self.resume2, self.zip2, self.zip_level2, self.preflight2, self.delta2, self.skip2, self.split2,
                 self.start2, log_chk, log_path, log_btn
             )
             stop_btn = self.stop2
 
-        if not all([url, login, pwd, exch, fp]) or (send_file and not os.path.isfile(fp)):
+        compress = send_file and options.get('compress')
+        if not all([url, login, pwd, exch, fp]) or (
+                send_file and not (os.path.isfile(fp) or (compress and os.path.isdir(fp)))):
             QMessageBox.warning(self, "Error", "Fill all fields and (if uploading) select existing file/name.")
             return
 
-        # open log file
+        # лог в файл пишет отдельный поток, GUI-поток файла не касается
+        self.log_writer = None
         if log_chk.isChecked():
             lp = log_path.text().strip() or "exchange.log"
             try:
-                self.log_file = open(lp, "a", encoding="utf-8")
-                self.log_file.write(f"\n=== {datetime.now():%Y-%m-%d %H:%M:%S} ===\n")
-            except:
-                self.log_file = None
-        else:
-            self.log_file = None
+                self.log_writer = log_writer.LogWriter(lp, self.log_format.currentText(),
+                                            max_bytes=self.log_max_size.value() * 1024 * 1024,
+                                            rotate_interval=self.log_rotate.value() * 3600,
+                                            backups=self.log_backups.value())
+            except OSError as e:
+                QMessageBox.warning(self, "Log", f"Log file is not available: {e}")
+
+        options.update(poll_min=self.poll_min.value(), poll_max=self.poll_max.value(),
+                       **self._connection_options())
 
         # disable UI
         for w in ui_disable:
@@ -325,13 +1136,17 @@ class MainWindow(QMainWindow):
         console.clear()
 
         # start worker
-        self.worker = ExchangeWorker(url, login, pwd, exch, fp, send_file=send_file)
-        # текстовый лог
-        self.worker.progress.connect(lambda m: self._log(m, console))
+        self.worker = exchange_worker.ExchangeWorker(url, login, pwd, exch, fp, send_file=send_file,
+                                     log_writer=self.log_writer, **options)
+        profile = self._start_profile("exchange")
+        # текстовый лог — пачками, не чаще UI_RATE_HZ раз в секунду
+        self._connect(profile, self.worker.progressBatch, "progressBatch → console.log_many", console.log_many)
         # процент заполнения прогрессбара
-        self.worker.progressPercent.connect(progress.setValue)
+        self._connect(profile, self.worker.progressPercent, "progressPercent → setValue", progress.setValue)
         # переключение диапазона (для лоадера на import)
-        self.worker.progressRange.connect(progress.setRange)
+        self._connect(profile, self.worker.progressRange, "progressRange → setRange", progress.setRange)
+        # замеры по шагам — на вкладку "Дополнительно"
+        self._connect(profile, self.worker.metrics, "metrics → _show_metrics", self._show_metrics)
         # по завершении
         self.worker.finished.connect(lambda ok: self._finish(ok, tab))
         # инициализируем прогрессбар в дефолтный диапазон
@@ -343,20 +1158,11 @@ class MainWindow(QMainWindow):
         if self.worker:
             self.worker.requestInterruption()
 
-    def _log(self, msg: str, console):
-        console.log(msg)
-        if self.log_file:
-            try:
-                self.log_file.write(msg + "\n")
-                self.log_file.flush()
-            except:
-                pass
-
     def _finish(self, ok: bool, tab: int):
         if tab == 1:
             ui_enable = (
                 self.url1, self.login1, self.password1,
-                self.type1, self.filename1,
+                self.type1, self.filename1, self.save1,
                 self.start1, self.log_chk1,
                 self.log_path1, self.log_b1
             )
@@ -364,7 +1170,8 @@ class MainWindow(QMainWindow):
         else:
             ui_enable = (
                 self.url2, self.login2, self.password2,
-                self.type2, self.file2, self.browse2,
+                self.type2, self.file2, self.browse2, self.browse_dir2,
+                self.resume2, self.zip2, self.preflight2, self.delta2, self.skip2, self.split2,
                 self.start2, self.log_chk2,
                 self.log_path2, self.log_b2
             )
@@ -373,13 +1180,16 @@ class MainWindow(QMainWindow):
         for w in ui_enable:
             w.setEnabled(True)
         stop_btn.setEnabled(False)
+        if tab == 2:
+            self.zip_level2.setEnabled(self.zip2.isChecked())
 
-        if self.log_file:
-            try:
-                self.log_file.close()
-            except:
-                pass
-            self.log_file = None
+        if self.log_writer:
+            # поток дописывает очередь сам, GUI его не ждёт
+            self.log_writer.close(timeout=0)
+            self.log_writer = None
+        # до окна с итогом: пока оно открыто, профиль писать нечего
+        self._finish_profile("exchange", self.console1 if tab == 1 else self.console2)
+        self._refresh_history()
 
         if ok:
             QMessageBox.information(self, "Success", "Exchange completed successfully.")
@@ -394,23 +1204,49 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "Error", "Exchange finished с ошибками.")
 
     def closeEvent(self, e):
-        if self.worker and self.worker.isRunning():
+        running = [w for w in (self.worker, self.fan_worker, self.queue_worker) if w and w.isRunning()]
+        if running:
             r = QMessageBox.question(self, "Abort?", "Exchange is running. Exit?", QMessageBox.Yes | QMessageBox.No)
             if r != QMessageBox.Yes:
                 e.ignore()
                 return
-            self.worker.requestInterruption()
-            self.worker.wait(2000)
-        if self.log_file:
-            try:
-                self.log_file.close()
-            except:
-                pass
+            for w in running:
+                w.requestInterruption()
+            if self.queue_worker in running:
+                self.queue_worker.wake()
+            for w in running:
+                w.wait(2000)
+        # профиль прерванного запуска тоже сохраняется
+        for key, console in (("exchange", self.console1), ("fanout", getattr(self, 'console4', None)),
+                             ("queue", getattr(self, 'console5', None))):
+            if key in self._profiles:
+                self._finish_profile(key, console)
+        if self.log_writer:
+            self.log_writer.close(timeout=2)
+        if self.connections:
+            self.connections.close()
+        self.responses.cleanup()
         e.accept()
 
 
+def _mb(value):
+    return f"{value / 1024 / 1024:.2f}" if value else "—"
+
+
+def _sec(value):
+    return f"{value:.1f}" if value is not None else "—"
+
+
 if __name__ == "__main__":
+    if timing:
+        timing.mark("импорты main.py")
     app = QApplication(sys.argv)
+    if timing:
+        timing.mark("QApplication")
     w = MainWindow()
+    if timing:
+        timing.mark("MainWindow()")
+        # после первой отрисовки — отчёт и выход
+        timing.watch(w, app)
     w.show()
     sys.exit(app.exec_())
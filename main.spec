@@ -6,7 +6,10 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('resources/c_icon.ico', 'resources')],
-    hiddenimports=[],
+    # main.py грузит их через startup.lazy_import — анализатор их не видит
+    hiddenimports=['exchange_worker', 'bitrix_exchange.connection', 'bitrix_exchange.fanout',
+                   'bitrix_exchange.jobs', 'bitrix_exchange.log_writer', 'bitrix_exchange.metrics',
+                   'bitrix_exchange.history', 'bitrix_exchange.profiling'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
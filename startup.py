@@ -0,0 +1,146 @@
+# startup.py
+# Быстрый запуск GUI: отложенные импорты и замер времени до первого окна.
+#
+# lazy_import возвращает модуль, который исполняется при первом обращении к
+# его атрибуту (importlib.util.LazyLoader). main.py так подключает сетевой и
+# архивный стек — requests, zipfile, движок обмена, воркеры: до первой
+# отрисовки окна они не нужны и грузятся, когда оператор нажимает Start или
+# открывает вкладку, которой они нужны. PyInstaller такие импорты не видит —
+# модули перечислены в hiddenimports в main.spec.
+#
+# StartupTiming (main.py --startup-timing) перехватывает __import__ до
+# импортов main.py, отмечает шаги запуска и после первой отрисовки окна
+# печатает время до неё и цену импорта каждого модуля (с вложенными, как
+# python -X importtime), после чего приложение закрывается. В сборке без
+# консоли отчёт пишется в ~/.bitrix_exchange/startup-timing.txt.
+
+import builtins
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+TIMING_FLAG = '--startup-timing'
+MIN_REPORTED = 0.001    # импорты быстрее миллисекунды в отчёт не попадают
+
+
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class StartupTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.marks = []         # [(шаг, секунд от старта)]
+        self.imports = []       # [(модуль, секунд с вложенными, глубина)] в порядке начала импорта
+        self._depth = 0
+        self._original = None
+        self._watched = None
+        self.report = None
+
+    @classmethod
+    def from_argv(cls, argv):
+        # None, если режим не включён; флаг из argv убирается, Qt его не увидит
+        if TIMING_FLAG not in argv:
+            return None
+        argv.remove(TIMING_FLAG)
+        timing = cls()
+        timing.install()
+        return timing
+
+    # --- импорты ---
+
+    def install(self):
+        self._original = builtins.__import__
+        main = threading.main_thread()
+        resolve = importlib.util.resolve_name
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            full = name
+            if level:
+                try:
+                    full = resolve('.' * level + name, (globals or {}).get('__package__'))
+                except (ImportError, ValueError):
+                    pass
+            if full in sys.modules or threading.current_thread() is not main:
+                return self._original(name, globals, locals, fromlist, level)
+            index = len(self.imports)
+            self.imports.append(None)
+            depth, self._depth = self._depth, self._depth + 1
+            started = time.perf_counter()
+            try:
+                return self._original(name, globals, locals, fromlist, level)
+            finally:
+                self._depth = depth
+                self.imports[index] = (full, time.perf_counter() - started, depth)
+
+        builtins.__import__ = timed_import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    # --- шаги ---
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter() - self.started))
+
+    def watch(self, window, app):
+        # первая отрисовка окна — конец замера: отчёт и выход из цикла событий
+        from PyQt5 import QtCore
+
+        timing = self
+
+        class FirstPaint(QtCore.QObject):
+            def eventFilter(self, obj, event):
+                if event.type() == QtCore.QEvent.Paint:
+                    window.removeEventFilter(self)
+                    timing.mark("первая отрисовка")
+                    timing.finish()
+                    QtCore.QTimer.singleShot(0, app.quit)
+                return False
+
+        self._watched = FirstPaint(window)
+        window.installEventFilter(self._watched)
+
+    def finish(self):
+        self.uninstall()
+        self.report = self.format()
+        if sys.stdout is not None:
+            print(self.report, flush=True)
+        else:
+            from bitrix_exchange.paths import data_dir
+            with open(os.path.join(data_dir(), 'startup-timing.txt'), 'w', encoding='utf-8') as f:
+                f.write(self.report + "\n")
+
+    def format(self):
+        lines = []
+        total = self.marks[-1][1] if self.marks else time.perf_counter() - self.started
+        lines.append(f"⏱ Окно отрисовано через {total:.3f} с после запуска main.py")
+        previous = 0.0
+        for step, at in self.marks:
+            lines.append(f"  {step:<28} {at:7.3f} с  (+{at - previous:.3f})")
+            previous = at
+        imported = [i for i in self.imports if i is not None]
+        top = sum(seconds for _, seconds, depth in imported if depth == 0)
+        lines.append(f"Импорт модулей: {top:.3f} с; мс с вложенными, от импортов main.py вглубь")
+        for name, seconds, depth in imported:
+            if seconds >= MIN_REPORTED:
+                lines.append(f"  {seconds * 1000:8.1f}  {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+# main.py импортирует этот модуль первым: с флагом в argv замер начинается здесь
+timing = StartupTiming.from_argv(sys.argv)
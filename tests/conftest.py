@@ -0,0 +1,146 @@
+# tests/conftest.py
+# Заглушка скрипта обмена Битрикса на локальном http.server: отвечает на
+# checkauth/init/file/import так, как настроит тест, и запоминает запросы.
+
+import os
+import sys
+import threading
+import time
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubBitrix:
+    def __init__(self):
+        self.checkauth = (200, "success\nPHPSESSID\nabc\nsessid=S1\n")
+        self.init = (200, "zip=yes\nfile_limit=0\n")
+        self.init_answers = []   # разовые ответы на init до ответа по умолчанию
+        self.file = (200, "success\n")
+        self.file_redirects = 0  # сколько первых POST ответить 307 на тот же адрес
+        self.file_answers = []   # разовые ответы на POST до ответа по умолчанию
+        # filename -> список ответов import по порядку; последний повторяется
+        self.imports = {}
+        self.query = (200, '<?xml version="1.0" encoding="UTF-8"?><КоммерческаяИнформация/>')
+        self.success = (200, "success\n")
+        self.requests = []  # (method, mode, params)
+        self.chunks = []    # принятые ("success") тела POST mode=file
+        self.url = None
+
+    def respond_import(self, filename):
+        seq = self.imports.get(filename) or [(200, "success\n")]
+        polls = sum(1 for _, mode, p in self.requests if mode == 'import' and p.get('filename') == filename)
+        return seq[min(polls, len(seq)) - 1]
+
+    def modes(self):
+        return [mode for _, mode, _ in self.requests]
+
+    @property
+    def uploaded(self):
+        return b''.join(self.chunks)
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, text):
+            body = text if isinstance(text, bytes) else text.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _params(self):
+            return dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+
+        def do_GET(self):
+            params = self._params()
+            mode = params.get('mode')
+            stub.requests.append(('GET', mode, params))
+            if mode == 'checkauth':
+                self._send(*stub.checkauth)
+            elif mode == 'init':
+                self._send(*(stub.init_answers.pop(0) if stub.init_answers else stub.init))
+            elif mode == 'import':
+                self._send(*stub.respond_import(params.get('filename')))
+            elif mode == 'query':
+                self._send(*stub.query)
+            elif mode == 'success':
+                self._send(*stub.success)
+            else:
+                self._send(400, "failure\nunknown mode")
+
+        def do_POST(self):
+            params = self._params()
+            stub.requests.append(('POST', params.get('mode'), params))
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length)
+            if stub.file_redirects:
+                stub.file_redirects -= 1
+                self.send_response(307)
+                self.send_header('Location', self.path)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status, text = stub.file_answers.pop(0) if stub.file_answers else stub.file
+            if status == 200 and text.startswith('success'):
+                stub.chunks.append(body)
+            self._send(status, text)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@pytest.fixture
+def make_bitrix():
+    # несколько заглушек в одном тесте — например, для fanout по сайтам
+    servers = []
+
+    def make():
+        stub = StubBitrix()
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _handler(stub))
+        thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        servers.append(server)
+        stub.url = f"http://127.0.0.1:{server.server_address[1]}/bitrix/admin/1c_exchange.php"
+        return stub
+
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def bitrix(make_bitrix):
+    return make_bitrix()
+
+
+@pytest.fixture(autouse=True)
+def no_poll_sleep(monkeypatch):
+    # в тестах не ждём между опросами import; time подменяем только в движке
+    import bitrix_exchange.engine
+    fake_time = types.SimpleNamespace(time=time.time, monotonic=time.monotonic,
+                                      perf_counter=time.perf_counter, sleep=lambda s: None)
+    monkeypatch.setattr(bitrix_exchange.engine, 'time', fake_time)
+
+
+@pytest.fixture(autouse=True)
+def data_home(tmp_path_factory, monkeypatch):
+    # история обменов, журналы и очередь — во временном каталоге, не в ~/.bitrix_exchange
+    home = tmp_path_factory.mktemp('home')
+    monkeypatch.setenv('BITRIX_EXCHANGE_HOME', str(home))
+    return home
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    # для тестов GUI-модулей: Qt без дисплея
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
@@ -0,0 +1,63 @@
+import pytest
+
+from bitrix_exchange import cli
+
+
+@pytest.fixture(autouse=True)
+def no_env_password(monkeypatch):
+    monkeypatch.delenv('BITRIX_PASSWORD', raising=False)
+
+
+def test_missing_password_exits_with_2(tmp_path, capsys):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    assert cli.main(['upload', '--url', 'http://x', '--login', 'a', '--file', str(path)]) == 2
+    assert 'BITRIX_PASSWORD' in capsys.readouterr().err
+
+
+def test_missing_file_exits_with_2(tmp_path, capsys):
+    missing = tmp_path / 'nope.xml'
+    rc = cli.main(['upload', '--url', 'http://x', '--login', 'a', '--password', 'p', '--file', str(missing)])
+    assert rc == 2
+    assert 'Файл не найден' in capsys.readouterr().err
+
+
+def test_standard_sale_needs_existing_folder(tmp_path, capsys):
+    rc = cli.main(['standard', '--url', 'http://x', '--login', 'a', '--password', 'p',
+                   '--type', 'sale', '--filename', str(tmp_path / 'none' / 'orders.xml')])
+    assert rc == 2
+    assert 'Папка не найдена' in capsys.readouterr().err
+
+
+def test_password_from_environment(bitrix, monkeypatch):
+    monkeypatch.setenv('BITRIX_PASSWORD', 'p')
+    rc = cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--filename', 'import.xml', '-q'])
+    assert rc == 0
+
+
+def test_upload_success_and_log_file(bitrix, tmp_path, capsys):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x>' + b'<y/>' * 100 + b'</x>')
+    log = tmp_path / 'exchange.log'
+    rc = cli.main(['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p',
+                   '--file', str(path), '--log', str(log), '--stats'])
+    assert rc == 0
+    out = capsys.readouterr()
+    assert "✅ Обмен успешно завершен." in out.out
+    assert '⏱' in out.err
+    assert "✅ Обмен успешно завершен." in log.read_text(encoding='utf-8')
+    assert bitrix.uploaded == path.read_bytes()
+
+
+def test_failed_exchange_exits_with_1(bitrix):
+    bitrix.checkauth = (401, "Unauthorized")
+    rc = cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--password', 'p',
+                   '--filename', 'import.xml', '-q'])
+    assert rc == 1
+
+
+def test_folder_upload_requires_zip(bitrix, tmp_path):
+    (tmp_path / 'import.xml').write_bytes(b'<x/>')
+    base = ['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--file', str(tmp_path), '-q']
+    assert cli.main(base) == 2
+    assert cli.main(base + ['--zip', '--zip-level', '1']) == 0
@@ -0,0 +1,166 @@
+import io
+import tracemalloc
+import zipfile
+
+import pytest
+
+from bitrix_exchange.commerceml import PreflightError, analyze_package, analyze_xml, expected_totals, report
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener
+from bitrix_exchange.fanout import FanOut, SiteTarget
+
+IMPORT_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<КоммерческаяИнформация ВерсияСхемы="2.08">
+  <Классификатор>
+    <Группы>
+      <Группа><Ид>1</Ид><Группы><Группа><Ид>2</Ид></Группа></Группы></Группа>
+    </Группы>
+    <ТипыЦен><ТипЦены><Ид>p</Ид></ТипЦены></ТипыЦен>
+  </Классификатор>
+  <Каталог>
+    <Товары>
+      <Товар><Ид>a</Ид><Группы><Ид>1</Ид></Группы></Товар>
+      <Товар><Ид>b</Ид><Группы><Ид>2</Ид></Группы></Товар>
+      <Товар><Ид>c</Ид></Товар>
+    </Товары>
+  </Каталог>
+</КоммерческаяИнформация>
+'''
+
+OFFERS_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<КоммерческаяИнформация>
+  <ПакетПредложений>
+    <Предложения>
+      <Предложение><Ид>a</Ид><Цены><Цена><ЦенаЗаЕдиницу>1</ЦенаЗаЕдиницу></Цена><Цена/></Цены></Предложение>
+      <Предложение><Ид>b</Ид><Цены><Цена/></Цены></Предложение>
+    </Предложения>
+  </ПакетПредложений>
+</КоммерческаяИнформация>
+'''
+
+
+def test_counts_and_expected_totals(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_text(IMPORT_XML, encoding='utf-8')
+    [st] = analyze_package(str(path))
+    assert (st.name, st.root) == ('import.xml', 'КоммерческаяИнформация')
+    assert (st.groups, st.products, st.offers, st.prices) == (2, 3, 0, 0)
+    assert expected_totals([st]) == {'import.xml': 3}
+    assert report([st])[0].startswith("🔎 import.xml: групп: 2, товаров: 3 (")
+
+
+def test_zip_members_are_read_from_the_archive(tmp_path):
+    path = tmp_path / 'export.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('import.xml', IMPORT_XML)
+        z.writestr('1/offers.xml', OFFERS_XML)
+        z.writestr('images/a.jpg', b'\xff\xd8')
+    stats = analyze_package(str(path))
+    assert [s.name for s in stats] == ['import.xml', '1/offers.xml']
+    assert (stats[1].offers, stats[1].prices) == (2, 3)
+    assert stats[1].size == len(OFFERS_XML.encode('utf-8'))
+
+
+def test_broken_xml_reports_position(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_text(IMPORT_XML.replace('</Товар>\n      <Товар><Ид>c', '</Товары>\n      <Товар><Ид>c'),
+                    encoding='utf-8')
+    with pytest.raises(PreflightError, match=r"import.xml: XML повреждён — mismatched tag: line 12"):
+        analyze_package(str(path))
+
+
+def test_corrupted_zip_member(tmp_path):
+    path = tmp_path / 'export.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as z:
+        z.writestr('import.xml', IMPORT_XML)
+    data = bytearray(path.read_bytes())
+    pos = data.index('Каталог'.encode('utf-8'))
+    data[pos] ^= 1
+    path.write_bytes(bytes(data))
+    with pytest.raises(PreflightError, match="import.xml: архив повреждён"):
+        analyze_package(str(path))
+
+
+def test_memory_does_not_grow_with_the_file(tmp_path):
+    path = tmp_path / 'import.xml'
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<КоммерческаяИнформация><Каталог><Товары>')
+        for i in range(30000):
+            f.write(f'<Товар><Ид>{i}</Ид><Наименование>Товар {i}</Наименование></Товар>')
+        f.write('</Товары></Каталог></КоммерческаяИнформация>')
+    tracemalloc.start()
+    try:
+        [st] = analyze_package(str(path))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert st.products == 30000
+    # без отцепления разобранного дерево заняло бы ~20 МБ
+    assert peak < 1024 * 1024
+
+
+def test_check_can_stop_the_parse():
+    body = '<a>' + '<b/>' * 30000 + '</a>'
+    calls = []
+
+    def check():
+        calls.append(1)
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        analyze_xml(io.BytesIO(body.encode()), 'a.xml', check=check)
+    assert calls == [1]
+
+
+class Percents(ExchangeListener):
+    def __init__(self):
+        self.percents = []
+        self.messages = []
+
+    def progress_percent(self, value):
+        self.percents.append(value)
+
+    def message(self, msg):
+        self.messages.append(msg)
+
+
+def test_broken_package_never_reaches_the_server(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_text(IMPORT_XML[:-40], encoding='utf-8')
+    listener = Percents()
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(path), listener=listener, preflight=True)
+    assert not engine.run()
+    assert bitrix.requests == []
+    assert listener.messages[-1].startswith("❌ Предпроверка: import.xml: XML повреждён")
+
+
+def test_counts_feed_import_progress(bitrix, tmp_path):
+    # сервер шлёт только счётчик — процент считается от числа товаров в файле
+    path = tmp_path / 'import.xml'
+    path.write_text(IMPORT_XML, encoding='utf-8')
+    bitrix.imports['import.xml'] = [(200, "progress\nИмпортировано элементов: 1"),
+                                    (200, "progress\nИмпортировано элементов: 2"), (200, "success\n")]
+    listener = Percents()
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(path), listener=listener, preflight=True)
+    assert engine.run()
+    assert engine.expected_totals == {'import.xml': 3}
+    assert 33 in listener.percents and 66 in listener.percents
+    assert any(m.startswith("🔎 import.xml: групп: 2, товаров: 3") for m in listener.messages)
+    assert 'preflight' in engine.metrics.snapshot()['phases']
+
+
+def test_fanout_checks_once_and_fails_every_site(make_bitrix, tmp_path):
+    stubs = [make_bitrix(), make_bitrix()]
+    path = tmp_path / 'import.xml'
+    path.write_text('<КоммерческаяИнформация>', encoding='utf-8')
+    finished = []
+
+    class Finished(ExchangeListener):
+        def finished(self, ok):
+            finished.append(ok)
+
+    results = FanOut([SiteTarget(s.url, 'a', 'p') for s in stubs], 'catalog', str(path), preflight=True,
+                     listener_factory=lambda i, t: Finished()).run()
+    assert [r.ok for r in results] == [False, False]
+    assert "XML повреждён" in results[0].last_message
+    assert finished == [False, False]
+    assert all(s.requests == [] for s in stubs)
@@ -0,0 +1,96 @@
+import pytest
+
+from bitrix_exchange.connection import ConnectionManager
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.mock_server import MockBitrix
+
+
+@pytest.fixture
+def xml_file(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    return str(path)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _run(bitrix, xml_file, connections, **options):
+    return ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', xml_file, connections=connections, **options).run()
+
+
+def test_second_run_reuses_sessid(bitrix, xml_file):
+    manager = ConnectionManager()
+    assert _run(bitrix, xml_file, manager)
+    bitrix.requests.clear()
+    assert _run(bitrix, xml_file, manager)
+    assert bitrix.modes()[0] == 'init' and 'checkauth' not in bitrix.modes()
+    assert bitrix.requests[0][2]['sessid'] == 'S1'
+
+
+def test_rejected_sessid_falls_back_to_checkauth(bitrix, xml_file):
+    manager = ConnectionManager()
+    assert _run(bitrix, xml_file, manager)
+    bitrix.requests.clear()
+    bitrix.checkauth = (200, "success\nPHPSESSID\nabc\nsessid=S2\n")
+    bitrix.init_answers = [(200, "failure\nОшибка проверки источника")]
+    assert _run(bitrix, xml_file, manager)
+    assert bitrix.modes()[:3] == ['init', 'checkauth', 'init']
+    assert bitrix.requests[-1][2]['sessid'] == 'S2'
+
+
+def test_old_sessid_and_other_password_are_not_reused(bitrix, xml_file):
+    clock = Clock()
+    manager = ConnectionManager(sessid_ttl=600, clock=clock)
+    assert _run(bitrix, xml_file, manager)
+    clock.now += 601
+    bitrix.requests.clear()
+    assert _run(bitrix, xml_file, manager)
+    assert bitrix.modes()[0] == 'checkauth'
+    bitrix.requests.clear()
+    assert ExchangeEngine(bitrix.url, 'a', 'other', 'catalog', xml_file, connections=manager).run()
+    assert bitrix.modes()[0] == 'checkauth'
+
+
+def test_standard_exchange_always_authorizes(bitrix):
+    manager = ConnectionManager()
+    for _ in range(2):
+        assert ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', 'import.xml', send_file=False,
+                              connections=manager).run()
+    assert bitrix.modes().count('checkauth') == 2
+
+
+def test_busy_connection_is_not_shared(bitrix):
+    manager = ConnectionManager()
+    first = manager.acquire(bitrix.url, 'a', 'p')
+    second = manager.acquire(bitrix.url, 'a', 'p')
+    assert second.session is not first.session and not second.pooled
+    manager.release(second)
+    manager.release(first)
+    assert manager.acquire(bitrix.url, 'a', 'p') is first
+
+
+def test_transient_errors_on_get_steps_are_retried(bitrix, xml_file):
+    bitrix.init_answers = [(503, "busy")]
+    bitrix.imports['import.xml'] = [(502, "bad gateway"), (200, "success\n")]
+    assert _run(bitrix, xml_file, None)
+    assert bitrix.modes().count('init') == 2 and bitrix.modes().count('import') == 2
+
+
+def test_keep_alive_connection_survives_between_runs(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    manager = ConnectionManager()
+    with MockBitrix(import_steps=1) as mock:
+        for _ in range(2):
+            assert ExchangeEngine(mock.url, 'admin', 'x', 'catalog', str(path), connections=manager).run()
+        assert mock.stats.connections == 1
+        assert mock.stats.requests['checkauth'] == 1
+        assert ExchangeEngine(mock.url, 'admin', 'x', 'catalog', str(path)).run()
+        assert mock.stats.connections == 2
+    manager.close()
@@ -0,0 +1,212 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('PyQt5.QtWidgets')
+
+from PyQt5.QtWidgets import QApplication  # noqa: E402
+
+from bitrix_exchange.preview import ResponseStore  # noqa: E402
+from console_widget import (  # noqa: E402
+    FACET_ERROR, FACET_REQUEST, FACET_RESPONSE, WRAP_WIDTH, ConsoleWidget, FilterBar, LogModel, facets_of,
+    prefixed, prewrap
+)
+
+
+def _texts(model):
+    return [model.index(i, 1).data() for i in range(model.rowCount())]
+
+
+def test_cap_evicts_oldest_entries(qapp):
+    model = LogModel(max_entries=100)
+    for i in range(1000):
+        model.append(f"msg {i}")
+    assert 90 <= len(model) <= 100
+    assert model.rowCount() == len(model)
+    assert model.index(model.rowCount() - 1, 1).data() == "msg 999"
+    assert model.index(0, 1).data() == f"msg {1000 - len(model)}"
+
+
+def test_children_are_wrapped_only_when_expanded(qapp):
+    model = LogModel()
+    model.append("📥 Ответ\n" + "x" * (WRAP_WIDTH * 2 + 5) + "\nвторая")
+    model.append("📤 следующая")
+    entry = model.entry_at(0)
+    assert model.rowCount() == 2
+    assert entry._children is None
+
+    model.toggle(0)
+    assert _texts(model) == ["📥 Ответ", "x" * WRAP_WIDTH, "x" * WRAP_WIDTH, "xxxxx", "вторая", "📤 следующая"]
+    assert model.index(1, 0).data() == ""
+    assert model.top_row(3) == 0 and model.is_expanded(3)
+
+    model.toggle(4)  # двойной щелчок по строке переноса сворачивает запись
+    assert _texts(model) == ["📥 Ответ", "📤 следующая"]
+
+
+def test_prewrapped_message_is_not_wrapped_again(qapp, monkeypatch):
+    msg = prefixed("[site] ", prewrap("📥 Ответ\n" + "x" * (WRAP_WIDTH + 1)))
+    monkeypatch.setattr('console_widget.wrap_lines', lambda text: pytest.fail("wrapped in GUI"))
+    model = LogModel()
+    model.append(msg)
+    model.toggle(0)
+    assert _texts(model) == ["[site] 📥 Ответ", "x" * WRAP_WIDTH, "x"]
+
+
+def test_full_response_is_loaded_only_when_opened(qapp, tmp_path):
+    body = "\n".join(f"строка {i}" for i in range(5000))
+    msg = "📥 Ответ сервера:\n" + ResponseStore(200, directory=str(tmp_path)).preview(body)
+    model = LogModel()
+    model.expand_new = True
+    model.append(msg)
+    entry = model.entry_at(0)
+    # автораскрытие показывает только начало, файл не читается
+    assert entry.spill and not entry.full
+    preview_rows = model.rowCount()
+    assert preview_rows < 50
+
+    model.toggle(0)
+    model.toggle(0)
+    for _ in range(200):
+        QApplication.processEvents()
+        if entry.full:
+            break
+        time.sleep(0.01)
+    assert entry.full
+    texts = _texts(model)
+    assert texts[0] == "📥 Ответ сервера:" and texts[1:5001] == body.splitlines()
+    assert texts[-1].endswith(entry.spill)
+
+    model.toggle(0)
+    assert model.rowCount() == 1 and entry._children is None
+
+
+def test_eviction_drops_expanded_children(qapp):
+    model = LogModel(max_entries=10)
+    model.expand_new = True
+    for i in range(25):
+        model.append(f"msg {i}\nchild {i}")
+    assert model.rowCount() == 2 * len(model)
+    assert _texts(model)[-2:] == ["msg 24", "child 24"]
+    assert model.is_child_row(1) and not model.is_child_row(0)
+
+
+def test_filter_and_new_entries(qapp):
+    model = LogModel()
+    for text in ("📤 Отправлено 1", "📥 Ответ\nsuccess", "❌ Ошибка file: failure"):
+        model.append(text)
+    model.set_filter("SUCCESS")
+    assert _texts(model) == ["📥 Ответ"]
+    model.append("📥 ещё success")
+    model.append("📤 не подходит")
+    assert model.rowCount() == 2
+    model.set_filter("")
+    assert model.rowCount() == 5
+
+
+def test_set_max_entries_keeps_newest(qapp):
+    model = LogModel(max_entries=100)
+    for i in range(80):
+        model.append(f"msg {i}")
+    model.set_max_entries(10)
+    assert len(model) == 10
+    assert model.index(0, 1).data() == "msg 70"
+
+
+def test_widget_expands_only_new_entry_in_sticky_mode(qapp):
+    console = ConsoleWidget(max_entries=1000)
+    for i in range(50):
+        console.log(f"msg {i}\nchild {i}")
+    console._expand_mode = 'expand'
+    row = console.log("new\nchild")
+    model = console.log_model
+    assert model.is_expanded(row)
+    assert model.rowCount() == 52
+    # раскрыта только новая запись — перенос остальных не считался
+    assert model.entry_at(0)._children is None
+
+    console.expandAll()
+    assert model.rowCount() == 102
+    console.collapseAll()
+    assert model.rowCount() == 51
+    console.clear()
+    assert model.rowCount() == 0
+
+
+def _sample_model():
+    model = LogModel()
+    for text in ("📤 Шаг 1: Авторизация.", "📤 Запрос: GET http://x/?mode=checkauth",
+                 "📥 Ответ сервера:\nsuccess\nPHPSESSID", "❌ Ошибка file: failure\n📥 внутри тела",
+                 "⏳ import.xml: Обработано 1500 из 20000"):
+        model.append(text)
+    return model
+
+
+def test_facets_are_taken_from_first_line():
+    assert facets_of("❌ Ошибка\n📥 тело") == FACET_ERROR
+    assert facets_of("[a.ru] 📤 Запрос") == FACET_REQUEST
+    assert facets_of("⏳ импорт") == 0
+
+
+def test_facet_filter(qapp):
+    model = _sample_model()
+    model.set_filter(facets=FACET_ERROR | FACET_RESPONSE)
+    assert _texts(model) == ["📥 Ответ сервера:", "❌ Ошибка file: failure"]
+    model.set_filter("checkauth", facets=FACET_REQUEST)
+    assert _texts(model) == ["📤 Запрос: GET http://x/?mode=checkauth"]
+
+
+def test_regex_filter_and_invalid_pattern(qapp):
+    model = _sample_model()
+    model.set_filter(r"обработано \d+ из", regex=True)
+    assert _texts(model) == ["⏳ import.xml: Обработано 1500 из 20000"]
+    with pytest.raises(Exception):
+        model.set_filter("(", regex=True)
+    assert _texts(model) == ["⏳ import.xml: Обработано 1500 из 20000"]
+
+
+def test_narrowing_filter_matches_full_scan(qapp):
+    model = _sample_model()
+    model.set_filter("ш")
+    model.set_filter("шаг")
+    narrowed = _texts(model)
+    model.set_filter("")
+    model.set_filter("шаг")
+    assert narrowed == _texts(model) == ["📤 Шаг 1: Авторизация."]
+    model.append("📤 Шаг 2: Инициализация.")
+    model.append("📤 шагомер")
+    model.set_filter("шаг 2")
+    assert _texts(model) == ["📤 Шаг 2: Инициализация."]
+
+
+def test_filter_input_is_debounced(qapp):
+    console = ConsoleWidget()
+    bar = FilterBar(console)
+    for text in ("📤 Запрос", "❌ Ошибка"):
+        console.log(text)
+    bar.text.setText("оши")
+    assert console.log_model.rowCount() == 2  # ещё не применён
+    assert console._filter_timer.isActive()
+    console.apply_filter()
+    assert _texts(console.log_model) == ["❌ Ошибка"]
+
+    bar.regex.setChecked(True)
+    bar.text.setText("[")
+    assert console.apply_filter() is False
+    bar._show_validity()
+    assert "color" in bar.text.styleSheet()
+    bar.text.setText("")
+    bar.facet_buttons[FACET_REQUEST].setChecked(True)  # фасет применяется сразу
+    assert _texts(console.log_model) == ["📤 Запрос"]
+
+
+def test_extend_is_one_insert_and_respects_cap(qapp):
+    model = LogModel(max_entries=10)
+    inserts = []
+    model.rowsInserted.connect(lambda parent, first, last: inserts.append((first, last)))
+    model.extend([f"a{i}" for i in range(4)])
+    model.extend([f"b{i}" for i in range(25)])
+    assert inserts == [(0, 3), (0, 9)]
+    assert _texts(model) == [f"b{i}" for i in range(15, 25)]
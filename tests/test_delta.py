@@ -0,0 +1,169 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+from bitrix_exchange import cli
+from bitrix_exchange.delta import READ_BLOCK, DeltaIndex, build_delta, make_delta
+from bitrix_exchange.engine import ExchangeEngine
+
+
+def catalog(products, date='2024-01-01T10:00:00', indent='\n      '):
+    items = ''.join(f'{indent}<Товар><Ид>{pid}</Ид><Наименование>{name}</Наименование></Товар>'
+                    for pid, name in products)
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<КоммерческаяИнформация ВерсияСхемы="2.08" ДатаФормирования="{date}">\n'
+            f'  <Классификатор><Группы><Группа><Ид>g1</Ид><Наименование>Обувь &amp; сумки</Наименование>'
+            f'</Группа></Группы></Классификатор>\n'
+            f'  <Каталог СодержитТолькоИзменения="false"><Ид>c1</Ид><Товары>{items}\n    </Товары></Каталог>\n'
+            f'</КоммерческаяИнформация>\n')
+
+
+def offers(prices):
+    items = ''.join(f'<Предложение><Ид>{oid}</Ид><Цены><Цена><ЦенаЗаЕдиницу>{price}</ЦенаЗаЕдиницу>'
+                    f'</Цена></Цены></Предложение>' for oid, price in prices)
+    return ('<КоммерческаяИнформация><ПакетПредложений><Предложения>'
+            f'{items}</Предложения></ПакетПредложений></КоммерческаяИнформация>')
+
+
+def delta(text, old, name='import.xml'):
+    out = io.BytesIO()
+    stats, index = make_delta(io.BytesIO(text.encode('utf-8')), out, name, old)
+    return stats, index, ET.fromstring(out.getvalue())
+
+
+PRODUCTS = [(f'p{i}', f'Товар {i}') for i in range(10)]
+
+
+def test_first_run_sends_everything():
+    stats, index, root = delta(catalog(PRODUCTS), None)
+    assert stats.full and stats.total == 10
+    assert len(root.findall('./Каталог/Товары/Товар')) == 10
+    assert root.find('Каталог').get('СодержитТолькоИзменения') == 'false'
+    assert root.find('.//Группа/Наименование').text == 'Обувь & сумки'
+    assert len(index) == 11  # 10 товаров и хэш остального
+
+
+def test_source_bytes_are_kept_as_is():
+    text = catalog(PRODUCTS).replace('UTF-8', 'windows-1251')
+    out = io.BytesIO()
+    make_delta(io.BytesIO(text.encode('cp1251')), out, 'import.xml', None)
+    assert out.getvalue() == text.encode('cp1251')
+
+
+def test_small_read_blocks_give_the_same_package(monkeypatch):
+    _, old, _ = delta(catalog(PRODUCTS), None)
+    new = catalog(PRODUCTS[1:5] + [('p5', 'Новое имя')] + PRODUCTS[6:], date='2024-02-01T10:00:00')
+    _, _, expected = delta(new, old)
+    monkeypatch.setattr('bitrix_exchange.delta.READ_BLOCK', 7)
+    stats, _, root = delta(new, old)
+    assert (stats.changed, stats.removed) == (1, 1)
+    assert ET.tostring(root) == ET.tostring(expected)
+
+
+def test_only_changes_and_removals_are_sent():
+    _, old, _ = delta(catalog(PRODUCTS), None)
+    new = PRODUCTS[1:5] + [('p5', 'Новое имя')] + PRODUCTS[6:] + [('p10', 'Товар 10')]
+    # другая дата формирования и отступы — не изменения
+    stats, index, root = delta(catalog(new, date='2024-02-01T10:00:00', indent='\n'), old)
+    assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (1, 1, 1, 8)
+    assert not stats.skeleton_changed
+    assert root.find('Каталог').get('СодержитТолькоИзменения') == 'true'
+    items = root.findall('./Каталог/Товары/Товар')
+    assert [(t.findtext('Ид'), t.get('Статус')) for t in items] == [('p5', None), ('p10', None), ('p0', 'Удален')]
+    assert root.find('Классификатор') is not None
+    assert ('Товар', 'p0') not in index and ('Товар', 'p10') in index
+
+
+def test_empty_list_gets_removal_stubs(monkeypatch):
+    _, old, _ = delta(catalog(PRODUCTS[:3]), None)
+    # все товары убрали — 1С выгружает пустой список самозакрывающимся тегом
+    empty = catalog([]).replace('<Товары>\n    </Товары>', '<Товары />')
+    for block in (READ_BLOCK, 5):
+        monkeypatch.setattr('bitrix_exchange.delta.READ_BLOCK', block)
+        stats, index, root = delta(empty, old)
+        assert stats.removed == 3 and stats.has_changes
+        items = root.findall('./Каталог/Товары/Товар')
+        assert [(t.findtext('Ид'), t.get('Статус')) for t in items] == [(f'p{i}', 'Удален') for i in range(3)]
+        assert root.findtext('Каталог/Ид') == 'c1' and ('Товар', 'p0') not in index
+    # удалять нечего — тег остаётся как был
+    _, empty_index, _ = delta(empty, None)
+    out = io.BytesIO()
+    make_delta(io.BytesIO(empty.encode('utf-8')), out, 'import.xml', empty_index)
+    assert '<Товары />' in out.getvalue().decode('utf-8')
+
+
+def test_unchanged_file_has_no_changes_but_classifier_counts():
+    _, old, _ = delta(catalog(PRODUCTS), None)
+    stats, _, root = delta(catalog(PRODUCTS), old)
+    assert not stats.has_changes
+    assert root.findall('./Каталог/Товары/Товар') == []
+    stats, _, _ = delta(catalog(PRODUCTS).replace('Обувь', 'Одежда'), old)
+    assert stats.skeleton_changed and stats.has_changes
+
+
+def test_offer_price_change():
+    _, old, _ = delta(offers([('o1', 10), ('o2', 20)]), None, 'offers.xml')
+    stats, _, root = delta(offers([('o1', 10), ('o2', 25)]), old, 'offers.xml')
+    assert (stats.changed, stats.unchanged) == (1, 1)
+    assert [o.findtext('Ид') for o in root.iter('Предложение')] == ['o2']
+    assert root.find('ПакетПредложений').get('СодержитТолькоИзменения') == 'true'
+
+
+def test_zip_package_keeps_other_files(tmp_path):
+    path = tmp_path / 'export.zip'
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('import.xml', catalog(PRODUCTS))
+        z.writestr('import_files/a.jpg', b'\xff\xd8jpeg')
+    index = DeltaIndex('http://x', 'catalog', directory=str(tmp_path / 'idx'))
+    package = build_delta(str(path), False, index)
+    try:
+        assert not package.single
+        assert [name for name, _ in package.entries] == ['import.xml', 'import_files/a.jpg']
+        with open(package.entries[1][1], 'rb') as f:
+            assert f.read() == b'\xff\xd8jpeg'
+        package.commit()
+    finally:
+        package.cleanup()
+    assert index.load('import.xml')[('Товар', 'p3')]
+    assert index.load('offers.xml') is None
+
+
+def _engine(bitrix, path, index):
+    return ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(path), delta=True, delta_index=index)
+
+
+def test_engine_sends_delta_and_commits_only_on_success(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    index = DeltaIndex(bitrix.url, 'catalog', directory=str(tmp_path / 'idx'))
+    path.write_text(catalog(PRODUCTS * 1), encoding='utf-8')
+    assert _engine(bitrix, path, index).run()
+    full = len(bitrix.uploaded)
+
+    # ничего не изменилось — к сайту даже не обращаемся
+    bitrix.requests.clear()
+    assert _engine(bitrix, path, index).run()
+    assert bitrix.requests == []
+
+    path.write_text(catalog(PRODUCTS[:9] + [('p9', 'Другое имя')]), encoding='utf-8')
+    bitrix.checkauth = (401, "Unauthorized")
+    assert not _engine(bitrix, path, index).run()
+    # неудачный обмен индекс не трогает — изменение уйдёт в следующий раз
+    bitrix.checkauth = (200, "success\nPHPSESSID\nabc\nsessid=S1\n")
+    bitrix.chunks.clear()
+    engine = _engine(bitrix, path, index)
+    assert engine.run()
+    sent = ET.fromstring(bitrix.uploaded)
+    assert [t.findtext('Наименование') for t in sent.iter('Товар')] == ['Другое имя']
+    assert len(bitrix.uploaded) < full / 2
+    assert engine.expected_totals == {'import.xml': 1}
+
+
+def test_cli_delta_flag(bitrix, tmp_path, monkeypatch):
+    monkeypatch.setenv('BITRIX_EXCHANGE_HOME', str(tmp_path / 'home'))
+    path = tmp_path / 'import.xml'
+    path.write_text(catalog(PRODUCTS), encoding='utf-8')
+    args = ['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--file', str(path), '--delta', '-q']
+    assert cli.main(args) == 0
+    bitrix.requests.clear()
+    assert cli.main(args) == 0
+    assert bitrix.requests == []
@@ -0,0 +1,384 @@
+import io
+import os
+import threading
+import zipfile
+
+import pytest
+
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener, order_xmls
+
+
+class Recorder(ExchangeListener):
+    def __init__(self):
+        self.messages = []
+        self.percents = []
+        self.ranges = []
+        self.result = None
+
+    def message(self, msg):
+        self.messages.append(msg)
+
+    def progress_range(self, lo, hi):
+        self.ranges.append((lo, hi))
+
+    def progress_percent(self, value):
+        self.percents.append(value)
+
+    def finished(self, ok):
+        self.result = ok
+
+    @property
+    def last(self):
+        return self.messages[-1]
+
+
+def run_engine(bitrix, path, send_file=True, **kw):
+    rec = Recorder()
+    engine = ExchangeEngine(bitrix.url, 'admin', 'secret', 'catalog', str(path),
+                            send_file=send_file, listener=rec, **kw)
+    ok = engine.run()
+    assert rec.result is ok
+    return ok, rec, engine
+
+
+@pytest.fixture
+def xml_file(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(bytes(range(256)) * 10)  # 2560 байт
+    return path
+
+
+def test_order_xmls_puts_import_catalog_goods_first():
+    xmls = ['offers.xml', 'Goods.xml', 'prices.xml', 'catalog_1.xml', 'import.xml', 'import0_1.xml']
+    assert order_xmls(xmls) == [
+        'import.xml', 'import0_1.xml', 'catalog_1.xml', 'Goods.xml', 'offers.xml', 'prices.xml'
+    ]
+
+
+def test_order_xmls_keeps_duplicates_out():
+    assert order_xmls(['b.xml', 'a.xml', 'import.xml']) == ['import.xml', 'a.xml', 'b.xml']
+
+
+def test_upload_sends_file_limit_chunks_and_imports(bitrix, xml_file):
+    bitrix.init = (200, "zip=yes\nfile_limit=1000\n")
+    bitrix.imports['import.xml'] = [(200, "progress\nшаг 1"), (200, "progress\nшаг 2"), (200, "success\n")]
+
+    ok, rec, _ = run_engine(bitrix, xml_file)
+
+    assert ok
+    assert bitrix.modes() == ['checkauth', 'init', 'file', 'file', 'file', 'import', 'import', 'import']
+    assert [len(c) for c in bitrix.chunks] == [1000, 1000, 560]
+    assert bitrix.uploaded == xml_file.read_bytes()
+    _, _, file_params = bitrix.requests[2]
+    assert file_params == {'type': 'catalog', 'mode': 'file', 'filename': 'import.xml',
+                           'sessid': 'S1', 'version': '3.1'}
+    assert 'sessid' not in bitrix.requests[0][2]
+    assert rec.percents[:3] == [39, 78, 100]
+    assert rec.ranges == [(0, 0), (0, 100)]
+    assert rec.last == "✅ Обмен успешно завершен."
+
+
+def test_upload_without_file_limit_sends_one_chunk(bitrix, xml_file):
+    ok, _, _ = run_engine(bitrix, xml_file)
+    assert ok
+    assert bitrix.chunks == [xml_file.read_bytes()]
+
+
+def test_zip_members_are_imported_in_order(bitrix, tmp_path):
+    path = tmp_path / 'package.zip'
+    with zipfile.ZipFile(path, 'w') as z:
+        for name in ('offers.xml', 'import.xml', 'images/1.jpg', 'prices.xml'):
+            z.writestr(name, b'<x/>')
+
+    ok, _, _ = run_engine(bitrix, path)
+
+    assert ok
+    imported = [p['filename'] for _, mode, p in bitrix.requests if mode == 'import']
+    assert imported == ['import.xml', 'offers.xml', 'prices.xml']
+
+
+def test_standard_exchange_skips_init_and_file(bitrix):
+    ok, _, _ = run_engine(bitrix, 'import.xml', send_file=False)
+    assert ok
+    assert bitrix.modes() == ['checkauth', 'import']
+    assert bitrix.requests[1][2]['filename'] == 'import.xml'
+
+
+def test_second_run_does_not_send_stale_sessid(bitrix):
+    engine = ExchangeEngine(bitrix.url, 'admin', 'secret', 'catalog', 'import.xml', send_file=False)
+    assert engine.run()
+    bitrix.checkauth = (200, "success\nPHPSESSID\nabc\nsessid=S2\n")
+    assert engine.run()
+    checkauths = [p for _, mode, p in bitrix.requests if mode == 'checkauth']
+    assert all('sessid' not in p for p in checkauths)
+    assert bitrix.requests[-1][2]['sessid'] == 'S2'
+
+
+@pytest.mark.parametrize('checkauth, expected, attempts', [
+    # 5xx повторяется, как и другие временные ошибки (3 повтора по умолчанию)
+    ((500, "boom"), "❌ Ошибка: код 500 при авторизации", 4),
+    ((200, "failure\nbad password"), "❌ Авторизация не удалась: failure\nbad password", 1),
+    ((200, "success\nPHPSESSID\nabc\n"), "❌ Ошибка: sessid не найден", 1),
+])
+def test_checkauth_failures(bitrix, xml_file, checkauth, expected, attempts):
+    bitrix.checkauth = checkauth
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert not ok
+    assert rec.last == expected
+    assert bitrix.modes() == ['checkauth'] * attempts
+
+
+@pytest.mark.parametrize('init, expected', [
+    ((503, "busy"), "❌ Ошибка init: код 503"),
+    ((200, "failure\nno rights"), "❌ Init failed: failure\nno rights"),
+])
+def test_init_failures(bitrix, xml_file, init, expected):
+    bitrix.init = init
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert not ok
+    assert rec.last == expected
+    assert 'file' not in bitrix.modes()
+
+
+def test_file_failure_stops_upload(bitrix, xml_file):
+    bitrix.init = (200, "file_limit=1000\n")
+    bitrix.file = (200, "failure\ndisk full")
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert not ok
+    assert rec.last == "❌ Ошибка file: failure\ndisk full"
+    assert bitrix.modes().count('file') == 1
+    assert 'import' not in bitrix.modes()
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ((500, "error"), "❌ Ошибка import: код 500"),
+    ((200, "failure\nbad xml"), "❌ Ошибка import, прерываем."),
+])
+def test_import_failures(bitrix, xml_file, answer, expected):
+    bitrix.imports['import.xml'] = [(200, "progress\n"), answer]
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert not ok
+    assert rec.last == expected
+    assert rec.ranges == [(0, 0)]
+
+
+def test_unreachable_server_reports_unexpected_error(xml_file):
+    rec = Recorder()
+    engine = ExchangeEngine('http://127.0.0.1:9/', 'admin', 'secret', 'catalog', str(xml_file), listener=rec)
+    assert not engine.run()
+    assert rec.last.startswith("❌ Неожиданная ошибка:")
+
+
+def test_interruption_before_upload(bitrix, xml_file):
+    ok, rec, _ = run_engine(bitrix, xml_file, interrupted=lambda: True)
+    assert not ok
+    assert rec.last == "🛑 Операция прервана пользователем."
+    assert 'file' not in bitrix.modes()
+
+
+def test_stop_during_preparation_sends_nothing(bitrix, xml_file):
+    ok, _, _ = run_engine(bitrix, xml_file, interrupted=lambda: True)
+    assert not ok and bitrix.modes() == []
+
+
+def test_stop_after_checkauth_does_not_send_init(bitrix, xml_file):
+    # Stop нажали, пока шёл checkauth
+    ok, rec, _ = run_engine(bitrix, xml_file, interrupted=lambda: 'checkauth' in bitrix.modes())
+    assert not ok and rec.last == "🛑 Операция прервана пользователем."
+    assert bitrix.modes() == ['checkauth']
+
+
+def test_chunk_is_resent_in_full_after_307(bitrix, xml_file):
+    bitrix.init = (200, "file_limit=1000\n")
+    bitrix.file_redirects = 2
+    ok, _, _ = run_engine(bitrix, xml_file)
+    assert ok
+    assert [len(c) for c in bitrix.chunks] == [1000, 1000, 560]
+    assert bitrix.uploaded == xml_file.read_bytes()
+
+
+def test_file_shrinking_during_upload_is_reported(bitrix, xml_file, monkeypatch):
+    # размер, который видел движок, больше того, что реально можно прочитать
+    import bitrix_exchange.engine as engine_mod
+    real_getsize = engine_mod.os.path.getsize
+    monkeypatch.setattr(engine_mod.os.path, 'getsize', lambda p: real_getsize(p) + 100)
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert not ok
+    assert rec.last.startswith("❌ Ошибка чтения import.xml во время отправки:")
+    assert 'import' not in bitrix.modes()
+
+
+def test_read_ahead_thread_stops_when_post_fails(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'x' * (3 * 1024 * 1024))
+    bitrix.init = (200, "file_limit=100000\n")
+    bitrix.file = (500, "failure\n")
+    ok, rec, _ = run_engine(bitrix, path, chunk_retries=2)
+    assert not ok
+    assert bitrix.modes().count('file') == 3  # попытка и два повтора
+    assert rec.last == "❌ Ошибка file: код 500, попытки исчерпаны"
+    assert not [t for t in threading.enumerate() if t.name == 'chunk-read-ahead']
+
+
+def test_transient_chunk_error_is_retried(bitrix, xml_file):
+    bitrix.init = (200, "file_limit=1000\n")
+    bitrix.file_answers = [(200, "success\n"), (503, "busy"), (502, "bad gateway")]
+    ok, rec, _ = run_engine(bitrix, xml_file)
+    assert ok
+    assert bitrix.modes().count('file') == 5
+    assert bitrix.uploaded == xml_file.read_bytes()
+    assert sum(m.startswith("⚠️ Чанк 1000+1000 не принят") for m in rec.messages) == 2
+
+
+def test_interrupt_during_backoff(bitrix, xml_file):
+    bitrix.init = (200, "file_limit=1000\n")
+    bitrix.file = (503, "busy")
+    ok, rec, _ = run_engine(bitrix, xml_file, interrupted=lambda: 'file' in bitrix.modes())
+    assert not ok
+    assert rec.last == "🛑 Операция прервана пользователем."
+    assert bitrix.modes().count('file') == 1
+
+
+def test_resume_continues_from_last_acknowledged_chunk(bitrix, xml_file, tmp_path):
+    from bitrix_exchange.journal import UploadJournal
+    journal = UploadJournal(str(tmp_path / 'journal'))
+    bitrix.init = (200, "file_limit=1000\n")
+    bitrix.file_answers = [(200, "success\n"), (200, "success\n"), (200, "failure\nconnection lost")]
+
+    ok, _, _ = run_engine(bitrix, xml_file, resume=True, journal=journal)
+    assert not ok
+    assert journal.entry(bitrix.url, str(xml_file)).acked_bytes == 2000
+
+    bitrix.requests.clear()
+    ok, rec, _ = run_engine(bitrix, xml_file, resume=True, journal=journal)
+    assert ok
+    assert bitrix.modes() == ['checkauth', 'file', 'import']
+    assert any("докачка с 2000 байт" in m for m in rec.messages)
+    assert bitrix.uploaded == xml_file.read_bytes()
+    # после успешного обмена журнал удаляется
+    assert not journal.entry(bitrix.url, str(xml_file)).chunks
+
+
+def test_resume_after_failed_import_skips_upload(bitrix, xml_file, tmp_path):
+    from bitrix_exchange.journal import UploadJournal
+    journal = UploadJournal(str(tmp_path / 'journal'))
+    bitrix.imports['import.xml'] = [(500, "error")]
+    ok, _, _ = run_engine(bitrix, xml_file, resume=True, journal=journal)
+    assert not ok
+
+    bitrix.requests.clear()
+    bitrix.imports.clear()
+    ok, _, _ = run_engine(bitrix, xml_file, resume=True, journal=journal)
+    assert ok
+    assert bitrix.modes() == ['checkauth', 'import']
+
+
+def test_resume_with_mismatching_checksum_starts_over(bitrix, xml_file, tmp_path):
+    from bitrix_exchange.journal import UploadJournal
+    journal = UploadJournal(str(tmp_path / 'journal'))
+    entry = journal.entry(bitrix.url, str(xml_file))
+    entry.start(1000)
+    entry.ack(0, 1000, 12345)
+
+    ok, rec, _ = run_engine(bitrix, xml_file, resume=True, journal=journal)
+    assert ok
+    assert "⚠️ Журнал докачки не совпал с файлом, загружаем заново." in rec.messages
+    assert bitrix.modes()[:2] == ['checkauth', 'init']
+
+
+def test_compressed_xml_upload(bitrix, tmp_path):
+    path = tmp_path / 'offers.xml'
+    path.write_text('<Предложение><Ид>1</Ид></Предложение>\n' * 20000, encoding='utf-8')
+    bitrix.init = (200, "file_limit=4000\n")
+    ok, rec, _ = run_engine(bitrix, path, compress=True, compress_level=9)
+    assert ok
+    assert all(len(c) <= 4000 for c in bitrix.chunks)
+    with zipfile.ZipFile(io.BytesIO(bitrix.uploaded)) as z:
+        assert z.read('offers.xml') == path.read_bytes()
+    files = {p['filename'] for _, mode, p in bitrix.requests if mode == 'file'}
+    assert files == {'offers.zip'}
+    imported = [p['filename'] for _, mode, p in bitrix.requests if mode == 'import']
+    assert imported == ['offers.xml']
+    assert len(bitrix.uploaded) * 10 < path.stat().st_size
+    assert rec.messages[0].startswith("📦 Сжатие в ZIP на лету: 1 файл(ов)")
+
+
+def test_compressed_folder_upload_with_resume(bitrix, tmp_path):
+    from bitrix_exchange.journal import UploadJournal
+    root = tmp_path / 'export'
+    root.mkdir()
+    (root / 'offers.xml').write_bytes(os.urandom(6000))
+    (root / 'import.xml').write_bytes(os.urandom(6000))
+    journal = UploadJournal(str(tmp_path / 'journal'))
+    bitrix.init = (200, "file_limit=5000\n")
+    bitrix.file_answers = [(200, "success\n"), (200, "failure\n")]
+    ok, _, _ = run_engine(bitrix, root, compress=True, resume=True, journal=journal)
+    assert not ok
+
+    bitrix.requests.clear()
+    ok, _, _ = run_engine(bitrix, root, compress=True, resume=True, journal=journal)
+    assert ok
+    assert 'init' not in bitrix.modes()
+    with zipfile.ZipFile(io.BytesIO(bitrix.uploaded)) as z:
+        assert z.read('import.xml') == (root / 'import.xml').read_bytes()
+    imported = [p['filename'] for _, mode, p in bitrix.requests if mode == 'import']
+    assert imported == ['import.xml', 'offers.xml']
+
+
+def test_zip_is_compressed_once_with_retries_and_resume(bitrix, tmp_path, monkeypatch):
+    from bitrix_exchange.journal import UploadJournal
+    from bitrix_exchange.zipstream import ZipStream
+    passes = []
+    generate = ZipStream._generate
+
+    def counted(self):
+        # проход считается, когда сжатие действительно началось
+        passes.append(1)
+        yield from generate(self)
+
+    monkeypatch.setattr(ZipStream, '_generate', counted)
+    path = tmp_path / 'offers.xml'
+    path.write_bytes(os.urandom(12000))
+    journal = UploadJournal(str(tmp_path / 'journal'))
+    bitrix.init = (200, "file_limit=5000\n")
+    # повтор чанка и обрыв: архив сжимается одним проходом, без прохода ради размера
+    bitrix.file_answers = [(200, "success\n"), (503, "busy"), (200, "success\n"), (200, "failure\n")]
+    ok, rec, _ = run_engine(bitrix, path, compress=True, resume=True, journal=journal)
+    assert not ok and len(passes) == 1
+    assert [len(c) for c in bitrix.chunks] == [5000, 5000] and bitrix.modes().count('file') == 4
+
+    # докачка: сверка с журналом и продолжение загрузки — тоже один проход
+    passes.clear()
+    ok, rec, _ = run_engine(bitrix, path, compress=True, resume=True, journal=journal)
+    assert ok and len(passes) == 1
+    with zipfile.ZipFile(io.BytesIO(bitrix.uploaded)) as z:
+        assert z.read('offers.xml') == path.read_bytes()
+    assert any(m.startswith(f"📦 Размер архива: {len(bitrix.uploaded)} байт") for m in rec.messages)
+    assert rec.percents[-1] == 100
+
+
+def test_folder_without_compression_is_rejected(bitrix, tmp_path):
+    ok, rec, _ = run_engine(bitrix, tmp_path)
+    assert not ok
+    assert rec.last == "❌ Папку можно отправить только со сжатием в ZIP"
+    assert bitrix.modes() == []
+
+
+def test_import_progress_becomes_percentage_with_eta(bitrix, xml_file, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(ExchangeEngine, '_sleep', lambda self, s: sleeps.append(s))
+    bitrix.imports['import.xml'] = [
+        (200, "progress\nИмпорт групп"),
+        (200, "progress\nОбработано 50 из 200 элементов"),
+        (200, "progress\nОбработано 150 из 200 элементов"),
+        (200, "success\n"),
+    ]
+    ok, rec, _ = run_engine(bitrix, xml_file, send_file=False, poll_min=0.01, poll_max=2.0)
+    assert ok
+    assert rec.ranges == [(0, 0), (0, 100), (0, 100)]
+    assert rec.percents == [25, 75, 100]
+    assert len(sleeps) == 3
+    assert all(0.01 <= s <= 2.0 for s in sleeps)
+    status = [m for m in rec.messages if m.startswith("⏳")]
+    assert status[0].startswith("⏳ import.xml: Обработано 50 из 200 элементов — 25%")
+    assert "осталось ~" in status[1]
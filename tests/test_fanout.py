@@ -0,0 +1,119 @@
+import json
+import threading
+
+import pytest
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeListener
+from bitrix_exchange.fanout import FanOut, SiteTarget, load_targets, summary
+
+
+def _targets(stubs):
+    return [SiteTarget(s.url, 'admin', 'p') for s in stubs]
+
+
+def test_every_site_gets_the_file_and_its_own_session(make_bitrix, tmp_path):
+    stubs = [make_bitrix() for _ in range(3)]
+    for i, stub in enumerate(stubs):
+        stub.checkauth = (200, f"success\nPHPSESSID\nabc{i}\nsessid=S{i}\n")
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>' * 1000)
+
+    results = FanOut(_targets(stubs), 'catalog', str(path), concurrency=2).run()
+
+    assert [r.ok for r in results] == [True, True, True]
+    assert [r.target.url for r in results] == [s.url for s in stubs]
+    for i, stub in enumerate(stubs):
+        assert stub.uploaded == path.read_bytes()
+        sessids = {p.get('sessid') for _, mode, p in stub.requests if mode != 'checkauth'}
+        assert sessids == {f"S{i}"}
+
+
+def test_one_failing_site_does_not_stop_the_others(make_bitrix, tmp_path):
+    good, bad = make_bitrix(), make_bitrix()
+    bad.checkauth = (401, "Unauthorized")
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+
+    results = FanOut(_targets([bad, good]), 'catalog', str(path)).run()
+
+    assert [r.ok for r in results] == [False, True]
+    assert "401" in results[0].last_message
+    text = summary(results)
+    assert text.splitlines()[0] == "Итого: 1 из 2 сайтов успешно"
+    assert text.splitlines()[1].startswith("❌ " + bad.url)
+    assert text.splitlines()[2].startswith("✅ " + good.url)
+
+
+def test_concurrency_limit(make_bitrix, tmp_path):
+    stubs = [make_bitrix() for _ in range(4)]
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    class Counting(ExchangeListener):
+        # слушатель создаётся при старте сайта, finished — в конце его run()
+        def __init__(self):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+
+        def finished(self, ok):
+            with lock:
+                active[0] -= 1
+
+    results = FanOut(_targets(stubs), 'catalog', str(path), concurrency=2,
+                     listener_factory=lambda i, t: Counting()).run()
+    assert all(r.ok for r in results)
+    assert 1 <= peak[0] <= 2
+
+
+def test_load_targets(tmp_path, monkeypatch):
+    monkeypatch.setenv('SITE_B_PASSWORD', 'secret')
+    path = tmp_path / 'sites.json'
+    path.write_text(json.dumps([
+        {"url": "https://a.ru/bitrix/admin/1c_exchange.php", "login": "a", "password": "pa"},
+        {"url": "https://b.ru/bitrix/admin/1c_exchange.php", "login": "b", "password_env": "SITE_B_PASSWORD"},
+    ]), encoding='utf-8')
+    targets = load_targets(str(path))
+    assert [(t.url, t.login, t.password) for t in targets] == [
+        ("https://a.ru/bitrix/admin/1c_exchange.php", "a", "pa"),
+        ("https://b.ru/bitrix/admin/1c_exchange.php", "b", "secret"),
+    ]
+
+
+def test_load_targets_rejects_incomplete_entry(tmp_path, monkeypatch):
+    monkeypatch.delenv('MISSING_PASSWORD', raising=False)
+    path = tmp_path / 'sites.json'
+    path.write_text(json.dumps([{"url": "https://a.ru", "login": "a", "password_env": "MISSING_PASSWORD"}]),
+                    encoding='utf-8')
+    with pytest.raises(ValueError):
+        load_targets(str(path))
+
+
+def test_cli_fanout(make_bitrix, tmp_path, capsys):
+    good, bad = make_bitrix(), make_bitrix()
+    bad.init = (500, "failure")
+    sites = tmp_path / 'sites.json'
+    sites.write_text(json.dumps([{"url": s.url, "login": "a", "password": "p"} for s in (good, bad)]),
+                     encoding='utf-8')
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+
+    rc = cli.main(['fanout', '--targets', str(sites), '--file', str(path), '--concurrency', '2'])
+    out = capsys.readouterr().out
+    assert rc == 1
+    assert "Итого: 1 из 2 сайтов успешно" in out
+    assert f"[127.0.0.1:{good.url.split(':')[2].split('/')[0]}]" in out
+
+    sites.write_text(json.dumps([{"url": good.url, "login": "a", "password": "p"}]), encoding='utf-8')
+    assert cli.main(['fanout', '--targets', str(sites), '--file', str(path), '-q']) == 0
+
+
+def test_cli_fanout_bad_targets_file(tmp_path, capsys):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    rc = cli.main(['fanout', '--targets', str(tmp_path / 'none.json'), '--file', str(path)])
+    assert rc == 2
+    assert 'Список сайтов' in capsys.readouterr().err
@@ -0,0 +1,189 @@
+import sqlite3
+
+import pytest
+
+from bitrix_exchange import cli, history
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener
+from bitrix_exchange.history import SCHEMA_VERSION, RunHistory, sparkline
+from bitrix_exchange.manifest import hash_stream
+
+MB = 1024 * 1024
+
+
+class Messages(ExchangeListener):
+    def __init__(self):
+        self.messages = []
+
+    def message(self, msg):
+        self.messages.append(msg)
+
+
+def _snap(url='https://shop.ru/bitrix/admin/1c_exchange.php', ok=True, upload=(4 * MB, 2.0), import_s=10.0,
+          connect=0.3, polls=5):
+    sent, seconds = upload
+    return {
+        'url': url, 'type': 'catalog', 'started': '2026-10-01T10:00:00', 'elapsed': connect + seconds + import_s,
+        'ok': ok, 'phase': None, 'phases': {'checkauth': connect / 2, 'init': connect / 2, 'file': seconds,
+                                            'import': import_s},
+        'requests': 10, 'errors': 0,
+        'upload': {'bytes': sent, 'seconds': seconds, 'throughput': sent / seconds if seconds else None,
+                   'chunks': 4, 'retries': 0, 'latency': {}},
+        'import': {'seconds': import_s, 'server': import_s / 2, 'wait': import_s / 2, 'polls': polls, 'files': {}},
+        'breakdown': {'connect': connect, 'upload': seconds, 'import': import_s},
+    }
+
+
+def test_record_keeps_run_details(tmp_path):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>' * 1000)
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    run = store.record(_snap(), str(package))
+    assert run.id == 1 and run.ok and run.flags == '' and run.site == 'shop.ru'
+    assert run.file_size == 4000 and run.file_hash == hash_stream(open(package, 'rb'))
+    assert (run.bytes_sent, run.chunks, run.import_polls) == (4 * MB, 4, 5)
+    assert run.phases['file'] == 2.0 and run.throughput == 2 * MB
+    store.record(_snap(ok=False), message="❌ Ошибка: код 500 при авторизации")
+    runs = store.runs('shop.ru')
+    assert [r.ok for r in runs] == [False, True] and runs[0].message.startswith("❌")
+    with sqlite3.connect(store.path) as db:
+        assert db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+
+
+def test_slow_run_is_flagged_against_baseline(tmp_path):
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    for seconds in (2.0, 2.2, 1.8):
+        assert store.record(_snap(upload=(4 * MB, seconds))).flags == ''
+    # сеть вчетверо медленнее, импорт и авторизация — как обычно
+    run = store.record(_snap(upload=(4 * MB, 8.0)))
+    assert run.flag_list == ['upload']
+    # импорт вдвое с лишним дольше для того же пакета, авторизация три секунды
+    run = store.record(_snap(import_s=25.0, connect=3.0))
+    assert run.flag_list == ['import', 'connect']
+    # неудачный обмен не помечается и в базу не входит
+    assert store.record(_snap(ok=False, upload=(4 * MB, 40.0))).flags == ''
+    assert [r.id for r in store.runs(slow_only=True)] == [5, 4]
+    trend = store.trends()[0]
+    assert (trend.total, trend.failed, trend.last_flags) == (6, 1, ['import', 'connect'])
+    assert len(sparkline(trend.series('throughput'))) == 5
+
+
+def test_small_uploads_are_not_compared(tmp_path):
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    for _ in range(3):
+        store.record(_snap(upload=(100 * 1024, 0.01), import_s=0.2))
+    run = store.record(_snap(upload=(100 * 1024, 0.5), import_s=0.9))
+    assert run.throughput is None and run.flags == ''
+
+
+def test_engine_records_every_run(bitrix, tmp_path):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>')
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(package), history=store)
+    assert engine.run()
+    assert engine.history_run.ok and engine.history_run.chunks == 1 and engine.history_run.file_size == 4
+    bitrix.checkauth = (403, "failure\nAccess denied")
+    rec = Messages()
+    assert not ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(package), listener=rec, history=store).run()
+    failed = store.runs()[0]
+    assert not failed.ok and failed.message == rec.messages[-1]
+    assert failed.file_hash == engine.history_run.file_hash
+
+
+def test_engine_reports_slow_run(bitrix, tmp_path, monkeypatch):
+    monkeypatch.setattr(history, 'MIN_FLAG_SECONDS', 0.0)
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>')
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    # база: тот же сайт импортировал мегабайты за микросекунды
+    for _ in range(3):
+        store.record(_snap(url=bitrix.url, import_s=1e-6))
+    rec = Messages()
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(package), listener=rec, history=store)
+    assert engine.run()
+    assert engine.history_run.flag_list == ['import']
+    slow = [m for m in rec.messages if m.startswith("🐢")]
+    assert len(slow) == 1 and "импорт" in slow[0] and "при обычных" in slow[0]
+
+
+def test_history_write_error_does_not_fail_exchange(bitrix, tmp_path):
+    rec = Messages()
+    store = RunHistory(str(tmp_path / 'missing' / 'h.sqlite'))
+    assert ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', 'import.xml', send_file=False, listener=rec,
+                          history=store).run()
+    assert any(m.startswith("⚠️ Обмен не записан в историю") for m in rec.messages)
+
+
+def test_cli_records_and_shows_history(bitrix, tmp_path, capsys):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>')
+    args = ['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--file', str(package), '-q']
+    assert cli.main(args) == 0
+    assert cli.main(args + ['--no-history']) == 0
+    capsys.readouterr()
+    assert cli.main(['history']) == 0
+    out = capsys.readouterr().out.splitlines()
+    site = bitrix.url.split('/')[2]
+    assert out[1].startswith(f"{site} catalog: 1 (0)")
+    assert len([line for line in out if "✅" in line]) == 1
+    assert cli.main(['history', '--slow']) == 0
+
+
+def test_history_tab_shows_trends_and_slow_runs(qapp, data_home):
+    store = RunHistory()
+    for seconds in (2.0, 2.0, 2.0, 9.0):
+        store.record(_snap(upload=(4 * MB, seconds)))
+    import main
+
+    w = main.MainWindow()
+    try:
+        w._ensure_tab("history")
+        assert w.trends6.rowCount() == 1 and w.trends6.item(0, 0).text() == 'shop.ru'
+        assert w.trends6.item(0, 4).text() == "2.00" and w.trends6.item(0, 5).text() == "0.44"
+        assert w.runs6.rowCount() == 4 and w.runs6.item(0, 10).text() == "загрузка"
+        w.slow6.setChecked(True)
+        assert w.runs6.rowCount() == 1
+        # запуск получает ту же историю с порогом из настроек
+        w._ensure_tab("settings")
+        w.slowdown.setValue(3.0)
+        assert w._connection_options()['history'] is w.run_history and w.run_history.slowdown == 3.0
+        w.record_history.setChecked(False)
+        assert w._connection_options()['history'] is None
+    finally:
+        w.close()
+
+
+def test_package_hash_is_cached_in_database(tmp_path, monkeypatch):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>' * 1000)
+    path = str(tmp_path / 'h.sqlite')
+    digest = RunHistory(path).record(_snap(), str(package)).file_hash
+    # другой процесс, тот же файл: хэш берётся из базы, файл не читается
+    monkeypatch.setattr(history, 'hash_stream', lambda f: pytest.fail("файл прочитан заново"))
+    assert RunHistory(path).record(_snap(), str(package)).file_hash == digest
+    monkeypatch.undo()
+    package.write_bytes(b'<y/>' * 1000)
+    assert RunHistory(path).record(_snap(), str(package)).file_hash != digest
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT COUNT(*) FROM digests").fetchone()[0] == 1
+
+
+def test_import_speed_uses_bytes_sent(tmp_path):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>' * 1000)
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    # delta: сервер получил 1000 байт пакета изменений, а не весь файл
+    run = store.record(_snap(import_s=10.0), str(package), package_bytes=1000)
+    assert run.import_speed == 100 and run.file_size == 4000
+    assert store.record(_snap(upload=(2 * MB, 1.0), import_s=2.0), str(package)).import_speed == MB
+
+
+def test_interrupted_run_is_not_hashed(bitrix, tmp_path, monkeypatch):
+    package = tmp_path / 'import.xml'
+    package.write_bytes(b'<x/>')
+    store = RunHistory(str(tmp_path / 'h.sqlite'))
+    monkeypatch.setattr(history, 'hash_stream', lambda f: pytest.fail("прерванный обмен хэширует пакет"))
+    assert not ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(package), history=store,
+                              interrupted=lambda: True).run()
+    run = store.runs()[0]
+    assert not run.ok and run.file_hash is None and run.file_size == 4
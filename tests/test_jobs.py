@@ -0,0 +1,243 @@
+import json
+import os
+import stat
+import threading
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeListener
+from bitrix_exchange.jobs import (DONE, FAILED, NEEDS_PASSWORD, PENDING, RUNNING, FolderWatcher, JobQueue,
+                                  JobScheduler)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _file(tmp_path, name='import.xml', data=b'<x/>'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_queue_survives_restart(tmp_path, monkeypatch):
+    monkeypatch.setenv('SITE2_PASSWORD', 'p2')
+    path = str(tmp_path / 'jobs.json')
+    xml = _file(tmp_path)
+    queue = JobQueue(path)
+    first = queue.add(xml, 'http://one/ex.php', 'a', 'p', stamp=(4, 1))
+    queue.add(xml, 'http://two/ex.php', 'a', None, password_env='SITE2_PASSWORD')
+    queue.add('/gone.xml', 'http://two/ex.php', 'a', 'p', stamp=(1, 1))
+    assert queue.take() is first
+    if os.name == 'posix':
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    again = JobQueue(path)
+    # приложение закрыли посреди обмена — задание снова ждёт; пароли в файл не попадают
+    with open(path, encoding='utf-8') as f:
+        assert [job['password'] for job in json.load(f)['jobs']] == [None, None, None]
+    assert [job.status for job in again.jobs] == [NEEDS_PASSWORD, PENDING, NEEDS_PASSWORD]
+    assert again.jobs[1].password == 'p2'
+    assert again.waiting_for_password() == [('http://one/ex.php', 'a'), ('http://two/ex.php', 'a')]
+    assert again.known(xml, (4, 1)) and not again.known(xml, (5, 1))
+    assert again.take().url == 'http://two/ex.php' and again.take() is None
+    assert again.set_password('http://one/ex.php', 'a', 'p') == 1
+    # новое задание на тот же сайт возвращает пароль и ждущим
+    again.add(xml, 'http://two/ex.php', 'a', 'p')
+    assert [job.status for job in again.jobs] == [PENDING, RUNNING, PENDING, PENDING]
+    assert again.jobs[0].password == 'p' and again.waiting_for_password() == []
+    again.finish(again.jobs[1], True)
+    for _ in range(3):
+        again.finish(again.take(2), True)
+    again.clear_finished()
+    # список очищен, но файл в этом виде уже отправлялся; пропавший файл забыт
+    again = JobQueue(path)
+    assert again.jobs == [] and again.known(xml, (4, 1)) and not again.known('/gone.xml', (1, 1))
+
+
+def test_broken_queue_file_is_put_aside(tmp_path):
+    path = tmp_path / 'jobs.json'
+    path.write_text('{not json', encoding='utf-8')
+    queue = JobQueue(str(path))
+    assert queue.jobs == [] and queue.load_error
+    assert (tmp_path / 'jobs.json.broken').exists()
+
+
+def test_take_keeps_per_host_limit(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    for url in ('http://one/a', 'http://one/b', 'http://two/a'):
+        queue.add('/f.xml', url, 'a', 'p')
+    first, second = queue.take(), queue.take()
+    # второе задание первого сайта ждёт, пока идёт задание второго
+    assert (first.host, second.host) == ('one', 'two')
+    assert queue.take() is None
+    queue.finish(first, False, "❌ boom")
+    assert queue.take().url == 'http://one/b'
+    queue.retry_failed()
+    assert queue.counts() == {PENDING: 1, NEEDS_PASSWORD: 0, RUNNING: 2, DONE: 0, FAILED: 0}
+
+
+def test_watcher_reports_settled_files_once(tmp_path):
+    clock = Clock()
+    watcher = FolderWatcher(str(tmp_path), settle=5, clock=clock)
+    path = _file(tmp_path, 'offers.xml')
+    _file(tmp_path, 'notes.txt')
+    assert watcher.poll() == []
+    clock.now += 3
+    with open(path, 'ab') as f:
+        f.write(b' ')
+    # 1С ещё пишет — отсчёт начинается заново
+    assert watcher.poll() == []
+    clock.now += 4
+    assert watcher.poll() == []
+    clock.now += 2
+    ready = watcher.poll()
+    assert [p for p, _ in ready] == [path]
+    clock.now += 10
+    assert watcher.poll() == []
+
+
+def test_scheduler_runs_queue_until_idle(make_bitrix, tmp_path):
+    one, two = make_bitrix(), make_bitrix()
+    two.init = (500, "failure")
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    path = _file(tmp_path)
+    for stub in (one, one, two):
+        queue.add(path, stub.url, 'a', 'p', options={'preflight': False})
+    lock = threading.Lock()
+    running, peak = {}, {}
+
+    class PerHost(ExchangeListener):
+        def __init__(self, job):
+            self.host = job.host
+            with lock:
+                running[self.host] = running.get(self.host, 0) + 1
+                peak[self.host] = max(peak.get(self.host, 0), running[self.host])
+
+        def finished(self, ok):
+            with lock:
+                running[self.host] -= 1
+
+    finished = []
+    JobScheduler(queue, concurrency=3, per_host=1, listener_factory=PerHost,
+                 on_finished=lambda job, ok: finished.append(ok), request_retries=0).run(
+        until_idle=True, poll_interval=0.01)
+
+    assert sorted(finished) == [False, True, True]
+    assert [job.status for job in queue.jobs] == [DONE, DONE, FAILED]
+    assert "500" in queue.jobs[2].message
+    assert max(peak.values()) == 1
+    assert one.modes().count('checkauth') == 2
+
+
+def test_scheduler_fails_jobs_without_password_or_file(tmp_path, monkeypatch):
+    monkeypatch.delenv('NO_SUCH_PASSWORD', raising=False)
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    queue.add(_file(tmp_path), 'http://one/ex.php', 'a', None, password_env='NO_SUCH_PASSWORD')
+    queue.add(str(tmp_path / 'gone.xml'), 'http://two/ex.php', 'a', 'p')
+    JobScheduler(queue).run(until_idle=True, poll_interval=0.01)
+    assert [job.status for job in queue.jobs] == [FAILED, FAILED]
+    assert 'NO_SUCH_PASSWORD' in queue.jobs[0].message
+    assert 'Файл не найден' in queue.jobs[1].message
+
+
+def test_scheduler_picks_up_watched_files(bitrix, tmp_path):
+    folder = tmp_path / 'export'
+    folder.mkdir()
+    path = _file(folder)
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    stop = threading.Event()
+
+    def enqueue(p, stamp):
+        queue.add(p, bitrix.url, 'a', 'p', stamp=stamp)
+
+    scheduler = JobScheduler(queue, interrupted=stop.is_set,
+                             on_finished=lambda job, ok: stop.set())
+    scheduler.run(FolderWatcher(str(folder), settle=0), enqueue, poll_interval=0.01)
+    assert [(job.file, job.status) for job in queue.jobs] == [(path, DONE)]
+    assert bitrix.uploaded == b'<x/>'
+
+
+def test_cli_watch_once(make_bitrix, tmp_path, capsys, monkeypatch):
+    good, bad = make_bitrix(), make_bitrix()
+    bad.checkauth = (401, "Unauthorized")
+    monkeypatch.setenv('BAD_SITE_PASSWORD', 'p')
+    sites = tmp_path / 'sites.json'
+    sites.write_text(json.dumps([{"url": good.url, "login": "a", "password": "p"},
+                                 {"url": bad.url, "login": "a", "password_env": "BAD_SITE_PASSWORD"}]),
+                     encoding='utf-8')
+    folder = tmp_path / 'export'
+    folder.mkdir()
+    _file(folder)
+    queue = str(tmp_path / 'jobs.json')
+    argv = ['watch', '--targets', str(sites), '--folder', str(folder), '--queue', queue,
+            '--once', '--settle', '0', '--request-retries', '0']
+
+    assert cli.main(argv) == 1
+    out = capsys.readouterr().out
+    assert "📥 В очередь: #1 import.xml" in out
+    assert "Итого: 1 из 2 заданий успешно" in out
+    assert good.uploaded == b'<x/>'
+    with open(queue, encoding='utf-8') as f:
+        assert json.load(f)['jobs'][1]['password'] is None
+
+    # тот же файл второй раз не уходит
+    good.requests.clear()
+    assert cli.main(argv) == 0
+    assert "Итого: 0 из 0 заданий успешно" in capsys.readouterr().out
+    assert good.requests == []
+
+
+def test_gui_password_is_not_saved(qapp, tmp_path, data_home, monkeypatch):
+    import main
+
+    xml = _file(tmp_path)
+    w = main.MainWindow()
+    try:
+        w._ensure_tab("upload")
+        for field, value in ((w.url2, 'http://one/ex.php'), (w.login2, 'a'), (w.password2, 'secret'),
+                             (w.file2, xml)):
+            field.setText(value)
+        w._queue_tab2()
+        assert w.job_queue.jobs[0].password == 'secret'
+        with open(w.job_queue.path, encoding='utf-8') as f:
+            assert 'secret' not in f.read()
+    finally:
+        w.close()
+    # после перезапуска задание ждёт пароля, пока его не введут
+    monkeypatch.setattr(main.QInputDialog, 'getText', lambda *a: ('secret', True))
+    w = main.MainWindow()
+    try:
+        w._ensure_tab("queue")
+        assert w.jobs5.item(0, 3).text() == NEEDS_PASSWORD and w.password_job5.isEnabled()
+        w.password_job5.click()
+        assert w.job_queue.jobs[0].password == 'secret' and w.jobs5.item(0, 3).text() == PENDING
+        assert not w.password_job5.isEnabled()
+    finally:
+        w.close()
+
+
+def test_scheduler_reports_engine_crash(tmp_path, monkeypatch):
+    def broken(*args, **kwargs):
+        raise TypeError("unexpected option")
+
+    monkeypatch.setattr('bitrix_exchange.jobs.ExchangeEngine', broken)
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    queue.add(_file(tmp_path), 'http://one/ex.php', 'a', 'p')
+
+    class Recorder(ExchangeListener):
+        messages, results = [], []
+
+        def message(self, msg):
+            self.messages.append(msg)
+
+        def finished(self, ok):
+            self.results.append(ok)
+
+    JobScheduler(queue, listener_factory=lambda job: Recorder()).run(until_idle=True, poll_interval=0.01)
+    assert queue.jobs[0].status == FAILED
+    assert queue.jobs[0].message == "❌ Неожиданная ошибка: unexpected option"
+    assert Recorder.results == [False] and "Traceback" in Recorder.messages[0]
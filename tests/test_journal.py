@@ -0,0 +1,70 @@
+import os
+import zlib
+
+from bitrix_exchange.journal import UploadJournal
+from bitrix_exchange.retry import Backoff
+
+
+def make_file(tmp_path, data=b'0123456789' * 300):
+    path = tmp_path / 'offers.xml'
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_acked_chunks_survive_reload(tmp_path):
+    path = make_file(tmp_path)
+    journal = UploadJournal(str(tmp_path / 'j'))
+    entry = journal.entry('https://a.ru/ex', path)
+    entry.start(1000)
+    data = open(path, 'rb').read()
+    entry.ack(0, 1000, zlib.crc32(data[:1000]))
+    entry.ack(1000, 1000, zlib.crc32(data[1000:2000]))
+
+    again = journal.entry('https://a.ru/ex', path)
+    assert again.file_limit == 1000
+    assert again.acked_bytes == 2000
+    assert again.verify()
+
+
+def test_key_depends_on_site_and_file_state(tmp_path):
+    path = make_file(tmp_path)
+    journal = UploadJournal(str(tmp_path / 'j'))
+    key = journal.key('https://a.ru/ex', path)
+    assert key != journal.key('https://b.ru/ex', path)
+    with open(path, 'ab') as f:
+        f.write(b'more')
+    assert key != journal.key('https://a.ru/ex', path)
+
+
+def test_torn_last_line_is_ignored(tmp_path):
+    path = make_file(tmp_path)
+    journal = UploadJournal(str(tmp_path / 'j'))
+    entry = journal.entry('https://a.ru/ex', path)
+    entry.start(1000)
+    entry.ack(0, 1000, zlib.crc32(open(path, 'rb').read()[:1000]))
+    with open(entry.path, 'a', encoding='utf-8') as f:
+        f.write('{"offset": 1000, "len')
+    assert journal.entry('https://a.ru/ex', path).acked_bytes == 1000
+
+
+def test_gap_limits_acked_prefix(tmp_path):
+    path = make_file(tmp_path)
+    entry = UploadJournal(str(tmp_path / 'j')).entry('https://a.ru/ex', path)
+    entry.start(1000)
+    entry.ack(0, 1000, 0)
+    entry.ack(2000, 1000, 0)
+    assert entry.acked_bytes == 1000
+
+
+def test_discard_removes_file(tmp_path):
+    path = make_file(tmp_path)
+    entry = UploadJournal(str(tmp_path / 'j')).entry('https://a.ru/ex', path)
+    entry.start(0)
+    assert os.path.exists(entry.path)
+    entry.discard()
+    assert not os.path.exists(entry.path)
+
+
+def test_backoff_grows_and_stops():
+    backoff = Backoff(retries=4, base=1.0, max_delay=5.0, jitter=0)
+    assert [backoff.next_delay() for _ in range(5)] == [1.0, 2.0, 4.0, 5.0, None]
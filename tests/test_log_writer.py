@@ -0,0 +1,89 @@
+import json
+import threading
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.log_writer import LogListener, LogWriter
+
+
+def test_text_format_skips_http_records(tmp_path):
+    path = tmp_path / 'exchange.log'
+    w = LogWriter(str(path))
+    w.write("📤 Шаг 1: Авторизация.", phase='checkauth')
+    w.write(phase='checkauth', method='GET', url='http://x', status=200, elapsed=0.1)
+    w.write("📥 Ответ сервера:\nsuccess", site='a.ru')
+    w.close()
+    lines = path.read_text(encoding='utf-8').splitlines()
+    assert lines[1].startswith("=== ")
+    assert lines[2:] == ["📤 Шаг 1: Авторизация.", "[a.ru] 📥 Ответ сервера:", "success"]
+
+
+def test_jsonl_records_have_all_fields(tmp_path):
+    path = tmp_path / 'exchange.jsonl'
+    w = LogWriter(str(path), 'jsonl')
+    w.write(phase='file', method='POST', url='http://x/?mode=file', status=200, elapsed=0.25)
+    w.write("✅ готово")
+    w.close()
+    recs = [json.loads(ln) for ln in path.read_text(encoding='utf-8').splitlines()]
+    assert set(recs[0]) == {'ts', 'phase', 'method', 'url', 'status', 'elapsed', 'site', 'message'}
+    assert (recs[0]['phase'], recs[0]['method'], recs[0]['status'], recs[0]['elapsed']) == ('file', 'POST', 200, 0.25)
+    assert recs[1]['message'] == "✅ готово" and recs[1]['method'] is None
+
+
+def test_size_rotation_keeps_backups(tmp_path):
+    path = tmp_path / 'exchange.log'
+    w = LogWriter(str(path), max_bytes=200, backups=2, batch=1)
+    for i in range(60):
+        w.write(f"строка {i:03d} " + "x" * 20)
+    w.close()
+    assert not (tmp_path / 'exchange.log.3').exists()
+    assert (tmp_path / 'exchange.log.2').exists()
+    for name in ('exchange.log', 'exchange.log.1'):
+        assert (tmp_path / name).stat().st_size <= 200
+    assert "строка 059" in path.read_text(encoding='utf-8')
+
+
+def test_time_rotation(tmp_path):
+    path = tmp_path / 'exchange.log'
+    w = LogWriter(str(path), rotate_interval=1e-9, batch=1)
+    w.write("первая")
+    w.close()
+    assert (tmp_path / 'exchange.log.1').exists()
+    assert "первая" in path.read_text(encoding='utf-8')
+
+
+def test_full_queue_drops_without_blocking(tmp_path):
+    path = tmp_path / 'exchange.log'
+    w = LogWriter(str(path), queue_size=5)
+    gate = threading.Event()
+    real = w._format_batch
+    w._format_batch = lambda records: (gate.wait(), real(records))[1]
+    for i in range(100):
+        w.write(f"m{i}")  # поток стоит на gate — очередь переполняется, write не ждёт
+    assert w.dropped > 0
+    gate.set()
+    w.close()
+    assert "пропущено" in path.read_text(encoding='utf-8')
+
+
+def test_engine_run_writes_structured_log(bitrix, tmp_path):
+    xml = tmp_path / 'import.xml'
+    xml.write_bytes(b'<x/>' * 10)
+    path = tmp_path / 'exchange.jsonl'
+    w = LogWriter(str(path), 'jsonl')
+    assert ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(xml), listener=LogListener(w)).run()
+    w.close()
+    recs = [json.loads(ln) for ln in path.read_text(encoding='utf-8').splitlines()]
+    http = [(r['phase'], r['method'], r['status']) for r in recs if r['method']]
+    assert http == [('checkauth', 'GET', 200), ('init', 'GET', 200), ('file', 'POST', 200), ('import', 'GET', 200)]
+    assert all(r['elapsed'] >= 0 for r in recs if r['method'])
+    assert recs[-1]['message'] == "✅ Обмен успешно завершен." and recs[-1]['phase'] == 'import'
+
+
+def test_cli_jsonl_log(bitrix, tmp_path):
+    log = tmp_path / 'exchange.jsonl'
+    rc = cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--filename', 'import.xml',
+                   '-q', '--log', str(log), '--log-format', 'jsonl'])
+    assert rc == 0
+    recs = [json.loads(ln) for ln in log.read_text(encoding='utf-8').splitlines()]
+    assert any(r['method'] == 'GET' and 'mode=checkauth' in r['url'] for r in recs)
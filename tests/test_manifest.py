@@ -0,0 +1,128 @@
+import io
+import zipfile
+
+from bitrix_exchange import cli, fanout
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.fanout import FanOut, SiteTarget
+from bitrix_exchange.manifest import ContentManifest, build_manifest, hash_package
+
+FILES = {
+    'import.xml': b'<?xml version="1.0"?><root>catalog</root>',
+    'offers.xml': b'<?xml version="1.0"?><root>offers</root>',
+    'import_files/a.jpg': b'a' * 5000,
+    'import_files/b.jpg': b'b' * 5000,
+}
+
+
+def package(tmp_path, files=FILES, name='export.zip'):
+    path = tmp_path / name
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for member, data in files.items():
+            z.writestr(member, data)
+    return str(path)
+
+
+def sent(bitrix):
+    # имена файлов в последнем отправленном ZIP
+    with zipfile.ZipFile(io.BytesIO(bitrix.uploaded)) as z:
+        return sorted(z.namelist())
+
+
+def test_zip_and_folder_hash_the_same_and_in_parallel(tmp_path):
+    folder = tmp_path / 'export'
+    for member, data in FILES.items():
+        (folder / member).parent.mkdir(parents=True, exist_ok=True)
+        (folder / member).write_bytes(data)
+    zipped = hash_package(package(tmp_path), False, workers=4)
+    plain = hash_package(str(folder), True, workers=1)
+    assert zipped.kind == 'zip' and plain.kind == 'files'
+    assert sorted((n, s, h) for n, _, s, h in zipped.members) == sorted((n, s, h) for n, _, s, h in plain.members)
+    assert zipped.size == sum(map(len, FILES.values()))
+
+
+def test_only_changed_members_are_repacked(tmp_path):
+    manifest = ContentManifest('http://x', 'catalog', directory=str(tmp_path / 'm'))
+    first = build_manifest(hash_package(package(tmp_path), False), manifest)
+    assert first.whole and first.entries == [] and len(first.changed) == 4
+    first.commit()
+
+    changed = dict(FILES, **{'import_files/b.jpg': b'B' * 5000, 'import_files/c.jpg': b'c'})
+    second = build_manifest(hash_package(package(tmp_path, changed), False), manifest)
+    try:
+        # картинки без XML Битрикс не импортирует — XML уходят вместе с ними
+        assert sorted(second.changed) == ['import_files/b.jpg', 'import_files/c.jpg']
+        assert [name for name, _ in second.entries] == ['import.xml', 'offers.xml', 'import_files/b.jpg',
+                                                       'import_files/c.jpg']
+        with open(dict(second.entries)['import_files/b.jpg'], 'rb') as f:
+            assert f.read() == b'B' * 5000
+    finally:
+        second.cleanup()
+
+
+def test_engine_skips_what_the_site_already_has(bitrix, tmp_path):
+    manifest = ContentManifest(bitrix.url, 'catalog', directory=str(tmp_path / 'm'))
+
+    def run(files):
+        return ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', package(tmp_path, files),
+                              skip_unchanged=True, manifest=manifest).run()
+
+    assert run(FILES)
+    assert sent(bitrix) == sorted(FILES)
+
+    bitrix.requests.clear()
+    assert run(FILES)
+    assert bitrix.requests == []
+
+    bitrix.requests.clear()
+    bitrix.chunks.clear()
+    assert run(dict(FILES, **{'offers.xml': b'<?xml version="1.0"?><root>new offers</root>'}))
+    assert sent(bitrix) == ['offers.xml']
+    assert [p['filename'] for _, mode, p in bitrix.requests if mode == 'import'] == ['offers.xml']
+
+
+def test_failed_run_does_not_update_manifest(bitrix, tmp_path):
+    manifest = ContentManifest(bitrix.url, 'catalog', directory=str(tmp_path / 'm'))
+    bitrix.imports['import.xml'] = [(200, "failure\nошибка импорта")]
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', package(tmp_path), skip_unchanged=True,
+                            manifest=manifest)
+    assert not engine.run()
+    assert manifest.load() == {}
+    assert engine.metrics.snapshot()['breakdown']['manifest'] >= 0
+
+
+def test_single_xml_is_sent_as_is(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(FILES['import.xml'])
+    manifest = ContentManifest(bitrix.url, 'catalog', directory=str(tmp_path / 'm'))
+    for _ in range(2):
+        assert ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(path), skip_unchanged=True,
+                              manifest=manifest).run()
+    assert bitrix.uploaded == FILES['import.xml']
+    assert bitrix.modes().count('init') == 1
+
+
+def test_fanout_hashes_once_and_compares_per_site(make_bitrix, tmp_path, monkeypatch):
+    monkeypatch.setenv('BITRIX_EXCHANGE_HOME', str(tmp_path / 'home'))
+    calls = []
+    real = fanout.hash_package
+    monkeypatch.setattr(fanout, 'hash_package', lambda *a, **k: calls.append(a) or real(*a, **k))
+    old, new = make_bitrix(), make_bitrix()
+    path = package(tmp_path)
+    assert ExchangeEngine(old.url, 'a', 'p', 'catalog', path, skip_unchanged=True).run()
+    old.requests.clear()
+
+    results = FanOut([SiteTarget(s.url, 'a', 'p') for s in (old, new)], 'catalog', path,
+                     skip_unchanged=True).run()
+    assert [r.ok for r in results] == [True, True]
+    assert len(calls) == 1
+    assert old.requests == [] and sent(new) == sorted(FILES)
+
+
+def test_cli_skip_unchanged(bitrix, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('BITRIX_EXCHANGE_HOME', str(tmp_path / 'home'))
+    argv = ['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p',
+            '--file', package(tmp_path), '--skip-unchanged']
+    assert cli.main(argv) == 0
+    assert cli.main(argv) == 0
+    assert "отправлять нечего" in capsys.readouterr().out
+    assert bitrix.modes().count('init') == 1
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.metrics import (RunMetrics, bottleneck, format_summary, prometheus_text,
+                                     write_prometheus)
+from bitrix_exchange.mock_server import MockBitrix
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_phases_chunks_and_polls():
+    clock = FakeClock()
+    m = RunMetrics('http://x/bitrix/admin/1c_exchange.php', 'catalog', clock=clock)
+    m.start()
+    m.begin('checkauth')
+    clock.now = 0.5
+    m.request('checkauth', 'GET', 200, 0.5)
+    m.begin('file')
+    for latency, status in ((0.1, 200), (0.2, 503), (0.3, 200), (0.4, 200)):
+        clock.now += latency
+        m.request('file', 'POST', status, latency, sent=1000)
+    m.begin('import')
+    for _ in range(3):
+        clock.now += 1.0
+        m.request('import', 'GET', 200, 0.75, filename='import.xml')
+    m.xml_done('import.xml', 3.0)
+    snap = m.snapshot()
+    assert snap['ok'] is None and snap['phase'] == 'import'
+    m.finish(True)
+
+    snap = m.snapshot()
+    assert snap['ok'] is True and snap['phase'] is None
+    assert snap['elapsed'] == pytest.approx(4.5)
+    assert snap['phases'] == pytest.approx({'checkauth': 0.5, 'file': 1.0, 'import': 3.0})
+    assert snap['errors'] == 1
+    up = snap['upload']
+    assert (up['bytes'], up['chunks'], up['retries']) == (3000, 3, 1)
+    assert up['throughput'] == pytest.approx(3000)
+    assert up['latency']['p50'] == pytest.approx(0.3)
+    assert up['latency']['max'] == pytest.approx(0.4)
+    imp = snap['import']
+    assert imp['server'] == pytest.approx(2.25) and imp['wait'] == pytest.approx(0.75)
+    assert imp['files'] == {'import.xml': {'seconds': 3.0, 'polls': 3, 'poll_avg': 0.75}}
+    assert bottleneck(snap) == ('import', pytest.approx(3.0 / 4.5))
+    assert "импорт на сервере (67%)" in format_summary(snap)
+
+
+def test_engine_records_a_real_run(tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>' * 25000)
+    with MockBitrix(file_limit=16384, import_steps=2) as mock:
+        engine = ExchangeEngine(mock.url, 'admin', 'x', 'catalog', str(path))
+        assert engine.run()
+    snap = engine.metrics.snapshot()
+    assert snap['ok'] is True
+    assert set(snap['phases']) == {'checkauth', 'init', 'file', 'import'}
+    assert snap['requests'] == mock.stats.total_requests
+    assert snap['upload']['bytes'] == 100000 and snap['upload']['chunks'] == 7
+    assert snap['import']['files']['import.xml']['polls'] == 3
+    assert snap['import']['files']['import.xml']['seconds'] is not None
+
+
+def test_failed_request_counts_as_error(tmp_path):
+    # порт закрыт: checkauth без ответа
+    with MockBitrix() as mock:
+        url = mock.url
+    engine = ExchangeEngine(url, 'admin', 'x', 'catalog', 'import.xml', send_file=False, request_retries=0)
+    assert not engine.run()
+    snap = engine.metrics.snapshot()
+    assert snap['ok'] is False and snap['errors'] == 1
+    assert 'checkauth' in snap['phases']
+
+
+def test_prometheus_textfile(tmp_path):
+    clock = FakeClock()
+    m = RunMetrics('https://shop.ru/bitrix/admin/1c_exchange.php', 'catalog', clock=clock)
+    m.start()
+    m.begin('import')
+    m.request('import', 'GET', 200, 0.5, filename='im"port.xml')
+    m.finish(True)
+    path = tmp_path / 'bitrix.prom'
+
+    write_prometheus(str(path), m.snapshot())
+
+    text = path.read_text(encoding='utf-8')
+    assert not (tmp_path / 'bitrix.prom.tmp').exists()
+    assert '# TYPE bitrix_exchange_success gauge' in text
+    assert 'bitrix_exchange_success{site="shop.ru",type="catalog"} 1' in text
+    assert 'bitrix_exchange_import_polls{site="shop.ru",xml="im\\"port.xml"} 1' in text
+    assert 'bitrix_exchange_phase_seconds{site="shop.ru",phase="import"} 0.0' in text
+    # у шагов, которых не было, нет и строк
+    assert 'phase="file"' not in text
+    assert text.count('# HELP bitrix_exchange_phase_seconds') == 1
+    two = prometheus_text([m.snapshot(), m.snapshot()])
+    assert two.count('# TYPE bitrix_exchange_success gauge') == 1
+
+
+def test_cli_exports_metrics(bitrix, tmp_path, capsys):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x>' + b'<y/>' * 100 + b'</x>')
+    out_json, out_prom = tmp_path / 'm.json', tmp_path / 'm.prom'
+    rc = cli.main(['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--file', str(path),
+                   '-q', '--stats', '--metrics-json', str(out_json), '--metrics-prom', str(out_prom)])
+    assert rc == 0
+    assert "📤 Загрузка: " in capsys.readouterr().err
+    snap = json.loads(out_json.read_text(encoding='utf-8'))
+    assert snap['ok'] is True and snap['upload']['bytes'] == path.stat().st_size
+    assert 'bitrix_exchange_upload_bytes{site="127.0.0.1' in out_prom.read_text(encoding='utf-8')
+
+
+def test_cli_fanout_exports_one_snapshot_per_site(make_bitrix, tmp_path):
+    stubs = [make_bitrix(), make_bitrix()]
+    targets = tmp_path / 'sites.json'
+    targets.write_text(json.dumps([{'url': s.url, 'login': 'a', 'password': 'p'} for s in stubs]))
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    out_json = tmp_path / 'm.json'
+    rc = cli.main(['fanout', '--targets', str(targets), '--file', str(path), '-q',
+                   '--metrics-json', str(out_json)])
+    assert rc == 0
+    snaps = json.loads(out_json.read_text(encoding='utf-8'))
+    assert [s['url'] for s in snaps] == [s.url for s in stubs]
@@ -0,0 +1,63 @@
+import importlib.util
+import json
+import os
+
+import requests
+
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.mock_server import MockBitrix
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _xml(tmp_path, size):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>' * (size // 4))
+    return str(path)
+
+
+def test_chunked_upload_and_import_polls(tmp_path):
+    path = _xml(tmp_path, 100000)
+    with MockBitrix(file_limit=16384, import_steps=2) as mock:
+        ok = ExchangeEngine(mock.url, 'admin', 'x', 'catalog', path).run()
+    assert ok
+    assert mock.stats.bytes_received == 100000
+    assert mock.stats.chunks == 7  # 100000 / 16384, с остатком
+    assert mock.stats.requests['import'] == 3
+    assert mock.stats.requests['checkauth'] == mock.stats.requests['init'] == 1
+
+
+def test_injected_errors_are_retried(tmp_path):
+    path = _xml(tmp_path, 100000)
+    with MockBitrix(file_limit=8192, error_rate=0.3, seed=3) as mock:
+        ok = ExchangeEngine(mock.url, 'admin', 'x', 'catalog', path, chunk_retries=10).run()
+    assert ok
+    assert mock.stats.errors > 0
+    assert mock.stats.chunks == 13
+    assert mock.stats.requests['file'] == mock.stats.chunks + mock.stats.errors
+    assert mock.stats.bytes_received == 100000
+
+
+def test_progress_answers_count_up():
+    with MockBitrix(import_steps=3, import_total=1000) as mock:
+        answers = [requests.get(mock.url, params={'mode': 'import', 'filename': 'a.xml'}).text
+                   for _ in range(4)]
+    assert answers[0].startswith("progress") and "Обработано 250 из 1000" in answers[0]
+    assert "Обработано 750 из 1000" in answers[2]
+    assert answers[3].startswith("success")
+
+
+def test_throughput_benchmark_smoke(tmp_path):
+    spec = importlib.util.spec_from_file_location('throughput', os.path.join(ROOT, 'benchmarks', 'throughput.py'))
+    throughput = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(throughput)
+    out = tmp_path / 'out.json'
+
+    code = throughput.main(['--sizes', '0.05', '--limits', '0,16384', '--import-steps', '1',
+                            '--json', str(out)])
+
+    assert code == 0
+    results = json.loads(out.read_text())
+    assert [r['file_limit'] for r in results] == [0, 16384]
+    assert results[0]['chunks'] == 1 and results[1]['chunks'] == 4
+    assert all(r['ok'] and r['upload_mb_s'] > 0 and r['import_polls'] == 2 for r in results)
@@ -0,0 +1,112 @@
+import io
+import zipfile
+from decimal import Decimal
+
+import pytest
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener
+from bitrix_exchange.mock_server import MockBitrix
+from bitrix_exchange.orders import OrdersError, OrdersStats, OrderCounter, save_orders
+
+
+def orders_xml(docs, encoding='windows-1251'):
+    body = ''.join(
+        f'<Документ><Ид>{n}</Ид><ХозОперация>{op}</ХозОперация><Валюта>{cur}</Валюта><Сумма>{amount}</Сумма>'
+        f'<Товары><Товар><Ид>p</Ид><Сумма>1.00</Сумма></Товар></Товары></Документ>'
+        for n, (op, cur, amount) in enumerate(docs))
+    return (f'<?xml version="1.0" encoding="{encoding}"?>\n'
+            f'<КоммерческаяИнформация ВерсияСхемы="2.08">{body}</КоммерческаяИнформация>').encode(encoding)
+
+
+DOCS = [('Заказ товара', 'руб', '100.50'), ('Заказ товара', 'руб', '1 000,25'),
+        ('Заказ товара', 'USD', '7'), ('Возврат товара', 'руб', '10')]
+
+
+def test_counter_sums_documents_fed_byte_by_byte():
+    stats = OrdersStats('x')
+    counter = OrderCounter(stats)
+    for b in orders_xml(DOCS):
+        counter.feed(bytes([b]))
+    counter.close()
+    # Сумма товара внутри документа не считается
+    assert (stats.documents, stats.orders) == (4, 3)
+    assert stats.totals == {'руб': Decimal('1110.75'), 'USD': Decimal('7')}
+
+
+def test_broken_xml_leaves_no_file(tmp_path):
+    path = str(tmp_path / 'orders.xml')
+    with pytest.raises(OrdersError):
+        save_orders(iter([orders_xml(DOCS)[:-10]]), path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_zipped_answer_is_counted_after_download(tmp_path):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr('orders.xml', orders_xml(DOCS))
+    data = buf.getvalue()
+    path = str(tmp_path / 'orders.zip')
+    stats = save_orders((data[i:i + 100] for i in range(0, len(data), 100)), path)
+    assert stats.zipped and stats.documents == 4
+    with open(path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_engine_downloads_orders_and_confirms(bitrix, tmp_path):
+    bitrix.query = (200, orders_xml(DOCS))
+    path = tmp_path / 'orders.xml'
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'sale', str(path), send_file=False)
+    assert engine.run()
+    assert bitrix.modes() == ['checkauth', 'init', 'query', 'success']
+    assert all(p['type'] == 'sale' for _, _, p in bitrix.requests)
+    assert path.read_bytes() == orders_xml(DOCS)
+    assert engine.orders_stats.orders == 3
+    assert engine.metrics.snapshot()['breakdown']['orders'] > 0
+
+
+def test_failure_answer_and_rejected_success(bitrix, tmp_path):
+    path = tmp_path / 'orders.xml'
+    bitrix.query = (200, "failure\nНет прав на выгрузку заказов")
+    messages = []
+
+    class Listener(ExchangeListener):
+        def message(self, msg):
+            messages.append(msg)
+
+    assert not ExchangeEngine(bitrix.url, 'a', 'p', 'sale', str(path), send_file=False, listener=Listener()).run()
+    assert 'Нет прав' in messages[-1] and not path.exists()
+    assert 'success' not in bitrix.modes()
+
+    bitrix.query = (200, orders_xml(DOCS))
+    bitrix.success = (200, "failure\n")
+    assert not ExchangeEngine(bitrix.url, 'a', 'p', 'sale', str(path), send_file=False, listener=Listener()).run()
+    # заказы уже на диске; сайт отдаст их снова
+    assert path.exists() and 'придут снова' in messages[-1]
+
+
+def test_large_chunked_answer_streams(tmp_path):
+    path = tmp_path / 'orders.xml'
+    progress = []
+
+    class Listener(ExchangeListener):
+        def progress_range(self, lo, hi):
+            progress.append((lo, hi))
+
+    with MockBitrix(orders=5000) as mock:
+        engine = ExchangeEngine(mock.url, 'a', 'p', 'sale', str(path), send_file=False, listener=Listener())
+        assert engine.run()
+        assert mock.stats.requests['success'] == 1
+    # без Content-Length процент неизвестен
+    assert progress[0] == (0, 0)
+    assert engine.orders_stats.documents == 5000
+    assert engine.orders_stats.bytes == path.stat().st_size
+
+
+def test_cli_standard_sale(bitrix, tmp_path, capsys):
+    bitrix.query = (200, orders_xml(DOCS))
+    path = tmp_path / 'orders.xml'
+    assert cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--password', 'p',
+                     '--type', 'sale', '--filename', str(path)]) == 0
+    assert "заказов 3" in capsys.readouterr().out
+    assert path.exists()
@@ -0,0 +1,61 @@
+import pytest
+
+from bitrix_exchange.polling import ImportProgress, PollScheduler, format_eta, parse_progress
+
+
+@pytest.mark.parametrize('text, done, total, percent, step', [
+    ("progress\nОбработано 1 500 из 20 000 элементов", 1500, 20000, None, "Обработано 1 500 из 20 000 элементов"),
+    ("progress\nИмпорт элементов.\nОбработано 40/200", 40, 200, None, "Импорт элементов."),
+    ("progress\nВыполнено 45%", None, None, 45.0, "Выполнено 45%"),
+    ("progress\nИмпортировано элементов: 300", 300, None, None, "Импортировано элементов: 300"),
+    ("progress\nУдаление временных данных", None, None, None, "Удаление временных данных"),
+    ("progress", None, None, None, ""),
+])
+def test_parse_progress(text, done, total, percent, step):
+    info = parse_progress(text)
+    assert (info.done, info.total, info.percent, info.step) == (done, total, percent, step)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_import_progress_fraction_and_eta():
+    clock = Clock()
+    tracker = ImportProgress(clock=clock)
+    assert tracker.update(parse_progress("progress\nшаг")) is None
+    assert tracker.eta() is None
+    clock.now += 30
+    assert tracker.update(parse_progress("progress\n250 из 1000")) == 0.25
+    assert tracker.eta() == pytest.approx(90)
+
+
+def test_import_progress_uses_expected_total_for_bare_counters():
+    tracker = ImportProgress(expected_total=400, clock=Clock())
+    assert tracker.update(parse_progress("progress\nОбработано элементов: 100")) == 0.25
+
+
+def test_scheduler_follows_step_duration_within_bounds():
+    sched = PollScheduler(min_interval=0.1, max_interval=5.0, ratio=0.5, smoothing=1.0)
+    assert sched.next_delay(0.01) == 0.1
+    assert sched.next_delay(4.0) == 2.0
+    assert sched.next_delay(60.0) == 5.0
+
+
+def test_scheduler_backs_off_while_progress_is_stalled():
+    sched = PollScheduler(min_interval=0.1, max_interval=10.0, ratio=0.5, smoothing=1.0)
+    same = parse_progress("progress\n10 из 100")
+    assert sched.next_delay(1.0, same) == 0.5
+    assert sched.next_delay(1.0, same) == 1.0
+    assert sched.next_delay(1.0, same) == 2.0
+    assert sched.next_delay(1.0, parse_progress("progress\n20 из 100")) == 0.5
+
+
+def test_format_eta():
+    assert format_eta(42) == "42 с"
+    assert format_eta(125) == "2 мин 05 с"
+    assert format_eta(3 * 3600 + 60 * 7) == "3 ч 07 мин"
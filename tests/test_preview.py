@@ -0,0 +1,97 @@
+import os
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeEngine, ExchangeListener
+from bitrix_exchange.preview import SPILL_MARK, ResponseStore, excerpt, spilled_path
+
+PAGE = "<html><body>" + "<p>Fatal error</p>\n" * 50000 + "</body></html>"
+
+
+class Messages(ExchangeListener):
+    def __init__(self):
+        self.messages = []
+
+    def message(self, msg):
+        self.messages.append(msg)
+
+
+def test_short_answer_is_kept_as_is(tmp_path):
+    store = ResponseStore(100, directory=str(tmp_path))
+    assert store.preview("success\nsessid=1") == "success\nsessid=1"
+    assert store.files == []
+
+
+def test_long_answer_is_cut_and_spilled_once(tmp_path):
+    store = ResponseStore(500, 100000, directory=str(tmp_path))
+    text = store.preview(PAGE)
+    assert len(text) < 1000
+    assert text.startswith("<html><body><p>Fatal error</p>")
+    assert f"показано 500 из {len(PAGE)} символов" in text
+    path = spilled_path(text)
+    assert path and text.endswith(SPILL_MARK + path)
+    # в файле — не больше spill_bytes
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == PAGE[:100000]
+    store.cleanup()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spill_can_be_turned_off(tmp_path):
+    text = ResponseStore(500, 0, directory=str(tmp_path)).preview(PAGE)
+    assert spilled_path(text) is None and "показано 500" in text
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_engine_logs_preview_of_error_page(bitrix, tmp_path):
+    bitrix.checkauth = (200, PAGE)
+    rec = Messages()
+    store = ResponseStore(1000, directory=str(tmp_path))
+    assert not ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', send_file=False, listener=rec,
+                              responses=store).run()
+    response = next(m for m in rec.messages if m.startswith("📥 Ответ сервера:"))
+    assert len(response) < 1200 and spilled_path(response) == store.files[0]
+    # в сообщении об ошибке — только начало ответа
+    assert rec.messages[-1] == "❌ Авторизация не удалась: " + excerpt(PAGE)
+    assert all(len(m) < 1200 for m in rec.messages)
+
+
+def test_cli_response_preview(bitrix, tmp_path, capsys):
+    bitrix.checkauth = (500, PAGE)
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    assert cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--filename', str(path),
+                     '--response-preview', '300', '--response-spill', '0']) == 1
+    out = capsys.readouterr().out
+    assert f"показано 300 из {len(PAGE)} символов" in out and SPILL_MARK not in out
+    assert len(out) < 5000
+
+
+def test_spilled_files_are_capped_oldest_first(tmp_path):
+    store = ResponseStore(100, 1000, directory=str(tmp_path), keep_files=3, keep_bytes=2500)
+    paths = [spilled_path(store.preview(f"{i}" * 2000)) for i in range(5)]
+    # по 1000 байт: лимит в 2500 байт оставляет два последних
+    assert store.files == paths[3:]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(os.path.basename(p) for p in paths[3:])
+    store.keep_bytes = 10 ** 6
+    paths = [spilled_path(store.preview(f"{i}" * 2000)) for i in range(5)]
+    assert store.files == paths[2:] and len(list(tmp_path.iterdir())) == 3
+
+
+def test_own_directory_is_per_process_and_removed():
+    store = ResponseStore(100)
+    path = spilled_path(store.preview(PAGE))
+    directory = os.path.dirname(path)
+    assert os.path.basename(directory).startswith('bitrix_exchange_responses-')
+    assert directory != os.path.dirname(spilled_path(ResponseStore(100).preview(PAGE)))
+    store.cleanup()
+    assert not os.path.exists(directory)
+
+
+def test_cli_removes_spilled_responses(bitrix, tmp_path, capsys):
+    bitrix.checkauth = (500, PAGE)
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    assert cli.main(['standard', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--filename', str(path),
+                     '--response-preview', '300']) == 1
+    spill = spilled_path(capsys.readouterr().out)
+    assert spill and not os.path.exists(os.path.dirname(spill))
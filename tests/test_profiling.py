@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+from bitrix_exchange import cli
+from bitrix_exchange.profiling import Profiler, is_idle
+
+
+def _spin(seconds):
+    # занятый поток: выборки должны попасть сюда
+    until = time.monotonic() + seconds
+    while time.monotonic() < until:
+        sum(range(1000))
+
+
+def test_busy_thread_is_the_hot_spot(tmp_path):
+    profiler = Profiler('test', str(tmp_path), interval=0.002).start()
+    worker = threading.Thread(target=_spin, args=(0.3,), name='busy')
+    worker.start()
+    worker.join()
+    profiler.stop()
+    folded, summary, text = profiler.write()
+    assert "Поток busy: занят" in text and "test_profiling.py:_spin" in text
+    with open(folded, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0 and ';' in stack
+    assert any(line.startswith('busy;') and 'test_profiling.py:_spin' in line for line in lines)
+    with open(summary, encoding='utf-8') as f:
+        assert f.read() == text + "\n"
+    # второй профиль в ту же секунду не затирает первый
+    assert profiler.write()[1] != summary
+
+
+def test_idle_samples_are_not_work():
+    assert is_idle(('main.py:<module>',))
+    assert is_idle(('threading.py:_bootstrap', 'thread.py:_worker'))
+    assert not is_idle(('threading.py:run', 'engine.py:_upload', 'ssl.py:read'))
+
+
+def test_gui_stall_and_handlers_are_recorded(tmp_path):
+    profiler = Profiler('gui', str(tmp_path), interval=0.002, stall_threshold=0.05, gui=True).start()
+    slot = profiler.timed("batch → log", lambda batch: _spin(0.12))
+    profiler.beat()
+    slot([1, 2])
+    profiler.beat()
+    profiler.beat()
+    profiler.stop()
+    (at, seconds, where), = profiler.stalls
+    assert seconds >= 0.08 and "_spin" in where
+    assert profiler.handlers["batch → log"][0] == 1
+    text = profiler.summary()
+    assert "Зависания GUI дольше 50 мс: 1" in text and "batch → log" in text
+    assert "Поток GUI" in text
+
+
+def test_cli_profile(bitrix, tmp_path, capsys):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    out = tmp_path / 'profiles'
+    assert cli.main(['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p', '--file', str(path),
+                     '-q', '--profile', str(out)]) == 0
+    err = capsys.readouterr().err
+    assert err.startswith("🔬 Профиль «upload»")
+    assert sorted(os.path.splitext(f)[1] for f in os.listdir(out)) == ['.folded', '.txt']
+
+
+def test_gui_run_writes_profile(qapp, bitrix, tmp_path, data_home, monkeypatch):
+    from PyQt5 import QtCore
+    import main
+
+    monkeypatch.setattr(main.QMessageBox, 'information', lambda *a: None)
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    w = main.MainWindow()
+    try:
+        w._ensure_tab("upload")
+        w._ensure_tab("settings")
+        w.profile_runs.setChecked(True)
+        for field, value in ((w.url2, bitrix.url), (w.login2, 'a'), (w.password2, 'p'), (w.file2, str(path))):
+            field.setText(value)
+        w._start(2)
+        loop = QtCore.QEventLoop()
+        w.worker.finished.connect(lambda ok: QtCore.QTimer.singleShot(0, loop.quit))
+        QtCore.QTimer.singleShot(10000, loop.quit)
+        loop.exec_()
+        assert not w._profiles
+        model = w.console2.log_model
+        report = model.entry_at(model.rowCount() - 1).text
+        assert report.startswith("🔬 Профиль «exchange»") and "progressBatch → console.log_many" in report
+        assert len(os.listdir(data_home / 'profiles')) == 2
+    finally:
+        w.close()
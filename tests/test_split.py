@@ -0,0 +1,118 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from bitrix_exchange import cli
+from bitrix_exchange.engine import ExchangeEngine
+from bitrix_exchange.split import SplitError, split_package, split_xml
+from test_delta import PRODUCTS, catalog
+
+
+def offers(count):
+    items = ''.join(f'\n  <Предложение><Ид>o{i}</Ид><Цены><Цена><ЦенаЗаЕдиницу>{i}</ЦенаЗаЕдиницу></Цена></Цены>'
+                    f'<Склад/></Предложение>' for i in range(count))
+    return ('<?xml version="1.0" encoding="windows-1251"?>\n<КоммерческаяИнформация><ПакетПредложений>'
+            '<ТипыЦен><ТипЦены><Ид>base</Ид></ТипЦены></ТипыЦен>'
+            f'<Предложения>{items}\n</Предложения></ПакетПредложений></КоммерческаяИнформация>\n')
+
+
+def parts_of(text, max_bytes, tmp_path, encoding='utf-8', name='import.xml'):
+    stats = split_xml(io.BytesIO(text.encode(encoding)), name, str(tmp_path), max_bytes)
+    return stats, [ET.fromstring(open(path, 'rb').read()) for _, path, _ in stats.parts]
+
+
+def test_catalog_is_split_into_whole_documents(tmp_path):
+    stats, roots = parts_of(catalog(PRODUCTS), 400, tmp_path)
+    assert len(roots) > 2 and stats.items == 10
+    assert [name for name, _, _ in stats.parts][:2] == ['import_00001.xml', 'import_00002.xml']
+    ids = [t.findtext('Ид') for root in roots for t in root.iterfind('./Каталог/Товары/Товар')]
+    assert ids == [pid for pid, _ in PRODUCTS]
+    assert [count for _, _, count in stats.parts] == [len(root.findall('.//Товар')) for root in roots]
+    for root in roots:
+        # всё вокруг списка — в каждой части
+        assert root.find('.//Группа/Наименование').text == 'Обувь & сумки'
+        assert root.findtext('Каталог/Ид') == 'c1'
+
+
+def test_full_export_flag_stays_on_last_part(tmp_path):
+    # исходный файл — полная выгрузка: частичные все, кроме последней
+    stats, roots = parts_of(catalog(PRODUCTS), 400, tmp_path)
+    flags = [root.find('Каталог').get('СодержитТолькоИзменения') for root in roots]
+    assert flags == ['true'] * (len(roots) - 1) + ['false']
+    assert stats.full_export and "полная выгрузка" in stats.describe()
+    # флага нет вовсе — у последней части его тоже нет
+    text = catalog(PRODUCTS).replace(' СодержитТолькоИзменения="false"', '')
+    (tmp_path / 'none').mkdir()
+    stats, roots = parts_of(text, 400, tmp_path / 'none')
+    flags = [root.find('Каталог').get('СодержитТолькоИзменения') for root in roots]
+    assert flags == ['true'] * (len(roots) - 1) + [None] and stats.full_export
+    # выгрузка изменений остаётся ею во всех частях
+    text = catalog(PRODUCTS).replace('СодержитТолькоИзменения="false"', 'СодержитТолькоИзменения="true"')
+    (tmp_path / 'delta').mkdir()
+    stats, roots = parts_of(text, 400, tmp_path / 'delta')
+    assert {root.find('Каталог').get('СодержитТолькоИзменения') for root in roots} == {'true'}
+    assert not stats.full_export and "полная" not in stats.describe()
+
+
+def test_offers_keep_encoding_and_empty_children(tmp_path, monkeypatch):
+    monkeypatch.setattr('bitrix_exchange.split.READ_BLOCK', 13)
+    stats, roots = parts_of(offers(30), 1000, tmp_path, 'cp1251', 'offers.xml')
+    assert stats.items == 30 and len(roots) > 1
+    with open(stats.parts[0][1], 'rb') as f:
+        assert f.read().startswith(b'<?xml version="1.0" encoding="windows-1251"?>')
+    found = [o.findtext('Ид') for root in roots for o in root.iter('Предложение')]
+    assert found == [f'o{i}' for i in range(30)]
+    assert all(root.find('.//ТипЦены/Ид').text == 'base' for root in roots)
+
+
+def test_small_file_is_not_split(tmp_path):
+    stats, roots = parts_of(catalog(PRODUCTS[:1]), 10000, tmp_path)
+    assert stats.items == 1 and roots == []
+    assert not list(tmp_path.iterdir())
+
+
+def test_second_list_is_refused(tmp_path):
+    text = catalog(PRODUCTS).replace('</Каталог>', '</Каталог><Каталог><Товары><Товар><Ид>x</Ид></Товар></Товары></Каталог>')
+    with pytest.raises(SplitError):
+        split_xml(io.BytesIO(text.encode('utf-8')), 'import.xml', str(tmp_path), 300)
+    assert not list(tmp_path.iterdir())
+
+
+def test_zip_package_splits_only_big_xml(tmp_path):
+    path = tmp_path / 'export.zip'
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('import.xml', catalog(PRODUCTS))
+        z.writestr('offers.xml', offers(1))
+        z.writestr('import_files/a.jpg', b'jpeg')
+    package = split_package(str(path), False, 600)
+    try:
+        names = [name for name, _ in package.entries]
+        assert names[0].startswith('import_0000') and names[-2:] == ['offers.xml', 'import_files/a.jpg']
+        assert [st.name for st in package.stats] == ['import.xml']
+    finally:
+        package.cleanup()
+
+
+def test_engine_uploads_parts_in_one_zip_and_imports_them_in_order(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_text(catalog(PRODUCTS), encoding='utf-8')
+    engine = ExchangeEngine(bitrix.url, 'a', 'p', 'catalog', str(path), preflight=True, split_size=600)
+    assert engine.run()
+    with zipfile.ZipFile(io.BytesIO(bitrix.uploaded)) as z:
+        names = z.namelist()
+    assert names == [f'import_{n:05d}.xml' for n in range(1, len(names) + 1)] and len(names) > 1
+    imported = [p['filename'] for _, mode, p in bitrix.requests if mode == 'import']
+    assert imported == names
+    assert sum(engine.expected_totals[name] for name in names) == 10
+    assert engine.metrics.snapshot()['phases']['split'] >= 0
+
+
+def test_cli_split_size(bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_text(catalog(PRODUCTS), encoding='utf-8')
+    # порог больше файла — отправляется как есть
+    assert cli.main(['upload', '--url', bitrix.url, '--login', 'a', '--password', 'p',
+                     '--file', str(path), '--split-size', '1', '-q']) == 0
+    assert [p['filename'] for _, mode, p in bitrix.requests if mode == 'import'] == ['import.xml']
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('PyQt5.QtWidgets')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# до первого окна не нужны ни сеть, ни архивы, ни движок обмена
+HEAVY = ('requests', 'urllib3', 'zipfile', 'bitrix_exchange.engine')
+
+
+def _env(tmp_path):
+    return dict(os.environ, QT_QPA_PLATFORM='offscreen', BITRIX_EXCHANGE_HOME=str(tmp_path))
+
+
+def test_main_window_does_not_load_network_stack(tmp_path):
+    code = ("import sys\n"
+            "from PyQt5.QtWidgets import QApplication\n"
+            "app = QApplication([])\n"
+            "import main\n"
+            "w = main.MainWindow()\n"
+            f"print(sorted(m for m in {HEAVY!r} if m in sys.modules))\n")
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=_env(tmp_path), capture_output=True,
+                         text=True, timeout=60, check=True).stdout
+    assert out.strip().splitlines()[-1] == '[]'
+
+
+def test_startup_timing_reports_first_paint(tmp_path):
+    proc = subprocess.run([sys.executable, 'main.py', '--startup-timing'], cwd=ROOT, env=_env(tmp_path),
+                          capture_output=True, text=True, timeout=60)
+    assert proc.returncode == 0, proc.stderr
+    report = proc.stdout
+    assert report.startswith("⏱ Окно отрисовано через")
+    for step in ("импорты main.py", "MainWindow()", "первая отрисовка"):
+        assert step in report
+    imported = [line.split()[-1] for line in report.splitlines() if line.startswith("  ") and
+                line.split()[0].replace('.', '').isdigit()]
+    assert 'PyQt5.QtWidgets' in imported and 'console_widget' in imported
+    assert not set(HEAVY) & set(imported)
+
+
+def test_tabs_are_built_on_first_use(qapp, tmp_path, monkeypatch):
+    monkeypatch.setenv('BITRIX_EXCHANGE_HOME', str(tmp_path))
+    import main
+
+    w = main.MainWindow()
+    try:
+        assert w._built_tabs == {"standard"} and not hasattr(w, 'console2')
+        w.tabs.setCurrentIndex(1)
+        assert "upload" in w._built_tabs and w.console2.isVisibleTo(w.tabs.widget(1))
+        # настройки нужны запуску, даже если вкладку не открывали
+        options = w._connection_options()
+        assert "settings" in w._built_tabs and options['responses'] is w.responses
+        w.console_limit.setValue(2000)
+        w.tabs.setCurrentIndex(2)
+        assert w.console4.log_model._max_entries == 2000
+        assert w.console1.log_model._max_entries == 2000
+    finally:
+        w.close()
@@ -0,0 +1,86 @@
+import io
+import threading
+import time
+
+import pytest
+
+from bitrix_exchange.stream import BlockReader, ChunkBody
+
+
+def read_all(body):
+    return b''.join(bytes(part) for part in body)
+
+
+def test_chunks_have_exact_sizes_and_content():
+    data = bytes(range(256)) * 40  # 10240 байт
+    with BlockReader(io.BytesIO(data), block_size=1024, depth=2) as reader:
+        parts = [read_all(ChunkBody(reader, n)) for n in (3000, 3000, 3000, 1240)]
+        assert reader.read(10) == b''
+    assert [len(p) for p in parts] == [3000, 3000, 3000, 1240]
+    assert b''.join(parts) == data
+
+
+def test_chunk_body_reports_its_length():
+    with BlockReader(io.BytesIO(b'abcdef')) as reader:
+        body = ChunkBody(reader, 4)
+        assert len(body) == 4
+        assert body.read() == b'abcd'
+        assert body.read() == b''
+
+
+def test_zero_byte_source():
+    with BlockReader(io.BytesIO(b'')) as reader:
+        assert reader.read(100) == b''
+        body = ChunkBody(reader, 0)
+        assert body.read() == b''
+        assert read_all(body) == b''
+
+
+def test_short_source_raises_oserror():
+    with BlockReader(io.BytesIO(b'abc')) as reader:
+        body = ChunkBody(reader, 10)
+        assert bytes(body.read(3)) == b'abc'
+        with pytest.raises(OSError):
+            body.read(3)
+        assert isinstance(body.error, OSError)
+
+
+def test_seek_rewinds_chunk_for_resend(tmp_path):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(bytes(range(200)) * 50)  # 10000 байт
+    with open(path, 'rb', buffering=0) as f, BlockReader(f, block_size=512, depth=2) as reader:
+        first = read_all(ChunkBody(reader, 4000))
+        body = ChunkBody(reader, 4000)
+        assert body.tell() == 0
+        body.read(1500)
+        body.seek(0)
+        second = read_all(body)
+        third = read_all(ChunkBody(reader, 2000))
+    assert first + second + third == path.read_bytes()
+
+
+def test_close_stops_read_ahead_thread_midway():
+    data = b'z' * (1024 * 1024)
+    reader = BlockReader(io.BytesIO(data), block_size=1024, depth=2)
+    assert bytes(reader.read(10)) == b'z' * 10
+    reader.close()
+    assert not [t for t in threading.enumerate() if t.name == 'chunk-read-ahead']
+
+
+def test_memory_is_bounded_by_buffer_pool():
+    # источник длиннее пула в сотни раз: прочитано вперёд не больше depth + 1 блоков
+    reader = BlockReader(io.BytesIO(b'q' * (4 * 1024 * 1024)), block_size=4096, depth=3)
+    try:
+        while reader._ready.qsize() < 4:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        assert reader._ready.qsize() == 4
+        total = 0
+        while True:
+            part = reader.read(65536)
+            if not part:
+                break
+            total += len(part)
+        assert total == 4 * 1024 * 1024
+    finally:
+        reader.close()
@@ -0,0 +1,109 @@
+import pytest
+
+pytest.importorskip('PyQt5.QtWidgets')
+
+from PyQt5 import QtCore  # noqa: E402
+
+from exchange_worker import ExchangeWorker, _BufferedListener, _CoalescingThread, _Pending  # noqa: E402
+
+
+def _run(qapp, worker, timeout_ms=10000):
+    loop = QtCore.QEventLoop()
+    worker.finished.connect(lambda *a: loop.quit())
+    QtCore.QTimer.singleShot(timeout_ms, loop.quit)
+    worker.start()
+    loop.exec_()
+    worker.wait()
+
+
+def test_events_are_coalesced(qapp, bitrix, tmp_path):
+    # 200 чанков по 10 байт: сотни сообщений, но доставка пачками
+    bitrix.init = (200, "zip=no\nfile_limit=10\n")
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>' * 500)
+    worker = ExchangeWorker(bitrix.url, 'a', 'p', 'catalog', str(path))
+    batches, percents, done = [], [], []
+    worker.progressBatch.connect(batches.append)
+    worker.progressPercent.connect(percents.append)
+    worker.finished.connect(lambda ok: done.append((ok, sum(map(len, batches)))))
+
+    _run(qapp, worker)
+
+    messages = [m for b in batches for m in b]
+    assert done == [(True, len(messages))]  # finished — после последней пачки
+    assert messages[-1] == "✅ Обмен успешно завершен."
+    assert sum(m.startswith("📤 Отправлено") for m in messages) == 200
+    assert len(batches) < len(messages) / 5
+    assert len(percents) <= len(batches) + 1
+    assert percents[-1] == 100
+    assert bitrix.uploaded == path.read_bytes()
+
+
+def test_range_change_discards_older_percent():
+    pending = _Pending()
+    listener = _BufferedListener(pending, key=3)
+    listener.progress_percent(100)
+    listener.progress_range(0, 0)
+    listener.message("📤 Шаг 4: Импорт данных.")
+    messages, ranges, percents, finished, done = pending.take()
+    assert ranges == {3: (0, 0)} and percents == {}
+    assert messages == [(3, "📤 Шаг 4: Импорт данных.")]
+    # перенос строк сделан здесь, в потоке обмена
+    listener.message("📥 Ответ сервера:\nsuccess")
+    assert pending.take()[0][0][1].children == ["success"]
+    listener.progress_percent(40)
+    listener.progress_percent(55)
+    assert pending.take()[2] == {3: 55}
+
+
+def test_coalescing_hooks_are_optional(qapp):
+    # наследник без своих хуков: доставка пачки и завершения ничего не роняет
+    class Quiet(_CoalescingThread):
+        def run(self):
+            with self._pending.lock:
+                self._pending.done = (True,)
+
+    thread = Quiet()
+    _BufferedListener(thread._pending).message("📤 Шаг 1")
+    thread.start()
+    thread.wait()
+    thread.flush()
+    assert not thread._timer.isActive()
+
+
+def test_metrics_snapshot_is_delivered(qapp, bitrix, tmp_path):
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>' * 100)
+    worker = ExchangeWorker(bitrix.url, 'a', 'p', 'catalog', str(path))
+    snaps = []
+    worker.metrics.connect(snaps.append)
+    worker.finished.connect(lambda ok: snaps.append(ok))
+
+    _run(qapp, worker)
+
+    # последний снимок — итоговый и приходит до finished
+    assert snaps[-1] is True
+    final = snaps[-2]
+    assert final['ok'] is True and final['upload']['bytes'] == 400
+    assert all(isinstance(s, dict) for s in snaps[:-1])
+
+
+def test_queue_worker_reports_jobs(qapp, bitrix, tmp_path):
+    from bitrix_exchange.jobs import DONE, JobQueue
+    from exchange_worker import QueueWorker
+
+    path = tmp_path / 'import.xml'
+    path.write_bytes(b'<x/>')
+    queue = JobQueue(str(tmp_path / 'jobs.json'))
+    job = queue.add(str(path), bitrix.url, 'a', 'p')
+    worker = QueueWorker(queue, 2, 1)
+    messages, tables = [], []
+    worker.jobMessages.connect(messages.extend)
+    worker.jobsChanged.connect(tables.append)
+    # очередь работает, пока её не остановят: останавливаем по первому итогу
+    worker.jobsChanged.connect(lambda jobs: jobs[0].status == DONE and worker.requestInterruption())
+
+    _run(qapp, worker)
+
+    assert tables[-1][0].status == DONE
+    assert (job.id, "✅ Обмен успешно завершен.") in messages
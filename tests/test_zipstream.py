@@ -0,0 +1,64 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from bitrix_exchange.zipstream import ZipStream, archive_name, collect_entries
+
+
+@pytest.fixture
+def export_dir(tmp_path):
+    root = tmp_path / 'export'
+    (root / 'import_files' / 'ab').mkdir(parents=True)
+    (root / 'import.xml').write_text('<Товар><Ид>1</Ид></Товар>' * 5000, encoding='utf-8')
+    (root / 'offers.xml').write_text('<Предложение/>' * 3000, encoding='utf-8')
+    (root / 'import_files' / 'ab' / 'pic.jpg').write_bytes(os.urandom(50000))
+    return root
+
+
+def read_all(stream):
+    out = bytearray()
+    buf = bytearray(7000)
+    while True:
+        n = stream.readinto(buf)
+        if not n:
+            return bytes(out)
+        out += buf[:n]
+
+
+def test_folder_entries_and_archive_name(export_dir):
+    names = [a for a, _ in collect_entries(str(export_dir))]
+    assert names == ['import.xml', 'offers.xml', 'import_files/ab/pic.jpg']
+    assert archive_name(str(export_dir)) == 'export.zip'
+    assert archive_name(str(export_dir / 'import.xml')) == 'import.zip'
+
+
+def test_stream_is_a_valid_zip_with_original_content(export_dir):
+    stream = ZipStream(collect_entries(str(export_dir)), level=6)
+    data = read_all(stream)
+    assert len(data) == stream.size()
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        assert z.read('import.xml') == (export_dir / 'import.xml').read_bytes()
+        assert z.read('import_files/ab/pic.jpg') == (export_dir / 'import_files' / 'ab' / 'pic.jpg').read_bytes()
+    assert stream.xml_names() == ['import.xml', 'offers.xml']
+    assert len(data) < stream.source_size()
+
+
+def test_seek_regenerates_identical_bytes(export_dir):
+    entries = collect_entries(str(export_dir))
+    data = read_all(ZipStream(entries))
+    stream = ZipStream(entries)
+    stream.seek(12345)
+    assert read_all(stream) == data[12345:]
+    stream.seek(100)
+    assert stream.tell() == 100
+    assert stream.read(50) == data[100:150]
+
+
+def test_level_changes_output_and_fingerprint(export_dir):
+    entries = collect_entries(str(export_dir))
+    fast, best = ZipStream(entries, level=1), ZipStream(entries, level=9)
+    assert fast.fingerprint() != best.fingerprint()
+    assert best.size() <= fast.size()